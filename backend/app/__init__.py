@@ -3,6 +3,7 @@
 import os
 import sys
 import logging
+import weakref
 from flask import Flask
 
 # Add the parent directory to the Python path to find config module
@@ -11,6 +12,18 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import config
 from app.extensions import init_extensions, db
 from app.utils.errors import register_error_handlers
+from app.utils.db_pool import reset_after_fork
+from app.utils.metrics import init_metrics
+from app.utils.profiling import init_profiling
+from app.utils.notifications import init_notifications
+from app.utils.messaging import init_messaging
+from app.utils.config import init_runtime_settings
+from app.utils.query_budget import init_query_budget
+from app.utils.staff_calendar import init_staff_calendar
+from app.utils.media import init_media
+from app.utils.promotion_engine import init_promotion_engine
+from app.utils.coverage import init_coverage
+from app.utils.staff_locator import init_staff_locator
 
 def create_app(config_name=None):
     """Application factory pattern"""
@@ -36,9 +49,41 @@ def create_app(config_name=None):
     # Register error handlers
     register_error_handlers(app)
     
+    # Request / SQL metrics exposed at /metrics
+    init_metrics(app)
+    
+    # Query budget / N+1 detection (development, tests)
+    init_query_budget(app)
+    
+    # Opt-in request profiling (X-Profile header, continuous sampling)
+    init_profiling(app)
+    
+    # Deliver queued notifications when the session commits
+    init_notifications(app)
+    
+    # Email/SMS outbox (embedded workers in development)
+    init_messaging(app)
+    
+    # Runtime settings snapshot, reloaded when an admin changes a setting
+    init_runtime_settings(app)
+    
+    # Drop cached staff calendar days when bookings / schedules change
+    init_staff_calendar(app)
+    
+    # Delete released legacy uploads after the transaction commits
+    init_media(app)
+    
+    # Rebuild the per-worker promotion / coverage / staff location indexes after writes commit
+    init_promotion_engine(app)
+    init_coverage(app)
+    init_staff_locator(app)
+    
     # Create upload directories
     create_directories(app)
     
+    # Make the app safe to load once and fork (gunicorn --preload)
+    setup_fork_safety(app)
+    
     return app
 
 def register_blueprints(app):
@@ -59,6 +104,9 @@ def register_blueprints(app):
     from app.api.reports import reports_bp
     from app.api.admin import admin_bp
     from app.api.vnpay import vnpay_bp
+    from app.api.media import media_bp
+    from app.api.metrics import metrics_bp
+    from app.api.messages import messages_bp
     
     # Register blueprints with URL prefix
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
@@ -75,6 +123,35 @@ def register_blueprints(app):
     app.register_blueprint(reports_bp, url_prefix='/api/reports')
     app.register_blueprint(admin_bp, url_prefix='/api/admin')
     app.register_blueprint(vnpay_bp, url_prefix='/api/vnpay')
+    # File upload được phục vụ ngoài /api (/media/..., /static/uploads/...)
+    app.register_blueprint(media_bp)
+    app.register_blueprint(metrics_bp)
+    # Chỉ có lệnh CLI (flask messages ...)
+    app.register_blueprint(messages_bp)
+
+_forked_apps = weakref.WeakSet()
+
+def _dispose_engines_after_fork():
+    """Drop database connections inherited from the parent process"""
+    for app in list(_forked_apps):
+        with app.app_context():
+            for engine in db.engines.values():
+                # close=False: the sockets still belong to the parent, only forget them
+                engine.dispose(close=False)
+                reset_after_fork(engine)
+
+def setup_fork_safety(app):
+    """
+    Dispose the connection pools in every forked child
+
+    With a preloaded app, worker processes are forked from the master. A
+    pooled connection opened before the fork would be shared by several
+    processes talking over the same socket, so each child starts with
+    empty pools instead.
+    """
+    if not _forked_apps and hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_dispose_engines_after_fork)
+    _forked_apps.add(app)
 
 def setup_logging(app):
     """Setup application logging"""
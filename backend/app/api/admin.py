@@ -1,15 +1,31 @@
 """Admin API endpoints"""
 
-from flask import Blueprint, request, jsonify, current_app
+import os
+from collections import Counter
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
-from sqlalchemy import func, desc, and_, or_
-from datetime import datetime, timedelta
+from sqlalchemy import func, desc, and_, or_, case
+from sqlalchemy.orm import aliased
+from datetime import date, datetime, timedelta
 from app.extensions import db
 from app.models.user import User
 from app.models.booking import Booking, BookingStaff, BookingItem
 from app.models.service import Service
 from app.utils.errors import ValidationAPIError, AuthenticationError, handle_error
 from app.utils.helpers import admin_required
+from app.utils.export import export_stream
+from app.utils.db_pool import pool_snapshots
+from app.utils.db_routing import read_only
+from app.utils.profiling import collect as collect_profile, render_collapsed
+from app.utils.notifications import notify_booking, booking_staff_ids
+from app.utils.config import SETTINGS, REGISTRY, update_settings, runtime_settings
+from app.utils.reviews import rating_summaries, period_ratings, overall_rating
+from app.utils.staff_locator import staff_locator, DEFAULT_DURATION_MINUTES
+from app.utils.query_budget import query_budget
+from app.utils.staff_calendar import staff_calendar, invalidate_calendar
+
+# payment_status -> sự kiện thông báo cho khách
+PAYMENT_EVENTS = {'paid': 'paid', 'refunded': 'refunded', 'failed': 'payment_failed'}
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -50,8 +66,8 @@ def get_admin_stats():
             )
         ).count()
         
-        # Đánh giá trung bình (giả sử có bảng reviews)
-        avg_rating = 4.5  # Placeholder
+        # Đánh giá trung bình (bảng tổng hợp theo ngày)
+        avg_rating = overall_rating()
         
         # Tăng trưởng (giả sử tính so với tháng trước)
         booking_growth = 15.2  # Placeholder
@@ -264,7 +280,7 @@ def get_admin_staff():
       + Phân công trực tiếp: Booking.staff_id 
       + Phân công nhiều người: BookingStaff table (many-to-many)
     - Lấy danh sách dịch vụ đã được phân công cho từng nhân viên
-    - ĐÃ XÓA: Phần đánh giá nhân viên (rating) không còn được sử dụng
+    - Điểm đánh giá của nhân viên đọc từ bảng rating_summaries (một query cho cả danh sách)
     
     THỐNG KÊ BẢO ĐẢM ĐỒNG BỘ:
     - totalBookings: Tổng số đơn hàng được phân công (tránh trùng lặp)
@@ -274,6 +290,7 @@ def get_admin_staff():
     try:
         # Lấy danh sách staff từ bảng users với role='staff'
         staff_users = User.query.filter_by(role='staff').order_by(desc(User.created_at)).all()
+        ratings = rating_summaries('staff', [user.id for user in staff_users])
         
         result = []
         for user in staff_users:
@@ -350,7 +367,8 @@ def get_admin_staff():
                 'status': user.status,
                 'avatar': user.avatar,
                 'hireDate': user.created_at.date().isoformat() if user.created_at else None,
-                # ĐÃ XÓA: 'rating' - Không còn đánh giá nhân viên
+                'rating': ratings[user.id]['average'],     # Điểm trung bình các đánh giá đã duyệt
+                'reviewCount': ratings[user.id]['count'],
                 'totalBookings': total_bookings,           # Tổng số đơn được phân công (đồng bộ)
                 'completedBookings': completed_bookings,   # Số đơn đã hoàn thành (đồng bộ)
                 'assignedServices': assigned_services,     # Danh sách dịch vụ được phân công (đồng bộ)
@@ -428,8 +446,16 @@ def update_booking_status(booking_id):
                 'message': 'Booking not found'
             }), 404
         
+        old_status = booking.status
         booking.status = status
         booking.updated_at = datetime.utcnow()
+        
+        if status != old_status:
+            recipients = [booking.user_id]
+            if status in ('cancelled', 'rescheduled'):
+                recipients += booking_staff_ids(booking)
+            notify_booking(booking, status, recipients)
+        
         db.session.commit()
         
         return jsonify({
@@ -493,6 +519,10 @@ def update_booking_payment_status(booking_id):
         if payment_status == 'paid' and old_payment_status != 'paid':
             current_app.logger.info(f"Booking {booking.booking_code} marked as paid by admin")
         
+        payment_event = PAYMENT_EVENTS.get(payment_status)
+        if payment_event and payment_status != old_payment_status:
+            notify_booking(booking, payment_event)
+        
         db.session.commit()
         
         return jsonify({
@@ -561,6 +591,10 @@ def assign_staff_to_booking(booking_id):
         # Nếu booking chưa confirmed, tự động confirmed khi có staff
         if booking.status == 'pending':
             booking.status = 'confirmed'
+            notify_booking(booking, 'confirmed')
+        
+        if str(old_staff_id) != str(staff_id):
+            notify_booking(booking, 'assigned', [staff.id])
         
         db.session.commit()
         
@@ -640,7 +674,10 @@ def assign_multiple_staff_to_booking(booking_id):
         from app.models.booking import BookingStaff
         
         # Xóa assignments cũ (nếu có)
+        previous_staff_ids = {str(staff_id) for staff_id in booking_staff_ids(booking)}
         BookingStaff.query.filter_by(booking_id=booking.id).delete()
+        # Xoá hàng loạt không qua mapper event: bỏ lịch đã cache của ngày booking
+        invalidate_calendar(dates=[booking.booking_date])
         
         # Thêm assignments mới
         assigned_staff = []
@@ -668,6 +705,10 @@ def assign_multiple_staff_to_booking(booking_id):
         # Cập nhật booking status
         if booking.status == 'pending':
             booking.status = 'confirmed'
+            notify_booking(booking, 'confirmed')
+        
+        # Chỉ báo cho nhân viên mới được phân công
+        notify_booking(booking, 'assigned', [staff.id for staff in staff_list if str(staff.id) not in previous_staff_ids])
         
         booking.updated_at = datetime.utcnow()
         db.session.commit()
@@ -694,11 +735,227 @@ def assign_multiple_staff_to_booking(booking_id):
             'message': f'Failed to assign staff to booking: {str(e)}'
         }), 500
 
+def suggestion_dict(suggestion):
+    return {
+        'staffId': str(suggestion.staff.id),
+        'name': suggestion.staff.name,
+        'distanceKm': round(suggestion.distance_km, 2),
+        'from': suggestion.origin  # home hoặc booking trước đó trong ngày
+    }
+
+def _max_km(value):
+    """maxKm as a positive float, None when not given (raises ValueError)"""
+    if value is None or value == '':
+        return None
+    try:
+        max_km = float(value) if not isinstance(value, bool) else None
+    except (TypeError, ValueError):
+        max_km = None
+    if max_km is None or not 0 < max_km < float('inf'):
+        raise ValueError('maxKm must be a positive number')
+    return max_km
+
+@admin_bp.route('/bookings/<booking_id>/staff-suggestions', methods=['GET'])
+@jwt_required()
+@admin_required
+@query_budget(5)
+def get_staff_suggestions(booking_id):
+    """
+    Gợi ý nhân viên rảnh gần địa điểm booking nhất (k nhân viên)
+
+    Vị trí booking lấy từ địa chỉ đã lưu (address_id), hoặc ?lat=&lng=.
+    """
+    try:
+        booking = Booking.query.get(booking_id)
+        if not booking:
+            return jsonify({
+                'status': 'error',
+                'message': 'Booking not found'
+            }), 404
+
+        k = min(max(request.args.get('k', 5, type=int), 1), 50)
+        try:
+            max_km = _max_km(request.args.get('maxKm'))
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
+        plan = staff_locator.day_plan(booking.booking_date)
+        slot = plan.window(booking.id) if booking.id in plan.slots else None
+        latitude = request.args.get('lat', type=float)
+        longitude = request.args.get('lng', type=float)
+        if latitude is None or longitude is None:
+            latitude, longitude = (slot.latitude, slot.longitude) if slot else (None, None)
+        if latitude is None or longitude is None:
+            return jsonify({
+                'status': 'error',
+                'message': 'Booking has no location: save its address with coordinates or pass lat/lng'
+            }), 400
+
+        if slot:
+            start, end = slot.start, slot.end
+        else:
+            start = booking.booking_time.hour * 60 + booking.booking_time.minute
+            end = start + DEFAULT_DURATION_MINUTES
+        suggestions = plan.nearest(latitude, longitude, start, end, k=k, ignore=booking.id, max_km=max_km)
+
+        return jsonify({
+            'status': 'success',
+            'data': {
+                'bookingId': str(booking.id),
+                'latitude': latitude,
+                'longitude': longitude,
+                'staff': [suggestion_dict(suggestion) for suggestion in suggestions]
+            }
+        }), 200
+
+    except Exception as e:
+        current_app.logger.error(f"Get staff suggestions error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to get staff suggestions: {str(e)}'
+        }), 500
+
+@admin_bp.route('/bookings/auto-assign', methods=['POST'])
+@jwt_required()
+@admin_required
+def auto_assign_staff():
+    """
+    Phân công tự động các booking chưa có nhân viên của một ngày
+
+    Theo thứ tự giờ bắt đầu, mỗi booking nhận nhân viên rảnh gần nhất
+    (tính từ nhà hoặc từ booking trước đó của nhân viên trong ngày).
+    Body: {"date": "YYYY-MM-DD", "maxKm": 20}
+    """
+    try:
+        data = request.get_json() or {}
+        try:
+            day = datetime.strptime(data.get('date') or '', '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify({
+                'status': 'error',
+                'message': 'date is required (YYYY-MM-DD)'
+            }), 400
+        try:
+            max_km = _max_km(data.get('maxKm'))
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
+
+        plan = staff_locator.day_plan(day)
+        bookings = {
+            booking.id: booking for booking in Booking.query.filter(
+                Booking.booking_date == day,
+                Booking.status.in_(['pending', 'confirmed']),
+                Booking.id.in_([booking_id for booking_id, (_, staff_ids) in plan.slots.items() if not staff_ids])
+            ).all()
+        }
+
+        assigned, unassigned = [], []
+        for slot in sorted((plan.window(booking_id) for booking_id in bookings), key=lambda slot: (slot.start, str(slot.booking_id))):
+            booking = bookings[slot.booking_id]
+            if slot.latitude is None:
+                unassigned.append({'bookingId': str(booking.id), 'bookingCode': booking.booking_code, 'reason': 'no_location'})
+                continue
+            nearest = plan.nearest(slot.latitude, slot.longitude, slot.start, slot.end, k=1, max_km=max_km)
+            if not nearest:
+                unassigned.append({'bookingId': str(booking.id), 'bookingCode': booking.booking_code, 'reason': 'no_staff'})
+                continue
+
+            staff_id = nearest[0].staff.id
+            plan.assign(booking.id, staff_id)
+            booking.staff_id = staff_id
+            booking.updated_at = datetime.utcnow()
+            if booking.status == 'pending':
+                booking.status = 'confirmed'
+                notify_booking(booking, 'confirmed')
+            notify_booking(booking, 'assigned', [staff_id])
+            assigned.append({'bookingId': str(booking.id), 'bookingCode': booking.booking_code, **suggestion_dict(nearest[0])})
+
+        db.session.commit()
+        current_app.logger.info(f"Auto-assigned {len(assigned)} bookings on {day}, {len(unassigned)} left")
+
+        return jsonify({
+            'status': 'success',
+            'message': f'Assigned {len(assigned)} bookings',
+            'data': {
+                'date': day.isoformat(),
+                'assigned': assigned,
+                'unassigned': unassigned
+            }
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Auto-assign staff error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to auto-assign staff: {str(e)}'
+        }), 500
+
+@admin_bp.route('/staff-calendar', methods=['GET'])
+@jwt_required()
+@admin_required
+@query_budget(3)
+def get_staff_calendar_grid():
+    """
+    Lưới lịch một ngày của mọi nhân viên đang hoạt động (?date=YYYY-MM-DD, mặc định hôm nay)
+
+    Một query lấy danh sách nhân viên, một query cho các ngày lịch chưa có trong cache.
+    """
+    try:
+        day = date.today()
+        if request.args.get('date'):
+            try:
+                day = datetime.strptime(request.args['date'], '%Y-%m-%d').date()
+            except ValueError:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'date must be YYYY-MM-DD'
+                }), 400
+
+        staff_members = db.session.query(User.id, User.name, User.avatar).filter(
+            User.role == 'staff', User.status == 'active'
+        ).order_by(User.name).all()
+        days = staff_calendar([staff.id for staff in staff_members], day)
+        settings = runtime_settings()
+
+        rows = []
+        for staff in staff_members:
+            calendar_day = days[staff.id][0]
+            rows.append({
+                'name': staff.name,
+                'avatar': staff.avatar,
+                'bookingCount': len([entry for entry in calendar_day.bookings if entry.kind == 'booking']),
+                **calendar_day.to_dict(settings)
+            })
+
+        return jsonify({
+            'status': 'success',
+            'data': {
+                'date': day.isoformat(),
+                'workStartHour': settings['booking.work_start_hour'],
+                'workEndHour': settings['booking.work_end_hour'],
+                'staff': rows
+            }
+        }), 200
+
+    except Exception as e:
+        current_app.logger.error(f"Get staff calendar grid error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to get staff calendar: {str(e)}'
+        }), 500
+
 # ==================== REPORTS & ANALYTICS ====================
 
 @admin_bp.route('/reports/daily', methods=['GET'])
 @jwt_required()
 @admin_required
+@read_only()
 def get_daily_report():
     """Lấy báo cáo booking theo ngày trong khoảng thời gian"""
     try:
@@ -727,6 +984,8 @@ def get_daily_report():
                 Booking.created_at <= end_date
             )
         ).all()
+        # Điểm đánh giá trung bình theo ngày tạo booking (bảng rating_daily_summaries)
+        ratings = period_ratings(start_date.date(), end_date.date() + timedelta(days=1))
           # Calculate daily breakdown
         daily_reports = []
         current_date = start_date.date()
@@ -738,20 +997,8 @@ def get_daily_report():
             cancelled_bookings = [b for b in day_bookings if b.status == 'cancelled']
             total_revenue = sum([float(b.total_price or 0) for b in day_bookings if b.payment_status == 'paid'])
             
-            # Calculate average rating for completed bookings
-            avg_rating = 0
-            if completed_bookings:
-                try:
-                    from app.models.service import Review
-                    completed_booking_ids = [b.id for b in completed_bookings]
-                    ratings = db.session.query(func.avg(Review.rating)).filter(
-                        Review.booking_id.in_(completed_booking_ids)
-                    ).scalar()
-                    avg_rating = float(ratings) if ratings else 0
-                except Exception as e:
-                    # Fallback if Review query fails
-                    current_app.logger.warning(f"Could not calculate avg rating: {str(e)}")
-                    avg_rating = 0
+            # Average rating of the reviewed bookings created that day
+            avg_rating = ratings.get(current_date, 0)
             
             daily_reports.append({
                 'date': current_date.isoformat(),
@@ -775,6 +1022,7 @@ def get_daily_report():
 @admin_bp.route('/reports/monthly', methods=['GET'])
 @jwt_required()
 @admin_required
+@read_only()
 def get_monthly_report():
     """Lấy báo cáo booking theo tháng"""
     try:
@@ -815,6 +1063,7 @@ def get_monthly_report():
         else:
             # Get all 12 months for the year
             monthly_reports = []
+            ratings = period_ratings(date(year, 1, 1), date(year + 1, 1, 1), 'month')
             
             for month_num in range(1, 13):
                 start_date = datetime(year, month_num, 1)
@@ -835,20 +1084,8 @@ def get_monthly_report():
                 cancelled_bookings = len([b for b in month_bookings if b.status == 'cancelled'])
                 total_revenue = sum([float(b.total_price or 0) for b in month_bookings if b.payment_status == 'paid'])
                 
-                # Calculate average rating for completed bookings
-                avg_rating = 0
-                completed_month_bookings = [b for b in month_bookings if b.status == 'completed']
-                if completed_month_bookings:
-                    try:
-                        from app.models.service import Review
-                        completed_booking_ids = [b.id for b in completed_month_bookings]
-                        ratings = db.session.query(func.avg(Review.rating)).filter(
-                            Review.booking_id.in_(completed_booking_ids)
-                        ).scalar()
-                        avg_rating = float(ratings) if ratings else 0
-                    except Exception as e:
-                        current_app.logger.warning(f"Could not calculate avg rating for month {month_num}: {str(e)}")
-                        avg_rating = 0
+                # Average rating of the reviewed bookings created that month
+                avg_rating = ratings.get(month_num, 0)
                 
                 monthly_reports.append({
                     'month': month_num,
@@ -871,6 +1108,7 @@ def get_monthly_report():
 @admin_bp.route('/reports/yearly', methods=['GET'])
 @jwt_required()
 @admin_required
+@read_only()
 def get_yearly_report():
     """Lấy báo cáo booking theo năm - trả về danh sách các năm"""
     try:
@@ -899,12 +1137,13 @@ def get_yearly_report():
                 'totalCompleted': completed_bookings,
                 'totalCancelled': cancelled_bookings,
                 'totalRevenue': total_revenue,
-                'avgRating': 4.5  # Placeholder
+                'avgRating': period_ratings(start_date.date(), end_date.date(), 'year').get(year, 0)
             }), 200
         else:
             # Get reports for multiple years (last 3 years)
             current_year = datetime.now().year
             yearly_reports = []
+            ratings = period_ratings(date(current_year - 2, 1, 1), date(current_year + 1, 1, 1), 'year')
             
             for y in range(current_year - 2, current_year + 1):
                 start_date = datetime(y, 1, 1)
@@ -921,20 +1160,8 @@ def get_yearly_report():
                 cancelled_bookings = len([b for b in year_bookings if b.status == 'cancelled'])
                 total_revenue = sum([float(b.total_price or 0) for b in year_bookings if b.payment_status == 'paid'])
                 
-                # Calculate average rating for completed bookings
-                avg_rating = 0
-                completed_year_bookings = [b for b in year_bookings if b.status == 'completed']
-                if completed_year_bookings:
-                    try:
-                        from app.models.service import Review
-                        completed_booking_ids = [b.id for b in completed_year_bookings]
-                        ratings = db.session.query(func.avg(Review.rating)).filter(
-                            Review.booking_id.in_(completed_booking_ids)
-                        ).scalar()
-                        avg_rating = float(ratings) if ratings else 0
-                    except Exception as e:
-                        current_app.logger.warning(f"Could not calculate avg rating for year {y}: {str(e)}")
-                        avg_rating = 0
+                # Average rating of the reviewed bookings created that year
+                avg_rating = ratings.get(y, 0)
                 
                 yearly_reports.append({
                     'year': y,
@@ -957,6 +1184,7 @@ def get_yearly_report():
 @admin_bp.route('/revenue', methods=['GET'])
 @jwt_required()
 @admin_required
+@read_only()
 def get_revenue():
     """Lấy doanh thu theo khoảng thời gian"""
     try:
@@ -1017,3 +1245,360 @@ def get_revenue():
             'status': 'error',
             'message': f'Failed to get revenue data: {str(e)}'
         }), 500
+
+# ===== EXPORT CSV / XLSX =====
+# Các endpoint export đọc dữ liệu bằng server-side cursor (yield_per) và stream
+# file về client, bộ nhớ không tăng theo số dòng.
+
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_FORMATS = ('csv', 'xlsx')
+
+def _invalid_format_response():
+    return jsonify({
+        'status': 'error',
+        'message': 'Format must be csv or xlsx'
+    }), 400
+
+def _export_response(fmt, name, header, rows):
+    """Stream rows của một query thành file CSV/XLSX đính kèm"""
+    def generate():
+        try:
+            yield from stream
+        except Exception as e:
+            # Header đã gửi, chỉ có thể log lỗi và cắt response
+            current_app.logger.error(f"Export {name} error: {str(e)}")
+            raise
+
+    stream, mimetype, extension = export_stream(fmt, name, header, rows)
+    filename = f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{extension}"
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@admin_bp.route('/export/bookings', methods=['GET'])
+@jwt_required()
+@admin_required
+def export_bookings():
+    """Export danh sách booking (cùng bộ lọc với /bookings)"""
+    try:
+        fmt = request.args.get('format', 'csv').lower()
+        if fmt not in EXPORT_FORMATS:
+            return _invalid_format_response()
+        status = request.args.get('status')
+        payment_status = request.args.get('payment_status')
+
+        customer = aliased(User)
+        staff = aliased(User)
+        # Dịch vụ của booking_item đầu tiên, giống /bookings (DISTINCT ON, một lần join)
+        first_item = db.session.query(
+            BookingItem.booking_id.label('booking_id'),
+            Service.name.label('service_name')
+        ).join(
+            Service, Service.id == BookingItem.service_id
+        ).distinct(BookingItem.booking_id).order_by(
+            BookingItem.booking_id, BookingItem.created_at
+        ).subquery()
+
+        query = db.session.query(
+            Booking.booking_code, customer.name, customer.email, customer.phone,
+            first_item.c.service_name, staff.name, Booking.booking_date, Booking.booking_time,
+            Booking.end_time, Booking.customer_address, Booking.subtotal, Booking.discount,
+            Booking.tax, Booking.total_price, Booking.status, Booking.payment_status,
+            Booking.payment_method, Booking.notes, Booking.cancel_reason, Booking.created_at
+        ).outerjoin(
+            customer, customer.id == Booking.user_id
+        ).outerjoin(
+            staff, staff.id == Booking.staff_id
+        ).outerjoin(
+            first_item, first_item.c.booking_id == Booking.id
+        )
+        if status:
+            query = query.filter(Booking.status == status)
+        if payment_status:
+            query = query.filter(Booking.payment_status == payment_status)
+        query = query.order_by(desc(Booking.created_at)).yield_per(EXPORT_BATCH_SIZE)
+
+        header = [
+            'Mã đơn', 'Khách hàng', 'Email', 'Số điện thoại', 'Dịch vụ', 'Nhân viên',
+            'Ngày', 'Giờ bắt đầu', 'Giờ kết thúc', 'Địa chỉ', 'Tạm tính', 'Giảm giá',
+            'Thuế', 'Tổng tiền', 'Trạng thái', 'Thanh toán', 'Phương thức', 'Ghi chú',
+            'Lý do hủy', 'Ngày tạo'
+        ]
+        return _export_response(fmt, 'bookings', header, query)
+
+    except Exception as e:
+        current_app.logger.error(f"Export bookings error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to export bookings: {str(e)}'
+        }), 500
+
+@admin_bp.route('/export/users', methods=['GET'])
+@jwt_required()
+@admin_required
+def export_users():
+    """Export danh sách user (cùng bộ lọc với /users)"""
+    try:
+        fmt = request.args.get('format', 'csv').lower()
+        if fmt not in EXPORT_FORMATS:
+            return _invalid_format_response()
+        role = request.args.get('role')
+        status = request.args.get('status')
+
+        # Thống kê booking của mọi user trong một lần GROUP BY thay vì 2 query mỗi user
+        booking_stats = db.session.query(
+            Booking.user_id.label('user_id'),
+            func.count(Booking.id).label('total_bookings'),
+            func.sum(case((Booking.payment_status == 'paid', Booking.total_price), else_=0)).label('total_spent')
+        ).group_by(Booking.user_id).subquery()
+
+        query = db.session.query(
+            User.name, User.email, User.phone, User.address, User.role, User.status,
+            User.email_verified_at, User.last_login_at, User.login_count,
+            func.coalesce(booking_stats.c.total_bookings, 0),
+            func.coalesce(booking_stats.c.total_spent, 0),
+            User.created_at
+        ).outerjoin(booking_stats, booking_stats.c.user_id == User.id)
+        if role:
+            query = query.filter(User.role == role)
+        if status:
+            query = query.filter(User.status == status)
+        query = query.order_by(desc(User.created_at)).yield_per(EXPORT_BATCH_SIZE)
+
+        header = [
+            'Họ tên', 'Email', 'Số điện thoại', 'Địa chỉ', 'Vai trò', 'Trạng thái',
+            'Xác thực email', 'Đăng nhập cuối', 'Số lần đăng nhập', 'Tổng đơn',
+            'Tổng chi tiêu', 'Ngày tham gia'
+        ]
+        return _export_response(fmt, 'users', header, query)
+
+    except Exception as e:
+        current_app.logger.error(f"Export users error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to export users: {str(e)}'
+        }), 500
+
+@admin_bp.route('/export/revenue', methods=['GET'])
+@jwt_required()
+@admin_required
+def export_revenue():
+    """Export doanh thu theo ngày (cùng tham số start/end với /revenue)"""
+    try:
+        fmt = request.args.get('format', 'csv').lower()
+        if fmt not in EXPORT_FORMATS:
+            return _invalid_format_response()
+        start_date_str = request.args.get('start')
+        end_date_str = request.args.get('end')
+
+        if not start_date_str or not end_date_str:
+            return jsonify({
+                'status': 'error',
+                'message': 'Start date and end date are required'
+            }), 400
+
+        try:
+            start_date = datetime.fromisoformat(start_date_str)
+            end_date = datetime.fromisoformat(end_date_str)
+        except ValueError:
+            return jsonify({
+                'status': 'error',
+                'message': 'Invalid date format. Use ISO format (YYYY-MM-DD)'
+            }), 400
+
+        day = func.date(Booking.created_at)
+        query = db.session.query(
+            day.label('day'),
+            func.count(Booking.id),
+            func.coalesce(func.sum(Booking.total_price), 0)
+        ).filter(
+            and_(
+                Booking.created_at >= start_date,
+                Booking.created_at <= end_date,
+                Booking.payment_status == 'paid'
+            )
+        ).group_by(day).order_by(day).yield_per(EXPORT_BATCH_SIZE)
+
+        def rows():
+            # Điền các ngày không có doanh thu giống dailyData của /revenue
+            current_date = start_date.date()
+            for row_day, bookings, revenue in query:
+                while current_date < row_day:
+                    yield current_date, 0, 0
+                    current_date += timedelta(days=1)
+                yield row_day, bookings, revenue
+                current_date = row_day + timedelta(days=1)
+            while current_date <= end_date.date():
+                yield current_date, 0, 0
+                current_date += timedelta(days=1)
+
+        return _export_response(fmt, 'revenue', ['Ngày', 'Số đơn', 'Doanh thu'], rows())
+
+    except Exception as e:
+        current_app.logger.error(f"Export revenue error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to export revenue: {str(e)}'
+        }), 500
+
+# ===== SETTINGS =====
+
+def _settings_response(snapshot):
+    values = snapshot.to_dict()
+    return {
+        'version': snapshot.version,
+        'settings': [
+            {
+                'key': key,
+                'value': values[key],
+                'default': spec.default,
+                'type': spec.type.__name__,
+                'description': spec.description,
+                'min': spec.min,
+                'max': spec.max,
+                'invalid': key in snapshot.invalid
+            }
+            for key, spec in SETTINGS.items()
+        ]
+    }
+
+@admin_bp.route('/settings', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_settings():
+    """Cài đặt đang áp dụng (đọc lại từ database, không dùng snapshot của worker)"""
+    try:
+        return jsonify({
+            'status': 'success',
+            'data': _settings_response(REGISTRY.load())
+        }), 200
+        
+    except Exception as e:
+        current_app.logger.error(f"Get settings error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to get settings: {str(e)}'
+        }), 500
+
+@admin_bp.route('/settings', methods=['PUT'])
+@jwt_required()
+@admin_required
+def update_runtime_settings():
+    """
+    Sửa cài đặt: body {"booking.work_end_hour": 18, ...}; null = về giá trị mặc định
+    Mọi worker áp dụng ngay sau khi commit (NOTIFY settings_changed)
+    """
+    try:
+        data = request.get_json() or {}
+        unknown = [key for key in data if key not in SETTINGS]
+        if not data or unknown:
+            return jsonify({
+                'status': 'error',
+                'message': f"Unknown settings: {', '.join(unknown)}" if unknown else 'No settings given'
+            }), 400
+        
+        try:
+            update_settings(data)
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
+        db.session.commit()
+        
+        return jsonify({
+            'status': 'success',
+            'message': 'Settings updated successfully',
+            'data': _settings_response(REGISTRY.load())
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Update settings error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to update settings: {str(e)}'
+        }), 500
+
+# ===== METRICS =====
+
+@admin_bp.route('/metrics/db-pool', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_db_pool_metrics():
+    """Thống kê connection pool của worker xử lý request (thời gian chờ, đang dùng, overflow, timeout)"""
+    try:
+        return jsonify({
+            'pid': os.getpid(),
+            'engines': pool_snapshots(db.engines.values())
+        }), 200
+        
+    except Exception as e:
+        current_app.logger.error(f"DB pool metrics error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to get database pool metrics: {str(e)}'
+        }), 500
+
+# ===== DEBUG =====
+
+@admin_bp.route('/debug/profile', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_profile_samples():
+    """
+    Tải mẫu stack của profiler chạy liên tục (PROFILING_SAMPLE_INTERVAL) dạng collapsed cho flamegraph
+    Query: endpoint (vd admin.get_monthly_report), seconds (mặc định cả cửa sổ), format=collapsed|json
+    """
+    try:
+        interval = current_app.config.get('PROFILING_SAMPLE_INTERVAL')
+        if not interval:
+            return jsonify({
+                'status': 'error',
+                'message': 'Continuous profiling is disabled (set PROFILING_SAMPLE_INTERVAL)'
+            }), 400
+        
+        counts = collect_profile(
+            current_app.config.get('PROFILING_DIR'),
+            seconds=request.args.get('seconds', type=int),
+            endpoint=request.args.get('endpoint')
+        )
+        
+        if request.args.get('format') == 'json':
+            # Tổng số mẫu theo endpoint và các hàm chiếm nhiều mẫu nhất (self time)
+            endpoints = Counter()
+            functions = Counter()
+            for stack, count in counts.items():
+                endpoints[stack.split(';', 1)[0]] += count
+                functions[stack.rsplit(';', 1)[-1]] += count
+            return jsonify({
+                'status': 'success',
+                'data': {
+                    'samples': sum(counts.values()),
+                    'interval': interval,
+                    'endpoints': [
+                        {'endpoint': name, 'samples': n, 'seconds': round(n * interval, 3)}
+                        for name, n in endpoints.most_common()
+                    ],
+                    'topFunctions': [
+                        {'function': name, 'samples': n} for name, n in functions.most_common(30)
+                    ]
+                }
+            }), 200
+        
+        filename = f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded"
+        return Response(
+            render_collapsed(counts),
+            mimetype='text/plain',
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+        
+    except Exception as e:
+        current_app.logger.error(f"Profile samples error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to get profile samples: {str(e)}'
+        }), 500
@@ -1,11 +1,284 @@
 """Areas API endpoints"""
 
-from flask import Blueprint, jsonify
+import uuid
+from decimal import Decimal, InvalidOperation
+
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import jwt_required
+from app.extensions import db
+from app.models.service import Service, Area, ServiceArea
+from app.utils.helpers import admin_required
+from app.utils.coverage import coverage_index, normalize_place
+from app.utils.query_budget import query_budget
 
 areas_bp = Blueprint('areas', __name__)
 
+
+def area_entry_dict(area):
+    return {
+        'id': str(area.id),
+        'name': area.name,
+        'district': area.district,
+        'city': area.city,
+        'deliveryFee': float(area.delivery_fee)
+    }
+
+
+def _parse_fee(value):
+    try:
+        fee = Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        return None
+    return fee if fee >= 0 else None
+
+
 @areas_bp.route('/', methods=['GET'])
+@areas_bp.route('', methods=['GET'])
+@query_budget(2)
 def get_areas():
-    """Get all service areas"""
-    return jsonify({'message': 'Areas endpoint working', 'areas': []})
+    """Get all active service areas (optionally of one city)"""
+    try:
+        city = request.args.get('city')
+        areas = coverage_index.areas()
+        if city:
+            city_key = normalize_place(city)
+            areas = [area for area in areas if normalize_place(area.city) == city_key]
+
+        return jsonify({
+            'status': 'success',
+            'areas': [area_entry_dict(area) for area in areas]
+        }), 200
+
+    except Exception as e:
+        current_app.logger.error(f"Get areas error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to get areas: {str(e)}'
+        }), 500
+
+
+@areas_bp.route('/resolve', methods=['GET'])
+@query_budget(2)
+def resolve_area():
+    """
+    Services available at an address (city, district) and their delivery fee
+
+    Answered from the in-memory coverage index (no query once it is built).
+    With serviceId, also tells whether that service covers the address.
+    """
+    try:
+        city = request.args.get('city')
+        district = request.args.get('district')
+        if not city:
+            return jsonify({
+                'status': 'error',
+                'message': 'city is required'
+            }), 400
+
+        coverage = coverage_index.resolve(city, district)
+        result = {
+            'status': 'success',
+            'city': city,
+            'district': district,
+            'areas': [area_entry_dict(area) for area in coverage.areas],
+            'services': [
+                {
+                    'serviceId': str(service_id),
+                    'areaId': str(area.id) if area else None,
+                    'deliveryFee': float(area.delivery_fee) if area else 0
+                }
+                for service_id, area in coverage.services.items()
+            ]
+        }
+
+        if request.args.get('serviceId'):
+            try:
+                service_id = uuid.UUID(request.args['serviceId'])
+            except ValueError:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Invalid serviceId'
+                }), 400
+            result['covered'] = coverage.covers(service_id)
+            result['deliveryFee'] = float(coverage.delivery_fee(service_id)) if result['covered'] else None
+
+        return jsonify(result), 200
+
+    except Exception as e:
+        current_app.logger.error(f"Resolve area error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to resolve area: {str(e)}'
+        }), 500
+
+
+@areas_bp.route('/', methods=['POST'])
+@areas_bp.route('', methods=['POST'])
+@jwt_required()
+@admin_required
+def create_area():
+    """Create a service area (Admin only)"""
+    try:
+        data = request.get_json() or {}
+        for field in ('name', 'city'):
+            if not data.get(field):
+                return jsonify({
+                    'status': 'error',
+                    'message': f'Missing required field: {field}'
+                }), 400
+
+        delivery_fee = _parse_fee(data.get('deliveryFee', 0))
+        if delivery_fee is None:
+            return jsonify({
+                'status': 'error',
+                'message': 'deliveryFee must be a non-negative number'
+            }), 400
+
+        area = Area(
+            name=data['name'],
+            city=data['city'],
+            district=data.get('district') or None,
+            delivery_fee=delivery_fee,
+            status='active' if data.get('isActive', True) else 'inactive'
+        )
+        db.session.add(area)
+        db.session.commit()
+
+        return jsonify({
+            'status': 'success',
+            'message': 'Area created successfully',
+            'area': area.to_dict()
+        }), 201
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Create area error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to create area: {str(e)}'
+        }), 500
+
+
+@areas_bp.route('/<area_id>', methods=['PUT'])
+@jwt_required()
+@admin_required
+def update_area(area_id):
+    """Update a service area (Admin only)"""
+    try:
+        area = Area.query.get(area_id)
+        if not area:
+            return jsonify({
+                'status': 'error',
+                'message': 'Area not found'
+            }), 404
+
+        data = request.get_json() or {}
+        if 'deliveryFee' in data:
+            delivery_fee = _parse_fee(data['deliveryFee'])
+            if delivery_fee is None:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'deliveryFee must be a non-negative number'
+                }), 400
+            area.delivery_fee = delivery_fee
+        for field in ('name', 'city'):
+            if data.get(field):
+                setattr(area, field, data[field])
+        if 'district' in data:
+            area.district = data['district'] or None
+        if 'isActive' in data:
+            area.status = 'active' if data['isActive'] else 'inactive'
+        db.session.commit()
+
+        return jsonify({
+            'status': 'success',
+            'message': 'Area updated successfully',
+            'area': area.to_dict()
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Update area error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to update area: {str(e)}'
+        }), 500
+
+
+@areas_bp.route('/<area_id>', methods=['DELETE'])
+@jwt_required()
+@admin_required
+def delete_area(area_id):
+    """Delete a service area and its service links (Admin only)"""
+    try:
+        area = Area.query.get(area_id)
+        if not area:
+            return jsonify({
+                'status': 'error',
+                'message': 'Area not found'
+            }), 404
+
+        for link in ServiceArea.query.filter_by(area_id=area.id).all():
+            db.session.delete(link)
+        # Xoá liên kết trước khu vực (không có relationship để sắp thứ tự)
+        db.session.flush()
+        db.session.delete(area)
+        db.session.commit()
+
+        return jsonify({
+            'status': 'success',
+            'message': 'Area deleted successfully'
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Delete area error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to delete area: {str(e)}'
+        }), 500
+
+
+@areas_bp.route('/<area_id>/services', methods=['PUT'])
+@jwt_required()
+@admin_required
+def set_area_services(area_id):
+    """Replace the services covering an area: {"serviceIds": [...]} (Admin only)"""
+    try:
+        area = Area.query.get(area_id)
+        if not area:
+            return jsonify({
+                'status': 'error',
+                'message': 'Area not found'
+            }), 404
+
+        requested = {str(id) for id in (request.get_json() or {}).get('serviceIds') or []}
+        services = Service.query.filter(Service.id.in_(requested)).all() if requested else []
+        if len(services) != len(requested):
+            return jsonify({
+                'status': 'error',
+                'message': 'Unknown service in serviceIds'
+            }), 400
+
+        wanted = {service.id for service in services}
+        links = ServiceArea.query.filter_by(area_id=area.id).all()
+        for link in links:
+            if link.service_id not in wanted:
+                db.session.delete(link)
+        for service_id in wanted - {link.service_id for link in links}:
+            db.session.add(ServiceArea(service_id=service_id, area_id=area.id))
+        db.session.commit()
+
+        return jsonify({
+            'status': 'success',
+            'message': 'Area services updated successfully',
+            'serviceIds': sorted(str(id) for id in wanted)
+        }), 200
 
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Set area services error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to update area services: {str(e)}'
+        }), 500
@@ -10,6 +10,7 @@ from app.extensions import db
 from app.models.user import User
 from app.utils.validators import validate_email, validate_password
 from app.utils.errors import ValidationAPIError, AuthenticationError, handle_error
+from app.utils.messaging import send_email, send_sms
 import re
 
 auth_bp = Blueprint('auth', __name__)
@@ -411,17 +412,31 @@ def generate_reset_code():
     return str(random.randint(100000, 999999))
 
 def send_email_code(email, code):
-    """Send reset code via email (mock implementation)"""
-    # In production, integrate with email service like SendGrid, AWS SES, etc.
-    current_app.logger.info(f"Sending email code {code} to {email}")
-    print(f"📧 EMAIL RESET CODE: {code} -> {email}")
+    """Queue the reset code email (sent by the message workers, see app/utils/messaging.py)"""
+    try:
+        send_email(
+            email,
+            'Mã xác thực đặt lại mật khẩu CleanHome',
+            f'Mã xác thực của bạn là {code}. Mã có hiệu lực trong 5 phút.'
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Queue email code error: {str(e)}")
+        return False
+    current_app.logger.info(f"Queued email reset code to {email}")
     return True
 
 def send_sms_code(phone, code):
-    """Send reset code via SMS (mock implementation)"""
-    # In production, integrate with SMS service like Twilio, AWS SNS, etc.
-    current_app.logger.info(f"Sending SMS code {code} to {phone}")
-    print(f"📱 SMS RESET CODE: {code} -> {phone}")
+    """Queue the reset code SMS (sent by the message workers)"""
+    try:
+        send_sms(phone, f'CleanHome: ma xac thuc cua ban la {code}, hieu luc 5 phut.')
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Queue SMS code error: {str(e)}")
+        return False
+    current_app.logger.info(f"Queued SMS reset code to {phone}")
     return True
 
 @auth_bp.route('/forgot-password', methods=['POST'])
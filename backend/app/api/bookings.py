@@ -5,14 +5,27 @@ Bảng: bookings, booking_items, reviews
 Author: CleanHome Team
 """
 
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 import uuid
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app.models.booking import Booking, BookingItem
-from app.models.user import User
+from sqlalchemy import func
+from app.models.booking import Booking, BookingItem, BookingPromotion, BookingSeries
+from app.models.promotion import Promotion
+from app.models.user import User, UserAddress
 from app.models.service import Service
 from app.extensions import db
+from app.utils.promotion_engine import promotion_engine
+from app.utils.coverage import coverage_index
+from app.utils.promotion_usage import reserve_usage, release_usage
+from app.utils.query_budget import query_budget
+from app.utils.notifications import notify_booking, booking_staff_ids
+from app.utils.config import runtime_settings
+from app.utils.helpers import booking_tax
+from app.utils.booking_series import (
+    SeriesError, OPEN_STATUSES, parse_rule, create_series, update_remaining, cancel_remaining, conflict_list
+)
 from .vnpay import generate_vnpay_payment_url # Import hàm helper
 
 bookings_bp = Blueprint('bookings', __name__)
@@ -96,13 +109,62 @@ def get_booking(booking_id):
             'message': f'Lỗi khi lấy chi tiết booking: {str(e)}'
         }), 500
 
+def _booking_area(data, user_id, service):
+    """
+    Phí di chuyển theo khu vực phục vụ: (delivery_fee, địa chỉ đã lưu hoặc None, None) hoặc (None, None, response lỗi)
+
+    Khu vực lấy từ city/district trong body, nếu không có thì từ địa chỉ đã lưu
+    (address_id), sau cùng từ chữ của customer_address. Booking không xác định được
+    thành phố chỉ bị từ chối khi dịch vụ giới hạn theo khu vực; dịch vụ phục vụ mọi nơi
+    thì không tính phí di chuyển (index trong bộ nhớ, không query).
+    """
+    address = None
+    if data.get('address_id'):
+        try:
+            address = UserAddress.query.filter_by(
+                id=uuid.UUID(str(data['address_id'])), user_id=uuid.UUID(str(user_id))
+            ).first()
+        except ValueError:
+            address = None
+        if not address:
+            return None, None, (jsonify({
+                'status': 'error',
+                'message': 'Địa chỉ không tồn tại'
+            }), 404)
+
+    city, district = data.get('city'), data.get('district')
+    if not city and address:
+        city, district = address.city, address.district
+    if not city:
+        city, district = coverage_index.locate(data['customer_address'])
+    if not city:
+        if service.id not in coverage_index.get_index().everywhere:
+            return None, None, (jsonify({
+                'status': 'error',
+                'message': 'Không xác định được khu vực của địa chỉ, vui lòng chọn tỉnh/thành phố và quận/huyện'
+            }), 400)
+        return 0, address, None
+
+    coverage = coverage_index.resolve(city, district)
+    if not coverage.covers(service.id):
+        place = f'{district}, {city}' if district else city
+        return None, None, (jsonify({
+            'status': 'error',
+            'message': f'Dịch vụ chưa phục vụ khu vực {place}'
+        }), 400)
+    return float(coverage.delivery_fee(service.id)), address, None
+
 @bookings_bp.route('/', methods=['POST'])
 @jwt_required()
+# Gồm địa chỉ đã lưu (1), khuyến mãi được áp dụng (2) và nạp lại cache của worker
+# (6: cài đặt, khu vực, khuyến mãi, cài đặt thông báo)
+@query_budget(21)
 def create_booking():
     """
     Tạo đơn đặt lịch mới
     Nếu phương thức thanh toán là 'vnpay', sẽ tạo và trả về URL thanh toán
     """
+    usage_reservation = None
     try:
         current_user_id = get_jwt_identity()
         data = request.get_json()
@@ -145,10 +207,12 @@ def create_booking():
                 'message': 'Không thể đặt lịch trong quá khứ'
             }), 400
         
-        # Cấu hình thời gian làm việc (có thể move vào config sau)
-        WORK_START_HOUR = 8  # 8:00 AM
-        WORK_END_HOUR = 17   # 5:00 PM (17:00)
-        MIN_ADVANCE_HOURS = 1  # Phải đặt trước ít nhất 1 tiếng
+        # Cấu hình thời gian làm việc (admin sửa tại /api/admin/settings, đọc từ snapshot, không query)
+        settings = runtime_settings()
+        WORK_START_HOUR = settings['booking.work_start_hour']
+        WORK_END_HOUR = settings['booking.work_end_hour']
+        MIN_ADVANCE_HOURS = settings['booking.min_advance_hours']
+        MIN_LEAD_MINUTES = settings['booking.min_lead_minutes']
         
         # Kiểm tra thời gian đặt lịch trong giờ làm việc
         if booking_time.hour < WORK_START_HOUR or booking_time.hour >= WORK_END_HOUR:
@@ -158,7 +222,7 @@ def create_booking():
             }), 400
         
         # Kiểm tra không được đặt quá 1 tiếng trước giờ kết thúc ca (áp dụng cho mọi ngày)
-        work_end_time = datetime.combine(booking_date, datetime.min.time().replace(hour=WORK_END_HOUR))
+        work_end_time = datetime.combine(booking_date, datetime.min.time()) + timedelta(hours=WORK_END_HOUR)
         latest_booking_time = work_end_time - timedelta(hours=MIN_ADVANCE_HOURS)
         
         if booking_datetime > latest_booking_time:
@@ -170,12 +234,12 @@ def create_booking():
         # Nếu đặt lịch cùng ngày, kiểm tra thời gian hiện tại
         if booking_date == current_datetime.date():
             
-            # Kiểm tra thời gian đặt lịch phải sau thời gian hiện tại ít nhất 30 phút
-            min_booking_time = current_datetime + timedelta(minutes=30)
+            # Kiểm tra thời gian đặt lịch phải sau thời gian hiện tại ít nhất MIN_LEAD_MINUTES phút
+            min_booking_time = current_datetime + timedelta(minutes=MIN_LEAD_MINUTES)
             if booking_datetime < min_booking_time:
                 return jsonify({
                     'status': 'error', 
-                    'message': f'Vui lòng đặt lịch trước ít nhất 30 phút. Thời gian sớm nhất: {min_booking_time.strftime("%H:%M")}'
+                    'message': f'Vui lòng đặt lịch trước ít nhất {MIN_LEAD_MINUTES} phút. Thời gian sớm nhất: {min_booking_time.strftime("%H:%M")}'
                 }), 400
 
         # Kiểm tra dịch vụ
@@ -186,16 +250,65 @@ def create_booking():
                 'message': 'Dịch vụ không tồn tại'
             }), 404
             
+        # Khu vực phục vụ và phí di chuyển theo quận/thành phố
+        delivery_fee, address, error = _booking_area(data, current_user_id, service)
+        if error:
+            return error
+            
         # Tính tổng tiền
         area = float(data.get('area', 0)) if data.get('area') else 0
         quantity = int(data.get('quantity', 1)) if data.get('quantity') else 1
         unit_price = float(service.price)
         subtotal = unit_price * quantity
         
-        # Tính discount và tax (có thể mở rộng sau)
-        discount = float(data.get('discount', 0))
-        tax = float(data.get('tax', 0))
-        total_price = subtotal - discount + tax
+        # Tính discount phía server bằng promotion engine (không dùng discount do client gửi)
+        promotion_code = data.get('promotion_code')
+        if promotion_code:
+            promotion_entry, result = promotion_engine.promotion_for_code(promotion_code, subtotal)
+            if not promotion_entry:
+                return jsonify({
+                    'status': 'error', 
+                    'message': f'Mã khuyến mãi không hợp lệ: {result}'
+                }), 400
+            discount = result
+        else:
+            # Tự động áp dụng khuyến mãi tốt nhất trong các khuyến mãi được đánh dấu tự động áp dụng;
+            # mã riêng (nhập/tạo hàng loạt) chỉ được dùng khi khách gửi đúng mã
+            promotion_entry, discount = promotion_engine.best_promotion(subtotal)
+        
+        promotion = None
+        if promotion_entry:
+            # Kiểm tra lại trên DB vì index trong bộ nhớ có thể đã cũ
+            promotion = Promotion.query.get(promotion_entry.id)
+            is_valid, message = promotion.is_valid(Decimal(str(subtotal))) if promotion else (False, 'Promotion not found')
+            if not is_valid:
+                promotion_engine.invalidate()
+                if promotion_code:
+                    return jsonify({
+                        'status': 'error', 
+                        'message': f'Mã khuyến mãi không hợp lệ: {message}'
+                    }), 400
+                promotion, discount = None, 0
+        
+        service_id = service.id
+        applied_promotion = None
+        if promotion:
+            # Giữ chỗ một lượt sử dụng: UPDATE có điều kiện được commit ngay,
+            # nên khóa dòng promotion không bị giữ trong suốt quá trình tạo booking
+            applied_promotion = {'id': promotion.id, 'code': promotion.code, 'name': promotion.name}
+            usage_reservation = reserve_usage(promotion.id)
+            if not usage_reservation:
+                promotion_engine.invalidate()
+                if promotion_code:
+                    return jsonify({
+                        'status': 'error', 
+                        'message': 'Mã khuyến mãi đã hết lượt sử dụng'
+                    }), 400
+                applied_promotion, discount = None, 0
+        
+        discount = float(discount)
+        tax = booking_tax(subtotal - discount)
+        total_price = subtotal - discount + tax + delivery_fee
           
         # Tạo booking mới
         new_booking = Booking(
@@ -203,11 +316,13 @@ def create_booking():
             booking_date=booking_date,
             booking_time=booking_time,
             customer_address=data['customer_address'],
+            address_id=address.id if address else None,
             area=area,
             notes=data.get('notes', ''),
             subtotal=subtotal,
             discount=discount,
             tax=tax,
+            delivery_fee=delivery_fee,
             total_price=total_price,
             payment_method=payment_method,
             payment_status='unpaid',
@@ -220,7 +335,7 @@ def create_booking():
         # Tạo booking item
         booking_item = BookingItem(
             booking_id=new_booking.id,
-            service_id=service.id,
+            service_id=service_id,
             quantity=quantity,
             unit_price=unit_price,
             subtotal=subtotal,
@@ -228,13 +343,27 @@ def create_booking():
         )
         
         db.session.add(booking_item)
+        
+        # Ghi nhận khuyến mãi đã áp dụng (lượt sử dụng đã được giữ chỗ ở trên)
+        if applied_promotion:
+            db.session.add(BookingPromotion(
+                booking_id=new_booking.id,
+                promotion_id=applied_promotion['id'],
+                discount_amount=discount
+            ))
         db.session.flush()
 
         # Chuẩn bị response data
         response_data = {
             'status': 'success',
             'message': 'Tạo booking thành công',
-            'booking': new_booking.to_dict()
+            'booking': new_booking.to_dict(),
+            'promotion': {
+                'id': str(applied_promotion['id']),
+                'code': applied_promotion['code'],
+                'name': applied_promotion['name'],
+                'discountAmount': discount
+            } if applied_promotion else None
         }
 
         # Nếu thanh toán VNPay, tạo URL thanh toán
@@ -249,17 +378,20 @@ def create_booking():
                 response_data['message'] = 'Tạo booking và URL thanh toán VNPay thành công'
             else:
                 db.session.rollback()
+                release_usage(usage_reservation)
                 return jsonify({
                     'status': 'error', 
                     'message': 'Lỗi khi tạo URL thanh toán VNPay'
                 }), 500
 
+        notify_booking(new_booking, 'created')
         db.session.commit()
         return jsonify(response_data), 201
         
     except Exception as e:
         db.session.rollback()
-        print(f"❌ Lỗi tạo booking: {str(e)}")  # Debug log
+        release_usage(usage_reservation)
+        current_app.logger.error(f"Create booking error: {str(e)}")
         return jsonify({
             'status': 'error',
             'message': f'Lỗi khi tạo booking: {str(e)}'
@@ -300,6 +432,9 @@ def cancel_booking(booking_id):
         # Thêm lý do hủy nếu có
         if 'cancel_reason' in data and data['cancel_reason']:
             booking.cancel_reason = data['cancel_reason']
+        
+        # Báo cho khách và nhân viên đã được phân công
+        notify_booking(booking, 'cancelled', [booking.user_id, *booking_staff_ids(booking)])
             
         db.session.commit()
         
@@ -438,3 +573,326 @@ def get_payment_status(booking_id):
             'message': f'Lỗi khi lấy trạng thái thanh toán: {str(e)}'
         }), 500
 
+
+# ==================== LỊCH ĐỊNH KỲ ====================
+
+def _series_error(error):
+    response = {
+        'status': 'error',
+        'message': str(error)
+    }
+    if error.conflicts:
+        response['conflicts'] = error.conflicts
+    return jsonify(response), 409 if error.conflicts else 400
+
+def _parse_series_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+    except ValueError:
+        raise SeriesError('Định dạng ngày không hợp lệ (YYYY-MM-DD)')
+
+def _find_series(series_id, current_user_id):
+    """(series, None) hoặc (None, response lỗi); chủ lịch hoặc admin"""
+    try:
+        series = BookingSeries.query.get(uuid.UUID(str(series_id)))
+    except ValueError:
+        series = None
+    if not series:
+        return None, (jsonify({
+            'status': 'error',
+            'message': 'Không tìm thấy lịch định kỳ'
+        }), 404)
+    if str(series.user_id) != str(current_user_id):
+        user = User.query.get(current_user_id)
+        if not user or user.role != 'admin':
+            return None, (jsonify({
+                'status': 'error',
+                'message': 'Bạn không có quyền truy cập lịch định kỳ này'
+            }), 403)
+    return series, None
+
+def occurrence_dict(row):
+    return {
+        'id': str(row.id),
+        'bookingCode': row.booking_code,
+        'date': row.booking_date.strftime('%Y-%m-%d'),
+        'time': row.booking_time.strftime('%H:%M'),
+        'status': row.status,
+        'paymentStatus': row.payment_status,
+        'staffId': str(row.staff_id) if row.staff_id else None,
+        'totalAmount': float(row.total_price) if row.total_price else 0
+    }
+
+@bookings_bp.route('/series', methods=['POST'])
+@jwt_required()
+# Gồm địa chỉ đã lưu (1) và nạp lại cache của worker (6: cài đặt, khu vực, nhân viên, cài đặt thông báo)
+@query_budget(18)
+def create_booking_series():
+    """
+    Đặt lịch định kỳ: sinh và kiểm tra tất cả các lần trong một lượt
+
+    Body như tạo booking (service_id, booking_date = ngày đầu tiên, booking_time,
+    customer_address, ...) và recurrence: {"frequency": "weekly"|"biweekly"|"monthly",
+    "count": 8} hoặc {"rrule": "FREQ=WEEKLY;INTERVAL=2;COUNT=6"}.
+    skip_conflicts=true bỏ qua các ngày không còn trống thay vì từ chối cả lịch.
+    Lịch định kỳ không áp dụng mã khuyến mãi.
+    """
+    try:
+        current_user_id = get_jwt_identity()
+        data = request.get_json() or {}
+
+        required_fields = ['service_id', 'booking_date', 'booking_time', 'customer_address', 'recurrence']
+        for field in required_fields:
+            if field not in data or not data[field]:
+                return jsonify({
+                    'status': 'error', 
+                    'message': f'Trường {field} là bắt buộc'
+                }), 400
+
+        payment_method = data.get('payment_method', 'cash')
+        if payment_method not in ['cash', 'vnpay', 'bank_transfer', 'credit_card', 'momo', 'zalopay']:
+            return jsonify({
+                'status': 'error', 
+                'message': 'Phương thức thanh toán không hợp lệ'
+            }), 400
+
+        try:
+            booking_date = datetime.strptime(data['booking_date'], '%Y-%m-%d').date()
+            booking_time = datetime.strptime(data['booking_time'], '%H:%M').time()
+        except ValueError:
+            return jsonify({
+                'status': 'error', 
+                'message': 'Định dạng ngày hoặc giờ không hợp lệ'
+            }), 400
+
+        rule = parse_rule(data['recurrence'])
+
+        service = Service.query.get(data['service_id'])
+        if not service:
+            return jsonify({
+                'status': 'error', 
+                'message': 'Dịch vụ không tồn tại'
+            }), 404
+
+        # Khu vực phục vụ và phí di chuyển
+        delivery_fee, address, error = _booking_area(data, current_user_id, service)
+        if error:
+            return error
+
+        template = {
+            'customer_address': data['customer_address'],
+            'address_id': address.id if address else None,
+            'quantity': int(data.get('quantity', 1)) if data.get('quantity') else 1,
+            'area': float(data.get('area', 0)) if data.get('area') else 0,
+            'notes': data.get('notes', ''),
+            'service_notes': data.get('service_notes', ''),
+            'payment_method': payment_method
+        }
+        series, bookings, skipped = create_series(
+            uuid.UUID(str(current_user_id)), service, rule, booking_date, booking_time, template,
+            delivery_fee=delivery_fee, skip_conflicts=bool(data.get('skip_conflicts'))
+        )
+        db.session.commit()
+
+        return jsonify({
+            'status': 'success',
+            'message': f'Đã tạo lịch định kỳ với {len(bookings)} lần đặt',
+            'series': series.to_dict(),
+            'bookings': [
+                {
+                    'id': str(booking['id']),
+                    'bookingCode': booking['booking_code'],
+                    'date': booking['booking_date'].strftime('%Y-%m-%d'),
+                    'time': booking['booking_time'].strftime('%H:%M'),
+                    'status': booking['status'],
+                    'totalAmount': booking['total_price']
+                }
+                for booking in bookings
+            ],
+            'skipped': conflict_list(skipped)
+        }), 201
+
+    except SeriesError as e:
+        db.session.rollback()
+        return _series_error(e)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Create booking series error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi tạo lịch định kỳ: {str(e)}'
+        }), 500
+
+@bookings_bp.route('/series', methods=['GET'])
+@jwt_required()
+@query_budget(2)
+def get_my_booking_series():
+    """Danh sách lịch định kỳ của user hiện tại, kèm số lần còn lại"""
+    try:
+        current_user_id = get_jwt_identity()
+        remaining = db.session.query(
+            Booking.series_id,
+            func.count().label('remaining'),
+            func.min(Booking.booking_date).label('next_date')
+        ).filter(
+            Booking.user_id == current_user_id,
+            Booking.series_id.isnot(None),
+            Booking.booking_date >= date.today(),
+            Booking.status.in_(OPEN_STATUSES)
+        ).group_by(Booking.series_id).subquery()
+
+        rows = db.session.query(BookingSeries, remaining.c.remaining, remaining.c.next_date).outerjoin(
+            remaining, remaining.c.series_id == BookingSeries.id
+        ).filter(
+            BookingSeries.user_id == current_user_id
+        ).order_by(BookingSeries.created_at.desc()).all()
+
+        return jsonify({
+            'status': 'success',
+            'series': [
+                {
+                    **series.to_dict(),
+                    'remaining': count or 0,
+                    'nextDate': next_date.strftime('%Y-%m-%d') if next_date else None
+                }
+                for series, count, next_date in rows
+            ]
+        })
+
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi lấy danh sách lịch định kỳ: {str(e)}'
+        }), 500
+
+@bookings_bp.route('/series/<series_id>', methods=['GET'])
+@jwt_required()
+@query_budget(3)
+def get_booking_series(series_id):
+    """Chi tiết lịch định kỳ và tất cả các lần đặt"""
+    try:
+        series, error = _find_series(series_id, get_jwt_identity())
+        if error:
+            return error
+
+        rows = db.session.query(
+            Booking.id, Booking.booking_code, Booking.booking_date, Booking.booking_time, Booking.status,
+            Booking.payment_status, Booking.staff_id, Booking.total_price
+        ).filter(Booking.series_id == series.id).order_by(Booking.booking_date).all()
+
+        return jsonify({
+            'status': 'success',
+            'series': series.to_dict(),
+            'bookings': [occurrence_dict(row) for row in rows]
+        })
+
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi lấy lịch định kỳ: {str(e)}'
+        }), 500
+
+@bookings_bp.route('/series/<series_id>', methods=['PUT'])
+@jwt_required()
+def update_booking_series(series_id):
+    """
+    Sửa các lần còn lại của lịch định kỳ bằng một câu UPDATE
+
+    Body: booking_time, customer_address (kèm city/district hoặc address_id như khi tạo), notes;
+    from_date (mặc định hôm nay); skip_conflicts=true giữ giờ cũ cho các ngày không còn
+    trống ở giờ mới. Địa chỉ mới được kiểm tra lại khu vực phục vụ và tính lại phí di chuyển.
+    """
+    try:
+        current_user_id = get_jwt_identity()
+        series, error = _find_series(series_id, current_user_id)
+        if error:
+            return error
+        if series.status == 'cancelled':
+            return jsonify({
+                'status': 'error',
+                'message': 'Lịch định kỳ đã bị hủy'
+            }), 400
+
+        data = request.get_json() or {}
+        changes = {}
+        if data.get('booking_time'):
+            try:
+                changes['booking_time'] = datetime.strptime(data['booking_time'], '%H:%M').time()
+            except ValueError:
+                return jsonify({
+                    'status': 'error', 
+                    'message': 'Định dạng giờ không hợp lệ'
+                }), 400
+        if data.get('customer_address'):
+            # Địa chỉ mới có thể ở khu vực khác: kiểm tra khu vực phục vụ, phí di chuyển và địa chỉ đã lưu
+            delivery_fee, address, error = _booking_area(data, current_user_id, db.session.get(Service, series.service_id))
+            if error:
+                return error
+            changes.update(customer_address=data['customer_address'], delivery_fee=delivery_fee,
+                           address_id=address.id if address else None)
+        if 'notes' in data:
+            changes['notes'] = data['notes'] or ''
+        if not changes:
+            return jsonify({
+                'status': 'error',
+                'message': 'Không có thay đổi (booking_time, customer_address, notes)'
+            }), 400
+
+        rows = update_remaining(
+            series, changes, from_date=_parse_series_date(data.get('from_date')),
+            skip_conflicts=bool(data.get('skip_conflicts'))
+        )
+        db.session.commit()
+
+        return jsonify({
+            'status': 'success',
+            'message': f'Đã cập nhật {len(rows)} lần đặt còn lại',
+            'series': series.to_dict(),
+            'updated': [{'id': str(row.id), 'date': row.booking_date.strftime('%Y-%m-%d')} for row in rows]
+        })
+
+    except SeriesError as e:
+        db.session.rollback()
+        return _series_error(e)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Update booking series error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi cập nhật lịch định kỳ: {str(e)}'
+        }), 500
+
+@bookings_bp.route('/series/<series_id>/cancel', methods=['PUT'])
+@jwt_required()
+def cancel_booking_series(series_id):
+    """Hủy các lần còn lại của lịch định kỳ (từ from_date, mặc định hôm nay) bằng một câu UPDATE"""
+    try:
+        current_user_id = get_jwt_identity()
+        series, error = _find_series(series_id, current_user_id)
+        if error:
+            return error
+
+        data = request.get_json() or {}
+        rows = cancel_remaining(
+            series, uuid.UUID(str(current_user_id)), reason=data.get('cancel_reason'),
+            from_date=_parse_series_date(data.get('from_date'))
+        )
+        db.session.commit()
+
+        return jsonify({
+            'status': 'success',
+            'message': f'Đã hủy {len(rows)} lần đặt còn lại',
+            'series': series.to_dict(),
+            'cancelled': [{'id': str(row.id), 'date': row.booking_date.strftime('%Y-%m-%d')} for row in rows]
+        })
+
+    except SeriesError as e:
+        db.session.rollback()
+        return _series_error(e)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Cancel booking series error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi hủy lịch định kỳ: {str(e)}'
+        }), 500
@@ -0,0 +1,46 @@
+"""Media file serving and maintenance commands"""
+
+import click
+from flask import Blueprint, current_app
+
+from app.extensions import db
+from app.models.user import User
+from app.models.service import Service
+from app.utils.media import (
+    get_media_store, parse_asset_key, collect_garbage, recount_references, IMMUTABLE_MAX_AGE
+)
+
+media_bp = Blueprint('media', __name__)
+
+@media_bp.route('/media/<path:key>', methods=['GET'])
+def get_media(key):
+    """Serve an uploaded file; content-addressed files are cached forever"""
+    max_age = IMMUTABLE_MAX_AGE if parse_asset_key(key) else current_app.config.get('MEDIA_LEGACY_MAX_AGE', 3600)
+    response = get_media_store().send(key, max_age)
+    if parse_asset_key(key):
+        response.cache_control.immutable = True
+    return response
+
+@media_bp.route('/static/uploads/<path:key>', methods=['GET'])
+def get_legacy_upload(key):
+    """Files uploaded before the media store, still referenced as /static/uploads/..."""
+    return get_media_store().send(key, current_app.config.get('MEDIA_LEGACY_MAX_AGE', 3600))
+
+@media_bp.cli.command('gc')
+@click.option('--grace', type=int, help='Seconds an asset must have been unreferenced (MEDIA_GC_GRACE_SECONDS)')
+def gc_command(grace):
+    """Delete uploaded images no record references anymore"""
+    deleted, freed = collect_garbage(grace)
+    print(f"Deleted {deleted} unreferenced assets ({freed / 1024:.0f} KB)")
+
+@media_bp.cli.command('recount')
+def recount_command():
+    """Recompute media reference counts from user avatars and service images"""
+    def referenced_urls():
+        for (url,) in db.session.query(User.avatar).filter(User.avatar.isnot(None)).yield_per(1000):
+            yield url
+        for (url,) in db.session.query(Service.thumbnail).filter(Service.thumbnail.isnot(None)).yield_per(1000):
+            yield url
+
+    changed = recount_references(list(referenced_urls()))
+    print(f"Updated the reference count of {changed} assets")
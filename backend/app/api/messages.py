@@ -0,0 +1,53 @@
+"""Outbound email/SMS worker commands (flask messages ...)"""
+
+import signal
+import time
+
+import click
+from flask import Blueprint, current_app
+
+from app.utils.messaging import CHANNELS, MessageWorker, queue_stats, retry_failed, purge_sent
+
+messages_bp = Blueprint('messages', __name__)
+
+@messages_bp.cli.command('work')
+@click.option('--threads', type=int, help='Worker threads (MESSAGE_WORKER_THREADS)')
+@click.option('--channel', 'channels', multiple=True, type=click.Choice(CHANNELS), help='Only these channels')
+@click.option('--once', is_flag=True, help='Send the messages due now, then exit')
+def work_command(threads, channels, once):
+    """Send queued emails and SMS until stopped (SIGTERM/Ctrl+C finishes the current batches)"""
+    worker = MessageWorker(current_app._get_current_object(), threads, channels or CHANNELS)
+    if once:
+        print(f"Handled {worker.drain()} messages")
+        return
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *args: stopping.append(True))
+    worker.start()
+    print(f"Sending {', '.join(worker.channels)} with {worker.threads} threads")
+    try:
+        while not stopping and worker.is_alive():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    worker.stop()
+
+@messages_bp.cli.command('stats')
+def stats_command():
+    """Queued/sent/failed messages per channel"""
+    stats, oldest_due = queue_stats()
+    for channel, counts in stats.items():
+        print(f"{channel}: " + (', '.join(f"{status} {count}" for status, count in sorted(counts.items())) or 'empty'))
+    print(f"Oldest due message waiting for {oldest_due:.0f}s")
+
+@messages_bp.cli.command('retry')
+@click.option('--channel', type=click.Choice(CHANNELS))
+def retry_command(channel):
+    """Queue failed messages again"""
+    print(f"Queued {retry_failed(channel)} failed messages again")
+
+@messages_bp.cli.command('purge')
+@click.option('--days', type=int, default=30, help='Delete messages sent more than this many days ago')
+def purge_command(days):
+    """Delete old sent messages"""
+    print(f"Deleted {purge_sent(days)} sent messages")
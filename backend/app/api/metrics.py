@@ -0,0 +1,21 @@
+"""Prometheus metrics endpoint"""
+
+import hmac
+
+from flask import Blueprint, Response, current_app, request
+
+from app.utils.metrics import collect, render
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Request, SQL and connection pool metrics (Prometheus text format)"""
+    token = current_app.config.get('METRICS_TOKEN')
+    if token:
+        supplied = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied, f'Bearer {token}'):
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+
+    values = collect(current_app.config.get('METRICS_MULTIPROC_DIR'))
+    return Response(render(values), mimetype='text/plain; version=0.0.4; charset=utf-8')
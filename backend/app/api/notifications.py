@@ -1,11 +1,219 @@
 """Notifications API endpoints"""
 
-from flask import Blueprint, jsonify
+import click
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+from app.extensions import db
+from app.models.notification import Notification, NotificationSetting
+from app.utils.helpers import encode_cursor, decode_cursor
+from app.utils.notifications import unread_count, mark_read, reconcile_unread_counts, SETTINGS_CACHE
 
 notifications_bp = Blueprint('notifications', __name__)
 
+# Trường settings nhận từ client (camelCase) -> cột NotificationSetting
+SETTING_FIELDS = {
+    'emailNotifications': 'email_notifications',
+    'smsNotifications': 'sms_notifications',
+    'pushNotifications': 'push_notifications',
+    'bookingNotifications': 'booking_notifications',
+    'paymentNotifications': 'payment_notifications',
+    'promotionNotifications': 'promotion_notifications',
+}
+
 @notifications_bp.route('/', methods=['GET'])
+@jwt_required()
 def get_notifications():
-    """Get all notifications"""
-    return jsonify({'message': 'Notifications endpoint working', 'notifications': []})
+    """
+    Hộp thư thông báo của user hiện tại (mới nhất trước)
+
+    Query params:
+        cursor: Con trỏ trang tiếp theo (phân trang keyset theo created_at, id)
+        per_page: Số thông báo mỗi trang (tối đa 100)
+        unread_only: 'true' để chỉ lấy thông báo chưa đọc
+    """
+    try:
+        current_user_id = get_jwt_identity()
+        cursor = request.args.get('cursor')
+        per_page = max(min(request.args.get('per_page', 20, type=int), 100), 1)
+        unread_only = request.args.get('unread_only', 'false').lower() == 'true'
+
+        query = Notification.query.filter_by(user_id=current_user_id)
+        if unread_only:
+            query = query.filter(Notification.is_read == False)  # noqa: E712
+        query = query.order_by(Notification.created_at.desc(), Notification.id.desc())
+
+        if cursor:
+            position = decode_cursor(cursor)
+            if not position:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Cursor không hợp lệ'
+                }), 400
+            created_at, last_id = position
+            query = query.filter(db.tuple_(Notification.created_at, Notification.id) < (created_at, last_id))
+
+        notifications = query.limit(per_page + 1).all()
+        has_next = len(notifications) > per_page
+        notifications = notifications[:per_page]
+
+        return jsonify({
+            'status': 'success',
+            'data': [notification.to_dict() for notification in notifications],
+            'pagination': {
+                'per_page': per_page,
+                'has_prev': bool(cursor),
+                'has_next': has_next,
+                'next_cursor': (
+                    encode_cursor(notifications[-1].created_at, notifications[-1].id)
+                    if has_next and notifications else None
+                )
+            },
+            'unreadCount': unread_count(current_user_id)
+        })
+
+    except Exception as e:
+        current_app.logger.error(f"Get notifications error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi lấy thông báo: {str(e)}'
+        }), 500
+
+@notifications_bp.route('/unread-count', methods=['GET'])
+@jwt_required()
+def get_unread_count():
+    """Số thông báo chưa đọc (badge), đọc từ bộ đếm thay vì COUNT(*)"""
+    try:
+        return jsonify({
+            'status': 'success',
+            'data': {'unread': unread_count(get_jwt_identity())}
+        })
+
+    except Exception as e:
+        current_app.logger.error(f"Get unread count error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi lấy số thông báo chưa đọc: {str(e)}'
+        }), 500
+
+@notifications_bp.route('/read', methods=['PUT'])
+@jwt_required()
+def mark_notifications_read():
+    """
+    Đánh dấu đã đọc hàng loạt
+    Body: {"ids": [...]} hoặc {"all": true}
+    """
+    try:
+        current_user_id = get_jwt_identity()
+        data = request.get_json() or {}
+
+        if data.get('all'):
+            ids = None
+        else:
+            ids = data.get('ids')
+            if not isinstance(ids, list) or not ids:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Cần truyền danh sách ids hoặc all = true'
+                }), 400
+            if len(ids) > 500:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Tối đa 500 thông báo mỗi lần'
+                }), 400
+
+        try:
+            updated = mark_read(current_user_id, ids)
+        except ValueError:
+            return jsonify({
+                'status': 'error',
+                'message': 'ID thông báo không hợp lệ'
+            }), 400
+        db.session.commit()
+
+        return jsonify({
+            'status': 'success',
+            'data': {
+                'updated': updated,
+                'unread': unread_count(current_user_id)
+            }
+        })
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Mark notifications read error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi đánh dấu đã đọc: {str(e)}'
+        }), 500
+
+@notifications_bp.route('/settings', methods=['GET'])
+@jwt_required()
+def get_notification_settings():
+    """Cài đặt nhận thông báo của user hiện tại (giá trị mặc định nếu chưa có)"""
+    try:
+        setting = NotificationSetting.query.filter_by(user_id=get_jwt_identity()).first()
+        if not setting:
+            setting = NotificationSetting(**{
+                column.name: column.default.arg for column in NotificationSetting.__table__.columns
+                if column.name in SETTING_FIELDS.values()
+            })
+        return jsonify({
+            'status': 'success',
+            'data': setting.to_dict()
+        })
+
+    except Exception as e:
+        current_app.logger.error(f"Get notification settings error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi lấy cài đặt thông báo: {str(e)}'
+        }), 500
+
+@notifications_bp.route('/settings', methods=['PUT'])
+@jwt_required()
+def update_notification_settings():
+    """Cập nhật cài đặt nhận thông báo"""
+    try:
+        current_user_id = get_jwt_identity()
+        data = request.get_json() or {}
+
+        invalid = [field for field in data if field not in SETTING_FIELDS or not isinstance(data[field], bool)]
+        if invalid:
+            return jsonify({
+                'status': 'error',
+                'message': f'Trường không hợp lệ: {", ".join(invalid)}'
+            }), 400
+
+        setting = NotificationSetting.query.filter_by(user_id=current_user_id).first()
+        if not setting:
+            setting = NotificationSetting(user_id=current_user_id)
+            db.session.add(setting)
+        for field, value in data.items():
+            setattr(setting, SETTING_FIELDS[field], value)
+        db.session.commit()
+
+        # Worker khác nhận thay đổi sau NOTIFICATION_SETTINGS_TTL giây
+        SETTINGS_CACHE.invalidate(current_user_id)
+
+        return jsonify({
+            'status': 'success',
+            'message': 'Đã cập nhật cài đặt thông báo',
+            'data': setting.to_dict()
+        })
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Update notification settings error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi cập nhật cài đặt thông báo: {str(e)}'
+        }), 500
 
+@notifications_bp.cli.command('reconcile')
+@click.option('--user-id', 'user_ids', multiple=True, help='Only these users (default: every counter)')
+@click.option('--batch-size', type=int, default=1000)
+def reconcile_command(user_ids, batch_size):
+    """Recompute unread notification counters from the notifications table"""
+    corrected = reconcile_unread_counts(list(user_ids) or None, batch_size=batch_size)
+    print(f"Corrected {corrected} unread counters")
@@ -1,15 +1,21 @@
 """Promotions API endpoints"""
 
-from flask import Blueprint, request, jsonify
+import json
+import click
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime, date
 from decimal import Decimal
 
 from app.extensions import db
-from app.models.promotion import Promotion
+from app.models.promotion import Promotion, PromotionCampaign
 from app.models.user import User
 from app.utils.helpers import admin_required
+from app.utils.promotion_engine import promotion_engine
+from app.utils.promotion_usage import merge_usage, pending_usage
+from app.utils.promotion_bulk import import_promotions, generate_promotions, export_promotions, read_rows
+from app.utils.campaigns import CampaignError, create_campaign, run_campaign, start_campaign, cancel_campaign
 
 promotions_bp = Blueprint('promotions', __name__)
 
@@ -33,6 +39,9 @@ def get_promotions():
                 Promotion.end_date >= today
             ).order_by(Promotion.created_at.desc()).all()
         
+        # Include redemptions not yet merged from the sharded usage counters
+        pending = pending_usage([promo.id for promo in promotions])
+        
         promotions_data = []
         for promo in promotions:
             promotions_data.append({
@@ -48,7 +57,8 @@ def get_promotions():
                 'endDate': promo.end_date.isoformat(),
                 'isActive': promo.status == 'active',
                 'usageLimit': promo.usage_limit,
-                'usageCount': promo.used_count,
+                'autoApply': promo.auto_apply,
+                'usageCount': (promo.used_count or 0) + pending.get(promo.id, 0),
                 'createdAt': promo.created_at.isoformat(),
                 'updatedAt': promo.updated_at.isoformat()
             })
@@ -112,7 +122,8 @@ def create_promotion():
             start_date=start_date,
             end_date=end_date,
             usage_limit=data.get('usageLimit'),
-            status='active' if data.get('isActive', True) else 'inactive'
+            status='active' if data.get('isActive', True) else 'inactive',
+            auto_apply=bool(data.get('autoApply', False))
         )
         
         db.session.add(promotion)
@@ -141,6 +152,87 @@ def create_promotion():
             'message': f'Failed to create promotion: {str(e)}'
         }), 500
 
+@promotions_bp.route('/bulk', methods=['POST'])
+@jwt_required()
+@admin_required
+def bulk_create_promotions():
+    """
+    Import or generate promotions in bulk (admin only)
+
+    Accepts either:
+    - multipart/form-data with a CSV or JSON `file`
+    - JSON {"promotions": [...]} with the same fields as create_promotion
+    - JSON {"generate": {"count": 10000, "prefix": "TET", "length": 8}, "template": {...}}
+      where template holds every field of create_promotion except code
+    """
+    try:
+        def log_progress(done, total):
+            current_app.logger.info(f"Bulk promotions: {done}/{total} rows inserted")
+
+        if 'file' in request.files:
+            upload = request.files['file']
+            fmt = request.form.get('format') or upload.filename.rsplit('.', 1)[-1].lower()
+            rows = read_rows(upload.stream, fmt)
+            result = import_promotions(rows, progress=log_progress)
+        else:
+            data = request.get_json() or {}
+            if 'generate' in data:
+                options = data['generate']
+                result = generate_promotions(
+                    int(options.get('count', 0)),
+                    data.get('template', {}),
+                    prefix=options.get('prefix', ''),
+                    length=int(options.get('length', 8)),
+                    progress=log_progress
+                )
+            elif isinstance(data.get('promotions'), list):
+                result = import_promotions(data['promotions'], progress=log_progress)
+            else:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Provide a file, a promotions list or generate options'
+                }), 400
+
+        return jsonify({
+            'status': 'success',
+            'message': f'Created {result.created} promotions',
+            'result': result.to_dict()
+        }), 201 if result.created else 200
+
+    except (ValueError, json.JSONDecodeError) as e:
+        db.session.rollback()
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to import promotions: {str(e)}'
+        }), 500
+
+@promotions_bp.route('/export', methods=['GET'])
+@jwt_required()
+@admin_required
+def export_promotions_file():
+    """Stream all promotions as CSV or JSON (admin only), optionally filtered by code prefix and status"""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'json'):
+        return jsonify({
+            'status': 'error',
+            'message': 'Format must be csv or json'
+        }), 400
+
+    filename = f"promotions-{date.today().isoformat()}.{fmt}"
+    return Response(
+        stream_with_context(export_promotions(
+            fmt, prefix=request.args.get('prefix'), status=request.args.get('status')
+        )),
+        mimetype='text/csv' if fmt == 'csv' else 'application/json',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
 @promotions_bp.route('/<promotion_id>', methods=['PUT'])
 @jwt_required()
 @admin_required
@@ -177,11 +269,17 @@ def update_promotion(promotion_id):
             promotion.usage_limit = data['usageLimit']
         if 'isActive' in data:
             promotion.status = 'active' if data['isActive'] else 'inactive'
+        if 'autoApply' in data:
+            promotion.auto_apply = bool(data['autoApply'])
         
         promotion.updated_at = datetime.utcnow()
         
         db.session.commit()
         
+        # Re-split the sharded usage capacity against the new limit
+        if 'usageLimit' in data:
+            merge_usage(promotion.id)
+        
         return jsonify({
             'status': 'success',
             'message': 'Promotion updated successfully'
@@ -254,6 +352,130 @@ def delete_promotion(promotion_id):
             'message': f'Failed to delete promotion: {str(e)}'
         }), 500
 
+@promotions_bp.route('/<promotion_id>/campaigns', methods=['POST'])
+@jwt_required()
+@admin_required
+def create_promotion_campaign(promotion_id):
+    """
+    Announce a promotion to customers (admin only)
+
+    Body (all optional): {"title": "...", "message": "...", "channels": ["email", "sms", "notification"]}
+    Templates can use {name}, {promotion}, {code}, {discount}, {end_date}. The campaign
+    is sent in the background; poll GET /campaigns/<id> for progress.
+    """
+    try:
+        promotion = Promotion.query.get(promotion_id)
+        if not promotion:
+            return jsonify({
+                'status': 'error',
+                'message': 'Promotion not found'
+            }), 404
+
+        data = request.get_json() or {}
+        try:
+            campaign = create_campaign(
+                promotion,
+                title=data.get('title'),
+                message=data.get('message'),
+                channels=data.get('channels'),
+                created_by=get_jwt_identity()
+            )
+        except CampaignError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
+        db.session.commit()
+
+        start_campaign(campaign.id)
+
+        return jsonify({
+            'status': 'success',
+            'message': 'Campaign started',
+            'campaign': campaign.to_dict()
+        }), 202
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to start campaign: {str(e)}'
+        }), 500
+
+@promotions_bp.route('/<promotion_id>/campaigns', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_promotion_campaigns(promotion_id):
+    """Campaigns of a promotion, newest first (admin only)"""
+    try:
+        campaigns = PromotionCampaign.query.filter_by(promotion_id=promotion_id)\
+            .order_by(PromotionCampaign.created_at.desc()).all()
+        return jsonify({
+            'status': 'success',
+            'campaigns': [campaign.to_dict() for campaign in campaigns]
+        })
+
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to get campaigns: {str(e)}'
+        }), 500
+
+@promotions_bp.route('/campaigns/<campaign_id>', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_promotion_campaign(campaign_id):
+    """Progress and throughput of a campaign (admin only)"""
+    try:
+        campaign = PromotionCampaign.query.get(campaign_id)
+        if not campaign:
+            return jsonify({
+                'status': 'error',
+                'message': 'Campaign not found'
+            }), 404
+        return jsonify({
+            'status': 'success',
+            'campaign': campaign.to_dict()
+        })
+
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to get campaign: {str(e)}'
+        }), 500
+
+@promotions_bp.route('/campaigns/<campaign_id>/cancel', methods=['POST'])
+@jwt_required()
+@admin_required
+def cancel_promotion_campaign(campaign_id):
+    """Stop a campaign; messages already queued are still sent (admin only)"""
+    try:
+        campaign = PromotionCampaign.query.get(campaign_id)
+        if not campaign:
+            return jsonify({
+                'status': 'error',
+                'message': 'Campaign not found'
+            }), 404
+        if not cancel_campaign(campaign):
+            return jsonify({
+                'status': 'error',
+                'message': f'Campaign is already {campaign.status}'
+            }), 400
+        db.session.commit()
+
+        return jsonify({
+            'status': 'success',
+            'message': 'Campaign cancelled',
+            'campaign': campaign.to_dict()
+        })
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to cancel campaign: {str(e)}'
+        }), 500
+
 @promotions_bp.route('/apply/<user_id>', methods=['POST'])
 @jwt_required()
 def get_best_promotion_for_user(user_id):
@@ -268,25 +490,8 @@ def get_best_promotion_for_user(user_id):
                 'message': 'Invalid order value'
             }), 400
         
-        # Get all active promotions
-        today = date.today()
-        active_promotions = Promotion.query.filter(
-            Promotion.status == 'active',
-            Promotion.start_date <= today,
-            Promotion.end_date >= today
-        ).all()
-        
-        best_promotion = None
-        best_discount = 0
-        
-        # Find the promotion that gives the highest discount
-        for promo in active_promotions:
-            is_valid, message = promo.is_valid(order_value)
-            if is_valid:
-                discount = promo.calculate_discount(order_value)
-                if discount > best_discount:
-                    best_discount = discount
-                    best_promotion = promo
+        # Pick the best discount among the auto-applied promotions (private codes are never suggested)
+        best_promotion, best_discount = promotion_engine.best_promotion(order_value)
         
         if best_promotion:
             return jsonify({
@@ -311,4 +516,73 @@ def get_best_promotion_for_user(user_id):
         return jsonify({
             'status': 'error',
             'message': f'Failed to find promotion: {str(e)}'
-        }), 500
\ No newline at end of file
+        }), 500
+
+@promotions_bp.cli.command('merge-usage')
+def merge_usage_command():
+    """Merge sharded promotion usage counters into promotions.used_count"""
+    merged = merge_usage()
+    print(f"Merged usage counters of {merged} promotions")
+
+def _print_progress(done, total):
+    print(f"{done}/{total} rows inserted")
+
+def _print_result(result):
+    summary = result.to_dict()
+    print(f"Created {summary['created']} of {summary['total']} promotions "
+          f"({summary['duplicates']} duplicates, {summary['invalid']} invalid)")
+    for error in summary['errors']:
+        print(f"  row {error['row']}: {error['message']}")
+
+@promotions_bp.cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'json']), help='Defaults to the file extension')
+@click.option('--chunk-size', type=int, help='Rows per INSERT')
+def import_promotions_command(path, fmt, chunk_size):
+    """Import promotions from a CSV or JSON file"""
+    fmt = fmt or path.rsplit('.', 1)[-1].lower()
+    with open(path, 'rb') as f:
+        rows = read_rows(f, fmt)
+    _print_result(import_promotions(rows, chunk_size=chunk_size, progress=_print_progress))
+
+@promotions_bp.cli.command('generate')
+@click.option('--count', type=int, required=True)
+@click.option('--prefix', default='')
+@click.option('--length', type=int, default=8, help='Random characters after the prefix')
+@click.option('--template', 'template_json', required=True,
+              help='JSON with the create_promotion fields shared by every code')
+@click.option('--chunk-size', type=int, help='Rows per INSERT')
+def generate_promotions_command(count, prefix, length, template_json, chunk_size):
+    """Generate COUNT single-use promotion codes from a template"""
+    result = generate_promotions(count, json.loads(template_json), prefix=prefix, length=length,
+                                 chunk_size=chunk_size, progress=_print_progress)
+    _print_result(result)
+
+@promotions_bp.cli.command('export')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'json']), default='csv')
+@click.option('--prefix', help='Only codes starting with this prefix')
+@click.option('--status', type=click.Choice(['active', 'inactive', 'draft']))
+def export_promotions_command(path, fmt, prefix, status):
+    """Export promotions to a CSV or JSON file"""
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        for chunk in export_promotions(fmt, prefix=prefix, status=status):
+            f.write(chunk)
+    print(f"Exported promotions to {path}")
+
+@promotions_bp.cli.command('send-campaign')
+@click.argument('campaign_id')
+@click.option('--force', is_flag=True, help='Take over a running campaign or restart a failed one')
+def send_campaign_command(campaign_id, force):
+    """Send (or resume) a promotion campaign in the foreground"""
+    def print_progress(campaign):
+        summary = campaign.to_dict()
+        print(f"{summary['processed']}/{summary['totalRecipients']} recipients "
+              f"({summary['progress']}%, {summary['ratePerSecond']}/s)")
+
+    campaign = run_campaign(campaign_id, progress=print_progress, force=force)
+    if campaign is None:
+        print("Campaign is finished or being sent by another process (use --force to take it over)")
+        return
+    print(f"Campaign {campaign.status}: {campaign.emails_queued} emails, {campaign.sms_queued} SMS, "
+          f"{campaign.notifications_created} notifications queued")
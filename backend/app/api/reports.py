@@ -15,12 +15,14 @@ from app.models.booking import Booking
 from app.models.service import Service
 from app.models.user import User
 from app.utils.helpers import admin_required
+from app.utils.db_routing import read_only
 
 reports_bp = Blueprint('reports', __name__)
 
 @reports_bp.route('/', methods=['GET'])
 @jwt_required()
 @admin_required
+@read_only()
 def get_reports():
     """
     Lấy báo cáo tổng quan hệ thống (chỉ dành cho admin)
@@ -1,25 +1,484 @@
-"""Reviews API endpoints"""
+"""
+Reviews API endpoints
+Bảng: reviews, rating_summaries, rating_daily_summaries
 
-from flask import Blueprint, jsonify, request
+Mỗi thay đổi đánh giá (tạo, sửa, duyệt, xoá) cập nhật bảng tổng hợp trong
+cùng transaction (app/utils/reviews.py), nên điểm trung bình của dịch vụ /
+nhân viên luôn đọc từ một dòng thay vì tính AVG.
+"""
+
+import uuid
+from datetime import datetime
+
+from flask import Blueprint, jsonify, request, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import db
+from app.models.booking import Booking, BookingItem, BookingStaff
+from app.models.review import Review, ReviewStatus
+from app.models.user import User
+from app.utils.db_routing import read_only
+from app.utils.helpers import admin_required, encode_cursor, decode_cursor
+from app.utils.query_budget import query_budget
+from app.utils.reviews import contributions, apply_changes, rating_summary, rebuild_summaries
 
 reviews_bp = Blueprint('reviews', __name__)
 
+MAX_IMAGES = 10
+
+
+def _uuid_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        raise ValueError(f'{name} không hợp lệ')
+
+
+def _current_user():
+    """User của token (nếu có), cho các endpoint không bắt buộc đăng nhập"""
+    verify_jwt_in_request(optional=True)
+    user_id = get_jwt_identity()
+    return db.session.get(User, uuid.UUID(user_id)) if user_id else None
+
+
+def _validate_content(data, partial=False):
+    """Kiểm tra rating/title/comment/images, trả về dict các trường hợp lệ"""
+    fields = {}
+    if 'rating' in data or not partial:
+        rating = data.get('rating')
+        if isinstance(rating, bool) or not isinstance(rating, int) or not 1 <= rating <= 5:
+            raise ValueError('Số sao phải từ 1 đến 5')
+        fields['rating'] = rating
+    if 'title' in data:
+        title = (data.get('title') or '').strip() or None
+        if title and len(title) > 255:
+            raise ValueError('Tiêu đề tối đa 255 ký tự')
+        fields['title'] = title
+    if 'comment' in data:
+        fields['comment'] = (data.get('comment') or '').strip() or None
+    if 'images' in data:
+        images = data.get('images') or []
+        if not isinstance(images, list) or len(images) > MAX_IMAGES or not all(isinstance(i, str) for i in images):
+            raise ValueError(f'Tối đa {MAX_IMAGES} ảnh (danh sách URL)')
+        fields['images'] = images or None
+    return fields
+
+
+def _initial_status():
+    if current_app.config.get('REVIEWS_REQUIRE_APPROVAL'):
+        return ReviewStatus.PENDING
+    return ReviewStatus.APPROVED
+
+
+def _already_reviewed():
+    return jsonify({
+        'status': 'error',
+        'message': 'Booking này đã được đánh giá'
+    }), 409
+
+
 @reviews_bp.route('', methods=['GET'])
 @reviews_bp.route('/', methods=['GET'])
+@read_only()
+@query_budget(4)
 def get_reviews():
-    """Get all reviews"""
-    return jsonify({'message': 'Reviews endpoint working', 'reviews': []})
+    """
+    Danh sách đánh giá (mới nhất trước)
+
+    Query params:
+        serviceId, staffId, userId: lọc theo dịch vụ / nhân viên / khách hàng
+        rating, minRating: lọc theo số sao
+        hasComment: 'true' để chỉ lấy đánh giá có nội dung
+        status: pending/approved/rejected (chỉ admin; mặc định approved)
+        cursor, per_page: phân trang keyset theo (created_at, id), tối đa 100
+    Có serviceId hoặc staffId thì trả kèm tổng hợp điểm (summary).
+    """
+    try:
+        try:
+            service_id = _uuid_arg('serviceId')
+            staff_id = _uuid_arg('staffId')
+            user_id = _uuid_arg('userId')
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        rating = request.args.get('rating', type=int)
+        min_rating = request.args.get('minRating', type=int)
+        has_comment = request.args.get('hasComment', 'false').lower() == 'true'
+        status = request.args.get('status')
+        cursor = request.args.get('cursor')
+        per_page = max(min(request.args.get('per_page', 20, type=int), 100), 1)
+
+        query = Review.query
+        if status and status != ReviewStatus.APPROVED.value:
+            user = _current_user()
+            if not user or user.role != 'admin':
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Chỉ admin được xem đánh giá chưa duyệt'
+                }), 403
+            if status != 'all':
+                try:
+                    query = query.filter(Review.status == ReviewStatus(status))
+                except ValueError:
+                    return jsonify({'status': 'error', 'message': 'Trạng thái không hợp lệ'}), 400
+        else:
+            query = query.filter(Review.status == ReviewStatus.APPROVED)
+
+        if service_id:
+            query = query.filter(Review.service_id == service_id)
+        if staff_id:
+            query = query.filter(Review.staff_id == staff_id)
+        if user_id:
+            query = query.filter(Review.user_id == user_id)
+        if rating:
+            query = query.filter(Review.rating == rating)
+        elif min_rating:
+            query = query.filter(Review.rating >= min_rating)
+        if has_comment:
+            query = query.filter(Review.comment.isnot(None), Review.comment != '')
+
+        if cursor:
+            position = decode_cursor(cursor)
+            if not position:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Cursor không hợp lệ'
+                }), 400
+            created_at, last_id = position
+            query = query.filter(db.tuple_(Review.created_at, Review.id) < (created_at, last_id))
+
+        reviews = query.order_by(Review.created_at.desc(), Review.id.desc()).limit(per_page + 1).all()
+        has_next = len(reviews) > per_page
+        reviews = reviews[:per_page]
+
+        # Tên người đánh giá (một query cho cả trang)
+        names = dict(db.session.query(User.id, User.name).filter(
+            User.id.in_({review.user_id for review in reviews})
+        ).all()) if reviews else {}
+
+        response = {
+            'status': 'success',
+            'data': [{**review.to_dict(), 'userName': names.get(review.user_id)} for review in reviews],
+            'pagination': {
+                'per_page': per_page,
+                'has_prev': bool(cursor),
+                'has_next': has_next,
+                'next_cursor': (
+                    encode_cursor(reviews[-1].created_at, reviews[-1].id)
+                    if has_next and reviews else None
+                )
+            }
+        }
+        if service_id or staff_id:
+            response['summary'] = rating_summary('service', service_id) if service_id else rating_summary('staff', staff_id)
+        return jsonify(response), 200
+
+    except Exception as e:
+        current_app.logger.error(f"Get reviews error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi lấy đánh giá: {str(e)}'
+        }), 500
+
+@reviews_bp.route('/summary', methods=['GET'])
+@read_only()
+@query_budget(1)
+def get_rating_summary():
+    """Điểm trung bình, số đánh giá và phân bố số sao của một dịch vụ (serviceId) hoặc nhân viên (staffId)"""
+    try:
+        try:
+            service_id = _uuid_arg('serviceId')
+            staff_id = _uuid_arg('staffId')
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        if not service_id and not staff_id:
+            return jsonify({
+                'status': 'error',
+                'message': 'Cần truyền serviceId hoặc staffId'
+            }), 400
+
+        return jsonify({
+            'status': 'success',
+            'data': rating_summary('service', service_id) if service_id else rating_summary('staff', staff_id)
+        }), 200
+
+    except Exception as e:
+        current_app.logger.error(f"Get rating summary error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi lấy tổng hợp đánh giá: {str(e)}'
+        }), 500
 
 @reviews_bp.route('', methods=['POST'])
 @reviews_bp.route('/', methods=['POST'])
+@jwt_required()
 def create_review():
-    """Create a new review"""
-    data = request.get_json()
-    return jsonify({
-        'success': True,
-        'message': 'Review created successfully',
-        'review': data
-    }), 201
+    """
+    Khách hàng đánh giá booking đã hoàn thành (mỗi booking một đánh giá)
+    Body: bookingId, rating (1-5), title, comment, images
+    """
+    try:
+        current_user_id = uuid.UUID(get_jwt_identity())
+        data = request.get_json() or {}
+
+        try:
+            fields = _validate_content(data)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        try:
+            booking_id = uuid.UUID(str(data.get('bookingId') or data.get('booking_id')))
+        except ValueError:
+            return jsonify({'status': 'error', 'message': 'Trường bookingId là bắt buộc'}), 400
+
+        booking = db.session.get(Booking, booking_id)
+        if not booking or booking.user_id != current_user_id:
+            return jsonify({
+                'status': 'error',
+                'message': 'Không tìm thấy booking'
+            }), 404
+        if booking.status != 'completed':
+            return jsonify({
+                'status': 'error',
+                'message': 'Chỉ đánh giá được booking đã hoàn thành'
+            }), 400
+        if Review.query.filter_by(booking_id=booking.id).first():
+            return _already_reviewed()
+
+        service_id = db.session.query(BookingItem.service_id).filter_by(
+            booking_id=booking.id
+        ).order_by(BookingItem.created_at).limit(1).scalar()
+        if not service_id:
+            return jsonify({
+                'status': 'error',
+                'message': 'Booking không có dịch vụ'
+            }), 400
+        staff_id = booking.staff_id or db.session.query(BookingStaff.staff_id).filter_by(
+            booking_id=booking.id
+        ).order_by(BookingStaff.assigned_at).limit(1).scalar()
+
+        review = Review(
+            booking_id=booking.id, user_id=current_user_id, service_id=service_id, staff_id=staff_id,
+            status=_initial_status(), **fields
+        )
+        try:
+            db.session.add(review)
+            db.session.flush()
+        except IntegrityError:
+            # Another request reviewed the booking after the check above (idx_reviews_booking)
+            db.session.rollback()
+            return _already_reviewed()
+        apply_changes([], contributions(review, booking.created_at.date()))
+        db.session.commit()
+
+        return jsonify({
+            'status': 'success',
+            'message': 'Đánh giá thành công',
+            'data': review.to_dict()
+        }), 201
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Create review error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi tạo đánh giá: {str(e)}'
+        }), 500
+
+@reviews_bp.route('/my-reviews', methods=['GET'])
+@jwt_required()
+def get_my_reviews():
+    """Đánh giá của user hiện tại (mọi trạng thái), mới nhất trước"""
+    try:
+        reviews = Review.query.filter_by(user_id=uuid.UUID(get_jwt_identity())).order_by(
+            Review.created_at.desc(), Review.id.desc()
+        ).limit(200).all()
+        return jsonify({'status': 'success', 'data': [review.to_dict() for review in reviews]}), 200
+
+    except Exception as e:
+        current_app.logger.error(f"Get my reviews error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi lấy đánh giá: {str(e)}'
+        }), 500
+
+@reviews_bp.route('/booking/<booking_id>', methods=['GET'])
+@jwt_required()
+def get_booking_review(booking_id):
+    """Đánh giá của user hiện tại cho một booking"""
+    try:
+        try:
+            review = Review.query.filter_by(
+                booking_id=uuid.UUID(booking_id), user_id=uuid.UUID(get_jwt_identity())
+            ).first()
+        except ValueError:
+            review = None
+        if not review:
+            return jsonify({
+                'status': 'error',
+                'message': 'Booking chưa được đánh giá'
+            }), 404
+
+        return jsonify({'status': 'success', 'data': review.to_dict()}), 200
+
+    except Exception as e:
+        current_app.logger.error(f"Get booking review error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi lấy đánh giá: {str(e)}'
+        }), 500
+
+@reviews_bp.route('/<review_id>', methods=['GET'])
+@read_only()
+def get_review(review_id):
+    """Chi tiết một đánh giá (chưa duyệt: chỉ người viết và admin)"""
+    try:
+        review = db.session.get(Review, uuid.UUID(review_id))
+        if review and review.status != ReviewStatus.APPROVED:
+            user = _current_user()
+            if not user or (user.role != 'admin' and user.id != review.user_id):
+                review = None
+        if not review:
+            return jsonify({
+                'status': 'error',
+                'message': 'Không tìm thấy đánh giá'
+            }), 404
+
+        return jsonify({'status': 'success', 'data': review.to_dict()}), 200
+
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Không tìm thấy đánh giá'}), 404
+    except Exception as e:
+        current_app.logger.error(f"Get review error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi lấy đánh giá: {str(e)}'
+        }), 500
+
+@reviews_bp.route('/<review_id>', methods=['PUT'])
+@jwt_required()
+def update_review(review_id):
+    """Người viết sửa đánh giá (rating, title, comment, images)"""
+    try:
+        current_user_id = uuid.UUID(get_jwt_identity())
+        data = request.get_json() or {}
+        try:
+            fields = _validate_content(data, partial=True)
+            review = db.session.get(Review, uuid.UUID(review_id), with_for_update=True)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        if not review or review.user_id != current_user_id:
+            return jsonify({
+                'status': 'error',
+                'message': 'Không tìm thấy đánh giá'
+            }), 404
+
+        before = contributions(review)
+        for field, value in fields.items():
+            setattr(review, field, value)
+        if current_app.config.get('REVIEWS_REQUIRE_APPROVAL') and review.status == ReviewStatus.APPROVED:
+            # Nội dung mới phải được duyệt lại
+            review.status = ReviewStatus.PENDING
+        apply_changes(before, contributions(review))
+        db.session.commit()
+
+        return jsonify({
+            'status': 'success',
+            'message': 'Cập nhật đánh giá thành công',
+            'data': review.to_dict()
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Update review error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi cập nhật đánh giá: {str(e)}'
+        }), 500
+
+@reviews_bp.route('/<review_id>', methods=['DELETE'])
+@jwt_required()
+def delete_review(review_id):
+    """Người viết hoặc admin xoá đánh giá"""
+    try:
+        user = db.session.get(User, uuid.UUID(get_jwt_identity()))
+        try:
+            review = db.session.get(Review, uuid.UUID(review_id), with_for_update=True)
+        except ValueError:
+            review = None
+        if not review or not user or (user.role != 'admin' and review.user_id != user.id):
+            return jsonify({
+                'status': 'error',
+                'message': 'Không tìm thấy đánh giá'
+            }), 404
+
+        apply_changes(contributions(review), [])
+        db.session.delete(review)
+        db.session.commit()
+
+        return jsonify({
+            'status': 'success',
+            'message': 'Đã xoá đánh giá'
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Delete review error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi xoá đánh giá: {str(e)}'
+        }), 500
+
+@reviews_bp.route('/<review_id>/moderate', methods=['PUT'])
+@jwt_required()
+@admin_required
+def moderate_review(review_id):
+    """
+    Admin duyệt / từ chối đánh giá và trả lời
+    Body: status (approved/rejected/pending), adminReply
+    """
+    try:
+        data = request.get_json() or {}
+        try:
+            review = db.session.get(Review, uuid.UUID(review_id), with_for_update=True)
+            status = ReviewStatus(data['status']) if data.get('status') else None
+        except ValueError:
+            return jsonify({'status': 'error', 'message': 'Trạng thái không hợp lệ'}), 400
+        if not review:
+            return jsonify({
+                'status': 'error',
+                'message': 'Không tìm thấy đánh giá'
+            }), 404
+        if status is None and 'adminReply' not in data:
+            return jsonify({
+                'status': 'error',
+                'message': 'Cần truyền status hoặc adminReply'
+            }), 400
+
+        before = contributions(review)
+        if status is not None:
+            review.status = status
+        if 'adminReply' in data:
+            review.admin_reply = (data.get('adminReply') or '').strip() or None
+            review.admin_reply_at = datetime.utcnow() if review.admin_reply else None
+        apply_changes(before, contributions(review))
+        db.session.commit()
+
+        return jsonify({
+            'status': 'success',
+            'message': 'Cập nhật đánh giá thành công',
+            'data': review.to_dict()
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Moderate review error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi duyệt đánh giá: {str(e)}'
+        }), 500
 
 @reviews_bp.route('', methods=['OPTIONS'])
 @reviews_bp.route('/', methods=['OPTIONS'])
@@ -27,3 +486,8 @@ def handle_options():
     """Handle preflight OPTIONS requests"""
     return '', 200
 
+@reviews_bp.cli.command('rebuild-summaries')
+def rebuild_summaries_command():
+    """Recompute service/staff/daily rating aggregates from the reviews table"""
+    counts = rebuild_summaries()
+    print(f"Rebuilt {counts.get('service', 0)} service, {counts.get('staff', 0)} staff and {counts['day']} daily rating summaries")
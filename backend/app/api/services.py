@@ -4,21 +4,34 @@ API endpoints cho quản lý dịch vụ
 Author: CleanHome Team
 """
 
+import time
+
+import click
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy import or_, and_, desc
-import os
 from app.extensions import db
-from app.models.service import Service, ServiceCategory, ServiceArea, Review
+from app.models.service import Service, ServiceCategory, ServiceArea, ServiceRanking
+from app.models.review import Review, RatingSummary
 from app.models.user import User
 from app.utils.helpers import admin_required, safe_float, safe_int
 from app.utils.validators import validate_service_data
-from werkzeug.utils import secure_filename
+from app.utils.images import process_upload, ImageProcessingError
+from app.utils.media import replace_reference, release_reference
+from app.utils.uploads import receive_upload, upload_slot, UploadRejected
+from app.utils.db_routing import read_only
+from app.utils.query_budget import query_budget
+from app.utils.reviews import contributions, apply_changes, rating_summaries, rating_summary, empty_ratings
+from app.utils.popularity import rank_services
+from app.utils.coverage import coverage_index
 
 services_bp = Blueprint('services', __name__)
 
 @services_bp.route('/', methods=['GET'])
 @services_bp.route('', methods=['GET'])
+@read_only()
+# Trang, đếm, điểm đánh giá, danh mục; thêm lọc danh mục (1) và nạp lại index khu vực (2, tối đa mỗi phút)
+@query_budget(7)
 def get_services():
     """
     Lấy danh sách tất cả dịch vụ với bộ lọc
@@ -33,6 +46,8 @@ def get_services():
         max_price = request.args.get('maxPrice', type=float)  # Giá tối đa
         is_active = request.args.get('isActive')  # Trạng thái hoạt động
         search = request.args.get('search')  # Từ khóa tìm kiếm
+        city = request.args.get('city')  # Chỉ dịch vụ phục vụ địa chỉ này
+        district = request.args.get('district')
         page = request.args.get('page', 1, type=int)  # Trang hiện tại
         limit = request.args.get('limit', 20, type=int)  # Số item mỗi trang
         
@@ -72,19 +87,28 @@ def get_services():
                 )
             )
         
+        if city:
+            # Dịch vụ phục vụ địa chỉ (index khu vực trong bộ nhớ, không join service_areas)
+            query = query.filter(Service.id.in_(list(coverage_index.resolve(city, district).service_ids)))
+        
         # Thực hiện query với phân trang
         services = query.order_by(Service.name).paginate(
             page=page, per_page=limit, error_out=False
         )
         
+        # Điểm đánh giá của cả trang (một query trên bảng tổng hợp)
+        ratings = rating_summaries('service', [service.id for service in services.items])
+        
+        # Tên danh mục của cả trang (một query trên bảng service_categories)
+        category_ids = {service.category_id for service in services.items if service.category_id}
+        category_names = dict(
+            db.session.query(ServiceCategory.id, ServiceCategory.name).filter(ServiceCategory.id.in_(category_ids))
+        ) if category_ids else {}
+        
         # Format dữ liệu trả về
         result = []
         for service in services.items:
-            # Lấy tên danh mục từ bảng service_categories
-            category_name = None
-            if service.category_id:
-                category_obj = ServiceCategory.query.get(service.category_id)
-                category_name = category_obj.name if category_obj else None
+            category_name = category_names.get(service.category_id)
             
             result.append({
                 'id': str(service.id),  # UUID
@@ -95,6 +119,8 @@ def get_services():
                 'image': service.thumbnail,  # URL ảnh thumbnail
                 'duration': service.duration,  # Thời gian (phút)
                 'isActive': service.status == 'active',  # Convert enum thành boolean
+                'rating': ratings[service.id]['average'],  # Điểm trung bình (bảng rating_summaries)
+                'reviewCount': ratings[service.id]['count'],
                 'createdAt': service.created_at.isoformat() if service.created_at else None,
                 'updatedAt': service.updated_at.isoformat() if service.updated_at else None
             })
@@ -125,6 +151,8 @@ def get_service(service_id):
             category_obj = ServiceCategory.query.get(service.category_id)
             category_name = category_obj.name if category_obj else None
         
+        ratings = rating_summary('service', service.id)
+        
         result = {
             'id': str(service.id),
             'name': service.name,
@@ -134,6 +162,9 @@ def get_service(service_id):
             'image': service.thumbnail,
             'duration': service.duration,
             'isActive': service.status == 'active',
+            'rating': ratings['average'],
+            'reviewCount': ratings['count'],
+            'ratingHistogram': ratings['histogram'],
             'createdAt': service.created_at.isoformat() if service.created_at else None,
             'updatedAt': service.updated_at.isoformat() if service.updated_at else None
         }
@@ -148,6 +179,8 @@ def get_service(service_id):
         }), 500
 
 @services_bp.route('/categories', methods=['GET'])
+@read_only()
+@query_budget(3)
 def get_categories():
     """Get all service categories"""
     try:
@@ -165,24 +198,38 @@ def get_categories():
         }), 500
 
 @services_bp.route('/featured', methods=['GET'])
+@read_only()
+@query_budget(1)
 def get_featured_services():
-    """Get featured services"""
+    """
+    Get featured services, most popular first
+
+    Services marked is_featured in the order of service_rankings (flask
+    services rank-popularity), then the ones not ranked yet (marked after the
+    last run) by name. With POPULARITY_FEATURED_ONLY off, ranked services that
+    are not marked are listed too.
+    """
     try:
         limit = request.args.get('limit', 5, type=int)
-        
-        # Get featured active services
-        services = Service.query.filter(
-            and_(Service.status == 'active', Service.is_featured == True)
-        ).limit(limit).all()
-        
+
+        query = db.session.query(Service, ServiceCategory.name, RatingSummary).outerjoin(
+            ServiceRanking, ServiceRanking.service_id == Service.id
+        ).outerjoin(
+            ServiceCategory, ServiceCategory.id == Service.category_id
+        ).outerjoin(
+            # Danh mục và điểm đánh giá trong cùng một query
+            RatingSummary, and_(RatingSummary.target_type == 'service', RatingSummary.target_id == Service.id)
+        ).filter(Service.status == 'active')
+        if current_app.config.get('POPULARITY_FEATURED_ONLY', True):
+            # Bỏ ngay dịch vụ admin vừa bỏ đánh dấu nổi bật, không chờ lần xếp hạng sau
+            query = query.filter(Service.is_featured == True)
+        else:
+            query = query.filter(or_(Service.is_featured == True, ServiceRanking.rank.isnot(None)))
+        rows = query.order_by(ServiceRanking.rank.asc().nullslast(), Service.name).limit(limit).all()
+
         result = []
-        for service in services:
-            # Get category name if category_id exists
-            category_name = None
-            if service.category_id:
-                category_obj = ServiceCategory.query.get(service.category_id)
-                category_name = category_obj.name if category_obj else None
-            
+        for service, category_name, summary in rows:
+            ratings = summary.ratings_dict() if summary else empty_ratings()
             result.append({
                 'id': str(service.id),
                 'name': service.name,
@@ -192,12 +239,14 @@ def get_featured_services():
                 'image': service.thumbnail,
                 'duration': service.duration,
                 'isActive': service.status == 'active',
+                'rating': ratings['average'],
+                'reviewCount': ratings['count'],
                 'createdAt': service.created_at.isoformat() if service.created_at else None,
                 'updatedAt': service.updated_at.isoformat() if service.updated_at else None
             })
-        
+
         return jsonify(result), 200
-        
+
     except Exception as e:
         current_app.logger.error(f"Get featured services error: {str(e)}")
         return jsonify({
@@ -244,6 +293,7 @@ def create_service():
         )
         
         db.session.add(new_service)
+        replace_reference(None, new_service.thumbnail)
         db.session.commit()
         
         # Get category name for response
@@ -304,6 +354,7 @@ def update_service(service_id):
             category_obj = ServiceCategory.query.filter_by(name=data['category']).first()
             service.category_id = category_obj.id if category_obj else None
         if 'image' in data:
+            replace_reference(service.thumbnail, data['image'])
             service.thumbnail = data['image']
         if 'duration' in data:
             service.duration = safe_int(data['duration'])
@@ -318,6 +369,8 @@ def update_service(service_id):
             category_obj = ServiceCategory.query.get(service.category_id)
             category_name = category_obj.name if category_obj else None
         
+        ratings = rating_summary('service', service.id)
+        
         result = {
             'id': str(service.id),
             'name': service.name,
@@ -327,6 +380,9 @@ def update_service(service_id):
             'image': service.thumbnail,
             'duration': service.duration,
             'isActive': service.status == 'active',
+            'rating': ratings['average'],
+            'reviewCount': ratings['count'],
+            'ratingHistogram': ratings['histogram'],
             'createdAt': service.created_at.isoformat() if service.created_at else None,
             'updatedAt': service.updated_at.isoformat() if service.updated_at else None
         }
@@ -388,6 +444,8 @@ def delete_service(service_id):
         current_app.logger.info(f"Deleted {len(service_areas)} service areas")        # Xóa reviews
         reviews = Review.query.filter_by(service_id=service_id).all()
         for review in reviews:
+            # Trừ khỏi điểm của nhân viên và báo cáo
+            apply_changes(contributions(review), [])
             db.session.delete(review)
         current_app.logger.info(f"Deleted {len(reviews)} reviews")
         
@@ -399,6 +457,7 @@ def delete_service(service_id):
         current_app.logger.info(f"Deleted {len(booking_items)} booking items")
         
         # Cuối cùng xóa service
+        release_reference(service.thumbnail)
         db.session.delete(service)
         db.session.commit()
         
@@ -429,47 +488,42 @@ def upload_service_image(service_id):
                 'message': 'Service not found'
             }), 404
         
-        if 'image' not in request.files:
+        # Stream the body and reject wrong types or oversized files early
+        try:
+            with upload_slot(get_jwt_identity()), receive_upload(
+                'image',
+                max_size=current_app.config.get('SERVICE_IMAGE_MAX_SIZE', 16 * 1024 * 1024),
+                allowed_extensions={'png', 'jpg', 'jpeg', 'gif', 'webp'}
+            ) as upload:
+                # Generate resized WebP/JPEG variants instead of serving the original
+                processed = process_upload(upload.read(), 'services')
+        except UploadRejected as e:
             return jsonify({
                 'status': 'error',
-                'message': 'No image file provided'
-            }), 400
-        
-        file = request.files['image']
-        if file.filename == '':
+                'message': e.message
+            }), e.status_code
+        except ImageProcessingError as e:
             return jsonify({
                 'status': 'error',
-                'message': 'No file selected'
+                'message': str(e)
             }), 400
-        
-        # Validate file type
-        allowed_extensions = {'png', 'jpg', 'jpeg', 'gif'}
-        if not ('.' in file.filename and 
-                file.filename.rsplit('.', 1)[1].lower() in allowed_extensions):
+        if processed.pending:
+            # Variants are still being written: keep the current image, the retry reuses the processed files
             return jsonify({
                 'status': 'error',
-                'message': 'Invalid file type'
-            }), 400
-        
-        # Save file
-        filename = secure_filename(f"service_{service_id}_{file.filename}")
-        upload_folder = current_app.config.get('UPLOAD_FOLDER', 'static/uploads')
-        service_folder = os.path.join(upload_folder, 'services')
+                'message': 'Image is still being processed, please retry'
+            }), 503, {'Retry-After': str(current_app.config.get('IMAGE_PROCESS_TIMEOUT', 10))}
         
-        if not os.path.exists(service_folder):
-            os.makedirs(service_folder)
-        
-        file_path = os.path.join(service_folder, filename)
-        file.save(file_path)
-        
-        # Update service with image URL
-        image_url = f"/static/uploads/services/{filename}"
+        # Service cards use the card variant
+        image_url = processed.urls['card']['webp']
+        replace_reference(service.thumbnail, image_url)
         service.thumbnail = image_url
         db.session.commit()
         
         return jsonify({
             'status': 'success',
-            'imageUrl': image_url
+            'imageUrl': image_url,
+            'variants': processed.urls
         }), 200
         
     except Exception as e:
@@ -479,3 +533,17 @@ def upload_service_image(service_id):
             'status': 'error',
             'message': f'Failed to upload image: {str(e)}'
         }), 500
+
+@services_bp.cli.command('rank-popularity')
+@click.option('--every', type=int, help='Recompute every this many seconds until stopped')
+def rank_popularity_command(every):
+    """Recompute the popularity ranking of featured services (service_rankings)"""
+    while True:
+        started = time.monotonic()
+        print(f"Ranked {rank_services()} services in {time.monotonic() - started:.2f}s")
+        if not every:
+            return
+        try:
+            time.sleep(every)
+        except KeyboardInterrupt:
+            return
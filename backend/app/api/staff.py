@@ -5,12 +5,21 @@ Bảng: users (role='staff')
 Author: CleanHome Team  
 """
 
-from flask import Blueprint, jsonify, request
+import uuid
+from datetime import date, datetime
+
+from flask import Blueprint, jsonify, request, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy import and_
 from app.extensions import db
 from app.models.user import User
+from app.models.booking import Booking
+from app.models.schedule import StaffSchedule
 from app.utils.helpers import admin_required
+from app.utils.reviews import rating_summaries
+from app.utils.config import runtime_settings
+from app.utils.query_budget import query_budget
+from app.utils.staff_calendar import staff_calendar
 
 staff_bp = Blueprint('staff', __name__)
 
@@ -22,6 +31,7 @@ def get_staff():
     Lấy danh sách tất cả nhân viên (chỉ dành cho admin)
     - Lọc users có role='staff' từ bảng users
     - Bao gồm thông tin lịch làm việc
+    - Điểm đánh giá đọc từ bảng tổng hợp (không tính AVG)
     """
     try:
         # Lấy tham số query
@@ -39,6 +49,9 @@ def get_staff():
             page=page, per_page=limit, error_out=False
         )
         
+        # Điểm đánh giá của cả trang (bảng rating_summaries)
+        ratings = rating_summaries('staff', [staff.id for staff in staff_pagination.items])
+        
         result = []
         for staff in staff_pagination.items:
             result.append({
@@ -49,6 +62,8 @@ def get_staff():
                 'status': staff.status,  # enum user_status
                 'avatar': staff.avatar,
                 'bio': staff.bio,
+                'rating': ratings[staff.id]['average'],
+                'reviewCount': ratings[staff.id]['count'],
                 'loginCount': staff.login_count,
                 'lastLoginAt': staff.last_login_at.isoformat() if staff.last_login_at else None,
                 'createdAt': staff.created_at.isoformat() if staff.created_at else None,
@@ -339,3 +354,186 @@ def delete_staff(staff_id):
             'status': 'error',
             'message': f'Lỗi khi xóa nhân viên: {str(e)}'
         }), 500
+
+# ==================== LỊCH LÀM VIỆC ====================
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value or '', '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+def _parse_time(value):
+    try:
+        return datetime.strptime(value or '', '%H:%M').time()
+    except ValueError:
+        return None
+
+@staff_bp.route('/<staff_id>/calendar', methods=['GET'])
+@jwt_required()
+@query_budget(3)
+def get_staff_calendar(staff_id):
+    """
+    Lịch làm việc của nhân viên theo ngày (nhân viên xem lịch của mình, admin xem mọi nhân viên)
+    - ?start=YYYY-MM-DD&end=YYYY-MM-DD (mặc định hôm nay, tối đa STAFF_CALENDAR_MAX_DAYS ngày)
+    - Mỗi ngày: ca làm, nghỉ, booking được phân công và giờ rảnh
+    """
+    try:
+        try:
+            staff_uuid = uuid.UUID(staff_id)
+        except ValueError:
+            return jsonify({
+                'status': 'error',
+                'message': 'Mã nhân viên không hợp lệ'
+            }), 400
+
+        current_user = User.query.get(get_jwt_identity())
+        if not current_user or (current_user.role != 'admin' and current_user.id != staff_uuid):
+            return jsonify({
+                'status': 'error',
+                'message': 'Không có quyền xem lịch của nhân viên này'
+            }), 403
+
+        staff = current_user if current_user.id == staff_uuid else User.query.filter_by(id=staff_uuid).first()
+        if not staff or staff.role != 'staff':
+            return jsonify({
+                'status': 'error',
+                'message': 'Nhân viên không tồn tại'
+            }), 404
+
+        start = _parse_date(request.args.get('start')) if request.args.get('start') else date.today()
+        end = _parse_date(request.args.get('end')) if request.args.get('end') else start
+        if not start or not end or end < start:
+            return jsonify({
+                'status': 'error',
+                'message': 'Khoảng ngày không hợp lệ (start, end: YYYY-MM-DD)'
+            }), 400
+        max_days = current_app.config.get('STAFF_CALENDAR_MAX_DAYS', 31)
+        if (end - start).days + 1 > max_days:
+            return jsonify({
+                'status': 'error',
+                'message': f'Chỉ xem được tối đa {max_days} ngày mỗi lần'
+            }), 400
+
+        settings = runtime_settings()
+        days = staff_calendar([staff.id], start, end)[staff.id]
+
+        return jsonify({
+            'status': 'success',
+            'staff': {
+                'id': str(staff.id),
+                'name': staff.name,
+                'avatar': staff.avatar
+            },
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'days': [day.to_dict(settings) for day in days]
+        }), 200
+
+    except Exception as e:
+        current_app.logger.error(f"Get staff calendar error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi lấy lịch làm việc: {str(e)}'
+        }), 500
+
+@staff_bp.route('/<staff_id>/schedules', methods=['POST'])
+@jwt_required()
+@admin_required
+def create_staff_schedule(staff_id):
+    """
+    Thêm ca làm / ngày nghỉ cho nhân viên (chỉ dành cho admin)
+    - Body: {"date": "YYYY-MM-DD", "startTime": "08:00", "endTime": "17:00",
+      "status": "available" | "off" | "booked", "bookingId": ..., "notes": ...}
+    """
+    try:
+        staff = User.query.filter_by(id=staff_id, role='staff').first()
+        if not staff:
+            return jsonify({
+                'status': 'error',
+                'message': 'Nhân viên không tồn tại'
+            }), 404
+
+        data = request.get_json() or {}
+        schedule_date = _parse_date(data.get('date'))
+        start_time = _parse_time(data.get('startTime'))
+        end_time = _parse_time(data.get('endTime'))
+        if not schedule_date or not start_time or not end_time:
+            return jsonify({
+                'status': 'error',
+                'message': 'date (YYYY-MM-DD), startTime và endTime (HH:MM) là bắt buộc'
+            }), 400
+        if end_time <= start_time:
+            return jsonify({
+                'status': 'error',
+                'message': 'endTime phải sau startTime'
+            }), 400
+
+        status = data.get('status', 'available')
+        if status not in ('available', 'booked', 'off'):
+            return jsonify({
+                'status': 'error',
+                'message': 'Trạng thái không hợp lệ (available, booked, off)'
+            }), 400
+
+        booking_id = data.get('bookingId')
+        if booking_id and not Booking.query.get(booking_id):
+            return jsonify({
+                'status': 'error',
+                'message': 'Booking không tồn tại'
+            }), 404
+
+        schedule = StaffSchedule(
+            staff_id=staff.id,
+            date=schedule_date,
+            start_time=start_time,
+            end_time=end_time,
+            status=status,
+            booking_id=booking_id or None,
+            notes=data.get('notes')
+        )
+        db.session.add(schedule)
+        db.session.commit()
+
+        return jsonify({
+            'status': 'success',
+            'message': 'Đã thêm lịch làm việc',
+            'schedule': schedule.to_dict()
+        }), 201
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi thêm lịch làm việc: {str(e)}'
+        }), 500
+
+@staff_bp.route('/<staff_id>/schedules/<schedule_id>', methods=['DELETE'])
+@jwt_required()
+@admin_required
+def delete_staff_schedule(staff_id, schedule_id):
+    """
+    Xóa ca làm / ngày nghỉ của nhân viên (chỉ dành cho admin)
+    """
+    try:
+        schedule = StaffSchedule.query.filter_by(id=schedule_id, staff_id=staff_id).first()
+        if not schedule:
+            return jsonify({
+                'status': 'error',
+                'message': 'Lịch làm việc không tồn tại'
+            }), 404
+
+        db.session.delete(schedule)
+        db.session.commit()
+
+        return jsonify({
+            'status': 'success',
+            'message': 'Đã xóa lịch làm việc'
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'status': 'error',
+            'message': f'Lỗi khi xóa lịch làm việc: {str(e)}'
+        }), 500
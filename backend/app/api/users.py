@@ -5,12 +5,10 @@ Bảng: users, user_addresses
 Author: CleanHome Team
 """
 
-import os
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from marshmallow import ValidationError
 from sqlalchemy.exc import IntegrityError
-from werkzeug.utils import secure_filename
 from werkzeug.datastructures import FileStorage
 
 from app.extensions import db
@@ -21,17 +19,15 @@ from app.schemas.user import (
 )
 from app.utils.errors import handle_error
 from app.utils.validators import validate_uuid
+from app.utils.images import process_upload, ImageProcessingError
+from app.utils.media import replace_reference, release_reference
+from app.utils.uploads import receive_upload, upload_slot, UploadRejected
 
 users_bp = Blueprint('users', __name__)
 
 # Các loại file ảnh được phép
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
-def allowed_file(filename):
-    """Kiểm tra file có phải là ảnh được phép không"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
 
 @users_bp.route('/', methods=['GET'])
 @jwt_required()
@@ -194,8 +190,8 @@ def upload_avatar(user_id):
     """
     Upload ảnh đại diện cho người dùng
     - Chỉ cho phép user tự upload avatar của mình hoặc admin
-    - Kiểm tra loại file và kích thước (max 5MB)
-    - Lưu file vào thư mục static/uploads/avatars/
+    - Kiểm tra đuôi file, magic bytes và kích thước (max 5MB) trong khi stream request
+    - Tạo các biến thể thumb/card/full (WebP + JPEG) trong media store (avatars/)
     - Cập nhật URL avatar vào database
     """
     try:
@@ -214,53 +210,29 @@ def upload_avatar(user_id):
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        # Kiểm tra có file upload trong request không
-        if 'avatar' not in request.files:
-            return jsonify({'error': 'No file provided'}), 400
-        
-        file = request.files['avatar']
-        if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
-        
-        # Kiểm tra loại file có phải ảnh không
-        if not allowed_file(file.filename):
-            return jsonify({'error': 'Invalid file type. Only images are allowed.'}), 400
-        
-        # Kiểm tra kích thước file (tối đa 5MB)
-        file.seek(0, 2)  # Di chuyển pointer đến cuối file để đo size
-        file_size = file.tell()
-        file.seek(0)  # Reset pointer về đầu file
-        
-        if file_size > 5 * 1024 * 1024:  # 5MB
-            return jsonify({'error': 'File too large. Maximum size is 5MB.'}), 400
-        
-        # Tạo tên file an toàn và unique
-        filename = secure_filename(file.filename)
-        file_extension = filename.rsplit('.', 1)[1].lower()
-        new_filename = f"avatar_{user_id}_{hash(current_app.config.get('SECRET_KEY', '')) % 1000000}.{file_extension}"
-        
-        # Tạo thư mục uploads/avatars nếu chưa có
-        upload_folder = os.path.join(current_app.config['UPLOAD_FOLDER'], 'avatars')
-        os.makedirs(upload_folder, exist_ok=True)
-        current_app.logger.info(f"📁 Thư mục upload: {upload_folder}")
-        
-        # Xóa avatar cũ nếu có để tiết kiệm dung lượng
-        if user.avatar:
-            old_avatar_path = os.path.join(current_app.config['UPLOAD_FOLDER'], user.avatar.lstrip('/static/uploads/'))
-            if os.path.exists(old_avatar_path):
-                try:
-                    os.remove(old_avatar_path)
-                    current_app.logger.info(f"Đã xóa avatar cũ: {old_avatar_path}")
-                except Exception as e:
-                    current_app.logger.warning(f"Không thể xóa avatar cũ: {str(e)}")
-        
-        # Lưu file mới vào thư mục
-        file_path = os.path.join(upload_folder, new_filename)
-        file.save(file_path)
-        current_app.logger.info(f"Đã lưu avatar mới: {file_path}")
-        
-        # Cập nhật đường dẫn avatar trong database
-        avatar_url = f"/static/uploads/avatars/{new_filename}"
+        # Đọc file theo từng chunk: từ chối sớm nếu sai đuôi file, sai magic bytes
+        # hoặc vượt quá AVATAR_MAX_SIZE mà không cần nhận hết request
+        try:
+            with upload_slot(current_user_id), receive_upload(
+                'avatar',
+                max_size=current_app.config.get('AVATAR_MAX_SIZE', 5 * 1024 * 1024),
+                allowed_extensions=ALLOWED_EXTENSIONS
+            ) as upload:
+                # Giải mã ảnh một lần, tạo các biến thể WebP/JPEG đã resize và bỏ metadata
+                processed = process_upload(upload.read(), 'avatars')
+        except UploadRejected as e:
+            return jsonify({'error': e.message}), e.status_code
+        except ImageProcessingError as e:
+            return jsonify({'error': str(e)}), 400
+        if processed.pending:
+            # Các biến thể chưa được ghi xong: giữ avatar cũ, client gửi lại sau (ảnh đã xử lý được dùng lại ngay)
+            return jsonify({'error': 'Ảnh đang được xử lý, vui lòng thử lại sau'}), 503, \
+                {'Retry-After': str(current_app.config.get('IMAGE_PROCESS_TIMEOUT', 10))}
+        
+        # Avatar hiển thị tối đa 80px nên dùng biến thể thumb.
+        # Chuyển tham chiếu từ avatar cũ sang ảnh mới; ảnh cũ không còn ai dùng sẽ được dọn bởi `flask media gc`
+        avatar_url = processed.urls['thumb']['webp']
+        replace_reference(user.avatar, avatar_url)
         user.avatar = avatar_url
         
         db.session.commit()
@@ -271,6 +243,7 @@ def upload_avatar(user_id):
             'message': 'Avatar uploaded successfully',
             'data': {
                 'avatar_url': avatar_url,
+                'variants': processed.urls,
                 'user': user_schema.dump(user)
             }
         }), 200
@@ -350,15 +323,8 @@ def delete_user(user_id):
         if str(current_user_id) == user_id:
             return jsonify({'error': 'Cannot delete your own account'}), 400
         
-        # Xóa avatar nếu có
-        if user.avatar:
-            avatar_path = os.path.join(current_app.config['UPLOAD_FOLDER'], user.avatar.lstrip('/static/uploads/'))
-            if os.path.exists(avatar_path):
-                try:
-                    os.remove(avatar_path)
-                    current_app.logger.info(f"Đã xóa avatar khi xóa user: {avatar_path}")
-                except Exception as e:
-                    current_app.logger.warning(f"Could not delete avatar: {str(e)}")
+        # Bỏ tham chiếu tới avatar
+        release_reference(user.avatar)
         
         db.session.delete(user)
         db.session.commit()
@@ -11,9 +11,11 @@ import urllib.parse
 from datetime import datetime
 from flask import Blueprint, request, redirect, current_app, jsonify
 from ..models.booking import Booking
-from ..models.vnpay import VnpayTransaction
+from ..models.vnpay import VnpayTransaction, VnpayUserSummary
 from ..models.user import User
 from ..utils.vnpay_utils import get_vnpay_response_message, get_user_friendly_message
+from ..utils.helpers import encode_cursor, decode_cursor
+from ..utils.notifications import notify_booking
 from .. import db
 
 vnpay_bp = Blueprint('vnpay', __name__, url_prefix='/api/vnpay')
@@ -101,6 +103,7 @@ def generate_vnpay_payment_url(booking: Booking, request_context):
             vnp_orderinfo=vnp_OrderInfo
         )
         db.session.add(new_transaction)
+        VnpayUserSummary.apply_change(booking.user_id, None, 'pending', booking.total_price)
         
         current_app.logger.info(f"Tạo URL thanh toán VNPay cho booking {booking.booking_code}: {payment_url}")
         return payment_url
@@ -210,13 +213,14 @@ def vnpay_return():
             current_app.logger.error("Thiếu vnp_TxnRef trong VNPay return")
             return redirect(f"{current_app.config['CORS_ORIGINS'][0]}/payment/failure?error=missing_txnref")
             
-        transaction = VnpayTransaction.query.filter_by(vnp_txnref=vnp_TxnRef).first()
+        transaction = VnpayTransaction.lock_by_txnref(vnp_TxnRef)
         
         if not transaction:
             current_app.logger.error(f"Không tìm thấy giao dịch: {vnp_TxnRef}")
             return redirect(f"{current_app.config['CORS_ORIGINS'][0]}/payment/failure?error=transaction_not_found")
         
         # Cập nhật thông tin giao dịch từ VNPay
+        old_status_group = transaction.status_group
         transaction.vnp_bankcode = request.args.get('vnp_BankCode')
         transaction.vnp_banktranno = request.args.get('vnp_BankTranNo')
         transaction.vnp_cardtype = request.args.get('vnp_CardType')
@@ -226,6 +230,8 @@ def vnpay_return():
         transaction.vnp_transactionno = request.args.get('vnp_TransactionNo')
         transaction.vnp_transactionstatus = request.args.get('vnp_TransactionStatus')
         transaction.vnp_securehash = vnp_SecureHash
+        VnpayUserSummary.apply_change(transaction.user_id, old_status_group,
+                                      transaction.status_group, transaction.vnp_amount)
         
         # Kiểm tra kết quả thanh toán và xử lý theo response code
         response_code = transaction.vnp_responsecode
@@ -247,9 +253,12 @@ def vnpay_return():
             current_app.logger.error(f"Không tìm thấy booking: {transaction.booking_id}")
             return redirect(f"{current_app.config['CORS_ORIGINS'][0]}/payment/failure?error=booking_not_found")
         
+        old_payment_status = booking.payment_status
         if success and response_code == '00' and transaction_status == '00':
             # Thanh toán thành công
             booking.payment_status = 'paid'
+            if old_payment_status != 'paid':
+                notify_booking(booking, 'paid')
             current_app.logger.info(f"Thanh toán thành công cho booking {booking.booking_code}")
             
             db.session.commit()
@@ -275,6 +284,8 @@ def vnpay_return():
         else:
             # Thanh toán thất bại - cập nhật booking với thông tin chi tiết
             booking.payment_status = 'failed'
+            if old_payment_status != 'failed':
+                notify_booking(booking, 'payment_failed')
             current_app.logger.warning(f"Thanh toán thất bại cho booking {booking.booking_code}. "
                                      f"Response Code: {response_code}, Error Type: {error_type}, Message: {message}")
                 
@@ -325,10 +336,11 @@ def vnpay_ipn():
         
         if secure_hash == vnp_SecureHash:
             vnp_TxnRef = request.args.get('vnp_TxnRef')
-            transaction = VnpayTransaction.query.filter_by(vnp_txnref=vnp_TxnRef).first()
+            transaction = VnpayTransaction.lock_by_txnref(vnp_TxnRef)
             
             if transaction:
                 # Cập nhật thông tin giao dịch
+                old_status_group = transaction.status_group
                 transaction.vnp_responsecode = request.args.get('vnp_ResponseCode')
                 transaction.vnp_transactionstatus = request.args.get('vnp_TransactionStatus')
                 transaction.vnp_bankcode = request.args.get('vnp_BankCode')
@@ -337,11 +349,16 @@ def vnpay_ipn():
                 transaction.vnp_paydate = request.args.get('vnp_PayDate')
                 transaction.vnp_transactionno = request.args.get('vnp_TransactionNo')
                 
+                # Cập nhật bảng tổng hợp giao dịch của user
+                VnpayUserSummary.apply_change(transaction.user_id, old_status_group,
+                                              transaction.status_group, transaction.vnp_amount)
+                
                 # Cập nhật trạng thái booking nếu thanh toán thành công
                 if transaction.vnp_responsecode == '00' and transaction.vnp_transactionstatus == '00':
                     booking = Booking.query.get(transaction.booking_id)
                     if booking and booking.payment_status != 'paid':
                         booking.payment_status = 'paid'
+                        notify_booking(booking, 'paid')
                         current_app.logger.info(f"IPN: Cập nhật booking {booking.booking_code} thành đã thanh toán")
                 
                 db.session.commit()
@@ -388,29 +405,79 @@ def get_transaction_by_booking(booking_id):
 def get_user_transactions(user_id):
     """
     API lấy danh sách giao dịch VNPay của người dùng
+    
+    Query params:
+        cursor: Con trỏ trang tiếp theo (phân trang keyset theo created_at, id)
+        page: Số trang (phân trang OFFSET cũ, chỉ dùng khi không có cursor)
+        per_page: Số giao dịch mỗi trang (tối đa 100)
+        include_total: 'false' để bỏ qua COUNT(*) tổng số giao dịch
+        include_summary: 'true' để trả kèm bảng tổng hợp (tổng tiền, số lượng theo trạng thái)
     """
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
+        cursor = request.args.get('cursor')
+        page = request.args.get('page', type=int)
+        per_page = min(request.args.get('per_page', 10, type=int), 100)
+        include_total = request.args.get('include_total', 'true').lower() != 'false'
+        include_summary = request.args.get('include_summary', 'false').lower() == 'true'
+        
+        query = VnpayTransaction.query.filter_by(user_id=user_id)
+        ordered = query.order_by(VnpayTransaction.created_at.desc(), VnpayTransaction.id.desc())
+        
+        pagination = {'per_page': per_page}
+        
+        if page and not cursor:
+            # Phân trang OFFSET (giữ tương thích với client cũ)
+            transactions = ordered.offset((page - 1) * per_page).limit(per_page + 1).all()
+            has_next = len(transactions) > per_page
+            transactions = transactions[:per_page]
+            pagination.update({'page': page, 'has_prev': page > 1})
+        else:
+            # Phân trang keyset: lấy các bản ghi đứng sau con trỏ theo (created_at, id)
+            if cursor:
+                position = decode_cursor(cursor)
+                if not position:
+                    return jsonify({
+                        'status': 'error',
+                        'message': 'Cursor không hợp lệ'
+                    }), 400
+                created_at, last_id = position
+                ordered = ordered.filter(
+                    db.tuple_(VnpayTransaction.created_at, VnpayTransaction.id) < (created_at, last_id)
+                )
+            transactions = ordered.limit(per_page + 1).all()
+            has_next = len(transactions) > per_page
+            transactions = transactions[:per_page]
+            pagination['has_prev'] = bool(cursor)
+        
+        pagination['has_next'] = has_next
+        pagination['next_cursor'] = (
+            encode_cursor(transactions[-1].created_at, transactions[-1].id)
+            if has_next and transactions else None
+        )
         
-        transactions = VnpayTransaction.query.filter_by(user_id=user_id)\
-            .order_by(VnpayTransaction.created_at.desc())\
-            .paginate(page=page, per_page=per_page, error_out=False)
+        if include_total:
+            total = query.order_by(None).count()
+            pagination['total'] = total
+            pagination['pages'] = (total + per_page - 1) // per_page if per_page else 0
         
-        return jsonify({
+        response = {
             'status': 'success',
-            'data': [transaction.to_dict() for transaction in transactions.items],
-            'pagination': {
-                'page': page,
-                'pages': transactions.pages,
-                'per_page': per_page,
-                'total': transactions.total,
-                'has_next': transactions.has_next,
-                'has_prev': transactions.has_prev
-            }
-        })
+            'data': [transaction.to_dict() for transaction in transactions],
+            'pagination': pagination
+        }
+        
+        if include_summary:
+            summary = VnpayUserSummary.query.get(user_id)
+            if not summary:
+                # Dữ liệu cũ chưa có bảng tổng hợp: tính một lần rồi lưu lại
+                summary = VnpayUserSummary.rebuild(user_id)
+                db.session.commit()
+            response['summary'] = summary.to_dict()
+        
+        return jsonify(response)
         
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(f"Lỗi khi lấy giao dịch của user: {e}")
         return jsonify({
             'status': 'error',
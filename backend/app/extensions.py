@@ -9,8 +9,11 @@ from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 from flask_migrate import Migrate
 
+from app.utils.db_pool import use_instrumented_pool, instrument_engine
+from app.utils.db_routing import RoutingSession, init_replica_routing
+
 # Khởi tạo các extension objects
-db = SQLAlchemy()           # ORM database
+db = SQLAlchemy(session_options={'class_': RoutingSession})  # ORM database (đọc replica trong read_only)
 ma = Marshmallow()          # Serialization/Deserialization
 jwt = JWTManager()          # JWT authentication
 cors = CORS()               # Cross-Origin Resource Sharing
@@ -24,8 +27,13 @@ def init_extensions(app):
         app: Flask application instance
     """
     
-    # Khởi tạo database ORM
+    # Khởi tạo database ORM (pool đo thời gian chờ connection, xem app.utils.db_pool)
+    use_instrumented_pool(app.config)
+    init_replica_routing(app)
     db.init_app(app)
+    with app.app_context():
+        for name, engine in db.engines.items():
+            instrument_engine(engine, name or 'default')
     
     # Khởi tạo Marshmallow (phải sau SQLAlchemy)
     ma.init_app(app)
@@ -2,24 +2,32 @@
 
 # Import all models to ensure they are registered with SQLAlchemy
 from .user import User, UserAddress
-from .service import Service, ServiceCategory, Area, ServiceArea, Review
-from .booking import Booking, BookingItem, BookingPromotion
-from .promotion import Promotion
+from .service import Service, ServiceCategory, Area, ServiceArea, ServiceRanking
+from .review import Review, ReviewStatus, RatingSummary, RatingDailySummary
+from .booking import Booking, BookingItem, BookingPromotion, BookingSeries
+from .schedule import StaffSchedule
+from .promotion import Promotion, PromotionUsageShard, PromotionCampaign
 # from .payment import Payment
-from .notification import Notification, NotificationSetting
-from .setting import Setting
+from .notification import Notification, NotificationSetting, NotificationCounter
+from .setting import Setting, SettingsVersion
 from .activity import UserActivityLog
-from .vnpay import VnpayTransaction
+from .vnpay import VnpayTransaction, VnpayUserSummary
+from .media import MediaAsset
+from .message import OutboundMessage
 
 __all__ = [
     'User', 'UserAddress',
-    'Service', 'ServiceCategory', 'Area', 'ServiceArea', 'Review',
-    'Booking', 'BookingItem', 'BookingPromotion',
-    'Promotion',
+    'Service', 'ServiceCategory', 'Area', 'ServiceArea', 'ServiceRanking',
+    'Review', 'ReviewStatus', 'RatingSummary', 'RatingDailySummary',
+    'Booking', 'BookingItem', 'BookingPromotion', 'BookingSeries',
+    'StaffSchedule',
+    'Promotion', 'PromotionUsageShard', 'PromotionCampaign',
     # 'Payment',
-    'Notification', 'NotificationSetting',
-    'Setting',
+    'Notification', 'NotificationSetting', 'NotificationCounter',
+    'Setting', 'SettingsVersion',
     'UserActivityLog',
-    'VnpayTransaction'
+    'VnpayTransaction', 'VnpayUserSummary',
+    'MediaAsset',
+    'OutboundMessage'
 ]
 
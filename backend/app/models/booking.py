@@ -14,6 +14,7 @@ class Booking(db.Model):
     user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'), nullable=False)
     address_id = db.Column(UUID(as_uuid=True), nullable=True)
     staff_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'), nullable=True)
+    series_id = db.Column(UUID(as_uuid=True), db.ForeignKey('booking_series.id', ondelete='SET NULL'), nullable=True)  # Lịch định kỳ sinh ra booking
     
     # Booking details (match database schema)
     booking_date = db.Column(db.Date, nullable=False)
@@ -25,6 +26,7 @@ class Booking(db.Model):
     subtotal = db.Column(db.Numeric(10, 2), nullable=False)
     discount = db.Column(db.Numeric(10, 2), default=0)  # Changed from discount_amount
     tax = db.Column(db.Numeric(10, 2), default=0)
+    delivery_fee = db.Column(db.Numeric(10, 2), default=0)  # Phí di chuyển theo khu vực (areas.delivery_fee)
     total_price = db.Column(db.Numeric(10, 2), nullable=False)  # Changed from total_amount
     
     # Payment info
@@ -63,6 +65,30 @@ class Booking(db.Model):
             
         return code
     
+    @staticmethod
+    def generate_booking_codes(count):
+        """Sinh nhiều booking code duy nhất, kiểm tra trùng lặp bằng một query cho cả lô"""
+        import random
+        import string
+        from datetime import datetime
+        
+        timestamp = str(int(datetime.now().timestamp()))[-6:]
+        codes = set()
+        while len(codes) < count:
+            candidates = set()
+            while len(candidates) < count - len(codes):
+                random_part = ''.join(random.choices(string.ascii_uppercase + string.digits, k=5))
+                code = f"CH{timestamp}{random_part}"
+                if code not in codes:
+                    candidates.add(code)
+            taken = {
+                row[0] for row in db.session.query(Booking.booking_code).filter(
+                    Booking.booking_code.in_(candidates)
+                ).all()
+            }
+            codes |= candidates - taken
+        return list(codes)
+    
     def __init__(self, **kwargs):
         """Constructor để tự động sinh booking_code"""
         if 'booking_code' not in kwargs or not kwargs['booking_code']:
@@ -97,6 +123,7 @@ class Booking(db.Model):
             'userId': str(self.user_id),
             'serviceId': service_info['service_id'],  # Lấy từ booking_items
             'staffId': str(self.staff_id) if self.staff_id else None,
+            'seriesId': str(self.series_id) if self.series_id else None,
             'date': self.booking_date.strftime('%Y-%m-%d') if self.booking_date else None,
             'time': self.booking_time.strftime('%H:%M') if self.booking_time else None,  # Changed from start_time
             'endTime': self.end_time.strftime('%H:%M') if self.end_time else None,
@@ -105,6 +132,7 @@ class Booking(db.Model):
             'subtotal': float(self.subtotal) if self.subtotal else 0,
             'discount': float(self.discount) if self.discount else 0,  # Changed from discountAmount
             'tax': float(self.tax) if self.tax else 0,
+            'deliveryFee': float(self.delivery_fee) if self.delivery_fee else 0,
             'totalAmount': float(self.total_price) if self.total_price else 0,  # Map total_price to totalAmount
             'status': self.status,
             'paymentStatus': self.payment_status,
@@ -170,6 +198,64 @@ class Booking(db.Model):
         return f'<Booking {self.id}: {self.booking_date}>'
 
 
+class BookingSeries(db.Model):
+    """Booking series model - a recurring booking (RRULE) and the template of its occurrences"""
+    __tablename__ = 'booking_series'
+    __table_args__ = (
+        db.Index('idx_booking_series_user', 'user_id'),
+    )
+    
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'), nullable=False)
+    service_id = db.Column(UUID(as_uuid=True), db.ForeignKey('services.id'), nullable=False)
+    
+    # Recurrence: weekly, biweekly, monthly; rrule = FREQ=WEEKLY;INTERVAL=2;COUNT=6
+    frequency = db.Column(db.String(20), nullable=False)
+    rrule = db.Column(db.String(255), nullable=False)
+    start_date = db.Column(db.Date, nullable=False)
+    until_date = db.Column(db.Date, nullable=True)
+    occurrence_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    # Template of the occurrences
+    booking_time = db.Column(db.Time, nullable=False)
+    customer_address = db.Column(db.Text, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False, default=1)
+    area = db.Column(db.Numeric(10, 2), nullable=True)
+    notes = db.Column(db.Text)
+    payment_method = db.Column(db.String(20), nullable=False, default='cash')
+    
+    status = db.Column(db.String(20), nullable=False, default='active')  # active, cancelled
+    
+    # Timestamps
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        """Chuyển đổi thành dictionary"""
+        return {
+            'id': str(self.id),
+            'userId': str(self.user_id),
+            'serviceId': str(self.service_id),
+            'frequency': self.frequency,
+            'rrule': self.rrule,
+            'startDate': self.start_date.isoformat() if self.start_date else None,
+            'untilDate': self.until_date.isoformat() if self.until_date else None,
+            'occurrenceCount': self.occurrence_count,
+            'time': self.booking_time.strftime('%H:%M') if self.booking_time else None,
+            'address': self.customer_address,
+            'quantity': self.quantity,
+            'area': float(self.area) if self.area else None,
+            'notes': self.notes,
+            'paymentMethod': self.payment_method,
+            'status': self.status,
+            'createdAt': self.created_at.isoformat() if self.created_at else None,
+            'updatedAt': self.updated_at.isoformat() if self.updated_at else None
+        }
+    
+    def __repr__(self):
+        return f'<BookingSeries {self.id}: {self.rrule}>'
+
+
 class BookingItem(db.Model):
     """Booking item model - services included in a booking"""
     __tablename__ = 'booking_items'
@@ -0,0 +1,34 @@
+"""Media models for CleanHome application"""
+
+from datetime import datetime
+from sqlalchemy.dialects.postgresql import ARRAY
+from app.extensions import db
+
+
+class MediaAsset(db.Model):
+    """
+    One uploaded image and its stored variants
+
+    Assets are content addressed: ``content_hash`` is the hash of the uploaded
+    bytes and every variant key is derived from it, so identical uploads share
+    one asset. ``ref_count`` counts the records (user avatars, service images)
+    pointing at it; assets at zero references are deleted by the media
+    garbage collector once ``MEDIA_GC_GRACE_SECONDS`` have passed.
+    """
+    __tablename__ = 'media_assets'
+
+    kind = db.Column(db.String(50), primary_key=True)  # avatars, services
+    content_hash = db.Column(db.String(64), primary_key=True)
+    keys = db.Column(ARRAY(db.Text), nullable=False, default=list)  # Keys of the stored variant files
+    size_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('idx_media_assets_unreferenced', 'updated_at', postgresql_where=db.text('ref_count <= 0')),
+    )
+
+    def __repr__(self):
+        return f'<MediaAsset {self.kind}/{self.content_hash}: {self.ref_count} refs>'
@@ -0,0 +1,42 @@
+"""Outbound message models for CleanHome application"""
+
+import uuid
+from datetime import datetime
+from sqlalchemy.dialects.postgresql import UUID
+from app.extensions import db
+
+
+class OutboundMessage(db.Model):
+    """
+    Email/SMS waiting to be sent by the message workers (outbox)
+
+    Rows are inserted in the transaction of the request that needs the
+    message, so a message exists only if that transaction commits. Workers
+    claim due rows (``status`` pending, or sending with an expired lease),
+    send them, then mark them sent or schedule a retry in
+    ``next_attempt_at``.
+    """
+    __tablename__ = 'outbound_messages'
+
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    channel = db.Column(db.String(20), nullable=False)  # email, sms
+    recipient = db.Column(db.String(255), nullable=False)  # Email address or phone number
+    subject = db.Column(db.String(255))
+    body = db.Column(db.Text, nullable=False)
+
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # Due time while pending; end of the worker's lease while sending
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('idx_outbound_messages_due', 'channel', 'next_attempt_at',
+                 postgresql_where=db.text("status IN ('pending', 'sending')")),
+    )
+
+    def __repr__(self):
+        return f'<OutboundMessage {self.channel} -> {self.recipient}: {self.status}>'
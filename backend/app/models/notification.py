@@ -24,8 +24,26 @@ class Notification(db.Model):
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Hộp thư phân trang keyset theo (created_at, id); index một phần cho thông báo chưa đọc
+    __table_args__ = (
+        db.Index('idx_notifications_user_created', 'user_id', db.text('created_at DESC'), db.text('id DESC')),
+        db.Index('idx_notifications_user_unread', 'user_id', postgresql_where=db.text('is_read = false')),
+    )
+    
     def __repr__(self):
         return f'<Notification {self.id}: {self.title}>'
+    
+    def to_dict(self):
+        return {
+            'id': str(self.id),
+            'title': self.title,
+            'message': self.message,
+            'type': self.type,
+            'isRead': bool(self.is_read),
+            'referenceId': str(self.reference_id) if self.reference_id else None,
+            'referenceType': self.reference_type,
+            'createdAt': self.created_at.isoformat() if self.created_at else None
+        }
 
 
 class NotificationSetting(db.Model):
@@ -51,4 +69,31 @@ class NotificationSetting(db.Model):
     
     def __repr__(self):
         return f'<NotificationSetting {self.user_id}>'
+    
+    def to_dict(self):
+        return {
+            'emailNotifications': self.email_notifications,
+            'smsNotifications': self.sms_notifications,
+            'pushNotifications': self.push_notifications,
+            'bookingNotifications': self.booking_notifications,
+            'paymentNotifications': self.payment_notifications,
+            'promotionNotifications': self.promotion_notifications
+        }
+
+
+class NotificationCounter(db.Model):
+    """
+    Số thông báo chưa đọc của từng user
+    Cộng khi gửi thông báo, trừ khi đánh dấu đã đọc (UPDATE cộng dồn trên DB),
+    để badge không phải chạy COUNT(*). Đối soát định kỳ bằng `flask notifications reconcile`.
+    """
+    __tablename__ = 'notification_counters'
+    
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+    reconciled_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<NotificationCounter {self.user_id}: {self.unread_count}>'
 
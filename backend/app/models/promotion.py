@@ -3,7 +3,7 @@
 import uuid
 from datetime import datetime, date
 from sqlalchemy import String, func, Enum
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import UUID, ARRAY
 from app.extensions import db
 
 # Define ENUM types to match database
@@ -34,6 +34,8 @@ class Promotion(db.Model):
     used_count = db.Column(db.Integer, default=0)
     
     status = db.Column(Enum(*STATUS_TYPES, name='service_status'), nullable=False, default='active')  # active, inactive, draft
+    # Applied to bookings sent without a code; imported and generated codes never are
+    auto_apply = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
     
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -78,3 +80,93 @@ class Promotion(db.Model):
         
         return min(discount, order_value)
 
+
+
+class PromotionUsageShard(db.Model):
+    """
+    Sharded usage counter for a promotion
+
+    Redemptions increment one of several shard rows instead of the single
+    promotions row, so concurrent checkouts of a popular code do not queue
+    on one row lock. ``capacity`` is this shard's share of the remaining
+    usage limit (null means unlimited). Shards are merged back into
+    ``Promotion.used_count`` periodically.
+    """
+    __tablename__ = 'promotion_usage_shards'
+
+    promotion_id = db.Column(UUID(as_uuid=True), db.ForeignKey('promotions.id', ondelete='CASCADE'), primary_key=True)
+    shard_no = db.Column(db.Integer, primary_key=True)
+    used_count = db.Column(db.Integer, nullable=False, default=0)
+    capacity = db.Column(db.Integer)  # null means unlimited
+
+    def __repr__(self):
+        return f'<PromotionUsageShard {self.promotion_id}#{self.shard_no}: {self.used_count}/{self.capacity}>'
+
+
+CAMPAIGN_CHANNELS = ['email', 'sms', 'notification']
+
+
+class PromotionCampaign(db.Model):
+    """
+    Announcement of a promotion to every customer who accepts promotions
+
+    Sent by ``app.utils.campaigns.run_campaign`` in chunks; ``last_user_id``
+    is the last customer handled, so an interrupted campaign resumes where it
+    stopped. ``heartbeat_at`` is refreshed after every chunk.
+    """
+    __tablename__ = 'promotion_campaigns'
+
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    promotion_id = db.Column(UUID(as_uuid=True), db.ForeignKey('promotions.id', ondelete='CASCADE'), nullable=False, index=True)
+    created_by = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'))
+
+    # Templates; placeholders {name}, {promotion}, {code}, {discount}, {end_date}
+    title = db.Column(db.String(255), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    channels = db.Column(ARRAY(db.String(20)), nullable=False)  # email, sms, notification
+
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, completed, failed, cancelled
+    total_recipients = db.Column(db.Integer)  # Counted when the campaign starts
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    emails_queued = db.Column(db.Integer, nullable=False, default=0)
+    sms_queued = db.Column(db.Integer, nullable=False, default=0)
+    notifications_created = db.Column(db.Integer, nullable=False, default=0)
+    last_user_id = db.Column(UUID(as_uuid=True))
+    error = db.Column(db.Text)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    promotion = db.relationship('Promotion')
+
+    def __repr__(self):
+        return f'<PromotionCampaign {self.id}: {self.status} {self.processed}/{self.total_recipients}>'
+
+    def to_dict(self):
+        end = self.finished_at or self.heartbeat_at
+        elapsed = (end - self.started_at).total_seconds() if self.started_at and end else 0
+        rate = self.processed / elapsed if elapsed else None
+        remaining = (self.total_recipients or 0) - self.processed
+        return {
+            'id': str(self.id),
+            'promotionId': str(self.promotion_id),
+            'title': self.title,
+            'message': self.message,
+            'channels': list(self.channels or []),
+            'status': self.status,
+            'totalRecipients': self.total_recipients,
+            'processed': self.processed,
+            'progress': round(self.processed / self.total_recipients * 100, 1) if self.total_recipients else None,
+            'emailsQueued': self.emails_queued,
+            'smsQueued': self.sms_queued,
+            'notificationsCreated': self.notifications_created,
+            'ratePerSecond': round(rate, 1) if rate else None,
+            'etaSeconds': round(remaining / rate) if rate and self.status == 'running' and remaining > 0 else None,
+            'error': self.error,
+            'createdAt': self.created_at.isoformat() if self.created_at else None,
+            'startedAt': self.started_at.isoformat() if self.started_at else None,
+            'heartbeatAt': self.heartbeat_at.isoformat() if self.heartbeat_at else None,
+            'finishedAt': self.finished_at.isoformat() if self.finished_at else None
+        }
@@ -1,4 +1,6 @@
-from sqlalchemy import Column, String, Integer, Text, DateTime, ForeignKey, CheckConstraint, Enum, ARRAY
+"""Review models for CleanHome application"""
+
+from sqlalchemy import Column, String, Integer, Text, DateTime, Date, ForeignKey, CheckConstraint, Enum, ARRAY, BigInteger, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from app.extensions import db
@@ -15,7 +17,7 @@ class ReviewStatus(enum.Enum):
 
 class Review(db.Model):
     __tablename__ = 'reviews'
-    
+
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     booking_id = Column(UUID(as_uuid=True), ForeignKey('bookings.id', ondelete='CASCADE'), nullable=False)
     user_id = Column(UUID(as_uuid=True), ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
@@ -27,35 +29,97 @@ class Review(db.Model):
     images = Column(ARRAY(Text), nullable=True)
     admin_reply = Column(Text, nullable=True)
     admin_reply_at = Column(DateTime(timezone=True), nullable=True)
-    status = Column(Enum(ReviewStatus), default=ReviewStatus.PENDING, nullable=False)
+    # Kiểu review_status trong database lưu giá trị ('pending'), không phải tên enum
+    status = Column(
+        Enum(ReviewStatus, name='review_status', values_callable=lambda statuses: [s.value for s in statuses]),
+        default=ReviewStatus.PENDING, nullable=False
+    )
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
-    
+
     # Constraints
     __table_args__ = (
         CheckConstraint('rating >= 1 AND rating <= 5', name='check_rating_range'),
+        # Danh sách đánh giá của dịch vụ / nhân viên, mới nhất trước (phân trang keyset)
+        Index('idx_reviews_service_created', 'service_id', 'created_at', 'id'),
+        Index('idx_reviews_staff_created', 'staff_id', 'created_at', 'id'),
+        # Mỗi booking một đánh giá (hai request cùng lúc: bản thứ hai bị từ chối)
+        Index('idx_reviews_booking', 'booking_id', unique=True),
     )
-    
+
     # Relationships
     booking = relationship("Booking", backref="reviews")
     user = relationship("User", foreign_keys=[user_id], backref="user_reviews")
     service = relationship("Service", backref="service_reviews")
     staff = relationship("User", foreign_keys=[staff_id], backref="staff_reviews")
-    
+
+    def __repr__(self):
+        return f'<Review {self.id}: {self.rating} stars>'
+
     def to_dict(self):
         return {
             'id': str(self.id),
-            'booking_id': str(self.booking_id),
-            'user_id': str(self.user_id),
-            'service_id': str(self.service_id),
-            'staff_id': str(self.staff_id) if self.staff_id else None,
+            'bookingId': str(self.booking_id),
+            'userId': str(self.user_id),
+            'serviceId': str(self.service_id),
+            'staffId': str(self.staff_id) if self.staff_id else None,
             'rating': self.rating,
             'title': self.title,
             'comment': self.comment,
-            'images': self.images,
-            'admin_reply': self.admin_reply,
-            'admin_reply_at': self.admin_reply_at.isoformat() if self.admin_reply_at else None,
+            'images': self.images or [],
+            'adminReply': self.admin_reply,
+            'adminReplyAt': self.admin_reply_at.isoformat() if self.admin_reply_at else None,
             'status': self.status.value if self.status else None,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+            'createdAt': self.created_at.isoformat() if self.created_at else None,
+            'updatedAt': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+class RatingCountersMixin:
+    """Số đánh giá, tổng số sao và số đánh giá theo từng mức sao (chỉ đánh giá đã duyệt)"""
+
+    review_count = Column(Integer, nullable=False, default=0)
+    rating_sum = Column(BigInteger, nullable=False, default=0)
+    rating_1 = Column(Integer, nullable=False, default=0)
+    rating_2 = Column(Integer, nullable=False, default=0)
+    rating_3 = Column(Integer, nullable=False, default=0)
+    rating_4 = Column(Integer, nullable=False, default=0)
+    rating_5 = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def average(self):
+        return round(self.rating_sum / self.review_count, 2) if self.review_count else 0
+
+    def ratings_dict(self):
+        return {
+            'average': self.average,
+            'count': self.review_count,
+            'histogram': {str(stars): getattr(self, f'rating_{stars}') for stars in range(1, 6)}
         }
+
+
+class RatingSummary(RatingCountersMixin, db.Model):
+    """
+    Tổng hợp đánh giá của từng dịch vụ / nhân viên
+    Cộng trừ trong cùng transaction khi tạo, sửa, duyệt hoặc xoá đánh giá
+    (app/utils/reviews.py), để danh sách dịch vụ và nhân viên không phải chạy AVG.
+    Tính lại toàn bộ bằng `flask reviews rebuild-summaries`.
+    """
+    __tablename__ = 'rating_summaries'
+
+    target_type = Column(String(20), primary_key=True)  # service, staff
+    target_id = Column(UUID(as_uuid=True), primary_key=True)
+
+    def __repr__(self):
+        return f'<RatingSummary {self.target_type} {self.target_id}: {self.review_count}>'
+
+
+class RatingDailySummary(RatingCountersMixin, db.Model):
+    """Tổng hợp đánh giá theo ngày tạo booking (báo cáo ngày/tháng/năm)"""
+    __tablename__ = 'rating_daily_summaries'
+
+    day = Column(Date, primary_key=True)
+
+    def __repr__(self):
+        return f'<RatingDailySummary {self.day}: {self.review_count}>'
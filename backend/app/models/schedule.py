@@ -0,0 +1,49 @@
+"""Staff schedule models for CleanHome application"""
+
+import uuid
+from datetime import datetime
+from sqlalchemy.dialects.postgresql import UUID
+from app.extensions import db
+
+class StaffSchedule(db.Model):
+    """
+    Staff schedule entry: a shift (available), a time off (off) or a time
+    blocked for a booking (booked) on one date
+    """
+    __tablename__ = 'staff_schedules'
+    __table_args__ = (
+        db.Index('idx_staff_schedules_staff', 'staff_id'),
+        db.Index('idx_staff_schedules_date', 'date'),
+        db.Index('idx_staff_schedules_staff_date', 'staff_id', 'date'),
+    )
+
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    staff_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+    booking_id = db.Column(UUID(as_uuid=True), db.ForeignKey('bookings.id', ondelete='SET NULL'), nullable=True)
+    status = db.Column(db.Enum('available', 'booked', 'off', name='schedule_status'), default='available')
+    notes = db.Column(db.Text)
+
+    # Timestamps
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<StaffSchedule {self.staff_id} {self.date} {self.start_time}-{self.end_time} {self.status}>'
+
+    def to_dict(self):
+        """Convert schedule entry to dictionary"""
+        return {
+            'id': str(self.id),
+            'staffId': str(self.staff_id),
+            'date': self.date.isoformat() if self.date else None,
+            'startTime': self.start_time.strftime('%H:%M') if self.start_time else None,
+            'endTime': self.end_time.strftime('%H:%M') if self.end_time else None,
+            'bookingId': str(self.booking_id) if self.booking_id else None,
+            'status': self.status,
+            'notes': self.notes,
+            'createdAt': self.created_at.isoformat() if self.created_at else None,
+            'updatedAt': self.updated_at.isoformat() if self.updated_at else None
+        }
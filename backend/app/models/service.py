@@ -72,6 +72,18 @@ class Area(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    def to_dict(self):
+        return {
+            'id': str(self.id),
+            'name': self.name,
+            'district': self.district,
+            'city': self.city,
+            'deliveryFee': float(self.delivery_fee) if self.delivery_fee else 0,
+            'status': self.status,
+            'createdAt': self.created_at.isoformat() if self.created_at else None,
+            'updatedAt': self.updated_at.isoformat() if self.updated_at else None
+        }
+
     def __repr__(self):
         return f'<Area {self.name}>'
 
@@ -91,23 +103,21 @@ class ServiceArea(db.Model):
         return f'<ServiceArea {self.service_id} - {self.area_id}>'
 
 
-class Review(db.Model):
-    """Review model"""
-    __tablename__ = 'reviews'
-    
-    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    booking_id = db.Column(UUID(as_uuid=True), db.ForeignKey('bookings.id'), nullable=False)
-    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'), nullable=False)
-    service_id = db.Column(UUID(as_uuid=True), db.ForeignKey('services.id'), nullable=False)
-    staff_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'), nullable=True)
-    
-    rating = db.Column(db.Integer, nullable=False)  # 1-5 stars
-    comment = db.Column(db.Text)
-    
-    # Timestamps
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+class ServiceRanking(db.Model):
+    """
+    Thứ hạng phổ biến của dịch vụ (trang chủ, /api/services/featured)
+    Tính định kỳ bằng `flask services rank-popularity` (app/utils/popularity.py)
+    từ số lượng đặt gần đây (giảm dần theo thời gian) và điểm đánh giá.
+    """
+    __tablename__ = 'service_rankings'
+    
+    service_id = db.Column(UUID(as_uuid=True), db.ForeignKey('services.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.Integer, nullable=False, index=True)
+    score = db.Column(db.Float, nullable=False)
+    bookings = db.Column(db.Integer, nullable=False, default=0)  # Số booking trong cửa sổ tính
+    recent_volume = db.Column(db.Float, nullable=False, default=0)  # Số lượng đặt đã nhân hệ số giảm theo tuổi
+    rating = db.Column(db.Float)  # Điểm đánh giá đã làm mượt (Bayes) dùng để tính score
+    computed_at = db.Column(db.DateTime, nullable=False)
     
     def __repr__(self):
-        return f'<Review {self.id}: {self.rating} stars>'
-
+        return f'<ServiceRanking {self.rank}: {self.service_id}>'
@@ -23,22 +23,25 @@ class Setting(db.Model):
     
     @classmethod
     def get_value(cls, key, default=None):
-        """Get setting value by key"""
-        setting = cls.query.filter_by(key=key).first()
-        return setting.value if setting else default
+        """Get setting value by key (from the settings snapshot, no query)"""
+        from app.utils.config import runtime_settings
+        value = runtime_settings().get(key)
+        return default if value is None else value
     
     @classmethod
     def set_value(cls, key, value, description=None):
-        """Set setting value"""
-        setting = cls.query.filter_by(key=key).first()
-        if setting:
-            setting.value = value
-            if description:
-                setting.description = description
-        else:
-            setting = cls(key=key, value=value, description=description)
-            db.session.add(setting)
-        
-        db.session.commit()
-        return setting
+        """Set setting value (the caller commits; workers reload after the commit)"""
+        from app.utils.config import update_settings
+        update_settings({key: value})
+        if description:
+            cls.query.filter_by(key=key).update({'description': description})
+        return cls.query.filter_by(key=key).first()
 
+
+class SettingsVersion(db.Model):
+    """Single row counting setting changes (workers reload when it changes)"""
+    __tablename__ = 'settings_version'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
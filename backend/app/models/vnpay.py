@@ -9,6 +9,23 @@ from datetime import datetime
 from sqlalchemy.dialects.postgresql import UUID
 from app.extensions import db
 
+# Nhóm trạng thái giao dịch dùng cho bảng tổng hợp theo user
+STATUS_GROUPS = ['success', 'failed', 'pending']
+
+
+def get_status_group(response_code, transaction_status):
+    """
+    Phân nhóm trạng thái giao dịch từ mã phản hồi VNPay
+    Returns:
+        str: 'success', 'failed' hoặc 'pending' (chưa có kết quả)
+    """
+    if not response_code:
+        return 'pending'
+    if response_code == '00' and transaction_status == '00':
+        return 'success'
+    return 'failed'
+
+
 class VnpayTransaction(db.Model):
     """
     Model lưu trữ thông tin giao dịch VNPay
@@ -47,9 +64,28 @@ class VnpayTransaction(db.Model):
     booking = db.relationship('Booking', backref='vnpay_transactions', lazy=True)
     user = db.relationship('User', backref='vnpay_transactions', lazy=True)
 
+    # Index phục vụ phân trang keyset lịch sử giao dịch theo user
+    __table_args__ = (
+        db.Index('idx_vnpay_transactions_user_created', user_id, created_at.desc(), id.desc()),
+    )
+
     def __repr__(self):
         return f'<VnpayTransaction {self.vnp_txnref}>'
 
+    @classmethod
+    def lock_by_txnref(cls, txnref):
+        """
+        Lấy giao dịch theo mã tham chiếu và khoá dòng (SELECT ... FOR UPDATE) tới hết transaction
+        IPN và return URL xử lý cùng một giao dịch sẽ chạy lần lượt: request sau đọc trạng thái
+        đã được request trước ghi, nên thay đổi trạng thái chỉ được tính vào bảng tổng hợp một lần
+        """
+        return cls.query.filter_by(vnp_txnref=txnref).populate_existing().with_for_update().first()
+
+    @property
+    def status_group(self):
+        """Nhóm trạng thái của giao dịch (success/failed/pending)"""
+        return get_status_group(self.vnp_responsecode, self.vnp_transactionstatus)
+
     @property
     def is_successful(self):
         """
@@ -121,3 +157,137 @@ class VnpayTransaction(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
+
+
+
+class VnpayUserSummary(db.Model):
+    """
+    Bảng tổng hợp giao dịch VNPay theo từng user
+    Được cập nhật khi tạo giao dịch và khi nhận kết quả (IPN/return),
+    giúp trang lịch sử không phải chạy aggregate trên toàn bộ giao dịch
+    """
+    __tablename__ = 'vnpay_user_summaries'
+
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    total_paid = db.Column(db.Numeric(15, 2), nullable=False, default=0, comment='Tổng tiền đã thanh toán thành công')
+    success_count = db.Column(db.Integer, nullable=False, default=0)
+    failed_count = db.Column(db.Integer, nullable=False, default=0)
+    pending_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<VnpayUserSummary {self.user_id}>'
+
+    @classmethod
+    def rebuild(cls, user_id):
+        """
+        Tính lại bảng tổng hợp của một user từ bảng vnpay_transactions
+        Dùng khi chưa có bản ghi tổng hợp (dữ liệu cũ) hoặc cần đối soát
+        """
+        rows = db.session.query(
+            VnpayTransaction.vnp_responsecode,
+            VnpayTransaction.vnp_transactionstatus,
+            db.func.count(VnpayTransaction.id),
+            db.func.coalesce(db.func.sum(VnpayTransaction.vnp_amount), 0)
+        ).filter(
+            VnpayTransaction.user_id == user_id
+        ).group_by(
+            VnpayTransaction.vnp_responsecode,
+            VnpayTransaction.vnp_transactionstatus
+        ).all()
+
+        counts = dict.fromkeys(STATUS_GROUPS, 0)
+        total_paid = 0
+        for response_code, transaction_status, count, amount in rows:
+            group = get_status_group(response_code, transaction_status)
+            counts[group] += count
+            if group == 'success':
+                total_paid += amount
+
+        summary = cls.query.get(user_id)
+        if not summary:
+            summary = cls(user_id=user_id)
+            db.session.add(summary)
+        summary.total_paid = total_paid
+        summary.success_count = counts['success']
+        summary.failed_count = counts['failed']
+        summary.pending_count = counts['pending']
+        return summary
+
+    @classmethod
+    def rebuild_all(cls):
+        """
+        Tính lại bảng tổng hợp của mọi user bằng một INSERT ... SELECT
+        Dùng sau khi nạp giao dịch hàng loạt (không qua API) hoặc để đối soát toàn bộ
+        Returns:
+            int: Số user có giao dịch
+        """
+        transaction = VnpayTransaction
+        pending = db.or_(transaction.vnp_responsecode.is_(None), transaction.vnp_responsecode == '')
+        success = db.and_(transaction.vnp_responsecode == '00', transaction.vnp_transactionstatus == '00')
+
+        def count_if(condition):
+            return db.func.coalesce(db.func.sum(db.case((condition, 1), else_=0)), 0)
+
+        db.session.execute(db.delete(cls))
+        db.session.execute(db.insert(cls).from_select(
+            ['user_id', 'total_paid', 'success_count', 'failed_count', 'pending_count', 'updated_at'],
+            db.select(
+                transaction.user_id,
+                db.func.coalesce(db.func.sum(db.case((success, transaction.vnp_amount), else_=0)), 0),
+                count_if(success),
+                count_if(db.and_(db.not_(pending), db.not_(success))),
+                count_if(pending),
+                db.func.now()
+            ).where(transaction.user_id.isnot(None)).group_by(transaction.user_id)
+        ))
+        return db.session.execute(db.select(db.func.count()).select_from(cls)).scalar()
+
+    @classmethod
+    def apply_change(cls, user_id, old_group, new_group, amount):
+        """
+        Cập nhật bảng tổng hợp khi một giao dịch chuyển trạng thái
+        Dùng UPDATE cộng dồn trên DB để không mất cập nhật giữa các giao dịch khác nhau của user.
+        old_group phải được đọc khi đang khoá dòng giao dịch (lock_by_txnref), nếu không IPN và
+        return chạy song song sẽ cùng thấy 'pending' và tính thay đổi hai lần
+
+        Args:
+            user_id: ID của user sở hữu giao dịch
+            old_group: Nhóm trạng thái cũ (None nếu giao dịch mới tạo)
+            new_group: Nhóm trạng thái mới
+            amount: Số tiền của giao dịch
+        """
+        if not user_id or old_group == new_group:
+            return
+
+        values = {}
+        if old_group:
+            column = getattr(cls, f'{old_group}_count')
+            values[column] = column - 1
+        column = getattr(cls, f'{new_group}_count')
+        values[column] = column + 1
+        if old_group == 'success':
+            values[cls.total_paid] = cls.total_paid - amount
+        if new_group == 'success':
+            values[cls.total_paid] = cls.total_paid + amount
+        values[cls.updated_at] = datetime.utcnow()
+
+        updated = cls.query.filter_by(user_id=user_id).update(values, synchronize_session=False)
+        if not updated:
+            # Chưa có bản ghi tổng hợp: tính lại từ giao dịch (đã bao gồm thay đổi hiện tại)
+            db.session.flush()
+            cls.rebuild(user_id)
+
+    def to_dict(self):
+        """Chuyển đổi thành dictionary để serialize JSON"""
+        return {
+            'user_id': str(self.user_id),
+            'total_paid': float(self.total_paid or 0),
+            'count_by_status': {
+                'success': self.success_count or 0,
+                'failed': self.failed_count or 0,
+                'pending': self.pending_count or 0
+            },
+            'total_transactions': (self.success_count or 0) + (self.failed_count or 0) + (self.pending_count or 0),
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
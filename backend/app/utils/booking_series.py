@@ -0,0 +1,454 @@
+"""
+Recurring booking series
+
+A series is a recurrence rule (a subset of RFC 5545 RRULE: ``FREQ=WEEKLY``
+or ``FREQ=MONTHLY``, ``INTERVAL``, ``COUNT`` / ``UNTIL``; the API also
+accepts ``weekly`` / ``biweekly`` / ``monthly``) plus the template of its
+bookings. Creating one does, for the whole series:
+
+- the working-hours checks of ``create_booking`` once (every occurrence has
+  the same time; the lead time only matters for the first one);
+- one availability query over every date: the customer must not already have
+  a booking overlapping the slot, and active staff must not all be busy
+  (bookings overlapping the slot widened by ``STAFF_TRAVEL_BUFFER_MINUTES``,
+  plus staff on time off);
+- one ``booking_code = ANY(:codes)`` query for all the booking codes;
+- multi-row INSERTs of the bookings and their items (``insertmanyvalues``),
+  ids generated client side so no RETURNING round trip is needed; the tax is
+  computed here (``BOOKING_TAX_RATE``), never taken from the client.
+
+The remaining occurrences (from a date, not started yet) are edited or
+cancelled with one ``UPDATE ... RETURNING``. Bulk statements bypass mapper
+events, so the inserted and returned dates drop the cached staff calendar
+days explicitly.
+"""
+
+import calendar
+import uuid
+from collections import namedtuple, defaultdict
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import Integer, Interval, and_, cast, func, insert, literal, literal_column, or_, select, union_all, update
+
+from app.extensions import db
+from app.models.booking import Booking, BookingItem, BookingSeries, BookingStaff
+from app.models.schedule import StaffSchedule
+from app.models.service import Service
+from app.utils.config import runtime_settings
+from app.utils.helpers import booking_tax
+from app.utils.notifications import notify
+from app.utils.staff_calendar import invalidate_calendar
+from app.utils.staff_locator import staff_locator, DEFAULT_DURATION_MINUTES
+
+# frequency -> (FREQ, INTERVAL)
+FREQUENCIES = {
+    'weekly': ('WEEKLY', 1),
+    'biweekly': ('WEEKLY', 2),
+    'monthly': ('MONTHLY', 1),
+}
+
+# Các lần còn lại có thể sửa / huỷ
+OPEN_STATUSES = ('pending', 'confirmed')
+
+SERIES_MESSAGES = {
+    'created': ('Đặt lịch định kỳ thành công', 'Đã tạo {count} lịch {frequency} lúc {time}, bắt đầu ngày {date}.'),
+    'updated': ('Lịch định kỳ đã được cập nhật', '{count} lịch còn lại từ ngày {date} đã được cập nhật.'),
+    'cancelled': ('Lịch định kỳ đã bị hủy', '{count} lịch còn lại từ ngày {date} đã bị hủy.'),
+}
+FREQUENCY_LABELS = {'weekly': 'hằng tuần', 'biweekly': '2 tuần một lần', 'monthly': 'hằng tháng'}
+
+
+class SeriesError(ValueError):
+    """Invalid series request; the message is shown to the customer"""
+
+    def __init__(self, message, conflicts=None):
+        super().__init__(message)
+        self.conflicts = conflicts or []
+
+
+class RecurrenceRule(namedtuple('RecurrenceRule', ['freq', 'interval', 'count', 'until'])):
+    """FREQ / INTERVAL / COUNT / UNTIL of an RRULE"""
+
+    @property
+    def frequency(self):
+        for name, (freq, interval) in FREQUENCIES.items():
+            if (freq, interval) == (self.freq, self.interval):
+                return name
+        return 'custom'
+
+    def to_rrule(self):
+        parts = [f'FREQ={self.freq}', f'INTERVAL={self.interval}']
+        if self.count:
+            parts.append(f'COUNT={self.count}')
+        if self.until:
+            parts.append(f'UNTIL={self.until.strftime("%Y%m%d")}')
+        return ';'.join(parts)
+
+    def dates(self, start, limit):
+        """Occurrence dates from start (included), at most limit of them"""
+        count = min(self.count or limit, limit)
+        result = []
+        step = 0
+        while len(result) < count:
+            if self.freq == 'WEEKLY':
+                day = start + timedelta(weeks=step * self.interval)
+            else:
+                # Như RFC 5545: tháng không có ngày đó (31/4...) thì bỏ qua
+                month_index = start.month - 1 + step * self.interval
+                year, month = start.year + month_index // 12, month_index % 12 + 1
+                if start.day > calendar.monthrange(year, month)[1]:
+                    step += 1
+                    continue
+                day = date(year, month, start.day)
+            if self.until and day > self.until:
+                break
+            result.append(day)
+            step += 1
+        return result
+
+
+def parse_rule(data):
+    """
+    RecurrenceRule from {"rrule": "FREQ=WEEKLY;INTERVAL=2;COUNT=6"} or
+    {"frequency": "weekly", "count": 8} / {"frequency": "monthly", "until": "YYYY-MM-DD"}
+    """
+    if data.get('rrule'):
+        fields = {}
+        for part in str(data['rrule']).upper().removeprefix('RRULE:').split(';'):
+            key, _, value = part.partition('=')
+            if key:
+                fields[key.strip()] = value.strip()
+        unsupported = set(fields) - {'FREQ', 'INTERVAL', 'COUNT', 'UNTIL'}
+        if unsupported:
+            raise SeriesError(f'RRULE không hỗ trợ: {", ".join(sorted(unsupported))}')
+        freq = fields.get('FREQ')
+        interval, count, until = fields.get('INTERVAL', '1'), fields.get('COUNT'), fields.get('UNTIL')
+        until_format, until = '%Y%m%d', until[:8] if until else None
+    else:
+        frequency = data.get('frequency')
+        if frequency not in FREQUENCIES:
+            raise SeriesError('frequency phải là weekly, biweekly hoặc monthly')
+        freq, interval = FREQUENCIES[frequency]
+        count, until = data.get('count'), data.get('until')
+        until_format = '%Y-%m-%d'
+
+    if freq not in ('WEEKLY', 'MONTHLY'):
+        raise SeriesError('Chỉ hỗ trợ lặp hằng tuần (WEEKLY) hoặc hằng tháng (MONTHLY)')
+    try:
+        interval = int(interval)
+        count = int(count) if count not in (None, '') else None
+        until = datetime.strptime(str(until), until_format).date() if until else None
+    except ValueError:
+        raise SeriesError('INTERVAL, COUNT hoặc UNTIL không hợp lệ')
+    if not 1 <= interval <= 12:
+        raise SeriesError('INTERVAL phải từ 1 đến 12')
+    if count is None and until is None:
+        raise SeriesError('Cần COUNT (số lần) hoặc UNTIL (ngày kết thúc)')
+    if count is not None and count < 1:
+        raise SeriesError('COUNT phải lớn hơn 0')
+    return RecurrenceRule(freq, interval, count, until)
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def _time_of(minutes):
+    return (datetime.min + timedelta(minutes=max(0, min(minutes, 24 * 60 - 1)))).time()
+
+
+def check_booking_time(first_date, booking_time, settings=None, now=None):
+    """
+    Working-hours rules of create_booking, checked once for a whole series
+
+    Valid for every later date too: the working hours do not depend on the
+    date (booking.* settings), and a later date is further from now.
+    """
+    settings = settings or runtime_settings()
+    now = now or datetime.now()
+    start_hour, end_hour = settings['booking.work_start_hour'], settings['booking.work_end_hour']
+    min_advance, min_lead = settings['booking.min_advance_hours'], settings['booking.min_lead_minutes']
+
+    first = datetime.combine(first_date, booking_time)
+    if first < now:
+        raise SeriesError('Không thể đặt lịch trong quá khứ')
+    if booking_time.hour < start_hour or booking_time.hour >= end_hour:
+        raise SeriesError(f'Thời gian đặt lịch phải từ {start_hour}:00 đến {end_hour-1}:59')
+    latest = datetime.combine(first_date, datetime.min.time()) + timedelta(hours=end_hour - min_advance)
+    if first > latest:
+        raise SeriesError(
+            f'Chỉ được đặt lịch đến {latest.strftime("%H:%M")} (trước {min_advance} tiếng so với giờ kết thúc ca {end_hour}:00)'
+        )
+    if first_date == now.date() and first < now + timedelta(minutes=min_lead):
+        raise SeriesError(f'Vui lòng đặt lịch trước ít nhất {min_lead} phút')
+
+
+def find_conflicts(dates, booking_time, duration, user_id, exclude_series_id=None, session=None):
+    """
+    {date: reason} of the dates where the slot is not available (one query)
+
+    reason is 'customer_busy' (the customer already has a booking overlapping
+    the slot) or 'no_staff' (every active staff member is booked or off).
+    """
+    session = session or db.session
+    if not dates:
+        return {}
+    buffer = current_app.config.get('STAFF_TRAVEL_BUFFER_MINUTES', 30)
+    start = _minutes(booking_time)
+    end = start + duration
+    window_start, window_end = _time_of(start - buffer), _time_of(end + buffer)
+
+    # Giờ kết thúc của booking chưa có end_time: giờ bắt đầu + thời lượng dịch vụ dài nhất
+    duration_minutes = select(func.max(Service.duration)).join(
+        BookingItem, BookingItem.service_id == Service.id
+    ).where(BookingItem.booking_id == Booking.id).scalar_subquery()
+    booking_end = func.coalesce(
+        Booking.end_time,
+        Booking.booking_time + func.coalesce(duration_minutes, DEFAULT_DURATION_MINUTES) * literal_column("interval '1 minute'", Interval)
+    )
+    bookings = select(
+        Booking.booking_date.label('day'),
+        func.count().label('busy'),
+        cast(func.bool_or(Booking.user_id == user_id), Integer).label('own'),
+        literal(0).label('off')
+    ).where(
+        Booking.booking_date.in_(dates),
+        Booking.status != 'cancelled',
+        Booking.booking_time < window_end,
+        booking_end > window_start
+    ).group_by(Booking.booking_date)
+    if exclude_series_id is not None:
+        bookings = bookings.where(or_(Booking.series_id.is_(None), Booking.series_id != exclude_series_id))
+
+    time_off = select(
+        StaffSchedule.date,
+        literal(0),
+        literal(0),
+        func.count(func.distinct(StaffSchedule.staff_id))
+    ).where(
+        StaffSchedule.date.in_(dates),
+        StaffSchedule.status == 'off',
+        StaffSchedule.start_time < _time_of(end),
+        StaffSchedule.end_time > booking_time
+    ).group_by(StaffSchedule.date)
+
+    load = defaultdict(lambda: [0, 0, 0])
+    for day, busy, own, off in session.execute(union_all(bookings, time_off)).all():
+        load[day][0] += busy
+        load[day][1] += own or 0
+        load[day][2] += off
+
+    staff_count = len(staff_locator.get_index().staff)
+    conflicts = {}
+    for day, (busy, own, off) in load.items():
+        if own:
+            conflicts[day] = 'customer_busy'
+        elif staff_count and busy + off >= staff_count:
+            conflicts[day] = 'no_staff'
+    return conflicts
+
+
+def conflict_list(conflicts):
+    return [{'date': day.isoformat(), 'reason': reason} for day, reason in sorted(conflicts.items())]
+
+
+def create_series(user_id, service, rule, first_date, booking_time, template, delivery_fee=0, skip_conflicts=False):
+    """
+    Validate the whole series, then insert it with its bookings and items
+
+    template: customer_address, address_id (optional), quantity, area, notes,
+    service_notes, payment_method. Returns (series, [booking rows], skipped conflicts). The
+    caller commits.
+    """
+    check_booking_time(first_date, booking_time)
+    limit = current_app.config.get('BOOKING_SERIES_MAX_OCCURRENCES', 52)
+    dates = rule.dates(first_date, limit + 1)
+    if len(dates) > limit:
+        raise SeriesError(f'Một lịch định kỳ có tối đa {limit} lần')
+    if not dates:
+        raise SeriesError('Quy tắc lặp không sinh ra ngày nào')
+
+    conflicts = find_conflicts(dates, booking_time, service.duration or DEFAULT_DURATION_MINUTES, user_id)
+    if conflicts and not skip_conflicts:
+        raise SeriesError('Một số ngày của lịch định kỳ không còn trống', conflict_list(conflicts))
+    dates = [day for day in dates if day not in conflicts]
+    if not dates:
+        raise SeriesError('Không còn ngày nào trống trong lịch định kỳ', conflict_list(conflicts))
+
+    quantity = template['quantity']
+    unit_price = float(service.price)
+    subtotal = unit_price * quantity
+    tax = booking_tax(subtotal)
+    total_price = subtotal + tax + delivery_fee
+
+    series = BookingSeries(
+        user_id=user_id,
+        service_id=service.id,
+        frequency=rule.frequency,
+        rrule=rule.to_rrule(),
+        start_date=dates[0],
+        until_date=rule.until,
+        occurrence_count=len(dates),
+        booking_time=booking_time,
+        customer_address=template['customer_address'],
+        quantity=quantity,
+        area=template['area'],
+        notes=template['notes'],
+        payment_method=template['payment_method']
+    )
+    db.session.add(series)
+    db.session.flush()
+
+    now = datetime.utcnow()
+    codes = Booking.generate_booking_codes(len(dates))
+    bookings = [
+        {
+            'id': uuid.uuid4(), 'booking_code': code, 'user_id': user_id, 'series_id': series.id,
+            'booking_date': day, 'booking_time': booking_time, 'status': 'pending',
+            'customer_address': template['customer_address'], 'address_id': template.get('address_id'),
+            'area': template['area'], 'notes': template['notes'],
+            'subtotal': subtotal, 'discount': 0, 'tax': tax, 'delivery_fee': delivery_fee, 'total_price': total_price,
+            'payment_status': 'unpaid', 'payment_method': template['payment_method'],
+            'created_at': now, 'updated_at': now
+        }
+        for code, day in zip(codes, dates)
+    ]
+    items = [
+        {
+            'id': uuid.uuid4(), 'booking_id': booking['id'], 'service_id': service.id, 'quantity': quantity,
+            'unit_price': unit_price, 'subtotal': subtotal, 'notes': template['service_notes'],
+            'created_at': now, 'updated_at': now
+        }
+        for booking in bookings
+    ]
+    # executemany -> multi-row INSERT ... VALUES (insertmanyvalues)
+    db.session.execute(insert(Booking.__table__), bookings)
+    db.session.execute(insert(BookingItem.__table__), items)
+    # Core INSERTs bypass the Booking mapper events that drop the cached calendar days
+    invalidate_calendar(dates=dates)
+
+    _notify_series(series, 'created', [user_id], len(bookings), dates[0])
+    return series, bookings, conflicts
+
+
+def _remaining(series, from_date):
+    """Condition of the occurrences that can still change: from from_date (today at the earliest), not started"""
+    from_date = max(from_date or date.today(), date.today())
+    return from_date, and_(
+        Booking.series_id == series.id,
+        Booking.booking_date >= from_date,
+        Booking.status.in_(OPEN_STATUSES)
+    )
+
+
+def remaining_dates(series, from_date=None, session=None):
+    session = session or db.session
+    _, condition = _remaining(series, from_date)
+    return [row[0] for row in session.execute(select(Booking.booking_date).where(condition).order_by(Booking.booking_date))]
+
+
+# Fields of the remaining occurrences update_remaining may change
+UPDATABLE_FIELDS = ('booking_time', 'customer_address', 'address_id', 'delivery_fee', 'notes')
+
+
+def update_remaining(series, changes, from_date=None, skip_conflicts=False, session=None):
+    """
+    Apply changes (booking_time, customer_address, notes) to the remaining occurrences
+
+    A new time is validated against working hours and availability for every
+    remaining date in one pass. A new address comes with the delivery_fee and
+    address_id resolved by the caller; total_price follows the new fee.
+    Returns [(booking_id, date)]. The caller commits.
+    """
+    session = session or db.session
+    from_date, condition = _remaining(series, from_date)
+    values = {key: value for key, value in changes.items() if key in UPDATABLE_FIELDS}
+    if not values:
+        return []
+
+    if 'booking_time' in values:
+        dates = remaining_dates(series, from_date, session)
+        if dates:
+            # Working hours are the same every day, only the past / lead time
+            # checks depend on the date: checking the earliest date covers all
+            check_booking_time(dates[0], values['booking_time'])
+            duration = session.execute(select(Service.duration).where(Service.id == series.service_id)).scalar()
+            conflicts = find_conflicts(
+                dates, values['booking_time'], duration or DEFAULT_DURATION_MINUTES, series.user_id, series.id, session
+            )
+            if conflicts and not skip_conflicts:
+                raise SeriesError('Một số ngày không còn trống ở giờ mới', conflict_list(conflicts))
+            if conflicts:
+                condition = and_(condition, Booking.booking_date.notin_(list(conflicts)))
+        # Giờ kết thúc cũ không còn đúng
+        values['end_time'] = None
+    if 'delivery_fee' in values:
+        values['total_price'] = Booking.total_price - func.coalesce(Booking.delivery_fee, 0) + values['delivery_fee']
+
+    rows = session.execute(
+        update(Booking).where(condition).values(updated_at=datetime.utcnow(), **values)
+        .returning(Booking.id, Booking.booking_date),
+        execution_options={'synchronize_session': False}
+    ).all()
+
+    for key in ('booking_time', 'customer_address', 'notes'):
+        if key in values:
+            setattr(series, key, values[key])
+    if rows:
+        invalidate_calendar(dates={row.booking_date for row in rows}, session=session)
+        _notify_series(series, 'updated', [series.user_id, *_staff_of([row.id for row in rows], session)],
+                       len(rows), min(row.booking_date for row in rows))
+    return rows
+
+
+def cancel_remaining(series, cancelled_by, reason=None, from_date=None, session=None):
+    """
+    Cancel the remaining occurrences with one UPDATE; returns [(booking_id, date)]
+
+    The series itself is cancelled when nothing of it is left. The caller commits.
+    """
+    session = session or db.session
+    from_date, condition = _remaining(series, from_date)
+    now = datetime.utcnow()
+    rows = session.execute(
+        update(Booking).where(condition).values(
+            status='cancelled', cancelled_by=cancelled_by, cancelled_at=now, cancel_reason=reason, updated_at=now
+        ).returning(Booking.id, Booking.booking_date),
+        execution_options={'synchronize_session': False}
+    ).all()
+
+    left = session.execute(
+        select(func.count()).select_from(Booking).where(
+            Booking.series_id == series.id, Booking.status.in_(OPEN_STATUSES)
+        )
+    ).scalar()
+    if not left:
+        series.status = 'cancelled'
+    if rows:
+        invalidate_calendar(dates={row.booking_date for row in rows}, session=session)
+        _notify_series(series, 'cancelled', [series.user_id, *_staff_of([row.id for row in rows], session)],
+                       len(rows), min(row.booking_date for row in rows))
+    return rows
+
+
+def _staff_of(booking_ids, session):
+    """Staff assigned to the bookings (bookings.staff_id and booking_staff), one query"""
+    if not booking_ids:
+        return []
+    rows = session.execute(union_all(
+        select(Booking.staff_id).where(Booking.id.in_(booking_ids), Booking.staff_id.isnot(None)),
+        select(BookingStaff.staff_id).where(BookingStaff.booking_id.in_(booking_ids))
+    )).all()
+    return list(dict.fromkeys(row[0] for row in rows))
+
+
+def _notify_series(series, event_name, user_ids, count, first_date):
+    title, template = SERIES_MESSAGES[event_name]
+    message = template.format(
+        count=count,
+        frequency=FREQUENCY_LABELS.get(series.frequency, 'định kỳ'),
+        time=series.booking_time.strftime('%H:%M'),
+        date=first_date.strftime('%d/%m/%Y')
+    )
+    notify(user_ids, 'booking', title, message, reference_id=series.id, reference_type='booking_series')
@@ -0,0 +1,284 @@
+"""
+Promotion campaigns: announce a promotion to every customer who accepts promotions
+
+Recipients are active customers whose ``notification_settings`` allow
+promotions (no settings row means the model defaults) and, per channel,
+email (``email_notifications``) or SMS (``sms_notifications`` and a phone
+number); the ``notification`` channel writes to the in-app inbox.
+
+``run_campaign`` streams the recipients in user id order from a server-side
+cursor on its own connection, ``CAMPAIGN_CHUNK_SIZE`` rows at a time. Each
+chunk is rendered and written with multi-row INSERTs (outbound_messages for
+the message workers, notifications plus unread counters for the inbox) in
+one transaction that also records the progress and the last user id, so
+memory stays constant and an interrupted campaign resumes after the last
+committed chunk. Cancelling takes effect at the next chunk.
+"""
+
+import threading
+import uuid
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, update, func, and_, or_, true
+
+from app.extensions import db
+from app.models.notification import NotificationSetting
+from app.models.promotion import PromotionCampaign, CAMPAIGN_CHANNELS
+from app.models.user import User
+from app.utils.messaging import enqueue_many
+from app.utils.notifications import write_notifications
+from app.utils.promotion_usage import pending_usage
+
+PLACEHOLDERS = ('name', 'promotion', 'code', 'discount', 'end_date')
+
+DEFAULT_TITLE = 'Ưu đãi {promotion}'
+DEFAULT_MESSAGE = 'Chào {name}, nhập mã {code} để được giảm {discount}. Áp dụng đến hết ngày {end_date}.'
+
+
+class CampaignError(Exception):
+    """Invalid campaign (unknown channel or placeholder, promotion that cannot be used)"""
+
+
+def _format_amount(value):
+    return f"{int(value or 0):,}".replace(',', '.') + 'đ'
+
+
+def promotion_values(promotion):
+    """Placeholder values shared by every recipient"""
+    if promotion.discount_type == 'percentage':
+        discount = f"{promotion.discount_value.normalize():f}%"
+    else:
+        discount = _format_amount(promotion.discount_value)
+    return {
+        'promotion': promotion.name,
+        'code': promotion.code,
+        'discount': discount,
+        'end_date': promotion.end_date.strftime('%d/%m/%Y')
+    }
+
+
+def validate_campaign(title, message, channels):
+    """Raise CampaignError unless the templates and channels can be used"""
+    unknown = [channel for channel in channels if channel not in CAMPAIGN_CHANNELS]
+    if not channels or unknown:
+        raise CampaignError(f"Channels must be some of: {', '.join(CAMPAIGN_CHANNELS)}")
+    sample = {name: '' for name in PLACEHOLDERS}
+    for template in (title, message):
+        try:
+            template.format_map(sample)
+        except (KeyError, IndexError, ValueError) as e:
+            raise CampaignError(f"Invalid template {template!r}: use the placeholders {', '.join(PLACEHOLDERS)} ({str(e)})")
+
+
+def validate_promotion(promotion):
+    """Raise CampaignError unless customers can still use the promotion"""
+    if promotion.status != 'active':
+        raise CampaignError("Promotion is not active")
+    if promotion.end_date < date.today():
+        raise CampaignError("Promotion has expired")
+    if promotion.usage_limit:
+        # Redemptions not yet merged from the sharded usage counters count too
+        used = (promotion.used_count or 0) + pending_usage([promotion.id]).get(promotion.id, 0)
+        if used >= promotion.usage_limit:
+            raise CampaignError("Promotion usage limit reached")
+
+
+def recipients_query(channels, after_user_id=None):
+    """Active customers accepting promotions on at least one of the channels, in id order"""
+    users = User.__table__
+    settings = NotificationSetting.__table__
+    email_ok = func.coalesce(settings.c.email_notifications, True)
+    sms_ok = and_(func.coalesce(settings.c.sms_notifications, False), users.c.phone.isnot(None), users.c.phone != '')
+
+    reachable = []
+    if 'notification' in channels:
+        reachable.append(true())
+    if 'email' in channels:
+        reachable.append(email_ok)
+    if 'sms' in channels:
+        reachable.append(sms_ok)
+
+    query = select(
+        users.c.id, users.c.name, users.c.email, users.c.phone,
+        email_ok.label('email_ok'), sms_ok.label('sms_ok')
+    ).select_from(
+        users.outerjoin(settings, settings.c.user_id == users.c.id)
+    ).where(
+        users.c.role == 'customer',
+        users.c.status == 'active',
+        func.coalesce(settings.c.promotion_notifications, True),
+        or_(*reachable)
+    )
+    if after_user_id is not None:
+        query = query.where(users.c.id > after_user_id)
+    return query.order_by(users.c.id)
+
+
+def create_campaign(promotion, title=None, message=None, channels=None, created_by=None):
+    """Add a pending campaign to the session (the caller commits)"""
+    title = title or DEFAULT_TITLE
+    message = message or DEFAULT_MESSAGE
+    channels = list(dict.fromkeys(channels or ['email', 'notification']))
+    validate_promotion(promotion)
+    validate_campaign(title, message, channels)
+    campaign = PromotionCampaign(
+        promotion_id=promotion.id, created_by=created_by, title=title, message=message,
+        channels=channels, status='pending', processed=0, emails_queued=0, sms_queued=0,
+        notifications_created=0
+    )
+    db.session.add(campaign)
+    return campaign
+
+
+def _claim(campaign_id, force=False):
+    """Mark the campaign running unless another runner has it; True when claimed (commits)"""
+    now = datetime.utcnow()
+    table = PromotionCampaign.__table__
+    claimable = table.c.status == 'pending'
+    if force:
+        claimable = table.c.status.in_(('pending', 'running', 'failed'))
+    else:
+        # A running campaign whose runner stopped sending heartbeats
+        stale = now - timedelta(seconds=current_app.config.get('CAMPAIGN_STALE_SECONDS', 300))
+        claimable = or_(claimable, and_(table.c.status == 'running', table.c.heartbeat_at < stale))
+    claimed = db.session.execute(
+        update(table).where(table.c.id == campaign_id, claimable).values(
+            status='running', error=None, heartbeat_at=now, finished_at=None,
+            started_at=func.coalesce(table.c.started_at, now)
+        ).returning(table.c.id)
+    ).first()
+    db.session.commit()
+    return claimed is not None
+
+
+def _write_chunk(campaign, rows, values, now):
+    """Render and queue one chunk; returns (emails, sms, notifications)"""
+    emails, sms, notifications = [], [], []
+    for row in rows:
+        values['name'] = row.name
+        title = campaign.title.format_map(values)
+        message = campaign.message.format_map(values)
+        if 'email' in campaign.channels and row.email_ok:
+            emails.append(('email', row.email, title, message))
+        if 'sms' in campaign.channels and row.sms_ok:
+            sms.append(('sms', row.phone, None, f"{title}: {message}"))
+        if 'notification' in campaign.channels:
+            notifications.append({
+                'id': uuid.uuid4(), 'user_id': row.id, 'title': title, 'message': message,
+                'type': 'promotion', 'is_read': False, 'reference_id': campaign.promotion_id,
+                'reference_type': 'promotion', 'created_at': now,
+            })
+    enqueue_many(emails + sms)
+    write_notifications(notifications)
+    return len(emails), len(sms), len(notifications)
+
+
+def run_campaign(campaign_id, progress=None, force=False):
+    """
+    Send a campaign (or resume it after its last committed chunk)
+
+    progress(campaign) is called after every chunk. Returns the campaign, or
+    None when another runner is sending it. force also takes over a running
+    campaign with a recent heartbeat and restarts a failed one.
+    """
+    if not _claim(campaign_id, force):
+        return None
+    campaign = db.session.get(PromotionCampaign, campaign_id)
+    table = PromotionCampaign.__table__
+    chunk_size = current_app.config.get('CAMPAIGN_CHUNK_SIZE', 5000)
+    values = promotion_values(campaign.promotion)
+
+    try:
+        if campaign.total_recipients is None:
+            recipients = recipients_query(campaign.channels).order_by(None).subquery()
+            campaign.total_recipients = db.session.execute(
+                select(func.count(func.distinct(recipients.c.id)))
+            ).scalar()
+            db.session.commit()
+
+        last_user_id = campaign.last_user_id
+        # Own connection: the cursor stays open while every chunk commits on the session's connection
+        with db.engine.connect() as reader:
+            result = reader.execution_options(stream_results=True, yield_per=chunk_size).execute(
+                recipients_query(campaign.channels, last_user_id)
+            )
+            for chunk in result.partitions():
+                # Several settings rows for one user come out next to each other
+                rows = []
+                for row in chunk:
+                    if row.id != last_user_id:
+                        rows.append(row)
+                        last_user_id = row.id
+                now = datetime.utcnow()
+                emails, sms, notifications = _write_chunk(campaign, rows, values, now)
+                status = db.session.execute(
+                    update(table).where(table.c.id == campaign.id).values(
+                        processed=table.c.processed + len(rows),
+                        emails_queued=table.c.emails_queued + emails,
+                        sms_queued=table.c.sms_queued + sms,
+                        notifications_created=table.c.notifications_created + notifications,
+                        last_user_id=last_user_id,
+                        heartbeat_at=now
+                    ).returning(table.c.status)
+                ).scalar()
+                if status == 'cancelled':
+                    # Cancelled while this chunk was written: do not send it
+                    db.session.rollback()
+                    break
+                db.session.commit()
+                if progress:
+                    db.session.refresh(campaign)
+                    progress(campaign)
+
+        now = datetime.utcnow()
+        db.session.execute(
+            update(table).where(table.c.id == campaign.id, table.c.status == 'running')
+            .values(status='completed', finished_at=now, heartbeat_at=now)
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        db.session.execute(
+            update(table).where(table.c.id == campaign.id)
+            .values(status='failed', error=str(e)[:1000], finished_at=datetime.utcnow())
+        )
+        db.session.commit()
+        current_app.logger.error(f"Campaign {campaign.id} failed: {str(e)}")
+        raise
+
+    db.session.refresh(campaign)
+    current_app.logger.info(
+        f"Campaign {campaign.id} {campaign.status}: {campaign.processed} recipients, "
+        f"{campaign.emails_queued} emails, {campaign.sms_queued} SMS, {campaign.notifications_created} notifications"
+    )
+    return campaign
+
+
+def cancel_campaign(campaign):
+    """Stop a pending or running campaign; chunks already committed stay queued"""
+    if campaign.status not in ('pending', 'running'):
+        return False
+    campaign.status = 'cancelled'
+    campaign.finished_at = datetime.utcnow()
+    return True
+
+
+def _run_in_thread(app, campaign_id):
+    with app.app_context():
+        try:
+            run_campaign(campaign_id)
+        except Exception:
+            pass  # Recorded on the campaign and logged by run_campaign
+        finally:
+            db.session.remove()
+
+
+def start_campaign(campaign_id):
+    """Send a campaign from a background thread of this process"""
+    thread = threading.Thread(
+        target=_run_in_thread, args=(current_app._get_current_object(), campaign_id),
+        name=f'campaign-{campaign_id}', daemon=True
+    )
+    thread.start()
+    return thread
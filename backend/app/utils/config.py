@@ -1 +1,331 @@
-  
+"""
+Runtime settings registry
+
+Settings editable at runtime (``settings`` table) are declared in
+``SETTINGS`` with a type and a default. Each worker process holds one
+immutable ``SettingsSnapshot`` with every value already parsed, so reading a
+setting on a hot path (``runtime_settings()['booking.work_end_hour']``) is a
+dictionary lookup and never a query.
+
+Changes go through ``update_settings`` (admin API ``PUT /api/admin/settings``
+or ``Setting.set_value``) in the caller's transaction. It bumps the single
+``settings_version`` row and sends ``NOTIFY settings_changed`` in the same
+transaction, so other workers hear about it only once it is committed:
+
+- every worker runs a thread that LISTENs on its own connection and reloads
+  the snapshot on a notification;
+- the same thread also compares the version every
+  ``SETTINGS_REFRESH_SECONDS``, in case a notification was missed while it
+  reconnected (with PgBouncer in transaction mode, LISTEN does not work:
+  set ``SETTINGS_LISTEN = False`` to only poll);
+- the worker that committed the change reloads right after its commit.
+
+Stored values are text; a value that does not parse falls back to the
+default (and is logged), so a bad edit cannot break booking.
+"""
+
+import json
+import os
+import select
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event, select as sql_select, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.extensions import db
+from app.models.setting import Setting, SettingsVersion
+from app.utils.db_routing import RoutingSession
+
+CHANNEL = 'settings_changed'
+
+SettingSpec = namedtuple('SettingSpec', ['key', 'type', 'default', 'description', 'min', 'max'])
+
+
+def _spec(key, type, default, description, min=None, max=None):
+    return SettingSpec(key, type, default, description, min, max)
+
+
+SETTINGS = {spec.key: spec for spec in [
+    _spec('booking.work_start_hour', int, 8, 'Giờ bắt đầu nhận lịch (0-23)', 0, 23),
+    _spec('booking.work_end_hour', int, 17, 'Giờ kết thúc ca làm việc (1-24)', 1, 24),
+    _spec('booking.min_advance_hours', int, 1, 'Lịch phải bắt đầu trước giờ kết thúc ca ít nhất số giờ này', 0, 24),
+    _spec('booking.min_lead_minutes', int, 30, 'Đặt lịch trong ngày: cách thời điểm hiện tại ít nhất số phút này', 0, 24 * 60),
+]}
+
+
+def parse_value(spec, raw):
+    """Typed value of a stored/submitted value (raises ValueError)"""
+    if spec.type is bool:
+        if isinstance(raw, bool):
+            return raw
+        text = str(raw).strip().lower()
+        if text not in ('1', '0', 'true', 'false', 'yes', 'no', 'on', 'off'):
+            raise ValueError(f"{spec.key} must be true or false")
+        return text in ('1', 'true', 'yes', 'on')
+    if spec.type is dict or spec.type is list:
+        value = json.loads(raw) if isinstance(raw, str) else raw
+        if not isinstance(value, spec.type):
+            raise ValueError(f"{spec.key} must be a JSON {spec.type.__name__}")
+        return value
+    if isinstance(raw, bool) or spec.type is int and isinstance(raw, float) and not raw.is_integer():
+        raise ValueError(f"{spec.key} must be an integer")
+    try:
+        value = spec.type(raw)
+    except (TypeError, ValueError):
+        raise ValueError(f"{spec.key} must be of type {spec.type.__name__}")
+    if spec.min is not None and value < spec.min or spec.max is not None and value > spec.max:
+        raise ValueError(f"{spec.key} must be between {spec.min} and {spec.max}")
+    return value
+
+
+def check_settings(values):
+    """Raise ValueError when parsed settings are valid one by one but not together"""
+    start, end = values['booking.work_start_hour'], values['booking.work_end_hour']
+    if start >= end:
+        raise ValueError("booking.work_start_hour must be before booking.work_end_hour")
+    if values['booking.min_advance_hours'] > end - start:
+        raise ValueError(f"booking.min_advance_hours must not exceed the working day ({end - start} hours)")
+
+
+def format_value(spec, value):
+    """Text stored in the settings table"""
+    if spec.type is bool:
+        return 'true' if value else 'false'
+    if spec.type is dict or spec.type is list:
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+class SettingsSnapshot:
+    """Parsed settings at one version (never modified)"""
+
+    def __init__(self, version, raw, loaded_at=None):
+        self.version = version
+        self.loaded_at = loaded_at or time.time()
+        # Settings not declared in SETTINGS are kept as text (Setting.get_value)
+        self.raw = dict(raw)
+        self.invalid = []
+        values = {}
+        for key, spec in SETTINGS.items():
+            if raw.get(key) is None:
+                values[key] = spec.default
+                continue
+            try:
+                values[key] = parse_value(spec, raw[key])
+            except ValueError:
+                values[key] = spec.default
+                self.invalid.append(key)
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def get(self, key, default=None):
+        if key in self._values:
+            return self._values[key]
+        return self.raw.get(key, default)
+
+    def to_dict(self):
+        return dict(self._values)
+
+
+class SettingsRegistry:
+    """The current snapshot of this process"""
+
+    def __init__(self):
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._checked = 0
+
+    def install(self, version, raw):
+        snapshot = SettingsSnapshot(version, raw)
+        with self._lock:
+            # Never go back to an older version (a slow load racing a newer one)
+            if self._snapshot is None or self._snapshot.version is None or version is None \
+                    or version >= self._snapshot.version:
+                self._snapshot = snapshot
+        if snapshot.invalid:
+            current_app.logger.warning(f"Invalid settings, using defaults: {', '.join(snapshot.invalid)}")
+        return self._snapshot
+
+    def load(self, session=None):
+        """Read every setting (two queries) and install the snapshot"""
+        session = session or db.session
+        version = current_version(session)
+        raw = dict(session.execute(sql_select(Setting.key, Setting.value)).all())
+        self._checked = time.monotonic()
+        return self.install(version, raw)
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            return self.load()
+        if not _listener_started() and time.monotonic() - self._checked > current_app.config.get('SETTINGS_REFRESH_SECONDS', 30):
+            # No listener thread in this process: poll the version from the request
+            self._checked = time.monotonic()
+            if current_version() != snapshot.version:
+                return self.load()
+        return snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+    @property
+    def version(self):
+        return self._snapshot.version if self._snapshot else None
+
+
+REGISTRY = SettingsRegistry()
+
+
+def runtime_settings():
+    """Current settings snapshot of this worker"""
+    return REGISTRY.snapshot()
+
+
+def current_version(session=None):
+    session = session or db.session
+    return session.execute(sql_select(SettingsVersion.version).where(SettingsVersion.id == 1)).scalar() or 0
+
+
+def update_settings(values, session=None):
+    """
+    Validate and store settings in the caller's transaction
+
+    values maps keys to typed values (or their text). Keys not declared in
+    SETTINGS are stored as text. The settings as they will be after the
+    change are checked together (check_settings), under a lock on the
+    version row so that two concurrent edits cannot combine into an invalid
+    set. Raises ValueError; returns the new version, other workers reload
+    when the transaction commits.
+    """
+    session = session or db.session
+    stored = {}
+    for key, value in values.items():
+        spec = SETTINGS.get(key)
+        if spec is None:
+            stored[key] = None if value is None else str(value)
+        else:
+            stored[key] = None if value is None else format_value(spec, parse_value(spec, value))
+
+    session.execute(sql_select(SettingsVersion.id).where(SettingsVersion.id == 1).with_for_update())
+    current = dict(session.execute(sql_select(Setting.key, Setting.value)).all())
+    check_settings(SettingsSnapshot(None, {**current, **stored}).to_dict())
+
+    now = datetime.utcnow()
+    for key, value in stored.items():
+        description = SETTINGS[key].description if key in SETTINGS else None
+        statement = pg_insert(Setting.__table__).values(
+            key=key, value=value, description=description, created_at=now, updated_at=now
+        )
+        session.execute(statement.on_conflict_do_update(
+            index_elements=['key'], set_={'value': statement.excluded.value, 'updated_at': now}
+        ))
+
+    statement = pg_insert(SettingsVersion.__table__).values(id=1, version=1, updated_at=now)
+    version = session.execute(statement.on_conflict_do_update(
+        index_elements=['id'],
+        set_={'version': SettingsVersion.__table__.c.version + 1, 'updated_at': now}
+    ).returning(SettingsVersion.__table__.c.version)).scalar()
+    # Delivered to the listeners when the transaction commits
+    session.execute(sql_select(func.pg_notify(CHANNEL, str(version))))
+    session.info['settings_changed'] = True
+    return version
+
+
+def _after_commit(session):
+    if session.info.pop('settings_changed', False):
+        REGISTRY.invalidate()
+
+
+def _after_soft_rollback(session, previous_transaction):
+    # A rolled back savepoint (notification fan-out) leaves the outer transaction's change
+    if previous_transaction.nested:
+        return
+    session.info.pop('settings_changed', None)
+
+
+# ===== Listener =====
+
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def _listener_started():
+    return _listener_pid == os.getpid()
+
+
+def _load_from(connection):
+    """Snapshot read on the listener's own DBAPI connection"""
+    cursor = connection.cursor()
+    cursor.execute("SELECT version FROM settings_version WHERE id = 1")
+    row = cursor.fetchone()
+    cursor.execute("SELECT key, value FROM settings")
+    raw = dict(cursor.fetchall())
+    cursor.close()
+    return (row[0] if row else 0), raw
+
+
+def _listen(app):
+    refresh = app.config.get('SETTINGS_REFRESH_SECONDS', 30)
+    while True:
+        connection = None
+        try:
+            with app.app_context():
+                pooled = db.engine.raw_connection()
+                connection = pooled.driver_connection
+                # Kept out of the pool for the life of the process
+                pooled.detach()
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            with app.app_context():
+                # Load after LISTEN so no change committed in between is missed
+                REGISTRY.install(*_load_from(connection))
+
+                while True:
+                    if select.select([connection], [], [], refresh) != ([], [], []):
+                        connection.poll()
+                        if connection.notifies:
+                            connection.notifies.clear()
+                            REGISTRY.install(*_load_from(connection))
+                    else:
+                        version, raw = _load_from(connection)
+                        if version != REGISTRY.version:
+                            REGISTRY.install(version, raw)
+        except Exception as e:
+            app.logger.warning(f"Settings listener error, reconnecting: {str(e)}")
+            if connection is not None:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+            time.sleep(5)
+
+
+def _start_listener():
+    """Start (once per process) the LISTEN thread"""
+    global _listener_pid
+    if _listener_started():
+        return
+    with _listener_lock:
+        if _listener_started():
+            return
+        _listener_pid = os.getpid()
+        app = current_app._get_current_object()
+        threading.Thread(target=_listen, args=(app,), name='settings-listener', daemon=True).start()
+
+
+def init_runtime_settings(app):
+    """Reload after local changes and start the listener (called by create_app)"""
+    if not event.contains(RoutingSession, 'after_commit', _after_commit):
+        event.listen(RoutingSession, 'after_commit', _after_commit)
+        event.listen(RoutingSession, 'after_soft_rollback', _after_soft_rollback)
+    if app.config.get('SETTINGS_LISTEN', True) and app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+        # On the first request, so that every forked gunicorn worker listens on its own connection
+        app.before_request(_start_listener)
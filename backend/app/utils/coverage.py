@@ -0,0 +1,249 @@
+"""
+Service coverage index - which services serve an address, and at what delivery fee
+
+Keeps a per-worker snapshot of the active areas (``areas``) and of the services
+linked to them (``service_areas``), keyed by the normalized (city, district)
+of each area, so that answering "what can be booked at this address" on the
+catalog, in ``/api/areas/resolve`` and in ``create_booking`` is a dictionary
+lookup instead of a join.
+
+Rules:
+
+- an area without a district covers the whole city; an area of the district
+  takes precedence over it;
+- when several areas of an address cover the same service, the lowest
+  ``delivery_fee`` applies;
+- a service without any ``service_areas`` row is available everywhere, with no
+  delivery fee (the catalog behaves as before areas are configured);
+- a booking must name its city once an area exists (explicitly, through the
+  saved address or in the address text, see ``locate``).
+
+City and district names are compared without accents, case, punctuation and
+administrative prefixes, so "TP. Hồ Chí Minh" / "tphcm" and "Quận 1" / "Q1"
+match.
+
+The index is rebuilt lazily when an area, a service area or a service is
+written (mapper events), and after ``COVERAGE_INDEX_TTL`` seconds so that
+writes made by other workers are picked up.
+"""
+
+import re
+import threading
+import time
+import unicodedata
+from collections import namedtuple, defaultdict
+from decimal import Decimal
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from app.extensions import db
+from app.models.service import Service, Area, ServiceArea
+from app.utils.db_routing import RoutingSession
+
+CHANGED_KEY = 'coverage_changed'
+
+AreaEntry = namedtuple('AreaEntry', ['id', 'name', 'city', 'district', 'delivery_fee'])
+
+# Tiền tố hành chính bỏ qua khi so sánh (đã bỏ dấu)
+_PREFIXES = re.compile(r'^(thanh pho|tinh|tp|quan|huyen|thi xa|tx|q|h)(?=\s|\d|$)\s*')
+_ALIASES = {
+    'hcm': 'ho chi minh', 'tphcm': 'ho chi minh', 'sai gon': 'ho chi minh', 'sg': 'ho chi minh',
+    'hn': 'ha noi', 'dn': 'da nang',
+}
+
+
+def normalize_place(name):
+    """Comparison key of a city or district name ('' when empty)"""
+    if not name:
+        return ''
+    text = unicodedata.normalize('NFD', str(name).replace('đ', 'd').replace('Đ', 'D'))
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    text = ' '.join(re.sub(r'[^a-z0-9]+', ' ', text).split())
+    text = _ALIASES.get(text, text)
+    text = _PREFIXES.sub('', text, count=1)
+    return _ALIASES.get(text, text)
+
+
+class Coverage:
+    """Services available at one address: {service_id: covering AreaEntry or None}"""
+
+    __slots__ = ('areas', 'services')
+
+    def __init__(self, areas, services):
+        self.areas = areas
+        self.services = services
+
+    @property
+    def service_ids(self):
+        return self.services.keys()
+
+    def covers(self, service_id):
+        return service_id in self.services
+
+    def delivery_fee(self, service_id):
+        area = self.services.get(service_id)
+        return area.delivery_fee if area else Decimal('0')
+
+
+class _CoverageIndex:
+    """Immutable snapshot of the areas and the services they cover"""
+
+    def __init__(self, areas, links):
+        self.built_at = time.monotonic()
+        self.areas = sorted(areas, key=lambda a: (a.city or '', a.district or '', a.name))
+        by_id = {area.id: area for area in self.areas}
+
+        # Dịch vụ không gắn khu vực nào: phục vụ mọi nơi
+        restricted = set()
+        services_by_area = defaultdict(set)
+        everywhere = set()
+        for service_id, area_id in links:
+            if area_id is None:
+                everywhere.add(service_id)
+                continue
+            restricted.add(service_id)
+            if area_id in by_id:
+                services_by_area[area_id].add(service_id)
+        self.everywhere = frozenset(everywhere - restricted)
+
+        # (city, district) -> {service_id: area có phí thấp nhất}; district '' = toàn thành phố
+        self.by_place = defaultdict(dict)
+        self.areas_by_place = defaultdict(list)
+        self.cities = set()
+        for area in self.areas:
+            key = (normalize_place(area.city), normalize_place(area.district))
+            self.areas_by_place[key].append(area)
+            self.cities.add(key[0])
+            covered = self.by_place[key]
+            for service_id in services_by_area[area.id]:
+                current = covered.get(service_id)
+                if current is None or area.delivery_fee < current.delivery_fee:
+                    covered[service_id] = area
+
+    def resolve(self, city, district=None):
+        city_key, district_key = normalize_place(city), normalize_place(district)
+        services = dict.fromkeys(self.everywhere)
+        services.update(self.by_place.get((city_key, ''), {}))
+        areas = list(self.areas_by_place.get((city_key, ''), []))
+        if district_key:
+            services.update(self.by_place.get((city_key, district_key), {}))
+            areas = self.areas_by_place.get((city_key, district_key), []) + areas
+        return Coverage(areas, services)
+
+    def locate(self, address):
+        """
+        (city, district) named in a free-text address ("12 Lê Lợi, Quận 1, TP.HCM")
+
+        The last comma-separated part that is the city of an area is the city;
+        the part before it is the district when an area has it (None otherwise).
+        (None, None) when no city of an area is found.
+        """
+        parts = [part.strip() for part in str(address or '').split(',') if part.strip()]
+        for i in range(len(parts) - 1, -1, -1):
+            city_key = normalize_place(parts[i])
+            if city_key not in self.cities:
+                continue
+            if i and (city_key, normalize_place(parts[i - 1])) in self.areas_by_place:
+                return parts[i], parts[i - 1]
+            return parts[i], None
+        return None, None
+
+
+class CoverageIndex:
+    """Process-wide access point to the coverage index"""
+
+    def __init__(self):
+        self._index = None
+        self._dirty = True
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Mark the index stale; it is rebuilt on the next lookup"""
+        self._dirty = True
+
+    def _is_stale(self, index):
+        if index is None or self._dirty:
+            return True
+        ttl = current_app.config.get('COVERAGE_INDEX_TTL', 60)
+        return ttl is not None and time.monotonic() - index.built_at > ttl
+
+    def get_index(self):
+        """Return the current index, rebuilding it when stale"""
+        index = self._index
+        if not self._is_stale(index):
+            return index
+        with self._lock:
+            index = self._index
+            if self._is_stale(index):
+                self._dirty = False
+                index = self._build()
+                self._index = index
+        return index
+
+    def _build(self):
+        areas = [
+            AreaEntry(row.id, row.name, row.city, row.district, row.delivery_fee or Decimal('0'))
+            for row in db.session.query(
+                Area.id, Area.name, Area.city, Area.district, Area.delivery_fee
+            ).filter(Area.status == 'active').all()
+        ]
+        links = db.session.query(Service.id, ServiceArea.area_id).outerjoin(
+            ServiceArea, ServiceArea.service_id == Service.id
+        ).filter(Service.status == 'active').all()
+
+        index = _CoverageIndex(areas, links)
+        current_app.logger.info(
+            f"Coverage index rebuilt with {len(areas)} areas, {len(index.everywhere)} services available everywhere"
+        )
+        return index
+
+    def resolve(self, city, district=None):
+        """Coverage of an address (city, district)"""
+        return self.get_index().resolve(city, district)
+
+    def locate(self, address):
+        """(city, district) of a free-text address, see _CoverageIndex.locate"""
+        return self.get_index().locate(address)
+
+    def areas(self):
+        """Active areas, by city and district"""
+        return self.get_index().areas
+
+
+coverage_index = CoverageIndex()
+
+
+@db.event.listens_for(Area, 'after_insert')
+@db.event.listens_for(Area, 'after_update')
+@db.event.listens_for(Area, 'after_delete')
+@db.event.listens_for(ServiceArea, 'after_insert')
+@db.event.listens_for(ServiceArea, 'after_update')
+@db.event.listens_for(ServiceArea, 'after_delete')
+@db.event.listens_for(Service, 'after_insert')
+@db.event.listens_for(Service, 'after_update')
+@db.event.listens_for(Service, 'after_delete')
+def _coverage_written(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info[CHANGED_KEY] = True
+
+
+def _after_commit(session):
+    # Not at flush: a rebuild before the commit would not see the write
+    if session.info.pop(CHANGED_KEY, False):
+        coverage_index.invalidate()
+
+
+def _after_soft_rollback(session, previous_transaction):
+    if previous_transaction.nested:
+        return
+    session.info.pop(CHANGED_KEY, None)
+
+
+def init_coverage(app):
+    """Invalidate the index when the sessions that wrote areas / services commit (called by create_app)"""
+    if not event.contains(RoutingSession, 'after_commit', _after_commit):
+        event.listen(RoutingSession, 'after_commit', _after_commit)
+        event.listen(RoutingSession, 'after_soft_rollback', _after_soft_rollback)
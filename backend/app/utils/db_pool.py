@@ -0,0 +1,222 @@
+"""
+Connection pool instrumentation
+
+Pool sizes come from ``SQLALCHEMY_ENGINE_OPTIONS`` (see ``engine_options`` in
+config.py). This module records how the pool of each engine is used, per
+process:
+
+- checkout wait: time spent waiting for a free connection (histogram, sum,
+  max), measured by ``InstrumentedQueuePool``;
+- timeouts: checkouts that gave up after ``pool_timeout``;
+- in use / peak in use, overflow connections open, connects, invalidations.
+
+A checkout waiting longer than ``DB_POOL_WAIT_WARNING`` seconds is logged, so
+pool saturation shows up in the logs and in ``GET /api/admin/metrics/db-pool``
+well before requests start failing with pool timeouts.
+"""
+
+import threading
+import time
+import weakref
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+# Upper bounds (seconds) of the checkout wait histogram buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_engine_stats = weakref.WeakKeyDictionary()
+
+
+class PoolStats:
+    """Counters for one engine's pool (thread safe)"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.wait_count = 0
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+        self.wait_buckets = [0] * len(WAIT_BUCKETS)
+
+    def record_wait(self, seconds, timed_out=False):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_sum += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            for i, bound in enumerate(WAIT_BUCKETS):
+                if seconds <= bound:
+                    self.wait_buckets[i] += 1
+                    break
+            if timed_out:
+                self.timeouts += 1
+
+    def on_checkout(self):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def on_checkin(self):
+        with self._lock:
+            self.in_use = max(self.in_use - 1, 0)
+
+    def on_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def on_invalidate(self):
+        with self._lock:
+            self.invalidations += 1
+
+    def reset_after_fork(self):
+        """Connections of the parent are not in use in the child"""
+        self._lock = threading.Lock()
+        self.in_use = 0
+
+    def snapshot(self, pool):
+        """Counters plus the current state of pool"""
+        with self._lock:
+            data = {
+                'name': self.name,
+                'pool': type(pool).__name__,
+                'inUse': self.in_use,
+                'peakInUse': self.peak_in_use,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'connects': self.connects,
+                'invalidations': self.invalidations,
+                'wait': {
+                    'count': self.wait_count,
+                    'sumSeconds': round(self.wait_sum, 6),
+                    'maxSeconds': round(self.wait_max, 6),
+                    'avgSeconds': round(self.wait_sum / self.wait_count, 6) if self.wait_count else 0,
+                    # Cumulative counts per upper bound, as in a Prometheus histogram
+                    'buckets': [
+                        {'le': bound, 'count': count}
+                        for bound, count in zip(WAIT_BUCKETS, _cumulative(self.wait_buckets))
+                    ],
+                },
+            }
+        if isinstance(pool, QueuePool):
+            capacity = pool.size() + max(pool._max_overflow, 0)
+            data.update({
+                'size': pool.size(),
+                'maxOverflow': pool._max_overflow,
+                'timeoutSeconds': pool.timeout(),
+                'idle': pool.checkedin(),
+                'overflow': max(pool.overflow(), 0),
+                'saturation': round(pool.checkedout() / capacity, 3) if capacity > 0 else None,
+            })
+        return data
+
+
+def _cumulative(counts):
+    total = 0
+    result = []
+    for count in counts:
+        total += count
+        result.append(total)
+    return result
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that times how long each checkout waits for a connection"""
+
+    stats = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self._record(time.perf_counter() - started, timed_out=True)
+            raise
+        self._record(time.perf_counter() - started)
+        return connection
+
+    def _record(self, waited, timed_out=False):
+        stats = self.stats
+        if stats is None:
+            return
+        stats.record_wait(waited, timed_out)
+        if timed_out or waited >= _wait_warning():
+            _log_slow_checkout(stats, self, waited, timed_out)
+
+    def recreate(self):
+        # dispose() replaces the pool; keep counting into the same stats
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def _wait_warning():
+    if has_app_context():
+        return current_app.config.get('DB_POOL_WAIT_WARNING', 0.5)
+    return 0.5
+
+
+def _log_slow_checkout(stats, pool, waited, timed_out):
+    if not has_app_context():
+        return
+    state = stats.snapshot(pool)
+    message = (
+        f"DB pool '{stats.name}' {'timed out' if timed_out else 'slow checkout'} "
+        f"after {waited:.3f}s (in use {state['inUse']}/{state.get('size')}+{state.get('maxOverflow')}, "
+        f"overflow {state.get('overflow')}, timeouts {state['timeouts']})"
+    )
+    if timed_out:
+        current_app.logger.error(message)
+    else:
+        current_app.logger.warning(message)
+
+
+def use_instrumented_pool(config):
+    """Select InstrumentedQueuePool where SQLAlchemy would use a QueuePool"""
+    uri = config.get('SQLALCHEMY_DATABASE_URI')
+    if not uri or make_url(uri).get_backend_name() == 'sqlite':
+        return
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    if 'poolclass' in options:
+        return
+    options['poolclass'] = InstrumentedQueuePool
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def instrument_engine(engine, name):
+    """Attach pool event listeners (and stats) to an engine"""
+    if engine in _engine_stats:
+        return _engine_stats[engine]
+    stats = _engine_stats[engine] = PoolStats(name)
+    if isinstance(engine.pool, InstrumentedQueuePool):
+        engine.pool.stats = stats
+
+    event.listen(engine, 'connect', lambda dbapi_conn, record: stats.on_connect())
+    event.listen(engine, 'checkout', lambda dbapi_conn, record, proxy: stats.on_checkout())
+    event.listen(engine, 'checkin', lambda dbapi_conn, record: stats.on_checkin())
+    event.listen(engine, 'invalidate', lambda dbapi_conn, record, error: stats.on_invalidate())
+    return stats
+
+
+def reset_after_fork(engine):
+    """Forget the parent's in-use connections (called after the pool is disposed)"""
+    stats = _engine_stats.get(engine)
+    if stats is not None:
+        stats.reset_after_fork()
+
+
+def pool_snapshots(engines):
+    """Snapshot of every instrumented engine: {engine name: dict}"""
+    return {
+        stats.name: stats.snapshot(engine.pool)
+        for engine in engines
+        for stats in [_engine_stats.get(engine)] if stats is not None
+    }
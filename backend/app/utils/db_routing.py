@@ -0,0 +1,162 @@
+"""
+Read-replica routing
+
+``REPLICA_DATABASE_URIS`` lists read replicas of the primary database. Each one
+becomes a Flask-SQLAlchemy bind (``replica_0``, ``replica_1``...) with the
+same engine options and pool instrumentation as the primary.
+
+Code marked with ``read_only`` (decorator or context manager) sends its
+queries to a random replica through ``RoutingSession``. Anything that writes
+still goes to the primary: flushes, INSERT/UPDATE/DELETE statements and
+``SELECT ... FOR UPDATE``.
+
+Read-your-writes: after a successful POST/PUT/PATCH/DELETE, the same user
+(JWT identity) reads from the primary for ``REPLICA_STICKY_SECONDS``, so a
+replica that has not caught up yet never hides their own change. The
+deadline is kept in the worker and in the ``db_primary_until`` cookie, which
+same-origin browsers send to every worker.
+
+With no replicas configured, ``read_only`` does nothing.
+"""
+
+import random
+import threading
+import time
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+
+from flask import current_app, has_request_context, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from flask_sqlalchemy.session import Session
+
+REPLICA_BIND_PREFIX = 'replica_'
+STICKY_COOKIE = 'db_primary_until'
+WRITE_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+_read_only = ContextVar('db_read_only', default=False)
+
+# identity -> time.time() until which the user reads from the primary
+_recent_writers = {}
+_recent_writers_lock = threading.Lock()
+
+
+def replica_uris(config):
+    """REPLICA_DATABASE_URIS as a list (comma separated string or list)"""
+    uris = config.get('REPLICA_DATABASE_URIS') or []
+    if isinstance(uris, str):
+        uris = uris.split(',')
+    return [uri.strip() for uri in uris if uri.strip()]
+
+
+def configure_replicas(config):
+    """Add one SQLALCHEMY_BINDS entry per replica (before db.init_app)"""
+    uris = replica_uris(config)
+    if not uris:
+        return
+    binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+    for i, uri in enumerate(uris):
+        binds[f'{REPLICA_BIND_PREFIX}{i}'] = uri
+    config['SQLALCHEMY_BINDS'] = binds
+
+
+def _writes(clause):
+    if clause is None:
+        return False
+    if getattr(clause, 'is_dml', False):
+        return True
+    return getattr(clause, '_for_update_arg', None) is not None
+
+
+class RoutingSession(Session):
+    """Session that sends reads inside ``read_only`` to a replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or not _read_only.get() or self._flushing or _writes(clause):
+            return engine
+        engines = self._db.engines
+        if engine is not engines.get(None):
+            # Models with their own bind keep it
+            return engine
+        replicas = [e for key, e in engines.items() if key and key.startswith(REPLICA_BIND_PREFIX)]
+        if not replicas:
+            return engine
+        return random.choice(replicas)
+
+
+def _identity():
+    """JWT identity of the current request, if any"""
+    try:
+        verify_jwt_in_request(optional=True)
+        return get_jwt_identity()
+    except Exception:
+        return None
+
+
+def reads_own_writes():
+    """True when the current request must read from the primary (recent write by this user)"""
+    if not has_request_context():
+        return False
+    now = time.time()
+    try:
+        if float(request.cookies.get(STICKY_COOKIE, 0)) > now:
+            return True
+    except ValueError:
+        pass
+    identity = _identity()
+    if identity is None:
+        return False
+    return _recent_writers.get(str(identity), 0) > now
+
+
+def remember_write(response):
+    """after_request: pin the user to the primary after a successful write"""
+    if request.method not in WRITE_METHODS or response.status_code >= 400:
+        return response
+    window = current_app.config.get('REPLICA_STICKY_SECONDS', 10)
+    if not window or not replica_uris(current_app.config):
+        return response
+    until = time.time() + window
+    identity = _identity()
+    if identity is not None:
+        with _recent_writers_lock:
+            _recent_writers[str(identity)] = until
+            if len(_recent_writers) > 10000:
+                now = time.time()
+                for key in [k for k, v in _recent_writers.items() if v <= now]:
+                    del _recent_writers[key]
+    response.set_cookie(STICKY_COOKIE, f'{until:.3f}', max_age=int(window) + 1, httponly=True, samesite='Lax')
+    return response
+
+
+class read_only(ContextDecorator):
+    """
+    Route the queries of a block or view to a read replica
+
+        @read_only()
+        def get_services(): ...
+
+        with read_only():
+            rows = query.all()
+
+    Falls back to the primary when the request follows a write by the same user.
+    """
+
+    def _recreate_cm(self):
+        # A fresh instance per call: the decorated view runs in many threads
+        return type(self)()
+
+    def __enter__(self):
+        routed = bool(replica_uris(current_app.config)) and not reads_own_writes()
+        self._token = _read_only.set(routed)
+        return self
+
+    def __exit__(self, *exc):
+        _read_only.reset(self._token)
+        return False
+
+
+def init_replica_routing(app):
+    """Configure replica binds and the read-your-writes hook (before db.init_app)"""
+    configure_replicas(app.config)
+    app.after_request(remember_write)
@@ -0,0 +1,119 @@
+"""
+Geographic helpers: great-circle distance and an in-memory grid index for k-nearest queries
+
+``GridIndex`` buckets points into square cells of ``cell_degrees`` (about
+1.1 km for the default 0.01°) and answers ``knn`` by scanning rings of cells
+around the query point, nearest ring first. Cells that cannot hold a point
+closer than the current k-th are skipped, and the scan stops as soon as k
+accepted points are closer than anything the next ring could contain, so a
+query touches a handful of cells whatever the number of points.
+"""
+
+import heapq
+import math
+from collections import defaultdict
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance in km"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex:
+    """Points (lat, lng, payload) bucketed in a lat/lng grid"""
+
+    def __init__(self, cell_degrees=0.01):
+        self.cell = cell_degrees
+        self.cells = defaultdict(list)
+        self.size = 0
+        self._bounds = None  # (min row, max row, min col, max col)
+
+    def _key(self, lat, lng):
+        return math.floor(lat / self.cell), math.floor(lng / self.cell)
+
+    def insert(self, lat, lng, payload):
+        row, col = self._key(lat, lng)
+        self.cells[(row, col)].append((lat, lng, payload))
+        self.size += 1
+        if self._bounds is None:
+            self._bounds = (row, row, col, col)
+        else:
+            min_row, max_row, min_col, max_col = self._bounds
+            self._bounds = (min(min_row, row), max(max_row, row), min(min_col, col), max(max_col, col))
+
+    def _ring(self, row, col, radius):
+        if radius == 0:
+            yield row, col
+            return
+        for c in range(col - radius, col + radius + 1):
+            yield row - radius, c
+            yield row + radius, c
+        for r in range(row - radius + 1, row + radius):
+            yield r, col - radius
+            yield r, col + radius
+
+    def _lower_bound_km(self, lat, radius):
+        """Distance under which no point outside the first radius+1 rings can be"""
+        if radius == 0:
+            return 0.0
+        # Points further out differ by more than radius cells in lat or lng; a
+        # degree of longitude is shortest at the highest latitude they can reach
+        highest = min(89.0, abs(lat) + (radius + 1) * self.cell)
+        return radius * self.cell * KM_PER_DEGREE * math.cos(math.radians(highest)) * 0.995
+
+    def _cell_bound_km(self, lat, lng, key):
+        """Distance under which no point of the cell can be"""
+        row, col = key
+        delta_lat = max(0.0, row * self.cell - lat, lat - (row + 1) * self.cell)
+        delta_lng = max(0.0, col * self.cell - lng, lng - (col + 1) * self.cell)
+        highest = min(89.0, max(abs(row * self.cell), abs((row + 1) * self.cell), abs(lat)))
+        return max(delta_lat, delta_lng * math.cos(math.radians(highest))) * KM_PER_DEGREE * 0.995
+
+    def knn(self, lat, lng, k, accept=None, max_km=None):
+        """
+        The k nearest points as [(distance km, payload)], nearest first
+
+        accept(payload) filters points (unavailable staff...); max_km limits
+        the search radius.
+        """
+        if not self.size or k <= 0:
+            return []
+        row, col = self._key(lat, lng)
+        min_row, max_row, min_col, max_col = self._bounds
+        last_ring = max(row - min_row, max_row - row, col - min_col, max_col - col, 0)
+
+        best = []  # max-heap of the k nearest: (-distance, tie, payload)
+        tie = 0
+        for radius in range(last_ring + 1):
+            for key in self._ring(row, col, radius):
+                points = self.cells.get(key)
+                if not points:
+                    continue
+                if radius:
+                    cell_bound = self._cell_bound_km(lat, lng, key)
+                    if len(best) == k and cell_bound >= -best[0][0] or max_km is not None and cell_bound > max_km:
+                        continue
+                for point_lat, point_lng, payload in points:
+                    distance = haversine_km(lat, lng, point_lat, point_lng)
+                    if max_km is not None and distance > max_km:
+                        continue
+                    if len(best) == k and distance >= -best[0][0]:
+                        continue
+                    if accept is not None and not accept(payload):
+                        continue
+                    tie += 1
+                    if len(best) == k:
+                        heapq.heapreplace(best, (-distance, tie, payload))
+                    else:
+                        heapq.heappush(best, (-distance, tie, payload))
+            bound = self._lower_bound_km(lat, radius)
+            if len(best) == k and -best[0][0] <= bound:
+                break
+            if max_km is not None and bound > max_km:
+                break
+        return [(-distance, payload) for distance, _, payload in sorted(best, reverse=True)]
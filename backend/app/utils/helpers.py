@@ -1,7 +1,11 @@
 """Helper functions and decorators"""
 
+import base64
+import binascii
 import functools
-from flask import jsonify
+import uuid
+from datetime import datetime
+from flask import jsonify, current_app
 from flask_jwt_extended import get_jwt_identity, get_jwt
 from app.models.user import User
 
@@ -71,6 +75,10 @@ def generate_booking_code():
     import string
     return 'BK' + ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
 
+def booking_tax(amount):
+    """Tax of a booking on amount (subtotal after discount), never taken from the client"""
+    return round(amount * current_app.config.get('BOOKING_TAX_RATE', 0), 2)
+
 def safe_float(value, default=0.0):
     """Safely convert value to float"""
     try:
@@ -85,3 +93,17 @@ def safe_int(value, default=0):
     except (ValueError, TypeError):
         return default
 
+
+def encode_cursor(created_at, record_id):
+    """Encode a (created_at, id) keyset position into an opaque cursor string"""
+    raw = f"{created_at.isoformat()}|{record_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor, returns (created_at, id) or None"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        created_at, record_id = raw.split('|', 1)
+        return datetime.fromisoformat(created_at), uuid.UUID(record_id)
+    except (ValueError, binascii.Error, UnicodeError):
+        return None
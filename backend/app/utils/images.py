@@ -0,0 +1,219 @@
+"""
+Image processing pipeline for uploaded avatars and service images
+
+An upload is decoded once (JPEGs directly at reduced scale with ``draft``),
+auto-rotated from its EXIF orientation and resized into the variants of
+``IMAGE_VARIANTS`` (largest first, each one resized from the previous), each
+encoded as WebP and JPEG. Metadata (EXIF, GPS, comments) is not copied into
+the variants.
+
+Files are named after the SHA-256 of the uploaded bytes and written to the
+media store (see ``app.utils.media``), so the same image uploaded twice is
+stored once and processing is skipped the second time.
+
+Decoding and encoding run in a small thread pool (Pillow releases the GIL
+while resizing and encoding) which also bounds how many images are processed
+at once per worker. The request waits up to ``IMAGE_PROCESS_TIMEOUT`` seconds;
+past that it returns the (deterministic) variant URLs and the pool finishes
+writing the files in the background.
+"""
+
+import hashlib
+import io
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from flask import current_app
+from PIL import Image, ImageOps, UnidentifiedImageError
+from sqlalchemy import update
+
+from app.extensions import db
+from app.models.media import MediaAsset
+from app.utils.media import get_media_store, register_asset
+
+# Longest edge in pixels of each variant
+DEFAULT_VARIANTS = {'thumb': 160, 'card': 480, 'full': 1600}
+FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+FILE_EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+CONTENT_TYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+ProcessedImage = namedtuple('ProcessedImage', ['content_hash', 'urls', 'pending'])
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class ImageProcessingError(ValueError):
+    """The upload is not an image Pillow can decode or is too large"""
+
+
+def _reset_executor():
+    """Forked children do not inherit the parent's pool threads"""
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_executor)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = current_app.config.get('IMAGE_WORKERS') or min(4, os.cpu_count() or 1)
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image')
+    return _executor
+
+
+def content_hash(data):
+    """Content hash used as the file name of every variant"""
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def variant_filename(digest, variant, fmt):
+    return f"{digest}_{variant}.{FILE_EXTENSIONS[fmt]}"
+
+
+def _open(data, max_pixels):
+    try:
+        image = Image.open(io.BytesIO(data))
+    except Image.DecompressionBombError:
+        raise ImageProcessingError('Image dimensions are too large')
+    except (UnidentifiedImageError, OSError):
+        raise ImageProcessingError('File is not a valid image')
+    width, height = image.size
+    if max_pixels and width * height > max_pixels:
+        raise ImageProcessingError('Image dimensions are too large')
+    return image
+
+
+def inspect_image(data, max_pixels=None):
+    """Check that data is a decodable image without decoding the pixels"""
+    image = _open(data, max_pixels)
+    if image.format not in ('JPEG', 'PNG', 'GIF', 'WEBP'):
+        raise ImageProcessingError(f'Unsupported image format: {image.format}')
+    return image.format, image.size
+
+
+def _flatten(image):
+    """JPEG has no alpha channel: composite on a white background"""
+    if image.mode in ('RGBA', 'LA'):
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render_variants(data, variants, quality=82, max_pixels=None):
+    """
+    Decode an image once and encode every variant
+
+    Returns:
+        dict: {(variant, fmt): encoded bytes}
+    """
+    largest = max(variants.values())
+    image = _open(data, max_pixels)
+    # JPEG: let the decoder scale down by 1/2, 1/4 or 1/8 while decoding
+    image.draft('RGB', (largest, largest))
+    try:
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    except Image.DecompressionBombError:
+        raise ImageProcessingError('Image dimensions are too large')
+    except OSError:
+        raise ImageProcessingError('File is not a valid image')
+
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    rendered = {}
+    source = image
+    for variant, edge in sorted(variants.items(), key=lambda item: -item[1]):
+        resized = source.copy()
+        resized.thumbnail((edge, edge), Image.LANCZOS)
+        source = resized
+
+        buffer = io.BytesIO()
+        resized.save(buffer, FORMATS['webp'], quality=quality, method=4)
+        rendered[(variant, 'webp')] = buffer.getvalue()
+
+        buffer = io.BytesIO()
+        _flatten(resized).save(buffer, FORMATS['jpeg'], quality=quality, optimize=True, progressive=True)
+        rendered[(variant, 'jpeg')] = buffer.getvalue()
+    return rendered
+
+
+def _process(data, store, keys, variants, quality, max_pixels):
+    """Render and store every variant; returns the total stored size"""
+    rendered = render_variants(data, variants, quality, max_pixels)
+    size = 0
+    for (variant, fmt), encoded in rendered.items():
+        store.put(keys[(variant, fmt)], encoded, CONTENT_TYPES[fmt])
+        size += len(encoded)
+    return size
+
+
+def process_upload(data, kind):
+    """
+    Generate and store the variants of an uploaded image
+
+    The asset is registered with no reference; the caller points a record at
+    one of the URLs with ``replace_reference``.
+
+    Args:
+        data: Uploaded file bytes
+        kind: Upload sub-folder ('avatars', 'services')
+
+    Returns:
+        ProcessedImage with urls = {variant: {'webp': url, 'jpeg': url}}.
+        ``pending`` is True when processing did not finish within
+        ``IMAGE_PROCESS_TIMEOUT``: the files do not exist yet, so callers must
+        not point a record at the URLs. Processing goes on in the background
+        and the same upload returns at once when retried.
+
+    Raises:
+        ImageProcessingError: if the upload is not a supported image
+    """
+    config = current_app.config
+    variants = config.get('IMAGE_VARIANTS') or DEFAULT_VARIANTS
+    quality = config.get('IMAGE_QUALITY', 82)
+    max_pixels = config.get('IMAGE_MAX_PIXELS')
+
+    inspect_image(data, max_pixels)
+
+    store = get_media_store()
+    digest = content_hash(data)
+    keys = {
+        (variant, fmt): f"{kind}/{variant_filename(digest, variant, fmt)}"
+        for variant in variants for fmt in FORMATS
+    }
+    urls = {variant: {fmt: store.url(keys[(variant, fmt)]) for fmt in FORMATS} for variant in variants}
+
+    # Register first: from here on the garbage collector leaves the files alone
+    register_asset(kind, digest, keys.values(), 0)
+
+    # Same content already processed: nothing to do
+    if all(store.exists(key) for key in keys.values()):
+        return ProcessedImage(digest, urls, False)
+
+    future = _get_executor().submit(_process, data, store, keys, variants, quality, max_pixels)
+    try:
+        size = future.result(timeout=config.get('IMAGE_PROCESS_TIMEOUT', 10))
+    except FutureTimeoutError:
+        logger = current_app.logger
+        future.add_done_callback(
+            lambda f: f.exception() and logger.error(f"Image processing failed for {digest}: {f.exception()}")
+        )
+        return ProcessedImage(digest, urls, True)
+
+    db.session.execute(
+        update(MediaAsset).where(
+            MediaAsset.kind == kind, MediaAsset.content_hash == digest
+        ).values(size_bytes=size)
+    )
+    return ProcessedImage(digest, urls, False)
@@ -0,0 +1,397 @@
+"""
+Media store - where uploaded files live and how they are served
+
+``get_media_store()`` returns the backend selected by ``MEDIA_STORAGE``:
+
+- ``local``: files under ``UPLOAD_FOLDER``, served by the ``/media/<key>`` route
+  with ``send_file`` (ETag, conditional and range requests).
+- ``s3``: an S3-compatible bucket (AWS, MinIO, or a local ``moto_server`` for
+  testing via ``MEDIA_S3_ENDPOINT_URL``). Needs ``boto3``. Files are served
+  from ``MEDIA_PUBLIC_URL`` (bucket/CDN) when set, otherwise proxied by the
+  same route.
+
+Keys look like ``avatars/<content hash>_<variant>.webp``. Because a key never
+changes content, content-addressed keys are served with
+``Cache-Control: public, max-age=31536000, immutable``.
+
+References from database records are counted per asset (``MediaAsset``):
+``replace_reference`` / ``release_reference`` are called in the same
+transaction as the record update, and ``collect_garbage`` deletes assets no
+longer referenced after a grace period (``flask media gc``).
+"""
+
+import io
+import mimetypes
+import os
+import re
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app, send_file
+from sqlalchemy import event, update, select, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+from app.extensions import db
+from app.models.media import MediaAsset
+from app.utils.db_routing import RoutingSession
+
+# One year: the longest max-age browsers honour
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# <kind>/<32 hex content hash>_<variant>.<ext>
+_ASSET_KEY = re.compile(r'^(?P<kind>[a-z0-9_-]+)/(?P<digest>[0-9a-f]{32})_[a-z0-9]+\.[a-z0-9]+$')
+
+LEGACY_URL_PREFIX = '/static/uploads/'
+
+# session.info key: legacy files to delete once the transaction commits
+PENDING_DELETES_KEY = 'media_pending_deletes'
+
+AssetRef = namedtuple('AssetRef', ['kind', 'content_hash'])
+
+
+def parse_asset_key(key):
+    """Return AssetRef for a content-addressed key, None for legacy/unknown keys"""
+    match = _ASSET_KEY.match(key or '')
+    if not match:
+        return None
+    return AssetRef(match.group('kind'), match.group('digest'))
+
+
+def guess_content_type(key):
+    return mimetypes.guess_type(key)[0] or 'application/octet-stream'
+
+
+class MediaStore:
+    """Backend interface; keys are relative paths such as 'avatars/<hash>_thumb.webp'"""
+
+    def __init__(self, url_prefix):
+        self.url_prefix = url_prefix.rstrip('/')
+
+    def put(self, key, data, content_type=None):
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def send(self, key, max_age):
+        """Flask response for a GET of key (raises NotFound)"""
+        raise NotImplementedError
+
+    def url(self, key):
+        return f"{self.url_prefix}/{key}"
+
+    def key_for_url(self, url):
+        """Key of a URL produced by this store (or a legacy /static/uploads URL), else None"""
+        if not url:
+            return None
+        for prefix in (self.url_prefix + '/', LEGACY_URL_PREFIX):
+            if url.startswith(prefix):
+                return url[len(prefix):]
+        return None
+
+
+class LocalMediaStore(MediaStore):
+    """Files on local disk under root"""
+
+    def __init__(self, root, url_prefix):
+        super().__init__(url_prefix)
+        self.root = os.path.abspath(root)
+
+    def _path(self, key):
+        path = safe_join(self.root, key)
+        if path is None:
+            raise NotFound()
+        return path
+
+    def put(self, key, data, content_type=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def exists(self, key):
+        return os.path.isfile(self._path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def send(self, key, max_age):
+        path = self._path(key)
+        if not os.path.isfile(path):
+            raise NotFound()
+        asset = parse_asset_key(key)
+        return send_file(
+            path,
+            mimetype=guess_content_type(key),
+            conditional=True,
+            # The content hash is a strong validator; legacy files get Werkzeug's mtime/size ETag
+            etag=os.path.basename(key) if asset else True,
+            max_age=max_age
+        )
+
+
+class S3MediaStore(MediaStore):
+    """Objects in an S3-compatible bucket"""
+
+    def __init__(self, bucket, url_prefix, public_url=None, endpoint_url=None, region=None,
+                 access_key=None, secret_key=None):
+        super().__init__(url_prefix)
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("MEDIA_STORAGE='s3' requires the boto3 package")
+        self._client_error = ClientError
+        self.bucket = bucket
+        self.public_url = public_url.rstrip('/') if public_url else None
+        self.client = boto3.client(
+            's3', endpoint_url=endpoint_url, region_name=region,
+            aws_access_key_id=access_key, aws_secret_access_key=secret_key
+        )
+
+    def _is_missing(self, error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def put(self, key, data, content_type=None):
+        extra = {}
+        if parse_asset_key(key):
+            extra['CacheControl'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+        self.client.put_object(
+            Bucket=self.bucket, Key=key, Body=data,
+            ContentType=content_type or guess_content_type(key), **extra
+        )
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except self._client_error as e:
+            if self._is_missing(e):
+                return False
+            raise
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def send(self, key, max_age):
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=key)
+        except self._client_error as e:
+            if self._is_missing(e):
+                raise NotFound()
+            raise
+        # Variants are small: buffer them so send_file can answer range requests
+        body = io.BytesIO(obj['Body'].read())
+        return send_file(
+            body,
+            mimetype=obj.get('ContentType') or guess_content_type(key),
+            conditional=True,
+            etag=obj.get('ETag', '').strip('"') or True,
+            last_modified=obj.get('LastModified'),
+            max_age=max_age
+        )
+
+    def url(self, key):
+        if self.public_url:
+            return f"{self.public_url}/{key}"
+        return super().url(key)
+
+    def key_for_url(self, url):
+        if self.public_url and url and url.startswith(self.public_url + '/'):
+            return url[len(self.public_url) + 1:]
+        return super().key_for_url(url)
+
+
+def create_media_store(config):
+    """Build the media store configured for an app"""
+    url_prefix = config.get('MEDIA_URL_PREFIX', '/media')
+    storage = config.get('MEDIA_STORAGE', 'local')
+    if storage == 's3':
+        return S3MediaStore(
+            bucket=config['MEDIA_S3_BUCKET'],
+            url_prefix=url_prefix,
+            public_url=config.get('MEDIA_PUBLIC_URL'),
+            endpoint_url=config.get('MEDIA_S3_ENDPOINT_URL'),
+            region=config.get('MEDIA_S3_REGION'),
+            access_key=config.get('MEDIA_S3_ACCESS_KEY'),
+            secret_key=config.get('MEDIA_S3_SECRET_KEY')
+        )
+    if storage == 'local':
+        return LocalMediaStore(config['UPLOAD_FOLDER'], url_prefix)
+    raise RuntimeError(f"Unknown MEDIA_STORAGE: {storage}")
+
+
+def get_media_store():
+    """Media store of the current app (created once per app)"""
+    store = current_app.extensions.get('media_store')
+    if store is None:
+        store = current_app.extensions['media_store'] = create_media_store(current_app.config)
+    return store
+
+
+# ===== Reference counting =====
+
+def register_asset(kind, digest, keys, size_bytes):
+    """
+    Record an uploaded asset (0 references) and refresh its grace period
+
+    Commits, so that a concurrent garbage collection either finishes first
+    (the caller then finds the files missing and writes them again) or sees
+    the refreshed updated_at and skips the asset.
+    """
+    table = MediaAsset.__table__
+    stmt = pg_insert(table).values(
+        kind=kind, content_hash=digest, keys=list(keys), size_bytes=size_bytes,
+        ref_count=0, created_at=datetime.utcnow(), updated_at=datetime.utcnow()
+    )
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[table.c.kind, table.c.content_hash],
+        set_={'keys': stmt.excluded['keys'], 'updated_at': stmt.excluded.updated_at}
+    ))
+    db.session.commit()
+
+
+def _change_refs(url, delta):
+    asset = parse_asset_key(get_media_store().key_for_url(url))
+    if asset is None:
+        return False
+    table = MediaAsset.__table__
+    result = db.session.execute(
+        update(table).where(
+            table.c.kind == asset.kind,
+            table.c.content_hash == asset.content_hash
+        ).values(
+            ref_count=func.greatest(table.c.ref_count + delta, 0),
+            updated_at=datetime.utcnow()
+        )
+    )
+    return result.rowcount > 0
+
+
+def release_reference(url):
+    """
+    Drop one reference to the file at url (in the caller's transaction)
+
+    Legacy uploads that are not content addressed belong to a single record
+    and are deleted when the transaction commits; a rollback keeps them, as
+    the record still points at them.
+    """
+    if not url:
+        return
+    if _change_refs(url, -1):
+        return
+    key = get_media_store().key_for_url(url)
+    if key and parse_asset_key(key) is None:
+        db.session.info.setdefault(PENDING_DELETES_KEY, []).append(key)
+
+
+def _after_commit(session):
+    keys = session.info.pop(PENDING_DELETES_KEY, None)
+    if not keys:
+        return
+    store = get_media_store()
+    for key in keys:
+        try:
+            store.delete(key)
+            current_app.logger.info(f"Deleted legacy upload {key}")
+        except Exception as e:
+            current_app.logger.warning(f"Could not delete legacy upload {key}: {str(e)}")
+
+
+def _after_soft_rollback(session, previous_transaction):
+    # Only the outermost rollback undoes the releases; a failed savepoint does not
+    if previous_transaction.nested:
+        return
+    session.info.pop(PENDING_DELETES_KEY, None)
+
+
+def init_media(app):
+    """Delete released legacy uploads once their transaction commits (called by create_app)"""
+    if not event.contains(RoutingSession, 'after_commit', _after_commit):
+        event.listen(RoutingSession, 'after_commit', _after_commit)
+        event.listen(RoutingSession, 'after_soft_rollback', _after_soft_rollback)
+
+
+def replace_reference(old_url, new_url):
+    """Move a record's reference from old_url to new_url (in the caller's transaction)"""
+    if old_url == new_url:
+        return
+    if new_url:
+        _change_refs(new_url, 1)
+    release_reference(old_url)
+
+
+def collect_garbage(grace_seconds=None, batch_size=200):
+    """
+    Delete assets that have had no references for the grace period
+
+    Rows are locked with SKIP LOCKED so several collectors (or workers) can
+    run at once; files are deleted before the rows are, so an upload racing
+    with the collector waits on the row lock and then re-creates the files.
+
+    Returns:
+        tuple: (assets deleted, bytes freed)
+    """
+    if grace_seconds is None:
+        grace_seconds = current_app.config.get('MEDIA_GC_GRACE_SECONDS', 24 * 3600)
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    store = get_media_store()
+
+    deleted = freed = 0
+    while True:
+        assets = db.session.execute(
+            select(MediaAsset).where(
+                MediaAsset.ref_count <= 0,
+                MediaAsset.updated_at < cutoff
+            ).limit(batch_size).with_for_update(skip_locked=True)
+        ).scalars().all()
+        if not assets:
+            db.session.commit()
+            break
+        for asset in assets:
+            for key in asset.keys:
+                store.delete(key)
+            freed += asset.size_bytes or 0
+            db.session.delete(asset)
+        db.session.commit()
+        deleted += len(assets)
+    return deleted, freed
+
+
+def recount_references(urls):
+    """
+    Recompute every ref_count from the URLs currently stored in records
+
+    Args:
+        urls: Iterable of every media URL referenced by a record
+
+    Returns:
+        int: Number of assets whose count changed
+    """
+    store = get_media_store()
+    counts = {}
+    for url in urls:
+        asset = parse_asset_key(store.key_for_url(url))
+        if asset:
+            counts[asset] = counts.get(asset, 0) + 1
+
+    changed = 0
+    for asset in MediaAsset.query.with_for_update().all():
+        ref_count = counts.get(AssetRef(asset.kind, asset.content_hash), 0)
+        if asset.ref_count != ref_count:
+            asset.ref_count = ref_count
+            changed += 1
+    db.session.commit()
+    return changed
@@ -0,0 +1,522 @@
+"""
+Outbound email/SMS
+
+Requests never wait for a provider: ``send_email`` / ``send_sms`` add an
+``OutboundMessage`` to the caller's session (it exists only if that
+transaction commits) and return. Message workers drain the table:
+
+    flask messages work --threads 4
+
+Each worker thread claims up to ``MESSAGE_BATCH_SIZE`` due messages of a
+channel with ``FOR UPDATE SKIP LOCKED`` (so any number of worker processes
+can run), sends them over its own long-lived provider connection and records
+the outcome of the batch. Failed sends are retried with exponential backoff
+and jitter up to ``MESSAGE_MAX_ATTEMPTS`` attempts; permanent errors (refused
+recipient, HTTP 4xx) fail at once. ``MESSAGE_RATE_LIMITS`` caps the sends per
+second of each channel in a worker process.
+
+Providers (``MESSAGE_EMAIL_PROVIDER``, ``MESSAGE_SMS_PROVIDER``):
+
+- ``console``: writes the message to the log (development);
+- ``smtp``: any SMTP server, locally ``python -m aiosmtpd -n -l localhost:8025``;
+- ``http``: JSON POST to ``SMS_HTTP_URL`` (``Authorization: Bearer SMS_HTTP_TOKEN``).
+
+A message can be sent twice if a worker dies after the provider accepted it
+and before the row was marked sent (at-least-once delivery).
+
+With ``MESSAGE_EMBEDDED_WORKERS`` > 0 the web process runs that many worker
+threads itself, woken up as soon as a commit queued messages.
+"""
+
+import os
+import random
+import smtplib
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+import requests
+from flask import current_app
+from sqlalchemy import event, select, insert, update, delete, func
+
+from app.extensions import db
+from app.models.message import OutboundMessage
+from app.utils.db_routing import RoutingSession
+
+CHANNELS = ('email', 'sms')
+
+# Set after a commit that queued messages, wakes up the embedded workers
+WAKE = threading.Event()
+
+Claimed = namedtuple('Claimed', ['id', 'channel', 'recipient', 'subject', 'body', 'attempts'])
+
+
+class SendError(Exception):
+    """The provider did not accept a message; permanent errors are not retried"""
+
+    def __init__(self, message, permanent=False, retry_after=None):
+        super().__init__(message)
+        self.permanent = permanent
+        self.retry_after = retry_after
+
+
+# ===== Queueing =====
+
+def enqueue(channel, recipient, body, subject=None, session=None):
+    """Queue a message in the caller's transaction"""
+    if channel not in CHANNELS:
+        raise ValueError(f"Unknown channel: {channel}")
+    session = session or db.session
+    message = OutboundMessage(
+        channel=channel, recipient=recipient, subject=subject, body=body,
+        status='pending', attempts=0, next_attempt_at=datetime.utcnow()
+    )
+    session.add(message)
+    session.info['outbound_messages'] = True
+    return message
+
+
+def enqueue_many(messages, session=None):
+    """Queue (channel, recipient, subject, body) tuples with one multi-row INSERT; the caller commits"""
+    session = session or db.session
+    now = datetime.utcnow()
+    rows = [{
+        'id': uuid.uuid4(), 'channel': channel, 'recipient': recipient, 'subject': subject, 'body': body,
+        'status': 'pending', 'attempts': 0, 'next_attempt_at': now, 'created_at': now,
+    } for channel, recipient, subject, body in messages]
+    if rows:
+        session.execute(insert(OutboundMessage.__table__), rows)
+        session.info['outbound_messages'] = True
+    return len(rows)
+
+
+def send_email(recipient, subject, body, session=None):
+    return enqueue('email', recipient, body, subject=subject, session=session)
+
+
+def send_sms(recipient, body, session=None):
+    return enqueue('sms', recipient, body, session=session)
+
+
+def _after_commit(session):
+    if session.info.pop('outbound_messages', False):
+        WAKE.set()
+
+
+def _after_soft_rollback(session, previous_transaction):
+    # Messages queued before a failed savepoint are still committed with the outer transaction
+    if previous_transaction.nested:
+        return
+    session.info.pop('outbound_messages', None)
+
+
+# ===== Providers =====
+
+class Provider:
+    """Sends the messages of one channel; one instance per worker thread, so connections are reused"""
+
+    def send(self, message):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class ConsoleProvider(Provider):
+    """Writes messages to the log instead of sending them"""
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def send(self, message):
+        subject = f" [{message.subject}]" if message.subject else ''
+        self.logger.info(f"{message.channel.upper()} -> {message.recipient}{subject}: {message.body}")
+
+
+class SmtpProvider(Provider):
+    """SMTP with one connection kept open across batches"""
+
+    def __init__(self, host, port, sender, username=None, password=None, use_tls=False, use_ssl=False,
+                 timeout=10, idle_timeout=60):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._smtp = None
+        self._last_used = 0
+
+    def _connection(self):
+        # Servers drop idle clients; reconnect instead of finding out on the next send
+        if self._smtp is not None and time.monotonic() - self._last_used > self.idle_timeout:
+            self.close()
+        if self._smtp is None:
+            smtp_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+            smtp = smtp_class(self.host, self.port, timeout=self.timeout)
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            self._smtp = smtp
+        return self._smtp
+
+    def send(self, message):
+        email = EmailMessage()
+        email['From'] = self.sender
+        email['To'] = message.recipient
+        email['Subject'] = message.subject or ''
+        email.set_content(message.body)
+
+        for attempt in range(2):
+            try:
+                self._connection().send_message(email)
+                self._last_used = time.monotonic()
+                return
+            except smtplib.SMTPServerDisconnected as e:
+                # Connection closed by the server while idle: retry once on a new one
+                self.close()
+                if attempt:
+                    raise SendError(f"SMTP server disconnected: {str(e)}")
+            except smtplib.SMTPRecipientsRefused as e:
+                codes = [code for code, _ in e.recipients.values()]
+                raise SendError(f"Recipient refused: {e.recipients}", permanent=all(code >= 500 for code in codes))
+            except smtplib.SMTPResponseException as e:
+                raise SendError(f"SMTP {e.smtp_code}: {e.smtp_error!r}", permanent=e.smtp_code >= 500)
+            except (OSError, smtplib.SMTPException) as e:
+                self.close()
+                raise SendError(f"SMTP error: {str(e)}")
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (OSError, smtplib.SMTPException):
+                self._smtp.close()
+            self._smtp = None
+
+
+class HttpSmsProvider(Provider):
+    """SMS gateway taking {"to", "message", "sender"} as JSON; keep-alive connections"""
+
+    def __init__(self, url, token=None, sender=None, timeout=10):
+        self.url = url
+        self.sender = sender
+        self.timeout = timeout
+        self.session = requests.Session()
+        if token:
+            self.session.headers['Authorization'] = f'Bearer {token}'
+
+    def send(self, message):
+        try:
+            response = self.session.post(self.url, json={
+                'to': message.recipient,
+                'message': message.body,
+                'sender': self.sender
+            }, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise SendError(f"SMS gateway error: {str(e)}")
+        if response.status_code < 300:
+            return
+        retry_after = response.headers.get('Retry-After')
+        raise SendError(
+            f"SMS gateway HTTP {response.status_code}: {response.text[:200]}",
+            permanent=400 <= response.status_code < 500 and response.status_code not in (408, 429),
+            retry_after=int(retry_after) if retry_after and retry_after.isdigit() else None
+        )
+
+    def close(self):
+        self.session.close()
+
+
+def create_provider(channel, config, logger):
+    """Provider configured for a channel"""
+    if channel == 'email':
+        name = config.get('MESSAGE_EMAIL_PROVIDER', 'console')
+        if name == 'smtp':
+            return SmtpProvider(
+                host=config['SMTP_HOST'],
+                port=config.get('SMTP_PORT', 25),
+                sender=config['SMTP_FROM'],
+                username=config.get('SMTP_USERNAME'),
+                password=config.get('SMTP_PASSWORD'),
+                use_tls=config.get('SMTP_USE_TLS', False),
+                use_ssl=config.get('SMTP_USE_SSL', False),
+                timeout=config.get('SMTP_TIMEOUT', 10)
+            )
+    else:
+        name = config.get('MESSAGE_SMS_PROVIDER', 'console')
+        if name == 'http':
+            return HttpSmsProvider(
+                url=config['SMS_HTTP_URL'],
+                token=config.get('SMS_HTTP_TOKEN'),
+                sender=config.get('SMS_SENDER'),
+                timeout=config.get('SMS_HTTP_TIMEOUT', 10)
+            )
+    if name == 'console':
+        return ConsoleProvider(logger)
+    raise RuntimeError(f"Unknown {channel} provider: {name}")
+
+
+class RateLimiter:
+    """Token bucket shared by the worker threads of a process (rate 0 = unlimited)"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def parse_rate_limits(value):
+    """'email=20,sms=5' -> {'email': 20.0, 'sms': 5.0}"""
+    limits = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            channel, rate = item.split('=', 1)
+            limits[channel.strip()] = float(rate)
+    return limits
+
+
+# ===== Dispatch =====
+
+def backoff(attempts, base, cap):
+    """Seconds before retry number `attempts`: exponential, capped, with jitter"""
+    return min(cap, base * 2 ** (attempts - 1)) * random.uniform(0.5, 1)
+
+
+def claim(channel, limit, lease_seconds):
+    """Lock and lease up to limit due messages of a channel (commits)"""
+    now = datetime.utcnow()
+    table = OutboundMessage.__table__
+    due = select(table.c.id).where(
+        table.c.channel == channel,
+        table.c.status.in_(('pending', 'sending')),
+        table.c.next_attempt_at <= now
+    ).order_by(table.c.next_attempt_at).limit(limit).with_for_update(skip_locked=True)
+    rows = db.session.execute(
+        update(table).where(table.c.id.in_(due.scalar_subquery())).values(
+            status='sending',
+            attempts=table.c.attempts + 1,
+            next_attempt_at=now + timedelta(seconds=lease_seconds)
+        ).returning(table.c.id, table.c.channel, table.c.recipient, table.c.subject, table.c.body, table.c.attempts)
+    ).all()
+    db.session.commit()
+    return [Claimed(*row) for row in rows]
+
+
+def record_results(sent_ids, failures, config):
+    """Mark sent messages and schedule retries of the failed ones (commits)"""
+    now = datetime.utcnow()
+    table = OutboundMessage.__table__
+    if sent_ids:
+        db.session.execute(
+            update(table).where(table.c.id.in_(sent_ids)).values(status='sent', sent_at=now, last_error=None)
+        )
+    max_attempts = config.get('MESSAGE_MAX_ATTEMPTS', 6)
+    for message, error in failures:
+        if error.permanent or message.attempts >= max_attempts:
+            values = {'status': 'failed'}
+        else:
+            delay = error.retry_after or backoff(
+                message.attempts, config.get('MESSAGE_RETRY_BASE_SECONDS', 30), config.get('MESSAGE_RETRY_MAX_SECONDS', 3600)
+            )
+            values = {'status': 'pending', 'next_attempt_at': now + timedelta(seconds=delay)}
+        db.session.execute(update(table).where(table.c.id == message.id).values(last_error=str(error)[:1000], **values))
+    db.session.commit()
+
+
+class MessageWorker:
+    """Threads draining the outbox; start()/stop() for a long-running worker, drain() for one pass"""
+
+    def __init__(self, app, threads=None, channels=CHANNELS):
+        self.app = app
+        self.config = app.config
+        self.threads = threads or self.config.get('MESSAGE_WORKER_THREADS', 4)
+        self.channels = tuple(channels)
+        rates = parse_rate_limits(self.config.get('MESSAGE_RATE_LIMITS'))
+        self.limiters = {channel: RateLimiter(rates.get(channel, 0)) for channel in CHANNELS}
+        self._stop = threading.Event()
+        self._threads = []
+
+    def process(self, providers):
+        """Claim, send and record one batch per channel; returns the number of messages handled"""
+        handled = 0
+        for channel in self.channels:
+            batch = claim(channel, self.config.get('MESSAGE_BATCH_SIZE', 50), self.config.get('MESSAGE_LEASE_SECONDS', 300))
+            if not batch:
+                continue
+            provider = providers.get(channel)
+            if provider is None:
+                try:
+                    provider = providers[channel] = create_provider(channel, self.config, self.app.logger)
+                except Exception as e:
+                    # Misconfigured provider: retry the claimed batch with backoff instead of
+                    # leaving it in 'sending', until MESSAGE_MAX_ATTEMPTS fails it
+                    error = SendError(f"{channel} provider unavailable: {type(e).__name__}: {str(e)}")
+                    record_results([], [(message, error) for message in batch], self.config)
+                    self.app.logger.error(f"Sending {channel} skipped ({len(batch)} messages): {str(error)}")
+                    handled += len(batch)
+                    continue
+
+            sent_ids, failures = [], []
+            for message in batch:
+                self.limiters[channel].acquire()
+                try:
+                    provider.send(message)
+                    sent_ids.append(message.id)
+                except SendError as e:
+                    failures.append((message, e))
+                except Exception as e:
+                    failures.append((message, SendError(f"{type(e).__name__}: {str(e)}")))
+            record_results(sent_ids, failures, self.config)
+
+            for message, error in failures:
+                self.app.logger.warning(
+                    f"Sending {channel} to {message.recipient} failed (attempt {message.attempts}): {str(error)}"
+                )
+            handled += len(batch)
+        return handled
+
+    def drain(self):
+        """Send everything due now in the current app context"""
+        providers = {}
+        total = 0
+        try:
+            while True:
+                handled = self.process(providers)
+                if not handled:
+                    return total
+                total += handled
+        finally:
+            for provider in providers.values():
+                provider.close()
+
+    def _run(self):
+        poll_interval = self.config.get('MESSAGE_POLL_INTERVAL', 1.0)
+        providers = {}
+        with self.app.app_context():
+            try:
+                while not self._stop.is_set():
+                    try:
+                        handled = self.process(providers)
+                    except Exception as e:
+                        db.session.rollback()
+                        self.app.logger.error(f"Message worker error: {str(e)}")
+                        handled = 0
+                    if not handled and WAKE.wait(poll_interval):
+                        WAKE.clear()
+            finally:
+                for provider in providers.values():
+                    provider.close()
+                db.session.remove()
+
+    def start(self):
+        for i in range(self.threads):
+            thread = threading.Thread(target=self._run, name=f'message-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=30):
+        """Let every thread finish its current batch"""
+        self._stop.set()
+        WAKE.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def is_alive(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+
+# ===== Maintenance =====
+
+def queue_stats():
+    """{channel: {status: count}} and the age in seconds of the oldest due message"""
+    table = OutboundMessage.__table__
+    stats = {channel: {} for channel in CHANNELS}
+    for channel, status, count in db.session.execute(
+        select(table.c.channel, table.c.status, func.count()).group_by(table.c.channel, table.c.status)
+    ):
+        stats.setdefault(channel, {})[status] = count
+    oldest = db.session.execute(
+        select(func.min(table.c.next_attempt_at)).where(
+            table.c.status.in_(('pending', 'sending')), table.c.next_attempt_at <= datetime.utcnow()
+        )
+    ).scalar()
+    return stats, (datetime.utcnow() - oldest).total_seconds() if oldest else 0
+
+
+def retry_failed(channel=None):
+    """Queue failed messages again with a fresh attempt count"""
+    table = OutboundMessage.__table__
+    stmt = update(table).where(table.c.status == 'failed')
+    if channel:
+        stmt = stmt.where(table.c.channel == channel)
+    result = db.session.execute(stmt.values(status='pending', attempts=0, next_attempt_at=datetime.utcnow()))
+    db.session.commit()
+    return result.rowcount
+
+
+def purge_sent(older_than_days, batch_size=5000):
+    """Delete messages sent more than older_than_days ago, batch_size rows per transaction"""
+    table = OutboundMessage.__table__
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    deleted = 0
+    while True:
+        batch = select(table.c.id).where(table.c.status == 'sent', table.c.sent_at < cutoff).limit(batch_size)
+        result = db.session.execute(delete(table).where(table.c.id.in_(batch.scalar_subquery())))
+        db.session.commit()
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
+
+
+# ===== App wiring =====
+
+_embedded_pid = None
+_embedded_lock = threading.Lock()
+
+
+def _start_embedded_workers():
+    """Start (once per process) the MESSAGE_EMBEDDED_WORKERS worker threads"""
+    global _embedded_pid
+    if _embedded_pid == os.getpid():
+        return
+    with _embedded_lock:
+        if _embedded_pid == os.getpid():
+            return
+        _embedded_pid = os.getpid()
+        app = current_app._get_current_object()
+        MessageWorker(app, threads=app.config['MESSAGE_EMBEDDED_WORKERS']).start()
+
+
+def init_messaging(app):
+    """Wake up workers on commit and start the embedded workers (called by create_app)"""
+    if not event.contains(RoutingSession, 'after_commit', _after_commit):
+        event.listen(RoutingSession, 'after_commit', _after_commit)
+        event.listen(RoutingSession, 'after_soft_rollback', _after_soft_rollback)
+    if app.config.get('MESSAGE_EMBEDDED_WORKERS'):
+        # On the first request, so that every forked gunicorn worker starts its own threads
+        app.before_request(_start_embedded_workers)
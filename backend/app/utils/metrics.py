@@ -0,0 +1,428 @@
+"""
+Request and database metrics in the Prometheus text format
+
+``init_metrics(app)`` (called by create_app) records, per Flask endpoint
+(``blueprint.view``, or ``unmatched`` for 404s):
+
+- ``http_requests_total`` by method and status code
+- ``http_request_duration_seconds`` latency histogram
+- ``http_requests_in_flight``
+- ``db_queries_total`` / ``db_query_duration_seconds``, from the SQLAlchemy
+  ``before_cursor_execute`` / ``after_cursor_execute`` events
+- ``http_request_db_queries``: statements per request
+
+and the connection pool state of ``app.utils.db_pool``. ``GET /metrics``
+renders them; it needs ``Authorization: Bearer <METRICS_TOKEN>`` when
+``METRICS_TOKEN`` is set.
+
+Metrics live in the worker process. With several gunicorn workers set
+``METRICS_MULTIPROC_DIR``: a thread in every worker writes its values to
+``<dir>/<pid>.json`` every ``METRICS_FLUSH_INTERVAL`` seconds and /metrics
+adds up all files. When a worker exits, gunicorn.conf.py writes its last
+values and ``mark_process_dead`` folds its counters into ``archive.json``.
+
+Latency of streamed responses (exports) covers the time until the response
+starts, not the whole download.
+"""
+
+import fcntl
+import json
+import os
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+from app.extensions import db
+from app.utils.db_pool import WAIT_BUCKETS, pool_snapshots
+
+# Seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+# Statements per request
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+UNMATCHED_ENDPOINT = 'unmatched'
+ARCHIVE_FILE = 'archive.json'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Metric:
+    """A metric family; values are kept per tuple of label values"""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def dump(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """Values are [count per bucket (not cumulative)..., +Inf count, sum]"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+                    break
+            else:
+                values[len(self.buckets)] += 1
+            values[-1] += value
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        """Plain dict of every value (what a worker writes to its file)"""
+        return {metric.name: metric.dump() for metric in self.metrics}
+
+    def reset(self):
+        for metric in self.metrics:
+            metric.reset()
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    'http_requests_total', 'HTTP requests', ('endpoint', 'method', 'status')))
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'HTTP request latency', ('endpoint', 'method')))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    'http_requests_in_flight', 'HTTP requests being processed', ('endpoint',)))
+DB_QUERIES = REGISTRY.register(Counter(
+    'db_queries_total', 'SQL statements executed', ('endpoint',)))
+DB_QUERY_LATENCY = REGISTRY.register(Histogram(
+    'db_query_duration_seconds', 'SQL statement execution time', ('endpoint',), QUERY_BUCKETS))
+REQUEST_QUERIES = REGISTRY.register(Histogram(
+    'http_request_db_queries', 'SQL statements per HTTP request', ('endpoint',), QUERY_COUNT_BUCKETS))
+POOL_IN_USE = REGISTRY.register(Gauge(
+    'db_pool_connections_in_use', 'Connections checked out of the pool', ('engine',)))
+POOL_IDLE = REGISTRY.register(Gauge(
+    'db_pool_connections_idle', 'Idle connections in the pool', ('engine',)))
+POOL_OVERFLOW = REGISTRY.register(Gauge(
+    'db_pool_overflow_connections', 'Overflow connections open', ('engine',)))
+POOL_TIMEOUTS = REGISTRY.register(Gauge(
+    'db_pool_timeouts_total', 'Pool checkouts that timed out', ('engine',)))
+POOL_WAIT = REGISTRY.register(Histogram(
+    'db_pool_checkout_wait_seconds', 'Time waiting for a pooled connection', ('engine',), WAIT_BUCKETS))
+
+# Gauges describe live processes only; counters/histograms of exited workers are kept
+LIVE_ONLY = {IN_FLIGHT.name, POOL_IN_USE.name, POOL_IDLE.name, POOL_OVERFLOW.name}
+# Pool counters come from app.utils.db_pool; exported as counters
+COUNTER_GAUGES = {POOL_TIMEOUTS.name}
+
+
+def _endpoint():
+    return request.endpoint or UNMATCHED_ENDPOINT
+
+
+# ===== Request hooks =====
+
+def _before_request():
+    g._metrics_started = time.perf_counter()
+    g._metrics_queries = 0
+    g._metrics_endpoint = _endpoint()
+    g._metrics_recorded = False
+    IN_FLIGHT.inc(endpoint=g._metrics_endpoint)
+
+
+def _record(status):
+    if getattr(g, '_metrics_recorded', True):
+        return
+    g._metrics_recorded = True
+    endpoint = g._metrics_endpoint
+    REQUESTS.inc(endpoint=endpoint, method=request.method, status=status)
+    REQUEST_LATENCY.observe(time.perf_counter() - g._metrics_started, endpoint=endpoint, method=request.method)
+    REQUEST_QUERIES.observe(g._metrics_queries, endpoint=endpoint)
+
+
+def _after_request(response):
+    _record(response.status_code)
+    return response
+
+
+def _teardown_request(error):
+    if not hasattr(g, '_metrics_started'):
+        return
+    if error is not None:
+        _record(500)
+    IN_FLIGHT.dec(endpoint=g._metrics_endpoint)
+    if current_app.config.get('METRICS_MULTIPROC_DIR'):
+        _start_flusher(current_app._get_current_object())
+
+
+# ===== SQLAlchemy events =====
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_metrics_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    endpoint = 'none'
+    if has_request_context():
+        endpoint = getattr(g, '_metrics_endpoint', None) or _endpoint()
+        if hasattr(g, '_metrics_queries'):
+            g._metrics_queries += 1
+    DB_QUERIES.inc(endpoint=endpoint)
+    DB_QUERY_LATENCY.observe(elapsed, endpoint=endpoint)
+
+
+def instrument_queries(engine):
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def init_metrics(app):
+    """Register request hooks and SQL events (called by create_app)"""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    with app.app_context():
+        for engine in db.engines.values():
+            instrument_queries(engine)
+    if app.config.get('METRICS_MULTIPROC_DIR'):
+        os.makedirs(app.config['METRICS_MULTIPROC_DIR'], exist_ok=True)
+
+
+# ===== Collection =====
+
+def collect_pool_metrics():
+    """Copy the pool snapshots of app.utils.db_pool into the pool metrics"""
+    for name, pool in pool_snapshots(db.engines.values()).items():
+        POOL_IN_USE.set(pool['inUse'], engine=name)
+        POOL_TIMEOUTS.set(pool['timeouts'], engine=name)
+        if 'idle' in pool:
+            POOL_IDLE.set(pool['idle'], engine=name)
+            POOL_OVERFLOW.set(pool['overflow'], engine=name)
+        wait = pool['wait']
+        values = []
+        previous = 0
+        for bucket in wait['buckets']:
+            values.append(bucket['count'] - previous)
+            previous = bucket['count']
+        values.append(wait['count'] - previous)
+        values.append(wait['sumSeconds'])
+        with POOL_WAIT._lock:
+            POOL_WAIT._values[(name,)] = values
+
+
+_flush_lock = threading.Lock()
+_flusher_pid = None
+
+
+def flush(directory):
+    """Write this worker's values to <directory>/<pid>.json"""
+    with _flush_lock:
+        collect_pool_metrics()
+        path = os.path.join(directory, f'{os.getpid()}.json')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(REGISTRY.snapshot(), f)
+        os.replace(tmp_path, path)
+
+
+def _start_flusher(app):
+    """Start (once per process) the thread writing this worker's file every METRICS_FLUSH_INTERVAL"""
+    global _flusher_pid
+    if _flusher_pid == os.getpid():
+        return
+    _flusher_pid = os.getpid()
+    directory = app.config['METRICS_MULTIPROC_DIR']
+    interval = app.config.get('METRICS_FLUSH_INTERVAL', 1)
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context():
+                    flush(directory)
+            except Exception as e:
+                app.logger.warning(f"Could not write metrics: {str(e)}")
+
+    threading.Thread(target=run, name='metrics-flush', daemon=True).start()
+
+
+def _merge(total, snapshot, skip=()):
+    for name, entries in snapshot.items():
+        if name in skip:
+            continue
+        merged = total.setdefault(name, {})
+        for key, value in entries:
+            key = tuple(key)
+            current = merged.get(key)
+            if current is None:
+                merged[key] = list(value) if isinstance(value, list) else value
+            elif isinstance(value, list):
+                merged[key] = [a + b for a, b in zip(current, value)]
+            else:
+                merged[key] = current + value
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def collect(directory=None):
+    """{metric name: {label values: value}} for this worker or every worker of directory"""
+    if not directory:
+        collect_pool_metrics()
+        total = {}
+        _merge(total, REGISTRY.snapshot())
+        return total
+
+    flush(directory)
+    total = {}
+    for filename in os.listdir(directory):
+        if not filename.endswith('.json'):
+            continue
+        path = os.path.join(directory, filename)
+        if filename == ARCHIVE_FILE:
+            _merge(total, _read_json(path), skip=LIVE_ONLY)
+            continue
+        try:
+            pid = int(filename[:-5])
+        except ValueError:
+            continue
+        _merge(total, _read_json(path), skip=() if _pid_alive(pid) else LIVE_ONLY)
+    return total
+
+
+def mark_process_dead(pid, directory):
+    """Fold an exited worker's counters into archive.json (gunicorn child_exit hook)"""
+    path = os.path.join(directory, f'{pid}.json')
+    if not os.path.exists(path):
+        return
+    with open(os.path.join(directory, '.archive.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        archive_path = os.path.join(directory, ARCHIVE_FILE)
+        total = {}
+        _merge(total, _read_json(archive_path))
+        _merge(total, _read_json(path), skip=LIVE_ONLY)
+        data = {name: [[list(key), value] for key, value in entries.items()] for name, entries in total.items()}
+        tmp_path = f'{archive_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, archive_path)
+        os.remove(path)
+
+
+def render(values):
+    """Prometheus text exposition format (version 0.0.4)"""
+    lines = []
+    for metric in REGISTRY.metrics:
+        entries = values.get(metric.name)
+        if not entries:
+            continue
+        metric_type = 'counter' if metric.name in COUNTER_GAUGES else metric.type
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric_type}')
+        for key, value in sorted(entries.items()):
+            if metric.type != 'histogram':
+                lines.append(f'{metric.name}{_format_labels(metric.labelnames, key)} {_format_value(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + (float('inf'),), value[:-1]):
+                cumulative += count
+                labels = _format_labels(metric.labelnames, key, ('le', _format_value(float(bound))))
+                lines.append(f'{metric.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(metric.labelnames, key)
+            lines.append(f'{metric.name}_sum{labels} {_format_value(float(value[-1]))}')
+            lines.append(f'{metric.name}_count{labels} {cumulative}')
+    return '\n'.join(lines) + '\n'
@@ -1 +1,346 @@
-  
+"""
+Notification delivery
+
+Views call ``notify`` / ``notify_booking`` while they change a booking or a
+payment. The event is queued on the current session and fanned out when that
+session commits (``before_commit``), inside a savepoint of the same
+transaction: notifications exist only if the change they describe was
+committed, and a failed fan-out is logged without failing the request.
+
+Fan-out:
+
+- recipients are filtered by their ``NotificationSetting`` (booking, payment
+  and promotion types can be switched off). Settings are cached in the worker
+  for ``NOTIFICATION_SETTINGS_TTL`` seconds; users without a row get the
+  model defaults;
+- rows are written with multi-row INSERTs of ``NOTIFICATION_BATCH_SIZE``;
+- ``notification_counters.unread_count`` is incremented per user with one
+  upsert, so the unread badge is a primary key lookup and never a COUNT(*).
+
+``mark_read`` decrements the counter by the number of rows it actually
+flipped. ``reconcile_unread_counts`` recomputes counters from the
+notifications table (``flask notifications reconcile``, run periodically).
+"""
+
+import threading
+import time
+import uuid
+from collections import Counter, namedtuple
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event, func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.extensions import db
+from app.utils.db_routing import RoutingSession
+from app.models.notification import Notification, NotificationSetting, NotificationCounter
+
+NotificationEvent = namedtuple('NotificationEvent', ['user_ids', 'type', 'title', 'message', 'reference_id', 'reference_type'])
+
+QUEUE_KEY = 'notification_events'
+
+# Notification type -> NotificationSetting flag that can switch it off (other types are always delivered)
+TYPE_SETTINGS = {
+    'booking': 'booking_notifications',
+    'payment': 'payment_notifications',
+    'promotion': 'promotion_notifications',
+}
+DEFAULT_SETTINGS = {flag: True for flag in TYPE_SETTINGS.values()}
+
+# event -> (type, title, message); placeholders: code, date, time, amount
+BOOKING_MESSAGES = {
+    'created': ('booking', 'Đặt lịch thành công', 'Đơn {code} ngày {date} lúc {time} đã được tạo và đang chờ xác nhận.'),
+    'pending': ('booking', 'Đơn đang chờ xác nhận', 'Đơn {code} ngày {date} lúc {time} đang chờ xác nhận.'),
+    'confirmed': ('booking', 'Đơn đã được xác nhận', 'Đơn {code} ngày {date} lúc {time} đã được xác nhận.'),
+    'in_progress': ('booking', 'Nhân viên đang thực hiện', 'Đơn {code} đang được thực hiện.'),
+    'completed': ('booking', 'Dịch vụ đã hoàn thành', 'Đơn {code} đã hoàn thành. Hãy đánh giá dịch vụ để giúp chúng tôi phục vụ tốt hơn.'),
+    'cancelled': ('booking', 'Đơn đã bị hủy', 'Đơn {code} ngày {date} lúc {time} đã bị hủy.'),
+    'rescheduled': ('booking', 'Đơn được dời lịch', 'Đơn {code} đã được dời lịch.'),
+    'assigned': ('booking', 'Bạn có lịch làm việc mới', 'Bạn được phân công đơn {code} ngày {date} lúc {time}.'),
+    'paid': ('payment', 'Thanh toán thành công', 'Đơn {code} đã được thanh toán {amount}đ.'),
+    'payment_failed': ('payment', 'Thanh toán không thành công', 'Thanh toán cho đơn {code} không thành công. Vui lòng thử lại.'),
+    'refunded': ('payment', 'Đã hoàn tiền', 'Đơn {code} đã được hoàn {amount}đ.'),
+}
+
+
+def _uuid(value):
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+
+# ===== Settings cache =====
+
+class SettingsCache:
+    """user_id -> {flag: bool} with a TTL, per worker"""
+
+    def __init__(self, max_entries=50000):
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, user_ids):
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for user_id in user_ids:
+                entry = self._entries.get(user_id)
+                if entry and entry[0] > now:
+                    found[user_id] = entry[1]
+        return found
+
+    def put_many(self, settings, ttl):
+        expires = time.monotonic() + ttl
+        with self._lock:
+            if len(self._entries) + len(settings) > self.max_entries:
+                self._entries.clear()
+            for user_id, flags in settings.items():
+                self._entries[user_id] = (expires, flags)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(_uuid(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+SETTINGS_CACHE = SettingsCache()
+
+
+def recipient_settings(user_ids, session=None):
+    """{user_id: {flag: bool}} for every user, from the cache or one query for the misses"""
+    session = session or db.session
+    settings = SETTINGS_CACHE.get_many(user_ids)
+    missing = [user_id for user_id in user_ids if user_id not in settings]
+    if missing:
+        loaded = {user_id: DEFAULT_SETTINGS for user_id in missing}
+        columns = [getattr(NotificationSetting, flag) for flag in DEFAULT_SETTINGS]
+        batch_size = current_app.config.get('NOTIFICATION_BATCH_SIZE', 1000)
+        for start in range(0, len(missing), batch_size):
+            rows = session.execute(
+                select(NotificationSetting.user_id, *columns)
+                .where(NotificationSetting.user_id.in_(missing[start:start + batch_size]))
+            ).all()
+            for row in rows:
+                # A NULL flag keeps the default
+                loaded[row[0]] = {flag: value is not False for flag, value in zip(DEFAULT_SETTINGS, row[1:])}
+        SETTINGS_CACHE.put_many(loaded, current_app.config.get('NOTIFICATION_SETTINGS_TTL', 300))
+        settings.update(loaded)
+    return settings
+
+
+# ===== Queue and fan-out =====
+
+def notify(user_ids, type, title, message, reference_id=None, reference_type=None, session=None):
+    """Queue a notification for users; it is delivered when the session commits"""
+    user_ids = list(dict.fromkeys(_uuid(user_id) for user_id in user_ids if user_id))
+    if not user_ids:
+        return
+    session = session or db.session
+    session.info.setdefault(QUEUE_KEY, []).append(
+        NotificationEvent(user_ids, type, title, message, reference_id, reference_type)
+    )
+
+
+def booking_staff_ids(booking):
+    """Staff of a booking: the main staff and every BookingStaff assignment"""
+    staff_ids = [booking.staff_id] if booking.staff_id else []
+    staff_ids += [assignment.staff_id for assignment in booking.assigned_staff]
+    return list(dict.fromkeys(staff_ids))
+
+
+def notify_booking(booking, event_name, user_ids=None, session=None):
+    """Queue one of BOOKING_MESSAGES about a booking (default recipient: its customer)"""
+    type_, title, template = BOOKING_MESSAGES[event_name]
+    message = template.format(
+        code=booking.booking_code,
+        date=booking.booking_date.strftime('%d/%m/%Y') if booking.booking_date else '',
+        time=booking.booking_time.strftime('%H:%M') if booking.booking_time else '',
+        amount=f"{int(booking.total_price or 0):,}".replace(',', '.')
+    )
+    notify(user_ids if user_ids is not None else [booking.user_id], type_, title, message,
+           reference_id=booking.id, reference_type='booking', session=session)
+
+
+def deliver(events, session=None):
+    """
+    Write events now (bulk INSERT + counter upsert) in the current transaction
+
+    Returns the number of notifications written. The caller commits.
+    """
+    session = session or db.session
+    settings = recipient_settings(list({user_id for e in events for user_id in e.user_ids}), session)
+    now = datetime.utcnow()
+    rows = []
+    for e in events:
+        flag = TYPE_SETTINGS.get(e.type)
+        for user_id in e.user_ids:
+            if flag and not settings[user_id][flag]:
+                continue
+            rows.append({
+                'id': uuid.uuid4(), 'user_id': user_id, 'title': e.title, 'message': e.message,
+                'type': e.type, 'is_read': False, 'reference_id': e.reference_id,
+                'reference_type': e.reference_type, 'created_at': now,
+            })
+    return write_notifications(rows, session)
+
+
+def write_notifications(rows, session=None):
+    """
+    Insert notification rows (dicts of Notification columns) and increment the unread counters
+
+    Recipients are not filtered by their settings. Returns the number of rows written;
+    the caller commits.
+    """
+    session = session or db.session
+    batch_size = current_app.config.get('NOTIFICATION_BATCH_SIZE', 1000)
+    now = datetime.utcnow()
+    unread = Counter(row['user_id'] for row in rows)
+    for start in range(0, len(rows), batch_size):
+        session.execute(insert(Notification.__table__), rows[start:start + batch_size])
+
+    # Sorted so concurrent fan-outs lock counter rows in the same order
+    user_ids = sorted(unread, key=str)
+    for start in range(0, len(user_ids), batch_size):
+        values = [{'user_id': user_id, 'unread_count': unread[user_id], 'updated_at': now}
+                  for user_id in user_ids[start:start + batch_size]]
+        statement = pg_insert(NotificationCounter.__table__).values(values)
+        session.execute(statement.on_conflict_do_update(
+            index_elements=['user_id'],
+            set_={
+                'unread_count': NotificationCounter.__table__.c.unread_count + statement.excluded.unread_count,
+                'updated_at': now,
+            }
+        ))
+    return len(rows)
+
+
+def _before_commit(session):
+    events = session.info.pop(QUEUE_KEY, None)
+    if not events:
+        return
+    try:
+        with session.begin_nested():
+            deliver(events, session)
+    except Exception as e:
+        current_app.logger.error(f"Notification fan-out failed ({len(events)} events): {str(e)}")
+
+
+def _after_soft_rollback(session, previous_transaction):
+    if previous_transaction.nested:
+        return
+    session.info.pop(QUEUE_KEY, None)
+
+
+# ===== Unread counters =====
+
+def unread_count(user_id):
+    """
+    Unread notifications of a user, from notification_counters
+
+    Read only. Counters are created by the fan-out (and were backfilled by
+    the migration); a user without one is counted from the notifications
+    table until then.
+    """
+    user_id = _uuid(user_id)
+    count = db.session.execute(
+        select(NotificationCounter.unread_count).where(NotificationCounter.user_id == user_id)
+    ).scalar()
+    if count is not None:
+        return max(count, 0)
+    return db.session.execute(
+        select(func.count()).select_from(Notification)
+        .where(Notification.user_id == user_id, Notification.is_read == False)  # noqa: E712
+    ).scalar()
+
+
+def mark_read(user_id, notification_ids=None):
+    """
+    Mark notifications of a user as read (all unread ones when notification_ids is None)
+
+    Returns the number of notifications that were unread. The caller commits.
+    """
+    user_id = _uuid(user_id)
+    statement = update(Notification).where(Notification.user_id == user_id, Notification.is_read == False)  # noqa: E712
+    if notification_ids is not None:
+        ids = [_uuid(notification_id) for notification_id in notification_ids]
+        if not ids:
+            return 0
+        statement = statement.where(Notification.id.in_(ids))
+    changed = len(db.session.execute(
+        statement.values(is_read=True).returning(Notification.id),
+        execution_options={'synchronize_session': False}
+    ).all())
+    if changed:
+        db.session.execute(
+            update(NotificationCounter)
+            .where(NotificationCounter.user_id == user_id)
+            .values(unread_count=func.greatest(NotificationCounter.unread_count - changed, 0), updated_at=datetime.utcnow())
+        )
+    return changed
+
+
+def reconcile_unread_counts(user_ids=None, batch_size=1000):
+    """
+    Recompute unread counters from the notifications table, batch by batch
+
+    Counter rows of a batch are locked first, so fan-outs of those users wait
+    and nothing committed meanwhile is lost. Without user_ids every existing
+    counter is checked. Returns the number of counters that were wrong.
+    """
+    corrected = 0
+    now = datetime.utcnow()
+
+    def batches():
+        if user_ids is not None:
+            ids = sorted({_uuid(user_id) for user_id in user_ids}, key=str)
+            for start in range(0, len(ids), batch_size):
+                yield ids[start:start + batch_size]
+            return
+        last = None
+        while True:
+            query = select(NotificationCounter.user_id).order_by(NotificationCounter.user_id).limit(batch_size)
+            if last is not None:
+                query = query.where(NotificationCounter.user_id > last)
+            ids = db.session.execute(query).scalars().all()
+            if not ids:
+                return
+            last = ids[-1]
+            yield ids
+
+    for ids in batches():
+        current = dict(db.session.execute(
+            select(NotificationCounter.user_id, NotificationCounter.unread_count)
+            .where(NotificationCounter.user_id.in_(ids))
+            .order_by(NotificationCounter.user_id)
+            .with_for_update()
+        ).all())
+        counts = dict(db.session.execute(
+            select(Notification.user_id, func.count())
+            .where(Notification.user_id.in_(ids), Notification.is_read == False)  # noqa: E712
+            .group_by(Notification.user_id)
+        ).all())
+        wrong = [user_id for user_id in ids if current.get(user_id) != counts.get(user_id, 0)]
+        for user_id in wrong:
+            db.session.execute(
+                pg_insert(NotificationCounter.__table__)
+                .values(user_id=user_id, unread_count=counts.get(user_id, 0), reconciled_at=now, updated_at=now)
+                .on_conflict_do_update(
+                    index_elements=['user_id'],
+                    set_={'unread_count': counts.get(user_id, 0), 'reconciled_at': now, 'updated_at': now}
+                )
+            )
+        db.session.execute(
+            update(NotificationCounter).where(NotificationCounter.user_id.in_(ids)).values(reconciled_at=now)
+        )
+        db.session.commit()
+        corrected += len(wrong)
+    return corrected
+
+
+def init_notifications(app):
+    """Deliver queued notifications when a session commits (called by create_app)"""
+    if not event.contains(RoutingSession, 'before_commit', _before_commit):
+        event.listen(RoutingSession, 'before_commit', _before_commit)
+        event.listen(RoutingSession, 'after_soft_rollback', _after_soft_rollback)
@@ -0,0 +1,109 @@
+"""
+Popularity ranking of services (featured services on the homepage)
+
+``rank_services`` scores the active services an admin marked
+``is_featured`` in one INSERT ... SELECT and replaces the
+``service_rankings`` table in a single transaction, so
+``/api/services/featured`` only reads the precomputed order::
+
+    score = ln(1 + recent volume) * rating factor * featured boost
+
+- recent volume: booked quantity over the last ``POPULARITY_WINDOW_DAYS``
+  (cancelled bookings excluded), each booking weighted by
+  ``0.5 ** (age in days / POPULARITY_HALF_LIFE_DAYS)``;
+- rating factor: Bayesian average of the service's approved reviews
+  (``rating_summaries``) divided by 5, where ``POPULARITY_RATING_PRIOR``
+  virtual reviews at the catalog mean keep a single 5-star review from
+  beating a well-reviewed service (1 while there are no reviews at all);
+- featured boost: with ``POPULARITY_FEATURED_ONLY = False`` every active
+  service is ranked and ``is_featured`` ones are multiplied by
+  ``POPULARITY_FEATURED_BOOST`` (featured-only rankings do not need it).
+
+Run it periodically: ``flask services rank-popularity`` (cron) or
+``flask services rank-popularity --every 3600`` as a long-running process.
+"""
+
+import math
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, delete, insert, func, case, literal, Float, DateTime
+
+from app.extensions import db
+from app.models.booking import Booking, BookingItem
+from app.models.review import RatingSummary
+from app.models.service import Service, ServiceRanking
+
+# Key of the transaction advisory lock: one ranking job at a time
+LOCK_KEY = 4_602_011
+
+
+def catalog_mean_rating():
+    """Average of every approved service review, None without reviews"""
+    count, total = db.session.execute(
+        select(func.sum(RatingSummary.review_count), func.sum(RatingSummary.rating_sum))
+        .where(RatingSummary.target_type == 'service')
+    ).one()
+    return float(total) / count if count else None
+
+
+def rank_services(now=None):
+    """Recompute service_rankings (commits); returns the number of ranked services"""
+    config = current_app.config
+    now = now or datetime.utcnow()
+    window_days = config.get('POPULARITY_WINDOW_DAYS', 180)
+    half_life = config.get('POPULARITY_HALF_LIFE_DAYS', 30)
+    prior_weight = config.get('POPULARITY_RATING_PRIOR', 10)
+    featured_only = config.get('POPULARITY_FEATURED_ONLY', True)
+    boost = config.get('POPULARITY_FEATURED_BOOST', 1.5)
+
+    db.session.execute(select(func.pg_advisory_xact_lock(LOCK_KEY)))
+    mean = catalog_mean_rating()
+
+    age_days = func.extract('epoch', literal(now, DateTime) - Booking.created_at) / 86400.0
+    volume = select(
+        BookingItem.service_id,
+        func.count(func.distinct(Booking.id)).label('bookings'),
+        func.sum(BookingItem.quantity * func.exp(-math.log(2) / half_life * age_days)).label('recent_volume')
+    ).join(
+        Booking, Booking.id == BookingItem.booking_id
+    ).where(
+        Booking.created_at >= now - timedelta(days=window_days),
+        Booking.status != 'cancelled'
+    ).group_by(BookingItem.service_id).cte('volume')
+
+    recent_volume = func.coalesce(volume.c.recent_volume, 0.0)
+    bookings = func.coalesce(volume.c.bookings, 0)
+    if mean is None:
+        rating = literal(None, Float)
+        rating_factor = literal(1.0)
+    else:
+        rating = (
+            func.coalesce(RatingSummary.rating_sum, 0) + prior_weight * mean
+        ) / (func.coalesce(RatingSummary.review_count, 0) + prior_weight)
+        rating_factor = rating / 5.0
+    score = func.ln(1 + recent_volume) * rating_factor * case((Service.is_featured == True, boost), else_=1.0)  # noqa: E712
+
+    ranked = select(
+        Service.id,
+        func.row_number().over(order_by=(score.desc(), bookings.desc(), Service.id)),
+        score,
+        bookings,
+        recent_volume,
+        rating,
+        literal(now, DateTime)
+    ).select_from(Service).outerjoin(
+        volume, volume.c.service_id == Service.id
+    ).outerjoin(
+        RatingSummary, (RatingSummary.target_type == 'service') & (RatingSummary.target_id == Service.id)
+    ).where(Service.status == 'active')
+    if featured_only:
+        ranked = ranked.where(Service.is_featured == True)  # noqa: E712
+
+    # Readers keep the previous ranking until this transaction commits
+    db.session.execute(delete(ServiceRanking))
+    result = db.session.execute(insert(ServiceRanking).from_select(
+        ['service_id', 'rank', 'score', 'bookings', 'recent_volume', 'rating', 'computed_at'], ranked
+    ))
+    db.session.commit()
+    return result.rowcount
@@ -0,0 +1,349 @@
+"""
+Request profiling (opt-in)
+
+One request: an admin sends ``X-Profile: 1`` (or ``?_profile=1``). The view
+runs normally and the response body is replaced by its profile; the original
+status code is in ``X-Profiled-Status``. Modes:
+
+- ``1`` / ``sample``: collapsed stacks from the built-in sampler, one sample
+  of the request thread every ``PROFILING_REQUEST_INTERVAL`` seconds;
+- ``cprofile``: cProfile statistics sorted by cumulative time;
+- ``html``: pyinstrument HTML page (needs the pyinstrument package).
+
+Requests from anyone else are served normally. ``PROFILING_REQUESTS = False``
+turns this off.
+
+Continuous: with ``PROFILING_SAMPLE_INTERVAL`` > 0 a thread in each worker
+samples the stacks of the threads serving requests and counts collapsed
+stacks per endpoint, in ``PROFILING_BUCKET_SECONDS`` buckets kept for
+``PROFILING_WINDOW_SECONDS``. ``GET /api/admin/debug/profile`` downloads them
+in the collapsed format read by flamegraph.pl, inferno and speedscope. With
+``PROFILING_DIR`` every worker writes its buckets to ``<dir>/<pid>.json``
+and the download adds up all workers.
+
+The sampler sees OS threads (sync and gthread workers). Under gevent all
+requests share one thread, so use the cprofile mode instead. Streamed
+responses (exports) are profiled until the response starts.
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+
+from flask import current_app, g, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+
+from app.extensions import db
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ARG = '_profile'
+MODES = {'1': 'sample', 'true': 'sample', 'sample': 'sample', 'cprofile': 'cprofile', 'html': 'html'}
+
+# Stacks start at Flask's request dispatch, the server frames above it are the same for every request
+ROOT_FRAME = 'flask/app.py:full_dispatch_request'
+MAX_DEPTH = 128
+# Distinct stacks kept per bucket; further new stacks are counted as OTHER_STACKS
+MAX_STACKS_PER_BUCKET = 20000
+OTHER_STACKS = '[other stacks]'
+
+
+# ===== Stacks =====
+
+@lru_cache(maxsize=16384)
+def _label(code):
+    filename = code.co_filename.replace('\\', '/')
+    if '/site-packages/' in filename:
+        filename = filename.rsplit('/site-packages/', 1)[1]
+    elif '/app/' in filename:
+        filename = 'app/' + filename.rsplit('/app/', 1)[1]
+    else:
+        filename = os.path.basename(filename)
+    # ';' separates frames and ' ' the count in the collapsed format
+    return f'{filename}:{code.co_name}'.replace(';', ',').replace(' ', '_')
+
+
+def collapse(frame, root=None):
+    """'root;outer;...;inner' for a frame, starting at ROOT_FRAME when present"""
+    labels = []
+    while frame is not None and len(labels) < MAX_DEPTH:
+        labels.append(_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    if ROOT_FRAME in labels:
+        labels = labels[labels.index(ROOT_FRAME):]
+    if root:
+        labels.insert(0, root)
+    return ';'.join(labels)
+
+
+def render_collapsed(counts):
+    """Collapsed stacks, one 'stack count' line each, biggest first"""
+    return ''.join(f'{stack} {count}\n' for stack, count in sorted(counts.items(), key=lambda item: -item[1]))
+
+
+class StackSampler:
+    """Samples the stack of one thread every interval seconds from a background thread"""
+
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.counts[collapse(frame)] += 1
+                self.samples += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self
+
+
+# ===== Rolling buffer =====
+
+class ProfileBuffer:
+    """Collapsed stack counts ('endpoint;frames...') in time buckets"""
+
+    def __init__(self, bucket_seconds=60, window_seconds=900):
+        self.bucket_seconds = bucket_seconds
+        self.window_seconds = window_seconds
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        oldest = now - self.window_seconds - self.bucket_seconds
+        for start in [start for start in self._buckets if start < oldest]:
+            del self._buckets[start]
+
+    def add(self, stack, now=None):
+        now = now or time.time()
+        start = int(now // self.bucket_seconds * self.bucket_seconds)
+        with self._lock:
+            bucket = self._buckets.get(start)
+            if bucket is None:
+                bucket = self._buckets[start] = Counter()
+                self._expire(now)
+            if stack not in bucket and len(bucket) >= MAX_STACKS_PER_BUCKET:
+                stack = f"{stack.split(';', 1)[0]};{OTHER_STACKS}"
+            bucket[stack] += 1
+
+    def snapshot(self):
+        """{bucket start: {stack: count}}"""
+        with self._lock:
+            self._expire(time.time())
+            return {start: dict(bucket) for start, bucket in self._buckets.items()}
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+BUFFER = ProfileBuffer()
+
+# Thread id -> endpoint of the requests being served by this worker
+_active_requests = {}
+_sampler_pid = None
+
+
+def _sample_loop(app):
+    interval = app.config['PROFILING_SAMPLE_INTERVAL']
+    directory = app.config.get('PROFILING_DIR')
+    flush_interval = app.config.get('PROFILING_FLUSH_INTERVAL', 5)
+    flushed = time.time()
+    while True:
+        time.sleep(interval)
+        frames = sys._current_frames()
+        now = time.time()
+        for thread_id, endpoint in list(_active_requests.items()):
+            frame = frames.get(thread_id)
+            if frame is not None:
+                BUFFER.add(collapse(frame, endpoint), now)
+        del frames
+        if directory and now - flushed >= flush_interval:
+            flushed = now
+            try:
+                flush(directory)
+            except OSError as e:
+                app.logger.warning(f"Could not write profile samples: {str(e)}")
+
+
+def _start_sampler(app):
+    """Start (once per process) the continuous sampling thread"""
+    global _sampler_pid
+    if _sampler_pid == os.getpid():
+        return
+    _sampler_pid = os.getpid()
+    BUFFER.bucket_seconds = app.config.get('PROFILING_BUCKET_SECONDS', 60)
+    BUFFER.window_seconds = app.config.get('PROFILING_WINDOW_SECONDS', 900)
+    threading.Thread(target=_sample_loop, args=(app,), name='profile-sampling', daemon=True).start()
+
+
+def flush(directory):
+    """Write this worker's buckets to <directory>/<pid>.json"""
+    path = os.path.join(directory, f'{os.getpid()}.json')
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(BUFFER.snapshot(), f)
+    os.replace(tmp_path, path)
+
+
+def collect(directory=None, seconds=None, endpoint=None):
+    """
+    Collapsed stack counts of this worker, or of every worker writing to directory
+
+    seconds limits the result to the most recent buckets, endpoint to the stacks
+    of one endpoint ('blueprint.view').
+    """
+    if directory:
+        flush(directory)
+        snapshots = []
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json'):
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                with open(path) as f:
+                    snapshot = {int(start): bucket for start, bucket in json.load(f).items()}
+            except (OSError, ValueError):
+                continue
+            if snapshot and max(snapshot) < time.time() - BUFFER.window_seconds - BUFFER.bucket_seconds:
+                # Worker gone for longer than the window
+                os.remove(path)
+                continue
+            snapshots.append(snapshot)
+    else:
+        snapshots = [BUFFER.snapshot()]
+
+    now = time.time()
+    oldest = now - (seconds or BUFFER.window_seconds) - BUFFER.bucket_seconds
+    prefix = f'{endpoint};' if endpoint else None
+    counts = Counter()
+    for snapshot in snapshots:
+        for start, bucket in snapshot.items():
+            if start < oldest:
+                continue
+            for stack, count in bucket.items():
+                if prefix is None or stack.startswith(prefix):
+                    counts[stack] += count
+    return counts
+
+
+# ===== Request hooks =====
+
+def _requested_mode():
+    value = request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_ARG)
+    return MODES.get(value.strip().lower()) if value else None
+
+
+def _is_admin():
+    from app.models.user import User
+
+    try:
+        verify_jwt_in_request(optional=True)
+        identity = get_jwt_identity()
+    except Exception:
+        return False
+    if not identity:
+        return False
+    user = db.session.get(User, identity)
+    return user is not None and user.role == 'admin'
+
+
+def _start_profile(mode):
+    if mode == 'html':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            return None
+        profiler = Profiler(interval=current_app.config.get('PROFILING_REQUEST_INTERVAL', 0.001))
+        profiler.start()
+        return profiler
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    return StackSampler(threading.get_ident(), current_app.config.get('PROFILING_REQUEST_INTERVAL', 0.001)).start()
+
+
+def _stop_profile(mode, profiler):
+    if mode == 'html':
+        profiler.stop()
+    elif mode == 'cprofile':
+        profiler.disable()
+    else:
+        profiler.stop()
+
+
+def _before_request():
+    config = current_app.config
+    if config.get('PROFILING_SAMPLE_INTERVAL'):
+        _start_sampler(current_app._get_current_object())
+        _active_requests[threading.get_ident()] = request.endpoint or 'unmatched'
+
+    mode = _requested_mode() if config.get('PROFILING_REQUESTS', True) else None
+    if mode is None or not _is_admin():
+        return
+    profiler = _start_profile(mode)
+    if profiler is None:
+        current_app.logger.warning("Profiling mode 'html' needs the pyinstrument package")
+        return
+    g._profile = (mode, profiler, time.perf_counter())
+
+
+def _after_request(response):
+    profile = g.pop('_profile', None)
+    if profile is None:
+        return response
+    mode, profiler, started = profile
+    _stop_profile(mode, profiler)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    if mode == 'html':
+        result = current_app.response_class(profiler.output_html(), mimetype='text/html')
+    elif mode == 'cprofile':
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(80)
+        result = current_app.response_class(output.getvalue(), mimetype='text/plain')
+    else:
+        result = current_app.response_class(render_collapsed(profiler.counts), mimetype='text/plain')
+        result.headers['X-Profile-Samples'] = str(profiler.samples)
+
+    result.headers['X-Profiled-Status'] = str(response.status_code)
+    result.headers['X-Profile-Duration-Ms'] = f'{elapsed_ms:.1f}'
+    result.headers['Cache-Control'] = 'no-store'
+    current_app.logger.info(f"Profiled {request.method} {request.path} ({mode}, {elapsed_ms:.0f} ms)")
+    return result
+
+
+def _teardown_request(error):
+    _active_requests.pop(threading.get_ident(), None)
+    # The view failed before after_request
+    profile = g.pop('_profile', None)
+    if profile is not None:
+        _stop_profile(profile[0], profile[1])
+
+
+def init_profiling(app):
+    """Register the profiling hooks (called by create_app)"""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    if app.config.get('PROFILING_DIR'):
+        os.makedirs(app.config['PROFILING_DIR'], exist_ok=True)
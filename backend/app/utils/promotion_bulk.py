@@ -0,0 +1,364 @@
+"""
+Bulk promotion import, code generation and export
+
+Campaigns need tens of thousands of single-use codes, far too many for one
+``create_promotion`` call (and one duplicate check query) per code. Rows are
+validated in memory, deduplicated against the batch itself and against the
+database with a single ``code = ANY(:codes)`` query, then inserted with
+chunked multi-row ``INSERT ... ON CONFLICT DO NOTHING`` statements, one
+transaction per chunk.
+
+Exports stream the promotions as CSV or JSON with ``yield_per`` so the whole
+table is never loaded at once.
+"""
+
+import csv
+import io
+import json
+import secrets
+import uuid
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from flask import current_app
+from sqlalchemy import select, bindparam, any_
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+
+from app.extensions import db
+from app.models.promotion import Promotion, DISCOUNT_TYPES
+from app.utils.promotion_engine import promotion_engine
+
+# No 0/O, 1/I/L so generated codes can be read out over the phone
+CODE_ALPHABET = 'ABCDEFGHJKMNPQRSTUVWXYZ23456789'
+MIN_CODE_LENGTH = 4
+# Generate at most this share of the possible codes, so that random draws rarely collide
+MAX_CODE_SPACE_SHARE = 0.01
+
+# Same field names as the create/update promotion API
+EXPORT_FIELDS = [
+    'code', 'name', 'description', 'discountType', 'discountValue', 'minOrderValue',
+    'maxDiscount', 'startDate', 'endDate', 'usageLimit', 'usageCount', 'isActive'
+]
+REQUIRED_FIELDS = ['code', 'name', 'discountType', 'discountValue', 'startDate', 'endDate']
+
+
+class BulkResult:
+    """Outcome of a bulk import: counts plus the first rejected rows"""
+
+    MAX_REPORTED = 100
+
+    def __init__(self):
+        self.total = 0
+        self.created = 0
+        self.duplicates = []
+        self.errors = []
+
+    def add_duplicate(self, code):
+        self.duplicates.append(code)
+
+    def add_error(self, row_number, message):
+        self.errors.append({'row': row_number, 'message': message})
+
+    def to_dict(self):
+        return {
+            'total': self.total,
+            'created': self.created,
+            'duplicates': len(self.duplicates),
+            'invalid': len(self.errors),
+            'duplicateCodes': self.duplicates[:self.MAX_REPORTED],
+            'errors': self.errors[:self.MAX_REPORTED]
+        }
+
+
+def _parse_decimal(value, field, required=False):
+    if value in (None, ''):
+        if required:
+            raise ValueError(f'Missing required field: {field}')
+        return None
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f'Invalid number for {field}: {value}')
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() not in ('0', 'false', 'no', 'inactive', '')
+
+
+def row_to_values(row, now=None):
+    """
+    Validate one imported row (API field names) and build the promotions row
+
+    Raises:
+        ValueError: if the row is invalid
+    """
+    for field in REQUIRED_FIELDS:
+        if row.get(field) in (None, ''):
+            raise ValueError(f'Missing required field: {field}')
+
+    code = str(row['code']).strip()
+    if not code or len(code) > 50:
+        raise ValueError(f'Invalid promotion code: {code}')
+    if row['discountType'] not in DISCOUNT_TYPES:
+        raise ValueError(f"Invalid discount type: {row['discountType']}")
+
+    try:
+        start_date = datetime.strptime(str(row['startDate']), '%Y-%m-%d').date()
+        end_date = datetime.strptime(str(row['endDate']), '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError('Dates must use the YYYY-MM-DD format')
+    if end_date <= start_date:
+        raise ValueError('End date must be after start date')
+
+    usage_limit = row.get('usageLimit')
+    if usage_limit in (None, ''):
+        usage_limit = None
+    else:
+        try:
+            usage_limit = int(usage_limit)
+        except (TypeError, ValueError):
+            raise ValueError(f'Invalid usage limit: {usage_limit}')
+
+    now = now or datetime.utcnow()
+    return {
+        'id': uuid.uuid4(),
+        'code': code,
+        'name': row['name'],
+        'description': row.get('description') or '',
+        'discount_type': row['discountType'],
+        'discount_value': _parse_decimal(row['discountValue'], 'discountValue', required=True),
+        'min_order_value': _parse_decimal(row.get('minOrderValue'), 'minOrderValue') or Decimal('0'),
+        'max_discount': _parse_decimal(row.get('maxDiscount'), 'maxDiscount'),
+        'start_date': start_date,
+        'end_date': end_date,
+        'usage_limit': usage_limit,
+        'used_count': 0,
+        'status': 'active' if _parse_bool(row.get('isActive', True)) else 'inactive',
+        'auto_apply': False,
+        'created_at': now,
+        'updated_at': now
+    }
+
+
+def existing_codes(codes):
+    """Return the subset of codes that already exist, in one query"""
+    if not codes:
+        return set()
+    stmt = select(Promotion.code).where(
+        Promotion.code == any_(bindparam('codes', list(codes), type_=ARRAY(db.String)))
+    )
+    return set(db.session.execute(stmt).scalars())
+
+
+def read_rows(stream, fmt):
+    """
+    Parse an uploaded CSV or JSON file into row dicts
+
+    JSON may be a list of objects or {"promotions": [...]}.
+    """
+    content = stream.read()
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig')
+    if fmt == 'json':
+        data = json.loads(content)
+        if isinstance(data, dict):
+            data = data.get('promotions', [])
+        if not isinstance(data, list):
+            raise ValueError('JSON import must be a list of promotions')
+        return data
+    if fmt == 'csv':
+        return list(csv.DictReader(io.StringIO(content)))
+    raise ValueError(f'Unsupported import format: {fmt}')
+
+
+def import_promotions(rows, chunk_size=None, progress=None):
+    """
+    Insert promotions in chunks, skipping invalid and duplicate codes
+
+    Args:
+        rows: Iterable of row dicts using the API field names
+        chunk_size: Rows per INSERT/transaction (PROMOTION_BULK_CHUNK_SIZE)
+        progress: Optional callback(done, total) called after each chunk
+
+    Returns:
+        BulkResult
+    """
+    chunk_size = chunk_size or current_app.config.get('PROMOTION_BULK_CHUNK_SIZE', 1000)
+    result = BulkResult()
+    now = datetime.utcnow()
+
+    # Validate and dedupe inside the batch
+    values = []
+    seen = set()
+    for row_number, row in enumerate(rows, start=1):
+        result.total += 1
+        try:
+            row_values = row_to_values(row, now)
+        except ValueError as e:
+            result.add_error(row_number, str(e))
+            continue
+        if row_values['code'] in seen:
+            result.add_duplicate(row_values['code'])
+            continue
+        seen.add(row_values['code'])
+        values.append(row_values)
+
+    # One pre-check against the codes already in the database
+    taken = existing_codes(seen)
+    if taken:
+        for row_values in values:
+            if row_values['code'] in taken:
+                result.add_duplicate(row_values['code'])
+        values = [v for v in values if v['code'] not in taken]
+
+    result.created = _insert_chunks(values, chunk_size, progress, result)
+    return result
+
+
+def _insert_chunks(values, chunk_size, progress, result):
+    table = Promotion.__table__
+    created = 0
+    try:
+        for start in range(0, len(values), chunk_size):
+            chunk = values[start:start + chunk_size]
+            # Codes created concurrently since the pre-check are skipped, not fatal
+            inserted = db.session.execute(
+                pg_insert(table).values(chunk).on_conflict_do_nothing(
+                    index_elements=[table.c.code]
+                ).returning(table.c.code)
+            ).scalars().all()
+            db.session.commit()
+            created += len(inserted)
+            if len(inserted) != len(chunk):
+                inserted = set(inserted)
+                for row_values in chunk:
+                    if row_values['code'] not in inserted:
+                        result.add_duplicate(row_values['code'])
+            if progress:
+                progress(start + len(chunk), len(values))
+    finally:
+        # Core inserts bypass the mapper events that normally refresh the index
+        if created:
+            promotion_engine.invalidate()
+    return created
+
+
+def check_generate_options(count, prefix='', length=8, max_count=None):
+    """
+    Reject code generation requests that cannot finish quickly
+
+    The random part must be at least MIN_CODE_LENGTH characters, count must
+    stay below MAX_CODE_SPACE_SHARE of the 31**length possible codes and
+    below max_count (PROMOTION_GENERATE_MAX_COUNT by default).
+    """
+    if max_count is None:
+        max_count = current_app.config.get('PROMOTION_GENERATE_MAX_COUNT', 100000)
+    if count <= 0:
+        raise ValueError('Count must be positive')
+    if count > max_count:
+        raise ValueError(f'Count must not exceed {max_count}')
+    if length < MIN_CODE_LENGTH:
+        raise ValueError(f'Code length must be at least {MIN_CODE_LENGTH}')
+    if len(prefix) + length > 50:
+        raise ValueError('Code prefix and length exceed 50 characters')
+    if count > len(CODE_ALPHABET) ** length * MAX_CODE_SPACE_SHARE:
+        raise ValueError(f'Too many codes for length {length}, use a longer code length')
+
+
+def generate_codes(count, prefix='', length=8):
+    """Generate count unique random codes (not checked against the database)"""
+    if length < MIN_CODE_LENGTH or count > len(CODE_ALPHABET) ** length * MAX_CODE_SPACE_SHARE:
+        raise ValueError(f'Cannot generate {count} codes of length {length}')
+    codes = set()
+    while len(codes) < count:
+        codes.add(prefix + ''.join(secrets.choice(CODE_ALPHABET) for _ in range(length)))
+    return codes
+
+
+def generate_promotions(count, template, prefix='', length=8, chunk_size=None, progress=None):
+    """
+    Create count promotions sharing the template fields, each with a new random code
+
+    Generated codes are single use unless the template sets usageLimit.
+
+    Returns:
+        BulkResult
+    """
+    check_generate_options(count, prefix, length)
+
+    template = dict(template)
+    template.setdefault('usageLimit', 1)
+    # Validate the shared fields once instead of failing every row
+    row_to_values({**template, 'code': prefix + 'X' * length})
+
+    codes = set()
+    for _ in range(10):
+        candidates = generate_codes(count - len(codes), prefix, length) - codes
+        codes |= candidates - existing_codes(candidates)
+        if len(codes) >= count:
+            break
+    else:
+        raise ValueError('Could not generate enough unique codes, use a longer code length')
+
+    return import_promotions(({**template, 'code': code} for code in codes), chunk_size, progress)
+
+
+def _export_query(prefix=None, status=None):
+    query = db.session.query(
+        Promotion.code, Promotion.name, Promotion.description, Promotion.discount_type,
+        Promotion.discount_value, Promotion.min_order_value, Promotion.max_discount,
+        Promotion.start_date, Promotion.end_date, Promotion.usage_limit,
+        Promotion.used_count, Promotion.status
+    )
+    if prefix:
+        query = query.filter(Promotion.code.startswith(prefix, autoescape=True))
+    if status:
+        query = query.filter(Promotion.status == status)
+    return query.order_by(Promotion.code).yield_per(1000)
+
+
+def _export_record(row):
+    return {
+        'code': row.code,
+        'name': row.name,
+        'description': row.description,
+        'discountType': row.discount_type,
+        'discountValue': float(row.discount_value),
+        'minOrderValue': float(row.min_order_value or 0),
+        'maxDiscount': float(row.max_discount) if row.max_discount else None,
+        'startDate': row.start_date.isoformat(),
+        'endDate': row.end_date.isoformat(),
+        'usageLimit': row.usage_limit,
+        'usageCount': row.used_count or 0,
+        'isActive': row.status == 'active'
+    }
+
+
+def export_promotions(fmt='csv', prefix=None, status=None):
+    """
+    Yield an export of the promotions as CSV lines or JSON array chunks
+
+    The output is re-importable with import_promotions.
+    """
+    query = _export_query(prefix, status)
+    if fmt == 'json':
+        yield '['
+        first = True
+        for row in query:
+            yield ('' if first else ',') + json.dumps(_export_record(row), ensure_ascii=False)
+            first = False
+        yield ']'
+        return
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for count, row in enumerate(query, start=1):
+        writer.writerow(_export_record(row))
+        if count % 1000 == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,291 @@
+"""
+Promotion engine - in-memory index of active promotions
+
+Keeps a per-worker snapshot of the promotions that are valid today so that
+quoting the best discount for an order does not hit the database nor loop
+over every promotion in Python.
+
+Each promotion's discount is a piecewise linear function of the order value:
+zero below ``min_order_value``, rising (``rate * value`` or ``value``) until it
+reaches its cap at the break-even order value, then flat. The rising and flat
+pieces are inserted into a Li Chao tree over the order value (in cents), so the
+best promotion for any order value is found in O(log range) per quote. Only
+promotions flagged ``auto_apply`` go into the tree; the others (private,
+imported or generated codes) are reachable by their code only.
+
+The index is rebuilt lazily after a transaction that wrote a promotion commits
+(mapper events record the write, ``after_commit`` invalidates), at date rollover, and after ``PROMOTION_INDEX_TTL`` seconds so that writes made by
+other workers are picked up.
+"""
+
+import math
+import threading
+import time
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from app.extensions import db
+from app.models.promotion import Promotion
+from app.utils.db_routing import RoutingSession
+
+CHANGED_KEY = 'promotions_changed'
+
+# Order values are indexed in cents; Numeric(10, 2) never exceeds this range
+MAX_ORDER_CENTS = 10 ** 12
+
+PromotionEntry = namedtuple('PromotionEntry', [
+    'id', 'code', 'name', 'description', 'discount_type', 'discount_value',
+    'min_order_value', 'max_discount', 'usage_limit', 'used_count', 'auto_apply', 'break_even'
+])
+
+
+def calculate_discount(entry, order_value):
+    """Calculate the discount of a promotion entry (same rules as Promotion.calculate_discount)"""
+    order_value = Decimal(str(order_value))
+    if entry.discount_type == 'percentage':
+        discount = order_value * (entry.discount_value / 100)
+        if entry.max_discount:
+            discount = min(discount, entry.max_discount)
+    else:  # fixed
+        discount = entry.discount_value
+
+    discount = min(discount, order_value)
+    return discount.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def _to_cents(value):
+    return int((Decimal(str(value or 0)) * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+class _LiChaoTree:
+    """Li Chao tree over the integer range [lo, hi] returning the max line at a point"""
+
+    __slots__ = ('lo', 'hi', 'line', 'left', 'right')
+
+    def __init__(self, lo, hi):
+        self.lo = lo
+        self.hi = hi
+        self.line = None
+        self.left = None
+        self.right = None
+
+    @staticmethod
+    def _value(line, x):
+        return line[0] * x + line[1]
+
+    def insert(self, line, lo, hi):
+        """Insert a line (slope, intercept, payload) restricted to the range [lo, hi]"""
+        if hi < self.lo or lo > self.hi or lo > hi:
+            return
+        if lo > self.lo or hi < self.hi:
+            # Segment only covers part of this node: push it down
+            mid = (self.lo + self.hi) // 2
+            if lo <= mid:
+                if self.left is None:
+                    self.left = _LiChaoTree(self.lo, mid)
+                self.left.insert(line, lo, hi)
+            if hi > mid:
+                if self.right is None:
+                    self.right = _LiChaoTree(mid + 1, self.hi)
+                self.right.insert(line, lo, hi)
+            return
+        self._insert_full(line)
+
+    def _insert_full(self, line):
+        node = self
+        while True:
+            if node.line is None:
+                node.line = line
+                return
+            mid = (node.lo + node.hi) // 2
+            if self._value(line, mid) > self._value(node.line, mid):
+                node.line, line = line, node.line
+            if node.lo == node.hi:
+                return
+            if self._value(line, node.lo) > self._value(node.line, node.lo):
+                if node.left is None:
+                    node.left = _LiChaoTree(node.lo, mid)
+                node = node.left
+            elif self._value(line, node.hi) > self._value(node.line, node.hi):
+                if node.right is None:
+                    node.right = _LiChaoTree(mid + 1, node.hi)
+                node = node.right
+            else:
+                return
+
+    def query(self, x):
+        """Return (value, payload) of the highest line at x, or (0, None)"""
+        best = (0, None)
+        node = self
+        while node is not None:
+            if node.line is not None:
+                value = self._value(node.line, x)
+                if value > best[0]:
+                    best = (value, node.line[2])
+            mid = (node.lo + node.hi) // 2
+            node = node.left if x <= mid else node.right
+        return best
+
+
+class _PromotionIndex:
+    """Immutable snapshot of the active promotions for one day"""
+
+    def __init__(self, entries, built_for):
+        self.built_for = built_for
+        self.built_at = time.monotonic()
+        # Sorted by break-even order value (where the discount stops growing)
+        self.entries = sorted(entries, key=lambda e: (e.break_even, e.code))
+        self.by_code = {e.code: e for e in self.entries}
+        self.tree = _LiChaoTree(0, MAX_ORDER_CENTS)
+        for entry in self.entries:
+            if entry.auto_apply:
+                self._insert(entry)
+
+    def _insert(self, entry):
+        min_cents = _to_cents(entry.min_order_value)
+        if entry.discount_type == 'percentage':
+            slope = min(float(entry.discount_value) / 100, 1.0)
+            cap = _to_cents(entry.max_discount) if entry.max_discount else None
+        else:
+            slope = 1.0
+            cap = _to_cents(entry.discount_value)
+        if slope <= 0 or cap == 0:
+            return
+
+        if cap is None:
+            self.tree.insert((slope, 0.0, entry), min_cents, MAX_ORDER_CENTS)
+            return
+        break_even = max(min_cents, math.ceil(cap / slope))
+        self.tree.insert((slope, 0.0, entry), min_cents, break_even - 1)
+        self.tree.insert((0.0, float(cap), entry), max(min_cents, break_even), MAX_ORDER_CENTS)
+
+    def best_for(self, order_value):
+        """Return (entry, discount) of the auto-applied promotion with the highest discount"""
+        order_cents = _to_cents(order_value)
+        if order_cents <= 0:
+            return None, Decimal('0')
+        _, entry = self.tree.query(min(order_cents, MAX_ORDER_CENTS))
+        if entry is None:
+            return None, Decimal('0')
+        return entry, calculate_discount(entry, order_value)
+
+    def lookup(self, code, order_value):
+        """Return (entry, discount) for a specific code, or (None, reason) if not applicable"""
+        entry = self.by_code.get(code)
+        if entry is None:
+            return None, 'Promotion is not active'
+        if Decimal(str(order_value)) < (entry.min_order_value or 0):
+            return None, f'Minimum order value is {entry.min_order_value}'
+        return entry, calculate_discount(entry, order_value)
+
+
+class PromotionEngine:
+    """Process-wide access point to the active promotion index"""
+
+    def __init__(self):
+        self._index = None
+        self._dirty = True
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Mark the index stale; it is rebuilt on the next quote"""
+        self._dirty = True
+
+    def _is_stale(self, index):
+        if index is None or self._dirty or index.built_for != date.today():
+            return True
+        ttl = current_app.config.get('PROMOTION_INDEX_TTL', 60)
+        return ttl is not None and time.monotonic() - index.built_at > ttl
+
+    def get_index(self):
+        """Return the current index, rebuilding it when stale"""
+        index = self._index
+        if not self._is_stale(index):
+            return index
+        with self._lock:
+            index = self._index
+            if self._is_stale(index):
+                self._dirty = False
+                index = self._build()
+                self._index = index
+        return index
+
+    def _build(self):
+        today = date.today()
+        rows = db.session.query(
+            Promotion.id, Promotion.code, Promotion.name, Promotion.description,
+            Promotion.discount_type, Promotion.discount_value, Promotion.min_order_value,
+            Promotion.max_discount, Promotion.usage_limit, Promotion.used_count, Promotion.auto_apply
+        ).filter(
+            Promotion.status == 'active',
+            Promotion.start_date <= today,
+            Promotion.end_date >= today,
+            db.or_(
+                Promotion.usage_limit.is_(None),
+                Promotion.usage_limit == 0,
+                db.func.coalesce(Promotion.used_count, 0) < Promotion.usage_limit
+            )
+        ).all()
+
+        entries = []
+        for row in rows:
+            if row.discount_type == 'percentage':
+                rate = row.discount_value / 100
+                break_even = (row.max_discount / rate) if row.max_discount and rate else None
+            else:
+                break_even = row.discount_value
+            entries.append(PromotionEntry(
+                id=row.id, code=row.code, name=row.name, description=row.description,
+                discount_type=row.discount_type, discount_value=row.discount_value,
+                min_order_value=row.min_order_value or Decimal('0'), max_discount=row.max_discount,
+                usage_limit=row.usage_limit, used_count=row.used_count or 0, auto_apply=row.auto_apply,
+                break_even=max(break_even, row.min_order_value or 0) if break_even is not None else Decimal('Infinity')
+            ))
+
+        current_app.logger.info(f"Promotion index rebuilt with {len(entries)} active promotions")
+        return _PromotionIndex(entries, today)
+
+    def best_promotion(self, order_value):
+        """Best auto-applied (entry, discount) for an order value"""
+        return self.get_index().best_for(order_value)
+
+    def promotion_for_code(self, code, order_value):
+        """(entry, discount) for a given code, or (None, reason)"""
+        return self.get_index().lookup(code, order_value)
+
+
+promotion_engine = PromotionEngine()
+
+
+@db.event.listens_for(Promotion, 'after_insert')
+@db.event.listens_for(Promotion, 'after_update')
+@db.event.listens_for(Promotion, 'after_delete')
+def _promotion_written(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info[CHANGED_KEY] = True
+
+
+def _after_commit(session):
+    # Invalidating at flush would let another request rebuild the index
+    # before the write is visible, and keep that stale copy until the TTL
+    if session.info.pop(CHANGED_KEY, False):
+        promotion_engine.invalidate()
+
+
+def _after_soft_rollback(session, previous_transaction):
+    if previous_transaction.nested:
+        return
+    session.info.pop(CHANGED_KEY, None)
+
+
+def init_promotion_engine(app):
+    """Invalidate the index when the sessions that wrote promotions commit (called by create_app)"""
+    if not event.contains(RoutingSession, 'after_commit', _after_commit):
+        event.listen(RoutingSession, 'after_commit', _after_commit)
+        event.listen(RoutingSession, 'after_soft_rollback', _after_soft_rollback)
@@ -0,0 +1,223 @@
+"""
+Promotion usage reservations
+
+Every redemption atomically reserves one use of a promotion before the
+booking is written, with a conditional
+``UPDATE ... SET used_count = used_count + 1 WHERE used_count < limit RETURNING``
+committed on its own, so the row lock is held only for that statement and
+never for the whole checkout.
+
+This is the default (``PROMOTION_USAGE_SHARDS`` = 1) and keeps
+``Promotion.used_count`` exact. Sharding is opt-in for flash sales of one hot
+code: with ``PROMOTION_USAGE_SHARDS`` > 1 the remaining capacity of a promotion is
+split over that many ``promotion_usage_shards`` rows and each reservation hits
+a random shard, spreading concurrent redemptions of one hot code over several
+rows. ``merge_usage`` folds the shard counts back into ``Promotion.used_count``
+and re-splits the remaining capacity; run it periodically with
+``flask promotions merge-usage``. Until then ``used_count`` lags behind, so
+readers that check the usage limit add ``pending_usage``.
+"""
+
+import random
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import update, select, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.extensions import db
+from app.models.promotion import Promotion, PromotionUsageShard
+
+# shard_no is None when the reservation was taken directly on the promotions row
+Reservation = namedtuple('Reservation', ['promotion_id', 'shard_no'])
+
+
+def _shard_count():
+    return max(int(current_app.config.get('PROMOTION_USAGE_SHARDS', 1) or 1), 1)
+
+
+def _split_capacity(remaining, shards):
+    """Split the remaining usage limit over shards (None = unlimited)"""
+    if remaining is None:
+        return [None] * shards
+    remaining = max(remaining, 0)
+    base, extra = divmod(remaining, shards)
+    return [base + (1 if i < extra else 0) for i in range(shards)]
+
+
+def _remaining(promotion):
+    if not promotion.usage_limit:
+        return None
+    return promotion.usage_limit - (promotion.used_count or 0)
+
+
+def _ensure_shards(promotion_id, shards):
+    """Create the shard rows of a promotion if they do not exist yet"""
+    promotion = db.session.get(Promotion, promotion_id)
+    if promotion is None:
+        return False
+    capacities = _split_capacity(_remaining(promotion), shards)
+    db.session.execute(
+        pg_insert(PromotionUsageShard.__table__).values([
+            {'promotion_id': promotion_id, 'shard_no': i, 'used_count': 0, 'capacity': capacities[i]}
+            for i in range(shards)
+        ]).on_conflict_do_nothing()
+    )
+    db.session.commit()
+    return True
+
+
+def _reserve_on_promotion(promotion_id):
+    stmt = update(Promotion).where(
+        Promotion.id == promotion_id,
+        db.or_(
+            Promotion.usage_limit.is_(None),
+            Promotion.usage_limit == 0,
+            func.coalesce(Promotion.used_count, 0) < Promotion.usage_limit
+        )
+    ).values(
+        used_count=func.coalesce(Promotion.used_count, 0) + 1
+    ).returning(Promotion.used_count)
+    row = db.session.execute(stmt).first()
+    db.session.commit()
+    return Reservation(promotion_id, None) if row else None
+
+
+def _reserve_on_shard(promotion_id, shard_no):
+    table = PromotionUsageShard.__table__
+    stmt = update(table).where(
+        table.c.promotion_id == promotion_id,
+        table.c.shard_no == shard_no,
+        db.or_(table.c.capacity.is_(None), table.c.used_count < table.c.capacity)
+    ).values(
+        used_count=table.c.used_count + 1
+    ).returning(table.c.used_count)
+    return db.session.execute(stmt).first() is not None
+
+
+def reserve_usage(promotion_id):
+    """
+    Reserve one use of a promotion
+
+    Commits the current session transaction together with the reservation,
+    so call it before the booking rows are added.
+
+    Returns:
+        Reservation or None when the usage limit is reached
+    """
+    shards = _shard_count()
+    if shards == 1:
+        return _reserve_on_promotion(promotion_id)
+
+    order = list(range(shards))
+    random.shuffle(order)
+    for attempt in range(2):
+        for shard_no in order:
+            if _reserve_on_shard(promotion_id, shard_no):
+                db.session.commit()
+                return Reservation(promotion_id, shard_no)
+        exists = db.session.execute(
+            select(func.count()).select_from(PromotionUsageShard.__table__).where(
+                PromotionUsageShard.promotion_id == promotion_id
+            )
+        ).scalar()
+        db.session.commit()
+        # On the first pass the shards may have been created concurrently
+        # after our updates ran: make sure they exist and try once more
+        if not attempt and not exists and not _ensure_shards(promotion_id, shards):
+            return None
+
+    if exists:
+        # Every shard is full, so the limit is reached: merge now so that
+        # used_count (and the promotion index) reflect the exhaustion
+        merge_usage(promotion_id)
+    return None
+
+
+def release_usage(reservation):
+    """Give back a reservation whose booking was not created"""
+    if reservation is None:
+        return
+    try:
+        released = 0
+        if reservation.shard_no is not None:
+            table = PromotionUsageShard.__table__
+            released = db.session.execute(
+                update(table).where(
+                    table.c.promotion_id == reservation.promotion_id,
+                    table.c.shard_no == reservation.shard_no,
+                    table.c.used_count > 0
+                ).values(used_count=table.c.used_count - 1)
+            ).rowcount
+        if not released:
+            # Direct reservation, or the shard was merged in the meantime
+            db.session.execute(
+                update(Promotion).where(
+                    Promotion.id == reservation.promotion_id,
+                    Promotion.used_count > 0
+                ).values(used_count=Promotion.used_count - 1)
+            )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Failed to release promotion usage {reservation}: {str(e)}")
+
+
+def merge_usage(promotion_id=None):
+    """
+    Fold shard counters into Promotion.used_count and re-split the remaining capacity
+
+    Args:
+        promotion_id: Merge a single promotion, or every sharded promotion if None
+
+    Returns:
+        int: Number of promotions merged
+    """
+    table = PromotionUsageShard.__table__
+    if promotion_id is None:
+        promotion_ids = [row[0] for row in db.session.execute(select(table.c.promotion_id).distinct())]
+    else:
+        promotion_ids = [promotion_id]
+
+    merged = 0
+    for pid in promotion_ids:
+        rows = db.session.execute(
+            select(table.c.shard_no, table.c.used_count).where(
+                table.c.promotion_id == pid
+            ).order_by(table.c.shard_no).with_for_update()
+        ).all()
+        if not rows:
+            db.session.commit()
+            continue
+
+        promotion = db.session.execute(
+            select(Promotion).where(Promotion.id == pid).with_for_update()
+        ).scalar_one_or_none()
+        if promotion is None:
+            db.session.commit()
+            continue
+
+        promotion.used_count = (promotion.used_count or 0) + sum(row.used_count for row in rows)
+        capacities = _split_capacity(_remaining(promotion), len(rows))
+        for row, capacity in zip(rows, capacities):
+            db.session.execute(
+                update(table).where(
+                    table.c.promotion_id == pid,
+                    table.c.shard_no == row.shard_no
+                ).values(used_count=0, capacity=capacity)
+            )
+        db.session.commit()
+        merged += 1
+    return merged
+
+
+def pending_usage(promotion_ids):
+    """Return {promotion_id: not yet merged shard usage} for the given promotions"""
+    if not promotion_ids:
+        return {}
+    rows = db.session.execute(
+        select(PromotionUsageShard.promotion_id, func.sum(PromotionUsageShard.used_count)).where(
+            PromotionUsageShard.promotion_id.in_(promotion_ids)
+        ).group_by(PromotionUsageShard.promotion_id)
+    ).all()
+    return {pid: int(used or 0) for pid, used in rows}
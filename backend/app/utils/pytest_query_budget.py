@@ -0,0 +1,64 @@
+"""
+pytest plugin: fail tests whose requests exceed a query budget or run N+1 queries
+
+Enable it with ``pytest -p app.utils.pytest_query_budget`` or
+``pytest_plugins = ['app.utils.pytest_query_budget']`` in conftest.py. The
+app under test must have ``QUERY_BUDGET_MODE`` set to ``log`` or ``raise``
+(TestingConfig uses ``raise``).
+
+Every violation seen while a test runs fails that test, even when the view
+swallowed the exception, and the terminal summary lists the offending
+endpoints. Mark a test ``@pytest.mark.query_budget_exempt`` to only report
+it, or pass ``--no-query-budget`` to report without failing.
+"""
+
+import pytest
+
+from app.utils.query_budget import add_violation_listener, remove_violation_listener, describe
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('query-budget')
+    group.addoption(
+        '--no-query-budget', action='store_true', default=False,
+        help='report query budget / N+1 violations without failing tests'
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'query_budget_exempt: do not fail this test on query budget violations')
+    config._query_budget_violations = []
+
+
+@pytest.hookimpl(wrapper=True)
+def pytest_runtest_call(item):
+    violations = []
+    add_violation_listener(violations.append)
+    try:
+        result = yield
+    finally:
+        remove_violation_listener(violations.append)
+
+    if violations:
+        item.config._query_budget_violations.extend((item.nodeid, v) for v in violations)
+        strict = not item.config.getoption('--no-query-budget')
+        if strict and item.get_closest_marker('query_budget_exempt') is None:
+            pytest.fail(
+                'Query budget exceeded / N+1 detected:\n' + '\n'.join(describe(v) for v in violations),
+                pytrace=False
+            )
+    return result
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    violations = getattr(config, '_query_budget_violations', [])
+    if not violations:
+        return
+    terminalreporter.section('query budget')
+    by_endpoint = {}
+    for nodeid, violation in violations:
+        by_endpoint.setdefault(violation.endpoint, []).append((nodeid, violation))
+    for endpoint, entries in sorted(by_endpoint.items(), key=lambda item: str(item[0])):
+        worst = max(entries, key=lambda entry: entry[1].count)[1]
+        terminalreporter.write_line(f"{endpoint}: {len(entries)} violation(s), worst run:")
+        terminalreporter.write_line(describe(worst))
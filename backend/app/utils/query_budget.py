@@ -0,0 +1,162 @@
+"""
+Per-request query budgets and N+1 detection (development and tests)
+
+When ``QUERY_BUDGET_MODE`` is ``log`` or ``raise``, every SQL statement of a
+request is counted and fingerprinted (literals and bound parameters replaced
+by ``?``). After the view returns, the request is checked against:
+
+- its budget: ``@query_budget(n)`` on the view, else ``QUERY_BUDGET_DEFAULT``
+  (None = no limit);
+- N+1: the same statement shape executed ``QUERY_REPEAT_THRESHOLD`` times or
+  more, typically a ``Model.query.get`` inside a loop. The report shows the
+  line of application code that issued it.
+
+``log`` writes a warning, ``raise`` raises ``QueryBudgetExceeded`` (tests).
+Either way listeners added with ``add_violation_listener`` are called; the
+pytest plugin (``app.utils.pytest_query_budget``) uses that to fail tests.
+Responses carry ``X-Query-Count`` while the check is enabled.
+"""
+
+import re
+import traceback
+from collections import Counter, namedtuple
+
+from flask import current_app, g, request
+from sqlalchemy import event
+
+from app.extensions import db
+
+QueryViolation = namedtuple('QueryViolation', ['endpoint', 'method', 'path', 'count', 'budget', 'repeated'])
+RepeatedQuery = namedtuple('RepeatedQuery', ['fingerprint', 'count', 'location'])
+
+_listeners = []
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+# Bound parameters (%(name)s, %s, :name, $1) but not casts (::uuid)
+_PARAM = re.compile(r'%\([^)]+\)s|%s|(?<!:):(?!:)[A-Za-z_]\w*|\$\d+|\?')
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\((?:\s*\?\s*,?)+\)', re.IGNORECASE)
+_SPACES = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A request ran more queries than its budget, or the same query shape in a loop"""
+
+    def __init__(self, violation):
+        self.violation = violation
+        super().__init__(describe(violation))
+
+
+def query_budget(max_queries):
+    """
+    Declare how many SQL statements a view may run per request
+
+        @services_bp.route('/', methods=['GET'])
+        @query_budget(5)
+        def get_services(): ...
+    """
+    def decorator(f):
+        f._query_budget = max_queries
+        return f
+    return decorator
+
+
+def fingerprint(statement):
+    """Shape of a statement: literals, parameters and IN lists collapsed"""
+    shape = _STRING.sub('?', statement)
+    shape = _PARAM.sub('?', shape)
+    shape = _NUMBER.sub('?', shape)
+    shape = _IN_LIST.sub('IN (?)', shape)
+    return _SPACES.sub(' ', shape).strip()
+
+
+def _caller():
+    """First frame in application code outside this module and the SQLAlchemy stack"""
+    for frame in reversed(traceback.extract_stack(limit=60)):
+        filename = frame.filename.replace('\\', '/')
+        if '/app/' in filename and '/app/utils/query_budget' not in filename and 'site-packages' not in filename:
+            return f"{filename.rsplit('/app/', 1)[-1]}:{frame.lineno} ({frame.name})"
+    return None
+
+
+def add_violation_listener(listener):
+    """Call listener(QueryViolation) for every violation (used by the pytest plugin)"""
+    _listeners.append(listener)
+
+
+def remove_violation_listener(listener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def describe(violation):
+    lines = [
+        f"{violation.method} {violation.path} ({violation.endpoint}) ran {violation.count} queries"
+        + (f", budget {violation.budget}" if violation.budget is not None else '')
+    ]
+    for repeated in violation.repeated:
+        lines.append(f"  {repeated.count}x at {repeated.location or '?'}: {repeated.fingerprint[:200]}")
+    return '\n'.join(lines)
+
+
+# ===== Hooks =====
+
+def _enabled():
+    return current_app.config.get('QUERY_BUDGET_MODE', 'off') in ('log', 'raise')
+
+
+def _before_request():
+    if _enabled():
+        g._query_shapes = Counter()
+        g._query_locations = {}
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    try:
+        shapes = g._query_shapes
+    except (AttributeError, RuntimeError):
+        # Outside a request, or the check is disabled
+        return
+    shape = fingerprint(statement)
+    shapes[shape] += 1
+    if shapes[shape] == current_app.config.get('QUERY_REPEAT_THRESHOLD', 5):
+        g._query_locations[shape] = _caller()
+
+
+def _after_request(response):
+    shapes = g.pop('_query_shapes', None)
+    if shapes is None:
+        return response
+    locations = g.pop('_query_locations', {})
+    count = sum(shapes.values())
+    response.headers['X-Query-Count'] = str(count)
+
+    view = current_app.view_functions.get(request.endpoint)
+    budget = getattr(view, '_query_budget', current_app.config.get('QUERY_BUDGET_DEFAULT'))
+    threshold = current_app.config.get('QUERY_REPEAT_THRESHOLD', 5)
+    repeated = [
+        RepeatedQuery(shape, times, locations.get(shape))
+        for shape, times in shapes.most_common() if times >= threshold
+    ]
+    if not repeated and (budget is None or count <= budget):
+        return response
+
+    violation = QueryViolation(request.endpoint, request.method, request.path, count, budget, repeated)
+    for listener in list(_listeners):
+        listener(violation)
+    if current_app.config.get('QUERY_BUDGET_MODE') == 'raise':
+        raise QueryBudgetExceeded(violation)
+    current_app.logger.warning(f"Query budget: {describe(violation)}")
+    return response
+
+
+def init_query_budget(app):
+    """Register the request hooks and SQL listener when QUERY_BUDGET_MODE is not 'off'"""
+    if app.config.get('QUERY_BUDGET_MODE', 'off') not in ('log', 'raise'):
+        return
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    with app.app_context():
+        for engine in db.engines.values():
+            if not event.contains(engine, 'after_cursor_execute', _after_cursor_execute):
+                event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
@@ -0,0 +1,173 @@
+"""
+Rating aggregates maintained alongside reviews
+
+Only approved reviews count. Every change to a review (create, edit,
+moderation, delete) is applied as a delta to ``rating_summaries`` (one row
+per service and per staff member) and ``rating_daily_summaries`` (one row per
+booking creation day, for the reports) in the caller's transaction::
+
+    before = contributions(review)
+    review.rating = 4
+    apply_changes(before, contributions(review))
+
+The deltas are single-row upserts (``count = count + 1``), so concurrent
+reviews of the same service serialize on that row only, and reading a
+rating is a primary key lookup instead of an AVG over the reviews.
+``rebuild_summaries`` recomputes everything from the reviews table.
+"""
+
+from collections import Counter, defaultdict
+
+from sqlalchemy import select, delete, insert, func, extract, literal, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.extensions import db
+from app.models.booking import Booking
+from app.models.review import Review, ReviewStatus, RatingSummary, RatingDailySummary
+
+
+def contributions(review, day=None):
+    """
+    What the review currently adds to the aggregates: [((kind, key), rating)]
+
+    day is the creation date of the booking (loaded from review.booking when
+    not given).
+    """
+    if review.status != ReviewStatus.APPROVED:
+        return []
+    if day is None:
+        day = review.booking.created_at.date()
+    items = [(('service', review.service_id), review.rating), (('day', day), review.rating)]
+    if review.staff_id:
+        items.append((('staff', review.staff_id), review.rating))
+    return items
+
+
+def apply_changes(before, after, session=None):
+    """Apply the difference between two contributions() results (the caller commits)"""
+    session = session or db.session
+    deltas = Counter()
+    for target, rating in before:
+        deltas[(target, rating)] -= 1
+    for target, rating in after:
+        deltas[(target, rating)] += 1
+
+    per_target = defaultdict(Counter)
+    for (target, rating), delta in deltas.items():
+        if delta:
+            per_target[target]['review_count'] += delta
+            per_target[target]['rating_sum'] += delta * rating
+            per_target[target][f'rating_{rating}'] += delta
+
+    # Same lock order in every transaction (no deadlock between two reviews)
+    for (kind, key), changes in sorted(per_target.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+        if kind == 'day':
+            table, keys = RatingDailySummary.__table__, {'day': key}
+        else:
+            table, keys = RatingSummary.__table__, {'target_type': kind, 'target_id': key}
+        statement = pg_insert(table).values(**keys, **changes)
+        session.execute(statement.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={
+                **{column: table.c[column] + statement.excluded[column] for column in changes},
+                'updated_at': func.now()
+            }
+        ))
+
+
+def empty_ratings():
+    return {'average': 0, 'count': 0, 'histogram': {str(stars): 0 for stars in range(1, 6)}}
+
+
+def rating_summaries(target_type, ids):
+    """{id: ratings dict} for a page of services or staff (one query)"""
+    ids = [id for id in ids if id is not None]
+    result = {id: empty_ratings() for id in ids}
+    if ids:
+        rows = RatingSummary.query.filter(
+            RatingSummary.target_type == target_type, RatingSummary.target_id.in_(ids)
+        ).all()
+        for row in rows:
+            result[row.target_id] = row.ratings_dict()
+    return result
+
+
+def rating_summary(target_type, id):
+    summary = db.session.get(RatingSummary, (target_type, id))
+    return summary.ratings_dict() if summary else empty_ratings()
+
+
+def period_ratings(start, end, part='day'):
+    """
+    Average rating per day/month/year of booking creation in [start, end)
+
+    Reads the daily summaries only (at most one row per day).
+    """
+    if part == 'day':
+        bucket = RatingDailySummary.day
+    else:
+        bucket = extract(part, RatingDailySummary.day)
+    rows = db.session.execute(
+        select(bucket, func.sum(RatingDailySummary.review_count), func.sum(RatingDailySummary.rating_sum))
+        .where(RatingDailySummary.day >= start, RatingDailySummary.day < end)
+        .group_by(bucket)
+    ).all()
+    return {
+        (key if part == 'day' else int(key)): round(float(total) / count, 2)
+        for key, count, total in rows if count
+    }
+
+
+def overall_rating():
+    """Average of every approved review"""
+    count, total = db.session.execute(
+        select(func.sum(RatingDailySummary.review_count), func.sum(RatingDailySummary.rating_sum))
+    ).one()
+    return round(float(total) / count, 2) if count else 0
+
+
+def _counter_columns(rating):
+    return [
+        func.count().label('review_count'),
+        func.sum(rating).label('rating_sum'),
+        *[func.count().filter(rating == stars).label(f'rating_{stars}') for stars in range(1, 6)],
+        func.now().label('updated_at')
+    ]
+
+
+COUNTER_COLUMNS = ['review_count', 'rating_sum', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5', 'updated_at']
+
+
+def rebuild_summaries():
+    """
+    Recompute every aggregate from the reviews table (commits)
+
+    Review writes wait for the rebuild (SHARE lock on reviews). Returns the
+    number of service, staff and day rows.
+    """
+    session = db.session
+    session.execute(text('LOCK TABLE reviews IN SHARE MODE'))
+    session.execute(delete(RatingSummary))
+    session.execute(delete(RatingDailySummary))
+
+    approved = Review.status == ReviewStatus.APPROVED
+    for target_type, column in (('service', Review.service_id), ('staff', Review.staff_id)):
+        session.execute(insert(RatingSummary).from_select(
+            ['target_type', 'target_id', *COUNTER_COLUMNS],
+            select(literal(target_type), column, *_counter_columns(Review.rating))
+            .where(approved, column.isnot(None)).group_by(column)
+        ))
+    day = func.date(Booking.created_at)
+    session.execute(insert(RatingDailySummary).from_select(
+        ['day', *COUNTER_COLUMNS],
+        select(day, *_counter_columns(Review.rating))
+        .select_from(Review).join(Booking, Booking.id == Review.booking_id)
+        .where(approved).group_by(day)
+    ))
+
+    counts = dict(session.execute(
+        select(RatingSummary.target_type, func.count()).group_by(RatingSummary.target_type)
+    ).all())
+    counts['day'] = session.execute(select(func.count()).select_from(RatingDailySummary)).scalar()
+    session.commit()
+    return counts
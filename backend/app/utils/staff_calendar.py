@@ -0,0 +1,395 @@
+"""
+Staff calendar - each staff member's day, materialized from shifts and bookings
+
+A ``CalendarDay`` gathers, for one staff member and one date:
+
+- the ``staff_schedules`` rows: shifts (``available``), time off (``off``)
+  and times blocked for a booking (``booked``);
+- the non-cancelled bookings the staff member works on, through
+  ``bookings.staff_id`` or ``booking_staff``, with their time window (the
+  longest service duration when ``end_time`` is empty).
+
+``load_days`` builds the days of a set of staff members over a date range
+with one query (a UNION ALL of both sources). Free time is computed when the
+day is rendered: shifts (the ``booking.work_start_hour`` /
+``booking.work_end_hour`` settings when the day has none) minus time off and
+bookings.
+
+Days are cached per worker, per (staff, date), for ``STAFF_CALENDAR_TTL``
+seconds. Writes are recorded on the session by mapper events and drop the
+cached days when the session commits:
+
+- a booking write drops its dates (old and new ``booking_date``), for every
+  staff member, since its assignments may have changed;
+- a ``booking_staff`` write drops the days of that staff member;
+- a ``staff_schedules`` write drops that (staff, date).
+
+Bulk ``UPDATE`` / ``DELETE`` statements do not fire mapper events: callers
+record what they change with ``invalidate_calendar``.
+"""
+
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy import Integer, String, cast, event, func, literal, null, select, true, union, union_all
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import object_session
+
+from app.extensions import db
+from app.models.booking import Booking, BookingItem, BookingStaff
+from app.models.schedule import StaffSchedule
+from app.models.service import Service
+from app.utils.config import runtime_settings
+from app.utils.db_routing import RoutingSession
+from app.utils.staff_locator import DEFAULT_DURATION_MINUTES
+
+CHANGES_KEY = 'staff_calendar_changes'
+
+# Dòng lịch: ca làm, nghỉ, giờ đã chặn cho booking, hoặc booking được phân công
+Entry = namedtuple('Entry', ['kind', 'start', 'end', 'schedule_id', 'booking_id', 'booking_code', 'status', 'label'])
+
+
+def _uuid(value):
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def _clock(minutes):
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+def _subtract(intervals, busy):
+    """Intervals (start, end) minus the busy ones"""
+    result = []
+    busy = sorted(busy)
+    for start, end in sorted(intervals):
+        for busy_start, busy_end in busy:
+            if busy_end <= start or busy_start >= end:
+                continue
+            if busy_start > start:
+                result.append((start, busy_start))
+            start = max(start, busy_end)
+            if start >= end:
+                break
+        if start < end:
+            result.append((start, end))
+    return result
+
+
+class CalendarDay:
+    """Shifts, time off and bookings of one staff member on one date"""
+
+    __slots__ = ('staff_id', 'date', 'shifts', 'time_off', 'bookings')
+
+    def __init__(self, staff_id, date):
+        self.staff_id = staff_id
+        self.date = date
+        self.shifts = []
+        self.time_off = []
+        self.bookings = []
+
+    def add(self, entry):
+        if entry.kind == 'available':
+            self.shifts.append(entry)
+        elif entry.kind == 'off':
+            self.time_off.append(entry)
+        else:
+            self.bookings.append(entry)
+
+    def finish(self):
+        # Giờ 'booked' của một booking đã phân công: chỉ giữ booking
+        assigned = {entry.booking_id for entry in self.bookings if entry.kind == 'booking'}
+        self.bookings = [
+            entry for entry in self.bookings
+            if entry.kind == 'booking' or entry.booking_id is None or entry.booking_id not in assigned
+        ]
+        for entries in (self.shifts, self.time_off, self.bookings):
+            entries.sort(key=lambda entry: (entry.start, entry.end))
+        return self
+
+    def working_hours(self, settings=None):
+        """Shifts as (start, end) minutes; the booking working hours when there is none"""
+        if self.shifts:
+            return [(entry.start, entry.end) for entry in self.shifts]
+        settings = settings or runtime_settings()
+        return [(settings['booking.work_start_hour'] * 60, settings['booking.work_end_hour'] * 60)]
+
+    def free(self, settings=None):
+        """Free intervals (start, end) minutes: working hours minus time off and bookings"""
+        busy = [(entry.start, entry.end) for entry in self.time_off + self.bookings]
+        return _subtract(self.working_hours(settings), busy)
+
+    def is_free(self, start, end, settings=None):
+        return any(free_start <= start and end <= free_end for free_start, free_end in self.free(settings))
+
+    def to_dict(self, settings=None):
+        def entry_dict(entry):
+            result = {'start': _clock(entry.start), 'end': _clock(entry.end)}
+            if entry.schedule_id:
+                result['scheduleId'] = str(entry.schedule_id)
+            if entry.booking_id:
+                result['bookingId'] = str(entry.booking_id)
+            if entry.booking_code:
+                result['bookingCode'] = entry.booking_code
+            if entry.status:
+                result['status'] = entry.status
+            if entry.label:
+                result['label'] = entry.label
+            return result
+
+        return {
+            'staffId': str(self.staff_id),
+            'date': self.date.isoformat(),
+            'defaultShift': not self.shifts,
+            'shifts': [{'start': _clock(start), 'end': _clock(end)} for start, end in self.working_hours(settings)],
+            'timeOff': [entry_dict(entry) for entry in self.time_off],
+            'bookings': [entry_dict(entry) for entry in self.bookings],
+            'free': [{'start': _clock(start), 'end': _clock(end)} for start, end in self.free(settings)]
+        }
+
+
+def _calendar_query(staff_ids, start, end):
+    """Schedule rows and assigned bookings of the staff over [start, end], as one UNION ALL"""
+    schedules = select(
+        cast(StaffSchedule.status, String).label('kind'),
+        StaffSchedule.staff_id.label('staff_id'),
+        StaffSchedule.date.label('day'),
+        StaffSchedule.start_time.label('start_time'),
+        StaffSchedule.end_time.label('end_time'),
+        StaffSchedule.id.label('schedule_id'),
+        StaffSchedule.booking_id.label('booking_id'),
+        cast(null(), String).label('booking_code'),
+        cast(null(), String).label('status'),
+        StaffSchedule.notes.label('label'),
+        cast(null(), Integer).label('duration')
+    ).where(
+        StaffSchedule.date.between(start, end), StaffSchedule.staff_id.in_(staff_ids)
+    )
+
+    # Phân công: bookings.staff_id và booking_staff
+    in_range = (Booking.booking_date.between(start, end), Booking.status != 'cancelled')
+    direct = select(Booking.id.label('booking_id'), Booking.staff_id.label('staff_id')).where(
+        Booking.staff_id.in_(staff_ids), *in_range
+    )
+    shared = select(BookingStaff.booking_id, BookingStaff.staff_id).join(
+        Booking, Booking.id == BookingStaff.booking_id
+    ).where(BookingStaff.staff_id.in_(staff_ids), *in_range)
+    assignments = union(direct, shared).subquery()
+
+    services = select(
+        func.string_agg(Service.name, literal(', ')).label('names'),
+        func.max(Service.duration).label('duration')
+    ).join(
+        BookingItem, BookingItem.service_id == Service.id
+    ).where(
+        BookingItem.booking_id == Booking.id
+    ).lateral()
+
+    bookings = select(
+        literal('booking').label('kind'),
+        assignments.c.staff_id,
+        Booking.booking_date,
+        Booking.booking_time,
+        Booking.end_time,
+        cast(null(), UUID(as_uuid=True)).label('schedule_id'),
+        Booking.id,
+        Booking.booking_code,
+        cast(Booking.status, String),
+        services.c.names,
+        services.c.duration
+    ).join(
+        Booking, Booking.id == assignments.c.booking_id
+    ).outerjoin(services, true())
+
+    return union_all(schedules, bookings)
+
+
+def load_days(staff_ids, start, end, session=None):
+    """
+    {(staff_id, date): CalendarDay} of the staff over [start, end] (one query)
+
+    Days without any schedule row or booking are not in the result.
+    """
+    session = session or db.session
+    days = {}
+    for row in session.execute(_calendar_query(staff_ids, start, end)).all():
+        kind, staff_id, day, start_time, end_time, schedule_id, booking_id, code, status, label, duration = row
+        start_minutes = _minutes(start_time)
+        if end_time is not None and _minutes(end_time) > start_minutes:
+            end_minutes = _minutes(end_time)
+        elif kind == 'booking':
+            end_minutes = start_minutes + (duration or DEFAULT_DURATION_MINUTES)
+        else:
+            # Ca/nghỉ kết thúc lúc 00:00 hôm sau
+            end_minutes = 24 * 60
+        key = (staff_id, day)
+        if key not in days:
+            days[key] = CalendarDay(staff_id, day)
+        days[key].add(Entry(kind, start_minutes, end_minutes, schedule_id, booking_id, code, status, label))
+    return {key: day.finish() for key, day in days.items()}
+
+
+# ===== Cache =====
+
+class CalendarCache:
+    """(staff_id, date) -> CalendarDay with a TTL, per worker"""
+
+    def __init__(self, max_entries=50000):
+        self.max_entries = max_entries
+        self._entries = {}  # date -> {staff_id: (expires, CalendarDay)}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for staff_id, day in keys:
+                entry = self._entries.get(day, {}).get(staff_id)
+                if entry and entry[0] > now:
+                    found[(staff_id, day)] = entry[1]
+        return found
+
+    def put_many(self, days, ttl):
+        expires = time.monotonic() + ttl
+        with self._lock:
+            if self._size + len(days) > self.max_entries:
+                self._entries.clear()
+                self._size = 0
+            for (staff_id, day), calendar_day in days.items():
+                by_staff = self._entries.setdefault(day, {})
+                if staff_id not in by_staff:
+                    self._size += 1
+                by_staff[staff_id] = (expires, calendar_day)
+
+    def invalidate(self, dates=(), staff_ids=(), keys=()):
+        with self._lock:
+            for day in dates:
+                self._size -= len(self._entries.pop(day, {}))
+            for staff_id, day in keys:
+                if self._entries.get(day, {}).pop(staff_id, None):
+                    self._size -= 1
+            if staff_ids:
+                for by_staff in self._entries.values():
+                    for staff_id in staff_ids:
+                        if by_staff.pop(staff_id, None):
+                            self._size -= 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+CALENDAR_CACHE = CalendarCache()
+
+
+def _date_range(start, end):
+    return [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+
+
+def staff_calendar(staff_ids, start, end=None, session=None):
+    """
+    {staff_id: [CalendarDay]} for every staff member and every date of [start, end]
+
+    Cached days are reused; the missing ones are loaded with one query over
+    the staff and dates that miss. Days without any entry are empty days.
+    """
+    end = end or start
+    staff_ids = list(dict.fromkeys(_uuid(staff_id) for staff_id in staff_ids))
+    dates = _date_range(start, end)
+    keys = [(staff_id, day) for staff_id in staff_ids for day in dates]
+    days = CALENDAR_CACHE.get_many(keys)
+
+    missing = [key for key in keys if key not in days]
+    if missing:
+        missing_staff = list({staff_id for staff_id, _ in missing})
+        missing_dates = [day for _, day in missing]
+        loaded = load_days(missing_staff, min(missing_dates), max(missing_dates), session)
+        fresh = {key: loaded.get(key) or CalendarDay(*key).finish() for key in missing}
+        CALENDAR_CACHE.put_many(fresh, current_app.config.get('STAFF_CALENDAR_TTL', 60))
+        days.update(fresh)
+
+    return {staff_id: [days[(staff_id, day)] for day in dates] for staff_id in staff_ids}
+
+
+# ===== Invalidation =====
+
+def _changes(session):
+    return session.info.setdefault(CHANGES_KEY, {'dates': set(), 'staff': set(), 'keys': set()})
+
+
+def invalidate_calendar(dates=(), staff_ids=(), session=None):
+    """
+    Record calendar changes made without mapper events (bulk UPDATE/DELETE)
+
+    The cached days are dropped when the session commits.
+    """
+    changes = _changes(session or db.session)
+    changes['dates'].update(dates)
+    changes['staff'].update(_uuid(staff_id) for staff_id in staff_ids)
+
+
+@db.event.listens_for(Booking, 'after_insert')
+@db.event.listens_for(Booking, 'after_update')
+@db.event.listens_for(Booking, 'after_delete')
+def _booking_written(mapper, connection, target):
+    session = object_session(target)
+    if session is None:
+        return
+    # Ngày cũ khi booking được dời lịch
+    history = db.inspect(target).attrs.booking_date.history
+    changes = _changes(session)
+    changes['dates'].update(day for day in (history.deleted or ()) if day)
+    if target.booking_date:
+        changes['dates'].add(target.booking_date)
+
+
+@db.event.listens_for(BookingStaff, 'after_insert')
+@db.event.listens_for(BookingStaff, 'after_update')
+@db.event.listens_for(BookingStaff, 'after_delete')
+def _assignment_written(mapper, connection, target):
+    session = object_session(target)
+    if session is not None and target.staff_id:
+        _changes(session)['staff'].add(_uuid(target.staff_id))
+
+
+@db.event.listens_for(StaffSchedule, 'after_insert')
+@db.event.listens_for(StaffSchedule, 'after_update')
+@db.event.listens_for(StaffSchedule, 'after_delete')
+def _schedule_written(mapper, connection, target):
+    session = object_session(target)
+    if session is None:
+        return
+    changes = _changes(session)
+    history = db.inspect(target).attrs.date.history
+    for day in (history.deleted or ()):
+        changes['keys'].add((_uuid(target.staff_id), day))
+    changes['keys'].add((_uuid(target.staff_id), target.date))
+
+
+def _after_commit(session):
+    changes = session.info.pop(CHANGES_KEY, None)
+    if changes:
+        CALENDAR_CACHE.invalidate(changes['dates'], changes['staff'], changes['keys'])
+
+
+def _after_soft_rollback(session, previous_transaction):
+    # Savepoint rollbacks (the notification fan-out) keep the changes of the outer transaction
+    if previous_transaction.nested:
+        return
+    session.info.pop(CHANGES_KEY, None)
+
+
+def init_staff_calendar(app):
+    """Drop cached calendar days when the sessions that changed them commit (called by create_app)"""
+    if not event.contains(RoutingSession, 'after_commit', _after_commit):
+        event.listen(RoutingSession, 'after_commit', _after_commit)
+        event.listen(RoutingSession, 'after_soft_rollback', _after_soft_rollback)
@@ -0,0 +1,282 @@
+"""
+Nearest available staff for a booking
+
+Staff home bases are the staff members' default ``user_addresses`` with
+coordinates. ``StaffLocator`` keeps them per worker in a ``GridIndex``
+(rebuilt once a transaction writing User/UserAddress commits and after
+``STAFF_LOCATOR_TTL`` seconds, like the promotion engine).
+
+A ``DayPlan`` is loaded with two queries per booking date: every
+non-cancelled booking of the day with its time window, its location
+(``bookings.address_id``) and its staff (``bookings.staff_id`` and
+``booking_staff``), and the time off of the day (``staff_schedules`` with
+status ``off``). For a booking starting at ``start``, a staff member:
+
+- is available when none of their bookings of the day overlaps
+  [start, end] widened by ``STAFF_TRAVEL_BUFFER_MINUTES`` on both sides, and
+  none of their time off overlaps [start, end];
+- leaves from the location of their last booking of the day that ends before
+  ``start``, or from home when there is none.
+
+``DayPlan.nearest`` merges the k-nearest search over the home bases with one
+over the day's booking locations, accepting each staff member only at the
+point they would leave from. ``DayPlan.assign`` records an assignment so that
+bulk assignment sees the staff busy and moved.
+"""
+
+import threading
+import time
+from collections import namedtuple, defaultdict
+
+from flask import current_app
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import object_session
+
+from app.extensions import db
+from app.models.booking import Booking, BookingItem, BookingStaff
+from app.models.schedule import StaffSchedule
+from app.models.service import Service
+from app.models.user import User, UserAddress
+from app.utils.db_routing import RoutingSession
+from app.utils.geo import GridIndex
+
+StaffEntry = namedtuple('StaffEntry', ['id', 'name', 'latitude', 'longitude'])
+Slot = namedtuple('Slot', ['booking_id', 'start', 'end', 'latitude', 'longitude'])
+Suggestion = namedtuple('Suggestion', ['staff', 'distance_km', 'origin'])
+
+# Thời lượng mặc định khi booking không có end_time và dịch vụ không có duration
+DEFAULT_DURATION_MINUTES = 120
+
+CHANGED_KEY = 'staff_locations_changed'
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+class _StaffIndex:
+    """Immutable snapshot of the active staff and their home bases"""
+
+    def __init__(self, entries, cell_degrees):
+        self.built_at = time.monotonic()
+        self.staff = {entry.id: entry for entry in entries}
+        self.homes = GridIndex(cell_degrees)
+        for entry in entries:
+            if entry.latitude is not None and entry.longitude is not None:
+                self.homes.insert(entry.latitude, entry.longitude, entry.id)
+
+
+class StaffLocator:
+    """Process-wide access point to the staff home index"""
+
+    def __init__(self):
+        self._index = None
+        self._dirty = True
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Mark the index stale; it is rebuilt on the next lookup"""
+        self._dirty = True
+
+    def _is_stale(self, index):
+        if index is None or self._dirty:
+            return True
+        ttl = current_app.config.get('STAFF_LOCATOR_TTL', 300)
+        return ttl is not None and time.monotonic() - index.built_at > ttl
+
+    def get_index(self):
+        """Return the current index, rebuilding it when stale"""
+        index = self._index
+        if not self._is_stale(index):
+            return index
+        with self._lock:
+            index = self._index
+            if self._is_stale(index):
+                self._dirty = False
+                index = self._build()
+                self._index = index
+        return index
+
+    def _build(self):
+        # Địa chỉ mặc định (hoặc mới nhất) có toạ độ của mỗi nhân viên
+        home = select(
+            UserAddress.user_id, UserAddress.latitude, UserAddress.longitude
+        ).where(
+            UserAddress.latitude.isnot(None), UserAddress.longitude.isnot(None)
+        ).distinct(UserAddress.user_id).order_by(
+            UserAddress.user_id, UserAddress.is_default.desc().nullslast(), UserAddress.created_at.desc()
+        ).subquery()
+        rows = db.session.query(
+            User.id, User.name, home.c.latitude, home.c.longitude
+        ).outerjoin(home, home.c.user_id == User.id).filter(
+            User.role == 'staff', User.status == 'active'
+        ).all()
+
+        entries = [
+            StaffEntry(row.id, row.name,
+                       float(row.latitude) if row.latitude is not None else None,
+                       float(row.longitude) if row.longitude is not None else None)
+            for row in rows
+        ]
+        index = _StaffIndex(entries, current_app.config.get('STAFF_GRID_CELL_DEGREES', 0.01))
+        current_app.logger.info(f"Staff locator rebuilt with {len(entries)} staff, {index.homes.size} with a home base")
+        return index
+
+    def day_plan(self, day):
+        """Bookings, time off and staff positions of one date (two queries)"""
+        return DayPlan(self.get_index(), day, _load_slots(day), _load_time_off(day))
+
+
+staff_locator = StaffLocator()
+
+
+def _load_slots(day):
+    """{booking_id: (Slot, staff ids)} of the non-cancelled bookings of a day"""
+    rows = db.session.query(
+        Booking.id, Booking.booking_time, Booking.end_time, Booking.staff_id,
+        UserAddress.latitude, UserAddress.longitude,
+        func.max(Service.duration),
+        func.array_remove(func.array_agg(func.distinct(BookingStaff.staff_id)), None)
+    ).outerjoin(
+        UserAddress, UserAddress.id == Booking.address_id
+    ).outerjoin(
+        BookingStaff, BookingStaff.booking_id == Booking.id
+    ).outerjoin(
+        BookingItem, BookingItem.booking_id == Booking.id
+    ).outerjoin(
+        Service, Service.id == BookingItem.service_id
+    ).filter(
+        Booking.booking_date == day, Booking.status != 'cancelled'
+    ).group_by(Booking.id, UserAddress.latitude, UserAddress.longitude).all()
+
+    slots = {}
+    for booking_id, start, end, staff_id, latitude, longitude, duration, assigned in rows:
+        start_minutes = _minutes(start)
+        if end is not None and _minutes(end) > start_minutes:
+            end_minutes = _minutes(end)
+        else:
+            end_minutes = start_minutes + (duration or DEFAULT_DURATION_MINUTES)
+        slot = Slot(booking_id, start_minutes, end_minutes,
+                    float(latitude) if latitude is not None else None,
+                    float(longitude) if longitude is not None else None)
+        staff_ids = set(assigned or [])
+        if staff_id:
+            staff_ids.add(staff_id)
+        slots[booking_id] = (slot, staff_ids)
+    return slots
+
+
+def _load_time_off(day):
+    """{staff_id: [(start, end)]} minutes of the day of the staff_schedules 'off' entries of a day"""
+    time_off = defaultdict(list)
+    for staff_id, start, end in db.session.query(
+        StaffSchedule.staff_id, StaffSchedule.start_time, StaffSchedule.end_time
+    ).filter(StaffSchedule.date == day, StaffSchedule.status == 'off'):
+        time_off[staff_id].append((_minutes(start), _minutes(end)))
+    return time_off
+
+
+class DayPlan:
+    """Staff schedules and positions on one date"""
+
+    def __init__(self, index, day, slots, time_off=None):
+        self.index = index
+        self.day = day
+        self.slots = slots
+        self.time_off = time_off or {}
+        self.buffer = current_app.config.get('STAFF_TRAVEL_BUFFER_MINUTES', 30)
+        self.schedule = defaultdict(list)  # staff_id -> [Slot]
+        self.stops = GridIndex(index.homes.cell)
+        for slot, staff_ids in slots.values():
+            for staff_id in staff_ids:
+                self._add(staff_id, slot)
+
+    def _add(self, staff_id, slot):
+        self.schedule[staff_id].append(slot)
+        if slot.latitude is not None and slot.longitude is not None:
+            self.stops.insert(slot.latitude, slot.longitude, (staff_id, slot.booking_id))
+
+    def is_free(self, staff_id, start, end, ignore=None):
+        return all(
+            slot.booking_id == ignore or slot.end + self.buffer <= start or end + self.buffer <= slot.start
+            for slot in self.schedule.get(staff_id, ())
+        ) and all(off_end <= start or end <= off_start for off_start, off_end in self.time_off.get(staff_id, ()))
+
+    def origin(self, staff_id, start, ignore=None):
+        """Slot the staff member leaves from to start at `start` (None = from home)"""
+        previous = [
+            slot for slot in self.schedule.get(staff_id, ())
+            if slot.booking_id != ignore and slot.end <= start and slot.latitude is not None
+        ]
+        return max(previous, key=lambda slot: slot.end) if previous else None
+
+    def window(self, booking_id):
+        slot, _ = self.slots[booking_id]
+        return slot
+
+    def nearest(self, latitude, longitude, start, end, k=5, ignore=None, max_km=None):
+        """
+        The k nearest staff free during [start, end] (minutes of the day)
+
+        ignore is the booking being assigned (its current staff stay candidates).
+        Returns [Suggestion], nearest first.
+        """
+        index = self.index
+
+        def at_home(staff_id):
+            return staff_id in index.staff and self.is_free(staff_id, start, end, ignore) \
+                and self.origin(staff_id, start, ignore) is None
+
+        def at_stop(payload):
+            staff_id, booking_id = payload
+            if staff_id not in index.staff or not self.is_free(staff_id, start, end, ignore):
+                return False
+            origin = self.origin(staff_id, start, ignore)
+            return origin is not None and origin.booking_id == booking_id
+
+        found = [(distance, staff_id, 'home') for distance, staff_id in
+                 index.homes.knn(latitude, longitude, k, at_home, max_km)]
+        # Only booking locations closer than the k-th nearest home can change the result
+        if len(found) == k:
+            max_km = found[-1][0] if max_km is None else min(max_km, found[-1][0])
+        found += [(distance, payload[0], 'booking') for distance, payload in
+                  self.stops.knn(latitude, longitude, k, at_stop, max_km)]
+        found.sort(key=lambda item: item[0])
+        return [Suggestion(index.staff[staff_id], distance, origin) for distance, staff_id, origin in found[:k]]
+
+    def assign(self, booking_id, staff_id):
+        """Record an assignment made by the caller"""
+        slot, staff_ids = self.slots[booking_id]
+        if staff_id not in staff_ids:
+            staff_ids.add(staff_id)
+            self._add(staff_id, slot)
+
+
+@db.event.listens_for(User, 'after_insert')
+@db.event.listens_for(User, 'after_update')
+@db.event.listens_for(User, 'after_delete')
+@db.event.listens_for(UserAddress, 'after_insert')
+@db.event.listens_for(UserAddress, 'after_update')
+@db.event.listens_for(UserAddress, 'after_delete')
+def _staff_written(mapper, connection, target):
+    session = object_session(target)
+    if session is not None and (isinstance(target, UserAddress) or target.role == 'staff'):
+        session.info[CHANGED_KEY] = True
+
+
+def _after_commit(session):
+    if session.info.pop(CHANGED_KEY, False):
+        staff_locator.invalidate()
+
+
+def _after_soft_rollback(session, previous_transaction):
+    if previous_transaction.nested:
+        return
+    session.info.pop(CHANGED_KEY, None)
+
+
+def init_staff_locator(app):
+    """Invalidate the index when the sessions that wrote staff or addresses commit (called by create_app)"""
+    if not event.contains(RoutingSession, 'after_commit', _after_commit):
+        event.listen(RoutingSession, 'after_commit', _after_commit)
+        event.listen(RoutingSession, 'after_soft_rollback', _after_soft_rollback)
@@ -0,0 +1,217 @@
+"""
+Streaming multipart upload handling
+
+``request.files`` makes Werkzeug read and spool the whole request body before
+the view can look at the file. ``receive_upload`` instead reads the raw body
+in ``UPLOAD_CHUNK_SIZE`` chunks through Werkzeug's incremental multipart
+decoder and rejects the upload as soon as it can:
+
+- before reading anything, when Content-Length is already too large;
+- on the part headers, when the file extension is not allowed;
+- on the first KB of the file, when its magic bytes are not an allowed type;
+- as soon as the file grows past ``max_size``.
+
+Accepted files are spooled to a temporary file (in memory up to
+``UPLOAD_SPOOL_SIZE``). ``upload_slot`` limits how many uploads one user can
+have in flight in a worker (``UPLOAD_MAX_CONCURRENT_PER_USER``), which bounds
+the memory a single user can hold with parallel or abusive uploads.
+"""
+
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from flask import current_app, request
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, NEED_DATA, File, Field, Data, Epilogue
+
+from app.utils.errors import APIError
+
+# Bytes sniffed before any data is accepted
+SNIFF_SIZE = 1024
+
+# Slack for the multipart framing and small form fields around the file
+MULTIPART_OVERHEAD = 64 * 1024
+
+IMAGE_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp'}
+
+_active_uploads = {}
+_active_lock = threading.Lock()
+
+
+class UploadRejected(APIError):
+    """The upload was refused (status_code 400, 413 or 429)"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message, status_code=status_code)
+
+
+def sniff_content_type(head):
+    """Detect the file type from its first bytes (None if unknown)"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+@contextmanager
+def upload_slot(user_id):
+    """Reserve one of the user's concurrent upload slots in this worker, or raise 429"""
+    limit = current_app.config.get('UPLOAD_MAX_CONCURRENT_PER_USER', 2)
+    key = str(user_id)
+    with _active_lock:
+        if limit and _active_uploads.get(key, 0) >= limit:
+            raise UploadRejected('Too many uploads in progress, please wait', 429)
+        _active_uploads[key] = _active_uploads.get(key, 0) + 1
+    try:
+        yield
+    finally:
+        with _active_lock:
+            remaining = _active_uploads.get(key, 1) - 1
+            if remaining:
+                _active_uploads[key] = remaining
+            else:
+                _active_uploads.pop(key, None)
+
+
+class ReceivedUpload:
+    """An accepted file spooled to a temporary file; use as a context manager"""
+
+    def __init__(self, filename, content_type, size, file, fields):
+        self.filename = filename
+        self.content_type = content_type
+        self.size = size
+        self.file = file
+        self.fields = fields
+
+    def read(self):
+        self.file.seek(0)
+        return self.file.read()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _extension(filename):
+    return os.path.splitext(filename or '')[1].lstrip('.').lower()
+
+
+def receive_upload(field_name, max_size, allowed_types=IMAGE_TYPES, allowed_extensions=None):
+    """
+    Read the multipart request body, keeping only the file in field_name
+
+    Must be called before anything accesses request.form / request.files.
+
+    Args:
+        field_name: Form field of the file
+        max_size: Maximum file size in bytes
+        allowed_types: Content types accepted after sniffing the magic bytes
+        allowed_extensions: Optional set of accepted file name extensions
+
+    Returns:
+        ReceivedUpload (other small form fields are in .fields)
+
+    Raises:
+        UploadRejected
+    """
+    mimetype, options = parse_options_header(request.headers.get('Content-Type', ''))
+    boundary = options.get('boundary')
+    if mimetype != 'multipart/form-data' or not boundary:
+        raise UploadRejected('Expected a multipart/form-data upload')
+
+    if request.content_length and request.content_length > max_size + MULTIPART_OVERHEAD:
+        raise UploadRejected(f'File too large. Maximum size is {max_size // (1024 * 1024)}MB.', 413)
+
+    config = current_app.config
+    chunk_size = config.get('UPLOAD_CHUNK_SIZE', 64 * 1024)
+    decoder = MultipartDecoder(boundary.encode('latin-1'), max_form_memory_size=MULTIPART_OVERHEAD)
+    stream = request.stream
+
+    upload = None
+    fields = {}
+    part = None  # 'file', 'field' or 'skip'
+    field_buffer = []
+    head = b''
+    sniffed = False
+    size = 0
+
+    try:
+        while True:
+            event = decoder.next_event()
+            if event is NEED_DATA:
+                chunk = stream.read(chunk_size)
+                decoder.receive_data(chunk or None)
+                continue
+
+            if isinstance(event, File):
+                if event.name != field_name or upload is not None:
+                    part = 'skip'
+                    continue
+                if not event.filename:
+                    raise UploadRejected('No file selected')
+                if allowed_extensions and _extension(event.filename) not in allowed_extensions:
+                    raise UploadRejected('Invalid file type. Only images are allowed.')
+                upload = ReceivedUpload(
+                    event.filename, None, 0,
+                    tempfile.SpooledTemporaryFile(max_size=config.get('UPLOAD_SPOOL_SIZE', 512 * 1024)),
+                    fields
+                )
+                part = 'file'
+            elif isinstance(event, Field):
+                part = 'field'
+                field_name_current = event.name
+                field_buffer = []
+            elif isinstance(event, Data):
+                if part == 'file':
+                    size += len(event.data)
+                    if size > max_size:
+                        raise UploadRejected(f'File too large. Maximum size is {max_size // (1024 * 1024)}MB.', 413)
+                    if not sniffed:
+                        head += event.data
+                        if len(head) < SNIFF_SIZE and event.more_data:
+                            continue
+                        upload.content_type = sniff_content_type(head)
+                        if upload.content_type not in allowed_types:
+                            raise UploadRejected('Invalid file type. Only images are allowed.')
+                        sniffed = True
+                        upload.file.write(head)
+                    else:
+                        upload.file.write(event.data)
+                    if not event.more_data:
+                        part = None
+                elif part == 'field':
+                    field_buffer.append(event.data)
+                    if not event.more_data:
+                        fields[field_name_current] = b''.join(field_buffer).decode('utf-8', 'replace')
+                        part = None
+            elif isinstance(event, Epilogue):
+                break
+    except UploadRejected:
+        if upload is not None:
+            upload.close()
+        raise
+    except ValueError as e:
+        # Malformed multipart body
+        if upload is not None:
+            upload.close()
+        raise UploadRejected(f'Invalid upload: {str(e)}')
+
+    if upload is None or size == 0:
+        if upload is not None:
+            upload.close()
+        raise UploadRejected('No file provided')
+    upload.size = size
+    upload.file.seek(0)
+    return upload
@@ -0,0 +1,278 @@
+"""
+Endpoint benchmark: latency percentiles and queries per request of the main API calls
+
+Runs each scenario (catalog, my-bookings, create_booking, admin lists,
+reports) sequentially against a database seeded by benchmarks/seed_data.py
+and records p50/p95/p99 latency and SQL queries per request. Results are
+compared with benchmarks/baseline.json: a scenario regresses when its query
+count grows, or when its p95 grows by more than --tolerance (and by more
+than --min-delta-ms, to ignore noise on fast endpoints).
+
+By default requests go through the Flask test client in this process, and
+queries are counted with a SQLAlchemy cursor listener. With --url the
+requests go over HTTP to a running server; queries per request are then read
+from the X-Query-Count header (server started with QUERY_BUDGET_MODE=log).
+
+Usage (against the database seeded by seed_data.py):
+    DATABASE_URL=postgresql://... python benchmarks/seed_data.py --bookings 100000 --reset
+    DATABASE_URL=postgresql://... python benchmarks/endpoints.py --iterations 200
+    DATABASE_URL=postgresql://... python benchmarks/endpoints.py --update-baseline
+    python benchmarks/endpoints.py --url http://127.0.0.1:8000 --scenarios catalog.services
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import urllib.error
+import urllib.request
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seed_data import ADMIN_EMAIL, CUSTOMER_EMAIL, WRITER_EMAIL, PASSWORD, SERVICE_NAME_PREFIX
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def scenarios(service_id):
+    """name -> (method, path or callable(i) -> path, account, json body or callable(i) -> body)"""
+    today = date.today()
+    start = (today - timedelta(days=30)).isoformat()
+    end = today.isoformat()
+
+    def new_booking(i):
+        # A different day and slot per call so bookings never collide
+        return {
+            'service_id': service_id,
+            'booking_date': (today + timedelta(days=7 + i // 16)).isoformat(),
+            'booking_time': f'{8 + (i % 16) // 2:02d}:{30 * (i % 2):02d}',
+            'customer_address': '1 Đường Benchmark, Quận 1, TP.HCM',
+            'payment_method': 'cash',
+        }
+
+    return {
+        'catalog.services': ('GET', '/api/services/', None, None),
+        'catalog.categories': ('GET', '/api/services/categories', None, None),
+        'catalog.featured': ('GET', '/api/services/featured', None, None),
+        'catalog.service_detail': ('GET', f'/api/services/{service_id}', None, None),
+        'bookings.mine': ('GET', '/api/bookings/my-bookings', 'customer', None),
+        'bookings.create': ('POST', '/api/bookings/', 'writer', new_booking),
+        'admin.stats': ('GET', '/api/admin/stats', 'admin', None),
+        'admin.bookings': ('GET', '/api/admin/bookings?page=1&limit=20', 'admin', None),
+        'admin.bookings_deep_page': ('GET', '/api/admin/bookings?page=200&limit=20', 'admin', None),
+        'admin.users': ('GET', '/api/admin/users?page=1&limit=20', 'admin', None),
+        'admin.staff': ('GET', '/api/admin/staff', 'admin', None),
+        'reports.overview': ('GET', '/api/reports/', 'admin', None),
+        'reports.daily': ('GET', f'/api/admin/reports/daily?start={start}&end={end}', 'admin', None),
+        'reports.monthly': ('GET', f'/api/admin/reports/monthly?year={today.year}&month={today.month}', 'admin', None),
+        'reports.revenue': ('GET', f'/api/admin/revenue?start={start}&end={end}', 'admin', None),
+    }
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+class InProcessClient:
+    """Flask test client; queries counted with a cursor listener on every engine"""
+
+    def __init__(self):
+        from config import config, DevelopmentConfig
+        from app import create_app
+        from app.extensions import db
+        from sqlalchemy import event
+
+        config['benchmark'] = type('BenchmarkConfig', (DevelopmentConfig,), {
+            'DEBUG': False, 'QUERY_BUDGET_MODE': 'off', 'SQLALCHEMY_ECHO': False,
+        })
+        self.app = create_app('benchmark')
+        self.app.logger.setLevel('ERROR')
+        self.client = self.app.test_client()
+        self.queries = 0
+
+        def count(*args):
+            self.queries += 1
+
+        with self.app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'after_cursor_execute', count)
+            # Seeded bookings only (BK...), not those added by bookings.create
+            self.bookings = db.session.execute(db.text("SELECT count(*) FROM bookings WHERE booking_code LIKE 'BK%'")).scalar()
+            self.service_id = db.session.execute(db.text(
+                "SELECT id FROM services WHERE status = 'active' AND slug LIKE 'bench-service-%' ORDER BY slug LIMIT 1"
+            )).scalar()
+
+    def request(self, method, path, headers, body):
+        self.queries = 0
+        started = time.perf_counter()
+        response = self.client.open(path, method=method, headers=headers, json=body)
+        elapsed = time.perf_counter() - started
+        return response.status_code, elapsed, self.queries, response.get_json(silent=True)
+
+
+class HttpClient:
+    """Plain HTTP against a running server; queries from X-Query-Count"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.bookings = None
+        _, _, _, data = self.request('GET', '/api/services/?isActive=true&limit=100', {}, None)
+        # Seeded services are named "Dịch vụ 001"... (the list does not return slugs)
+        bench = sorted((s for s in data or [] if s.get('name', '').startswith(SERVICE_NAME_PREFIX)),
+                       key=lambda s: s['name'])
+        self.service_id = bench[0]['id'] if bench else None
+
+    def request(self, method, path, headers, body):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                         headers={**headers, 'Content-Type': 'application/json'})
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                payload, status, header = response.read(), response.status, response.headers
+        except urllib.error.HTTPError as e:
+            payload, status, header = e.read(), e.code, e.headers
+        elapsed = time.perf_counter() - started
+        queries = header.get('X-Query-Count')
+        try:
+            payload = json.loads(payload)
+        except ValueError:
+            payload = None
+        return status, elapsed, int(queries) if queries is not None else None, payload
+
+
+def login(client, email):
+    status, _, _, data = client.request('POST', '/api/auth/login', {}, {'email': email, 'password': PASSWORD})
+    if status != 200 or not data or 'access_token' not in data:
+        raise SystemExit(f'Cannot log in as {email} (status {status}); seed the database with seed_data.py first')
+    return {'Authorization': f"Bearer {data['access_token']}"}
+
+
+def run_scenario(client, headers, method, path, body, iterations, warmup):
+    latencies, queries, statuses = [], [], {}
+    for i in range(warmup + iterations):
+        url = path(i) if callable(path) else path
+        payload = body(i) if callable(body) else body
+        status, elapsed, count, _ = client.request(method, url, headers, payload)
+        if i < warmup:
+            continue
+        latencies.append(elapsed * 1000)
+        if count is not None:
+            queries.append(count)
+        statuses[status] = statuses.get(status, 0) + 1
+    return {
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'queries': max(queries) if queries else None,
+        'errors': sum(n for status, n in statuses.items() if status >= 400),
+        'statuses': {str(status): n for status, n in sorted(statuses.items())},
+    }
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """Lines for the report and the names of regressed scenarios"""
+    regressions = []
+    lines = [f"{'scenario':<26}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'errors':>8}   vs baseline p95 / queries"]
+    for name, result in results.items():
+        line = (f"{name:<26}{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+                f"{str(result['queries']):>9}{result['errors']:>8}")
+        base = baseline.get(name)
+        if base:
+            change = (result['p95_ms'] - base['p95_ms']) / base['p95_ms'] if base['p95_ms'] else 0
+            slower = change > tolerance and result['p95_ms'] - base['p95_ms'] > min_delta_ms
+            more_queries = (result['queries'] is not None and base.get('queries') is not None
+                            and result['queries'] > base['queries'])
+            line += f"   {change:+.0%} / {base.get('queries')}"
+            if slower or more_queries or result['errors'] > base.get('errors', 0):
+                line += '  REGRESSION'
+                regressions.append(name)
+        else:
+            line += '   (new)'
+        lines.append(line)
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--scenarios', nargs='+', help='run only these scenarios (default: all)')
+    parser.add_argument('--url', help='benchmark a running server instead of the in-process app')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--update-baseline', action='store_true', help='record the results in the baseline (other scenarios are kept)')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 growth (0.25 = +25%%)')
+    parser.add_argument('--min-delta-ms', type=float, default=2.0, help='ignore p95 changes smaller than this')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    client = HttpClient(args.url) if args.url else InProcessClient()
+    if client.service_id is None:
+        raise SystemExit('No benchmark services found; seed the database with seed_data.py first')
+    accounts = {
+        None: {},
+        'customer': login(client, CUSTOMER_EMAIL),
+        # Bookings created by the benchmark go to another customer so bookings.mine stays comparable
+        'writer': login(client, WRITER_EMAIL),
+        'admin': login(client, ADMIN_EMAIL),
+    }
+
+    available = scenarios(str(client.service_id))
+    selected = args.scenarios or list(available)
+    unknown = [name for name in selected if name not in available]
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(unknown)} (available: {', '.join(available)})")
+
+    results = {}
+    for name in selected:
+        method, path, account, body = available[name]
+        results[name] = run_scenario(client, accounts[account], method, path, body, args.iterations, args.warmup)
+
+    meta = {
+        'bookings': client.bookings,
+        'iterations': args.iterations,
+        'mode': 'http' if args.url else 'in-process',
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'date': date.today().isoformat(),
+    }
+    report = {'meta': meta, 'scenarios': results}
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            stored = json.load(f)
+        baseline = stored.get('scenarios', {})
+        if stored.get('meta', {}).get('bookings') != meta['bookings']:
+            print(f"warning: baseline was recorded with {stored.get('meta', {}).get('bookings')} bookings, "
+                  f"this database has {meta['bookings']}")
+
+    lines, regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+    print('\n'.join(lines))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.update_baseline:
+        # Scenarios not run this time keep their recorded values
+        stored = {'meta': meta, 'scenarios': {**baseline, **results}}
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(stored, f, indent=2, ensure_ascii=False)
+            f.write('\n')
+        print(f'baseline written to {args.baseline}')
+        return
+
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
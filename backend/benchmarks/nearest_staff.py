@@ -0,0 +1,131 @@
+"""
+Nearest-staff benchmark: k-nearest queries over 100k addresses
+
+Generates reproducible home bases around Hà Nội, Đà Nẵng and TP.HCM (same
+--seed, same points), then measures:
+
+- ``GridIndex.knn`` against a brute-force haversine scan, checking that both
+  return the same distances;
+- ``DayPlan.nearest`` (availability + position of each staff member during
+  the day) with part of the staff already booked.
+
+No database is needed: the indexes are built directly from the generated
+points.
+
+Usage:
+    python benchmarks/nearest_staff.py --points 100000 --queries 2000 -k 5 --cell 0.01
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.utils.geo import GridIndex, haversine_km
+from app.utils.staff_locator import DayPlan, Slot, StaffEntry, _StaffIndex
+
+# (lat, lng, spread in degrees, share of the points)
+CITIES = [(21.0285, 105.8542, 0.15, 0.4), (16.0544, 108.2022, 0.08, 0.15), (10.7769, 106.7009, 0.18, 0.45)]
+
+
+def random_point(rng):
+    lat, lng, spread, _ = rng.choices(CITIES, weights=[city[3] for city in CITIES])[0]
+    return rng.gauss(lat, spread), rng.gauss(lng, spread)
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {
+        'p50': statistics.median(samples),
+        'p95': samples[int(len(samples) * 0.95) - 1],
+        'p99': samples[int(len(samples) * 0.99) - 1],
+    }
+
+
+def report(name, timings):
+    stats = percentiles([t * 1000 for t in timings])
+    print(f"{name:<28} p50 {stats['p50']:8.3f} ms   p95 {stats['p95']:8.3f} ms   p99 {stats['p99']:8.3f} ms")
+
+
+def bench_grid(points, queries, k, cell, brute):
+    started = time.perf_counter()
+    grid = GridIndex(cell)
+    for i, (lat, lng) in enumerate(points):
+        grid.insert(lat, lng, i)
+    print(f"Built grid of {len(points)} points in {time.perf_counter() - started:.2f}s ({len(grid.cells)} cells)")
+
+    grid_times, brute_times, mismatches = [], [], 0
+    for index, (lat, lng) in enumerate(queries):
+        started = time.perf_counter()
+        found = grid.knn(lat, lng, k)
+        grid_times.append(time.perf_counter() - started)
+
+        # Brute force on a sample only (it is slow at 100k points)
+        if index < brute:
+            started = time.perf_counter()
+            expected = sorted(haversine_km(lat, lng, p_lat, p_lng) for p_lat, p_lng in points)[:k]
+            brute_times.append(time.perf_counter() - started)
+            if [round(d, 9) for d, _ in found] != [round(d, 9) for d in expected]:
+                mismatches += 1
+
+    report(f'grid knn (k={k})', grid_times)
+    report('brute force', brute_times)
+    print(f"Mismatches against brute force: {mismatches}/{min(len(queries), brute)}")
+    return mismatches
+
+
+def bench_day_plan(points, queries, k, cell, booked_share, rng):
+    app = create_app('testing')
+    with app.app_context():
+        entries = [StaffEntry(uuid.UUID(int=i + 1), f'Staff {i}', lat, lng) for i, (lat, lng) in enumerate(points)]
+        index = _StaffIndex(entries, cell)
+
+        # Part of the staff already has a morning booking near home
+        slots = {}
+        for entry in rng.sample(entries, int(len(entries) * booked_share)):
+            booking_id = uuid.uuid4()
+            start = rng.randrange(8 * 60, 12 * 60, 30)
+            slot = Slot(booking_id, start, start + 120,
+                        entry.latitude + rng.gauss(0, 0.02), entry.longitude + rng.gauss(0, 0.02))
+            slots[booking_id] = (slot, {entry.id})
+        started = time.perf_counter()
+        plan = DayPlan(index, None, slots)
+        print(f"Day plan with {len(slots)} bookings built in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+        timings = []
+        for lat, lng in queries:
+            start = rng.randrange(8 * 60, 16 * 60, 30)
+            began = time.perf_counter()
+            plan.nearest(lat, lng, start, start + 120, k=k)
+            timings.append(time.perf_counter() - began)
+        report(f'day plan nearest (k={k})', timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--points', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--cell', type=float, default=0.01, help='Grid cell size in degrees (STAFF_GRID_CELL_DEGREES)')
+    parser.add_argument('--booked', type=float, default=0.3, help='Share of staff with a booking that day')
+    parser.add_argument('--brute', type=int, default=200, help='Queries also answered by brute force to check the results')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    points = [random_point(rng) for _ in range(args.points)]
+    queries = [random_point(rng) for _ in range(args.queries)]
+
+    mismatches = bench_grid(points, queries, args.k, args.cell, args.brute)
+    bench_day_plan(points, queries, args.k, args.cell, args.booked, rng)
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Flash-sale benchmark: thousands of concurrent create_booking calls against one promotion code
+
+Seeds one service, a pool of customers and a promotion with a usage limit, then
+fires concurrent POST /api/bookings/ requests that all use the same code.
+It reports throughput and checks that the promotion was never over-redeemed.
+
+Usage (against a disposable PostgreSQL database):
+    DATABASE_URL=postgresql://... python benchmarks/promotion_flash_sale.py \
+        --requests 2000 --workers 32 --limit 500 --shards 1 8
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config, DevelopmentConfig
+from app import create_app
+from app.extensions import db
+
+
+def build_app(workers):
+    """App with a connection pool large enough for every worker thread"""
+    config['benchmark'] = type('BenchmarkConfig', (DevelopmentConfig,), {
+        'DEBUG': False,
+        'SQLALCHEMY_ENGINE_OPTIONS': {'pool_size': workers + 2, 'max_overflow': 0},
+    })
+    return create_app('benchmark')
+
+
+def seed(app, customers, limit):
+    """Create the service, customers and promotion used by one run"""
+    from flask_jwt_extended import create_access_token
+    from app.models.user import User
+    from app.models.service import Service
+    from app.models.promotion import Promotion
+
+    run_id = uuid.uuid4().hex[:8]
+    with app.app_context():
+        db.create_all()
+        service = Service(name=f'Flash sale {run_id}', slug=f'flash-sale-{run_id}', price=500000, duration=60)
+        promotion = Promotion(
+            code=f'FLASH{run_id}'.upper(), name='Flash sale', discount_type='percentage',
+            discount_value=20, min_order_value=0, start_date=date.today(),
+            end_date=date.today() + timedelta(days=1), usage_limit=limit, used_count=0
+        )
+        users = [User(name=f'Customer {i}', email=f'flash-{run_id}-{i}@example.com') for i in range(customers)]
+        for user in users:
+            user.password = 'benchmark'
+        db.session.add_all([service, promotion, *users])
+        db.session.commit()
+        tokens = [create_access_token(identity=str(user.id)) for user in users]
+        return str(service.id), promotion.id, promotion.code, tokens
+
+
+def run(app, shards, requests, workers, limit):
+    from app.models.booking import BookingPromotion
+    from app.models.promotion import Promotion
+    from app.utils.promotion_usage import merge_usage
+
+    app.config['PROMOTION_USAGE_SHARDS'] = shards
+    service_id, promotion_id, code, tokens = seed(app, workers, limit)
+    booking_date = (date.today() + timedelta(days=2)).isoformat()
+    local = threading.local()
+    statuses = {}
+    lock = threading.Lock()
+
+    def book(i):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        response = client.post('/api/bookings/', json={
+            'service_id': service_id,
+            'booking_date': booking_date,
+            'booking_time': '09:00',
+            'customer_address': 'Benchmark',
+            'promotion_code': code,
+        }, headers={'Authorization': f'Bearer {tokens[i % len(tokens)]}'})
+        with lock:
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(book, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        merge_usage(promotion_id)
+        redeemed = BookingPromotion.query.filter_by(promotion_id=promotion_id).count()
+        used = db.session.get(Promotion, promotion_id).used_count
+
+    ok = redeemed == used == min(limit, requests)
+    print(f"shards={shards:<3} requests={requests} workers={workers} limit={limit} "
+          f"time={elapsed:.2f}s throughput={requests / elapsed:.0f} req/s "
+          f"statuses={dict(sorted(statuses.items()))} redeemed={redeemed} used_count={used} "
+          f"{'OK' if ok else 'OVER/UNDER-REDEEMED'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--limit', type=int, default=500, help='usage limit of the promotion')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 8])
+    args = parser.parse_args()
+
+    app = build_app(args.workers)
+    results = [run(app, shards, args.requests, args.workers, args.limit) for shards in args.shards]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+"""
+Deterministic benchmark dataset loaded with PostgreSQL COPY
+
+Seeds service categories, services, users (customers, staff, one admin),
+promotions, bookings with their booking_items / booking_staff, reviews (and
+their rating summaries) and vnpay_transactions (and the per-user payment
+summaries). The same --seed, --bookings and --anchor always produce
+the same rows, so runs of benchmarks/endpoints.py are comparable.
+
+Everything else scales from --bookings (10k to 5M): about one customer per
+8 bookings, one staff per 400 bookings, one promotion per 1000 bookings.
+Bookings are written in chunks, one COPY per table and chunk, so memory stays
+flat at any scale.
+
+Fixed accounts are used by the endpoint benchmark:
+    bench-admin@cleanhome.test     (admin)
+    bench-customer@cleanhome.test  (customer with BENCH_CUSTOMER_BOOKINGS bookings)
+    bench-user-1@cleanhome.test    (customer who creates bookings)
+Password of every seeded account: "benchmark".
+
+Usage (against a disposable PostgreSQL database):
+    DATABASE_URL=postgresql://... python benchmarks/seed_data.py --bookings 100000 --reset
+"""
+
+import argparse
+import csv
+import io
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import date, datetime, time as dtime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config, DevelopmentConfig
+from app import create_app
+from app.extensions import db
+from app.models.vnpay import VnpayUserSummary
+from app.utils.reviews import rebuild_summaries
+
+ADMIN_EMAIL = 'bench-admin@cleanhome.test'
+CUSTOMER_EMAIL = 'bench-customer@cleanhome.test'
+WRITER_EMAIL = 'bench-user-1@cleanhome.test'
+PASSWORD = 'benchmark'
+SERVICE_NAME_PREFIX = 'Dịch vụ '
+BENCH_CUSTOMER_BOOKINGS = 40
+CHUNK_SIZE = 20000
+
+# Child tables first: TRUNCATE order for --reset
+TABLES = [
+    'rating_summaries', 'rating_daily_summaries',
+    'vnpay_user_summaries', 'vnpay_transactions', 'reviews', 'booking_staff', 'booking_promotions', 'booking_items',
+    'bookings', 'promotions', 'services', 'service_categories', 'users',
+]
+
+COLUMNS = {
+    'service_categories': ['id', 'name', 'description', 'status', 'created_at', 'updated_at'],
+    'services': [
+        'id', 'category_id', 'name', 'slug', 'short_description', 'price', 'duration', 'unit',
+        'is_featured', 'staff_count', 'status', 'created_at', 'updated_at',
+    ],
+    'users': [
+        'id', 'name', 'email', 'password', 'phone', 'role', 'status', 'email_verified_at',
+        'login_count', 'failed_login_attempts', 'created_at', 'updated_at',
+    ],
+    'promotions': [
+        'id', 'code', 'name', 'discount_type', 'discount_value', 'min_order_value', 'max_discount',
+        'start_date', 'end_date', 'usage_limit', 'used_count', 'status', 'created_at', 'updated_at',
+    ],
+    'bookings': [
+        'id', 'booking_code', 'user_id', 'staff_id', 'booking_date', 'booking_time', 'end_time',
+        'status', 'subtotal', 'discount', 'tax', 'total_price', 'payment_status', 'payment_method',
+        'customer_address', 'area', 'cancel_reason', 'cancelled_at', 'completed_at',
+        'created_at', 'updated_at',
+    ],
+    'booking_items': ['id', 'booking_id', 'service_id', 'quantity', 'unit_price', 'subtotal', 'created_at', 'updated_at'],
+    'booking_staff': ['id', 'booking_id', 'staff_id', 'assigned_at', 'assigned_by', 'created_at', 'updated_at'],
+    'reviews': ['id', 'booking_id', 'user_id', 'service_id', 'staff_id', 'rating', 'comment', 'status', 'created_at', 'updated_at'],
+    'vnpay_transactions': [
+        'id', 'booking_id', 'user_id', 'vnp_amount', 'vnp_orderinfo', 'vnp_txnref', 'vnp_bankcode',
+        'vnp_paydate', 'vnp_responsecode', 'vnp_tmncode', 'vnp_transactionno', 'vnp_transactionstatus',
+        'created_at', 'updated_at',
+    ],
+}
+
+CATEGORIES = ['Dọn nhà', 'Vệ sinh sofa', 'Giặt rèm', 'Vệ sinh máy lạnh', 'Tổng vệ sinh', 'Văn phòng', 'Diệt côn trùng', 'Kính & mặt tiền']
+DISTRICTS = ['Quận 1', 'Quận 3', 'Quận 7', 'Bình Thạnh', 'Phú Nhuận', 'Thủ Đức', 'Gò Vấp', 'Tân Bình']
+COMMENTS = ['Rất sạch sẽ', 'Nhân viên đúng giờ', 'Sẽ đặt lại', 'Tạm ổn', 'Cần cải thiện thái độ', None]
+
+# (status, weight); payment follows from the status
+BOOKING_STATUSES = [('completed', 55), ('confirmed', 12), ('pending', 12), ('in_progress', 3), ('cancelled', 15), ('rescheduled', 3)]
+PAYMENT_METHODS = [('cash', 50), ('vnpay', 30), ('bank_transfer', 10), ('momo', 5), ('zalopay', 5)]
+ITEM_COUNTS = [(1, 70), (2, 22), (3, 8)]
+REVIEW_RATE = 0.4
+
+
+class Dataset:
+    """Row generator for one (seed, scale, anchor) triple"""
+
+    def __init__(self, bookings, seed=42, anchor=None, days=730):
+        self.bookings = bookings
+        self.seed = seed
+        self.anchor = anchor or date.today()
+        self.days = days
+        self.customers = max(200, bookings // 8)
+        self.staff_count = max(20, bookings // 400)
+        self.services_count = 40
+        self.promotions_count = max(50, bookings // 1000)
+        self.rng = random.Random(seed)
+        self.password_hash = None
+
+        self.category_ids = []
+        self.services = []  # (id, price, duration)
+        self.customer_ids = []
+        self.staff_ids = []
+        self.admin_id = None
+        self.promotion_ids = []
+
+    def uuid(self):
+        return uuid.UUID(int=self.rng.getrandbits(128), version=4)
+
+    def moment(self, day):
+        """A datetime on the given date, between 07:00 and 21:00"""
+        return datetime.combine(day, dtime(7)) + timedelta(seconds=self.rng.randrange(14 * 3600))
+
+    @staticmethod
+    def _choices(weighted):
+        values, weights = zip(*weighted)
+        return list(values), list(weights)
+
+    # ===== Reference data =====
+
+    def categories(self):
+        created = datetime.combine(self.anchor - timedelta(days=self.days + 30), dtime(8))
+        for name in CATEGORIES:
+            category_id = self.uuid()
+            self.category_ids.append(category_id)
+            yield (category_id, name, f'Danh mục {name.lower()}', 'active', created, created)
+
+    def service_rows(self):
+        created = datetime.combine(self.anchor - timedelta(days=self.days + 30), dtime(9))
+        for i in range(self.services_count):
+            service_id = self.uuid()
+            price = Decimal(self.rng.randrange(150, 2500) * 1000)
+            duration = self.rng.choice([60, 90, 120, 180, 240])
+            self.services.append((service_id, price, duration))
+            category = self.category_ids[i % len(self.category_ids)]
+            status = 'active' if i % 10 else 'inactive'
+            yield (
+                service_id, category, f'{SERVICE_NAME_PREFIX}{i + 1:03d}', f'bench-service-{i + 1:03d}',
+                f'Gói vệ sinh số {i + 1}', price, duration, 'Lần', i % 8 == 0,
+                1 + i % 3, status, created, created,
+            )
+
+    def users(self):
+        start = self.anchor - timedelta(days=self.days + 30)
+        accounts = [('admin', ADMIN_EMAIL, 'Bench Admin')]
+        accounts += [('staff', f'bench-staff-{i}@cleanhome.test', f'Nhân viên {i}') for i in range(self.staff_count)]
+        accounts += [('customer', CUSTOMER_EMAIL, 'Bench Customer')]
+        accounts += [('customer', f'bench-user-{i}@cleanhome.test', f'Khách hàng {i}') for i in range(1, self.customers)]
+        for i, (role, email, name) in enumerate(accounts):
+            user_id = self.uuid()
+            if role == 'admin':
+                self.admin_id = user_id
+            elif role == 'staff':
+                self.staff_ids.append(user_id)
+            else:
+                self.customer_ids.append(user_id)
+            created = self.moment(start + timedelta(days=self.rng.randrange(self.days)))
+            status = 'active' if self.rng.random() > 0.03 or email in (ADMIN_EMAIL, CUSTOMER_EMAIL, WRITER_EMAIL) else 'inactive'
+            yield (
+                user_id, name, email, self.password_hash, f'09{i:08d}'[-10:], role, status,
+                created, self.rng.randrange(0, 200), 0, created, created,
+            )
+
+    def promotion_rows(self):
+        for i in range(self.promotions_count):
+            promotion_id = self.uuid()
+            self.promotion_ids.append(promotion_id)
+            start = self.anchor - timedelta(days=self.rng.randrange(self.days))
+            end = start + timedelta(days=self.rng.randrange(7, 90))
+            percentage = self.rng.random() < 0.6
+            value = Decimal(self.rng.choice([5, 10, 15, 20, 30])) if percentage else Decimal(self.rng.choice([20, 50, 100]) * 1000)
+            limit = self.rng.choice([None, 100, 500, 1000])
+            used = self.rng.randrange(0, limit) if limit else self.rng.randrange(0, 2000)
+            created = self.moment(start - timedelta(days=3))
+            status = 'active' if end >= self.anchor else 'inactive'
+            yield (
+                promotion_id, f'BENCH{i:06d}', f'Khuyến mãi {i}', 'percentage' if percentage else 'fixed',
+                value, Decimal(self.rng.choice([0, 200000, 500000])),
+                Decimal(200000) if percentage else None, start, end, limit, used, status, created, created,
+            )
+
+    # ===== Bookings and dependants =====
+
+    def booking_chunks(self, chunk_size=CHUNK_SIZE):
+        """Yield dicts of table -> rows, CHUNK_SIZE bookings at a time"""
+        statuses, status_weights = self._choices(BOOKING_STATUSES)
+        methods, method_weights = self._choices(PAYMENT_METHODS)
+        counts, count_weights = self._choices(ITEM_COUNTS)
+        active_services = [s for i, s in enumerate(self.services) if i % 10]
+        bench_customer = self.customer_ids[0]
+        rng = self.rng
+
+        chunk = {table: [] for table in ('bookings', 'booking_items', 'booking_staff', 'reviews', 'vnpay_transactions')}
+        for n in range(self.bookings):
+            booking_id = self.uuid()
+            user_id = bench_customer if n < BENCH_CUSTOMER_BOOKINGS else rng.choice(self.customer_ids)
+            # Slightly more recent bookings than old ones
+            age = int(self.days * (rng.random() ** 1.3))
+            booking_date = self.anchor - timedelta(days=age) + timedelta(days=3)
+            created_at = self.moment(booking_date - timedelta(days=rng.randrange(1, 15)))
+            booking_time = dtime(rng.randrange(7, 18), rng.choice([0, 30]))
+            status = rng.choices(statuses, status_weights)[0]
+            if booking_date > self.anchor and status in ('completed', 'in_progress'):
+                status = 'confirmed'
+            method = rng.choices(methods, method_weights)[0]
+
+            subtotal = Decimal(0)
+            duration = 0
+            booked = rng.sample(active_services, rng.choices(counts, count_weights)[0])
+            for service_id, price, service_duration in booked:
+                quantity = 1 if rng.random() < 0.85 else 2
+                subtotal += price * quantity
+                duration += service_duration
+                chunk['booking_items'].append((
+                    self.uuid(), booking_id, service_id, quantity, price, price * quantity, created_at, created_at,
+                ))
+            discount = (subtotal * Decimal('0.1')).quantize(Decimal('1')) if rng.random() < 0.15 else Decimal(0)
+            total = subtotal - discount
+            end_time = (datetime.combine(booking_date, booking_time) + timedelta(minutes=duration)).time()
+
+            if status == 'completed':
+                payment_status = 'paid'
+            elif status == 'cancelled':
+                payment_status = 'refunded' if method == 'vnpay' and rng.random() < 0.5 else 'unpaid'
+            elif method == 'vnpay':
+                payment_status = rng.choice(['paid', 'pending', 'failed'])
+            else:
+                payment_status = 'unpaid'
+
+            staff_id = None
+            if status in ('confirmed', 'in_progress', 'completed', 'rescheduled'):
+                assigned = rng.sample(self.staff_ids, 2 if rng.random() < 0.2 else 1)
+                staff_id = assigned[0]
+                assigned_at = created_at + timedelta(hours=rng.randrange(1, 24))
+                for staff in assigned:
+                    chunk['booking_staff'].append((
+                        self.uuid(), booking_id, staff, assigned_at, self.admin_id, assigned_at, assigned_at,
+                    ))
+
+            started = datetime.combine(booking_date, booking_time)
+            completed_at = started + timedelta(minutes=duration) if status == 'completed' else None
+            cancelled_at = created_at + timedelta(hours=rng.randrange(1, 48)) if status == 'cancelled' else None
+            chunk['bookings'].append((
+                booking_id, f'BK{self.seed:02d}{n:09d}', user_id, staff_id, booking_date, booking_time,
+                end_time, status, subtotal, discount, Decimal(0), total, payment_status, method,
+                f'{rng.randrange(1, 500)} Đường số {rng.randrange(1, 60)}, {rng.choice(DISTRICTS)}, TP.HCM',
+                Decimal(rng.randrange(30, 250)), 'Khách đổi lịch' if cancelled_at else None,
+                cancelled_at, completed_at, created_at, completed_at or cancelled_at or created_at,
+            ))
+
+            if status == 'completed' and rng.random() < REVIEW_RATE:
+                reviewed_at = completed_at + timedelta(hours=rng.randrange(1, 72))
+                rating = rng.choices([5, 4, 3, 2, 1], [50, 30, 12, 5, 3])[0]
+                chunk['reviews'].append((
+                    self.uuid(), booking_id, user_id, booked[0][0], staff_id, rating,
+                    rng.choice(COMMENTS), 'approved', reviewed_at, reviewed_at,
+                ))
+
+            if method == 'vnpay':
+                success = payment_status in ('paid', 'refunded')
+                paid_at = created_at + timedelta(minutes=rng.randrange(1, 30))
+                chunk['vnpay_transactions'].append((
+                    self.uuid(), booking_id, user_id, total, f'Thanh toan don hang {n}', f'BENCH{self.seed:02d}{n:09d}',
+                    rng.choice(['NCB', 'VCB', 'TCB', 'VISA']), paid_at.strftime('%Y%m%d%H%M%S'),
+                    '00' if success else '24', 'BENCHTMN', f'{14000000 + n}' if success else None,
+                    '00' if success else '02', paid_at, paid_at,
+                ))
+
+            if len(chunk['bookings']) >= chunk_size:
+                yield chunk
+                chunk = {table: [] for table in chunk}
+        if chunk['bookings']:
+            yield chunk
+
+
+def copy_rows(cursor, table, rows):
+    """COPY rows (tuples in COLUMNS[table] order) into table; None becomes NULL"""
+    if not rows:
+        return
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(COLUMNS[table])}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def build_app():
+    config['benchmark'] = type('BenchmarkConfig', (DevelopmentConfig,), {'DEBUG': False, 'QUERY_BUDGET_MODE': 'off'})
+    return create_app('benchmark')
+
+
+def seed(app, bookings, seed_value=42, anchor=None, reset=False, chunk_size=CHUNK_SIZE):
+    from werkzeug.security import generate_password_hash
+
+    dataset = Dataset(bookings, seed_value, anchor)
+    # One hash for every account: hashing millions of passwords would dominate the load time
+    dataset.password_hash = generate_password_hash(PASSWORD, method='pbkdf2:sha256')
+
+    with app.app_context():
+        db.create_all()
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            if reset:
+                cursor.execute(f"TRUNCATE {', '.join(TABLES)} CASCADE")
+            else:
+                cursor.execute('SELECT 1 FROM users WHERE email = %s', (ADMIN_EMAIL,))
+                if cursor.fetchone():
+                    raise SystemExit('Benchmark data already present, run again with --reset to replace it')
+
+            started = time.perf_counter()
+            copy_rows(cursor, 'service_categories', list(dataset.categories()))
+            copy_rows(cursor, 'services', list(dataset.service_rows()))
+            copy_rows(cursor, 'users', list(dataset.users()))
+            copy_rows(cursor, 'promotions', list(dataset.promotion_rows()))
+            connection.commit()
+
+            totals = {}
+            for chunk in dataset.booking_chunks(chunk_size):
+                for table in ('bookings', 'booking_items', 'booking_staff', 'reviews', 'vnpay_transactions'):
+                    copy_rows(cursor, table, chunk[table])
+                    totals[table] = totals.get(table, 0) + len(chunk[table])
+                connection.commit()
+                print(f"  {totals['bookings']:>9} / {bookings} bookings ({time.perf_counter() - started:.0f}s)", flush=True)
+        finally:
+            connection.close()
+
+        # Rating and payment aggregates of the copied rows (normally kept up to date by the API)
+        rebuild_summaries()
+        VnpayUserSummary.rebuild_all()
+        db.session.commit()
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            for table in TABLES:
+                cursor.execute(f'ANALYZE {table}')
+            connection.commit()
+        finally:
+            connection.close()
+
+    elapsed = time.perf_counter() - started
+    counts = {
+        'users': len(dataset.customer_ids) + len(dataset.staff_ids) + 1,
+        'services': len(dataset.services),
+        'promotions': len(dataset.promotion_ids),
+        **totals,
+    }
+    print(f"seed={seed_value} anchor={dataset.anchor.isoformat()} time={elapsed:.1f}s " +
+          ' '.join(f'{table}={count}' for table, count in counts.items()))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bookings', type=int, default=10000, help='number of bookings (10k to 5M)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--anchor', type=date.fromisoformat, default=None,
+                        help='last day of the generated history (YYYY-MM-DD, default today)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--reset', action='store_true', help='TRUNCATE the seeded tables first (destroys their data)')
+    args = parser.parse_args()
+
+    seed(build_app(), args.bookings, args.seed, args.anchor, args.reset, args.chunk_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+Serving benchmark: throughput of the gunicorn worker models on real HTTP traffic
+
+Starts gunicorn with gunicorn.conf.py once per worker model, then drives it
+with concurrent keep-alive HTTP clients on two endpoints:
+
+- catalog: GET /api/services/ (read only)
+- booking: POST /api/bookings/ (authenticated write)
+
+It reports throughput, p50/p95 latency and the status codes seen per model.
+The gevent model is skipped when gevent is not installed.
+
+Usage (against a disposable PostgreSQL database):
+    DATABASE_URL=postgresql://... python benchmarks/serving_load.py \
+        --models sync gthread gevent --workers 4 --threads 4 --clients 32 --duration 15
+"""
+
+import argparse
+import importlib.util
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from app import create_app
+from app.extensions import db
+
+
+def seed(app, customers):
+    """Create a service and the customers (with tokens) used by the booking endpoint"""
+    from flask_jwt_extended import create_access_token
+    from app.models.user import User
+    from app.models.service import Service
+
+    run_id = uuid.uuid4().hex[:8]
+    with app.app_context():
+        db.create_all()
+        service = Service(name=f'Load test {run_id}', slug=f'load-test-{run_id}', price=300000, duration=60)
+        users = [User(name=f'Customer {i}', email=f'load-{run_id}-{i}@example.com') for i in range(customers)]
+        for user in users:
+            user.password = 'benchmark'
+        db.session.add_all([service, *users])
+        db.session.commit()
+        tokens = [create_access_token(identity=str(user.id)) for user in users]
+        return str(service.id), tokens
+
+
+def start_server(model, port, args):
+    env = dict(
+        os.environ,
+        GUNICORN_BIND=f'127.0.0.1:{port}',
+        GUNICORN_WORKER_CLASS=model,
+        GUNICORN_WORKERS=str(args.workers),
+        GUNICORN_THREADS=str(args.threads),
+        GUNICORN_ACCESS_LOG='/dev/null',
+        GUNICORN_LOG_LEVEL='warning',
+    )
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+        cwd=BACKEND_DIR, env=env
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get(f'http://127.0.0.1:{port}/api/services/categories', timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'gunicorn ({model}) did not start')
+
+
+def load(base_url, endpoint, clients, duration, service_id, tokens):
+    """Run clients keep-alive sessions for duration seconds; returns (count, latencies, statuses)"""
+    booking_date = (date.today() + timedelta(days=3)).isoformat()
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client(index):
+        session = requests.Session()
+        headers = {'Authorization': f'Bearer {tokens[index % len(tokens)]}'}
+        local_latencies = []
+        local_statuses = {}
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            if endpoint == 'catalog':
+                response = session.get(f'{base_url}/api/services/', params={'per_page': 20})
+            else:
+                response = session.post(f'{base_url}/api/bookings/', headers=headers, json={
+                    'service_id': service_id,
+                    'booking_date': booking_date,
+                    'booking_time': '09:00',
+                    'customer_address': 'Load test',
+                })
+            local_latencies.append(time.perf_counter() - started)
+            local_statuses[response.status_code] = local_statuses.get(response.status_code, 0) + 1
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(latencies), latencies, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--models', nargs='+', default=['sync', 'gthread', 'gevent'])
+    parser.add_argument('--endpoints', nargs='+', default=['catalog', 'booking'], choices=['catalog', 'booking'])
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=4, help='threads per gthread worker')
+    parser.add_argument('--clients', type=int, default=32, help='concurrent HTTP clients')
+    parser.add_argument('--duration', type=float, default=15, help='seconds per endpoint and model')
+    parser.add_argument('--port', type=int, default=5055)
+    args = parser.parse_args()
+
+    os.environ.setdefault('FLASK_ENV', 'production')
+    app = create_app(os.environ['FLASK_ENV'])
+    service_id, tokens = seed(app, args.clients)
+
+    for model in args.models:
+        if model == 'gevent' and importlib.util.find_spec('gevent') is None:
+            print(f"{model:<8} skipped (gevent is not installed)")
+            continue
+        process = start_server(model, args.port, args)
+        try:
+            for endpoint in args.endpoints:
+                count, latencies, statuses = load(
+                    f'http://127.0.0.1:{args.port}', endpoint, args.clients, args.duration, service_id, tokens
+                )
+                quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [0] * 99
+                print(f"{model:<8} {endpoint:<8} workers={args.workers} threads={args.threads} "
+                      f"clients={args.clients} throughput={count / args.duration:.0f} req/s "
+                      f"p50={quantiles[49] * 1000:.1f}ms p95={quantiles[94] * 1000:.1f}ms "
+                      f"statuses={dict(sorted(statuses.items()))}")
+        finally:
+            process.terminate()
+            process.wait(timeout=60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Gunicorn configuration for CleanHome backend (production)
+
+Usage:
+    cd backend
+    FLASK_ENV=production gunicorn -c gunicorn.conf.py wsgi:app
+
+Every setting can be overridden with an environment variable (GUNICORN_*).
+
+Worker model: the API is I/O bound (PostgreSQL, VNPay, SMTP), so the default
+is ``gthread``: a few processes (CPU bound work such as JSON and image
+encoding scales over processes) each with a pool of threads waiting on I/O.
+``gevent`` can be selected for many slow/idle connections; psycopg2 is then
+made cooperative with psycogreen when it is installed.
+"""
+
+import multiprocessing
+import os
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+# Socket
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+backlog = _env_int('GUNICORN_BACKLOG', 2048)
+
+# Worker model
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = _env_int('GUNICORN_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 9))
+# Threads per worker (gthread). Each thread may hold a DB connection while it
+# serves a request, so keep threads <= DB_POOL_SIZE + DB_MAX_OVERFLOW
+threads = _env_int('GUNICORN_THREADS', 4)
+# Concurrent greenlets per worker (gevent)
+worker_connections = _env_int('GUNICORN_WORKER_CONNECTIONS', 200)
+
+# Load the app once in the master and fork it: faster starts, shared memory
+# pages. The app disposes inherited DB connections after fork (see create_app).
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+# Timeouts
+# Seconds an idle keep-alive connection stays open. A few seconds lets the API
+# calls of one page reuse a connection without tying up threads for long
+keepalive = _env_int('GUNICORN_KEEPALIVE', 5)
+# A worker silent for this long is killed (covers the VNPay/SMTP calls)
+timeout = _env_int('GUNICORN_TIMEOUT', 30)
+# Time given to in-flight requests on reload/shutdown (SIGTERM/SIGHUP)
+graceful_timeout = _env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+
+# Recycle workers now and then to bound memory growth; jitter avoids all
+# workers restarting at once
+max_requests = _env_int('GUNICORN_MAX_REQUESTS', 2000)
+max_requests_jitter = _env_int('GUNICORN_MAX_REQUESTS_JITTER', 200)
+
+# Heartbeat files on tmpfs, not a disk-backed /tmp
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Logging to stdout/stderr (collected by Docker / systemd)
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = os.environ.get('GUNICORN_ERROR_LOG', '-')
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+access_log_format = '%(h)s "%(r)s" %(s)s %(b)s %(M)sms'
+
+# Behind Nginx: trust X-Forwarded-* from the local proxy only
+forwarded_allow_ips = os.environ.get('GUNICORN_FORWARDED_ALLOW_IPS', '127.0.0.1')
+
+
+# Shared directory for per-worker metrics (see app.utils.metrics)
+metrics_dir = os.environ.get('METRICS_MULTIPROC_DIR')
+
+
+def on_starting(server):
+    """Drop metrics files left by a previous run"""
+    if metrics_dir and os.path.isdir(metrics_dir):
+        for filename in os.listdir(metrics_dir):
+            if filename.endswith('.json'):
+                os.remove(os.path.join(metrics_dir, filename))
+
+
+def worker_exit(server, worker):
+    """Write the last metrics of a worker before it exits"""
+    if metrics_dir and hasattr(worker.wsgi, 'app_context'):
+        from app.utils.metrics import flush
+        with worker.wsgi.app_context():
+            flush(metrics_dir)
+
+
+def child_exit(server, worker):
+    """Keep the counters of an exited worker in the metrics archive"""
+    if metrics_dir:
+        from app.utils.metrics import mark_process_dead
+        mark_process_dead(worker.pid, metrics_dir)
+
+
+def post_fork(server, worker):
+    """Make psycopg2 yield to other greenlets under the gevent worker"""
+    if worker_class == 'gevent':
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            server.log.warning('gevent worker without psycogreen: database calls will block the worker')
+
+
+def worker_abort(worker):
+    """
+    Log where a worker was stuck when it is killed on timeout
+
+    The master sends SIGABRT to a worker silent for ``timeout`` seconds;
+    gunicorn runs this hook in the worker before it exits.
+    """
+    import sys
+    import threading
+    import traceback
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    for thread_id, frame in sys._current_frames().items():
+        stack = ''.join(traceback.format_stack(frame))
+        worker.log.warning(f"Worker {worker.pid} timed out, thread {names.get(thread_id, thread_id)}:\n{stack}")
@@ -0,0 +1,39 @@
+"""Phí di chuyển theo khu vực phục vụ và trên booking
+
+Revision ID: area_delivery_fee_011
+Revises: service_rankings_010
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = 'area_delivery_fee_011'
+down_revision = 'service_rankings_010'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Schema gốc (database.sql) chưa có cột này trên areas
+    op.execute("""
+        ALTER TABLE areas
+        ADD COLUMN IF NOT EXISTS delivery_fee DECIMAL(10, 2) DEFAULT 0;
+    """)
+    # Khu vực không có quận: phục vụ toàn thành phố
+    op.execute("ALTER TABLE areas ALTER COLUMN district DROP NOT NULL;")
+
+    # Phí di chuyển tính lúc đặt lịch (đã cộng vào total_price)
+    op.execute("""
+        ALTER TABLE bookings
+        ADD COLUMN IF NOT EXISTS delivery_fee DECIMAL(10, 2) DEFAULT 0;
+    """)
+
+
+def downgrade():
+    op.execute("ALTER TABLE bookings DROP COLUMN IF EXISTS delivery_fee;")
+    # Khu vực toàn thành phố không còn được hỗ trợ: district rỗng thay cho NULL
+    op.execute("UPDATE areas SET district = '' WHERE district IS NULL;")
+    op.execute("ALTER TABLE areas ALTER COLUMN district SET NOT NULL;")
+    op.execute("ALTER TABLE areas DROP COLUMN IF EXISTS delivery_fee;")
@@ -0,0 +1,57 @@
+"""Lịch đặt định kỳ (booking_series) và liên kết từ bookings
+
+Revision ID: booking_series_013
+Revises: staff_schedules_012
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = 'booking_series_013'
+down_revision = 'staff_schedules_012'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Quy tắc lặp (RRULE) và mẫu của các lần đặt
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS booking_series (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            user_id UUID NOT NULL REFERENCES users(id),
+            service_id UUID NOT NULL REFERENCES services(id),
+            frequency VARCHAR(20) NOT NULL,
+            rrule VARCHAR(255) NOT NULL,
+            start_date DATE NOT NULL,
+            until_date DATE,
+            occurrence_count INTEGER NOT NULL DEFAULT 0,
+            booking_time TIME NOT NULL,
+            customer_address TEXT NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 1,
+            area DECIMAL(10, 2),
+            notes TEXT,
+            payment_method VARCHAR(20) NOT NULL DEFAULT 'cash',
+            status VARCHAR(20) NOT NULL DEFAULT 'active',
+            created_at TIMESTAMP DEFAULT NOW(),
+            updated_at TIMESTAMP DEFAULT NOW()
+        );
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS idx_booking_series_user ON booking_series (user_id);")
+
+    op.execute("""
+        ALTER TABLE bookings
+        ADD COLUMN IF NOT EXISTS series_id UUID REFERENCES booking_series(id) ON DELETE SET NULL;
+    """)
+    # Các lần còn lại của một lịch định kỳ (sửa / huỷ hàng loạt)
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS idx_bookings_series_date
+        ON bookings (series_id, booking_date) WHERE series_id IS NOT NULL;
+    """)
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS idx_bookings_series_date;")
+    op.execute("ALTER TABLE bookings DROP COLUMN IF EXISTS series_id;")
+    op.execute("DROP TABLE IF EXISTS booking_series;")
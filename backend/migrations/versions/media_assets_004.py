@@ -0,0 +1,41 @@
+"""Bảng media_assets đếm tham chiếu file ảnh đã upload
+
+Revision ID: media_assets_004
+Revises: promotion_usage_003
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = 'media_assets_004'
+down_revision = 'promotion_usage_003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Mỗi ảnh (theo hash nội dung) một dòng, ref_count = số bản ghi đang dùng ảnh
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS media_assets (
+            kind VARCHAR(50) NOT NULL,
+            content_hash VARCHAR(64) NOT NULL,
+            keys TEXT[] NOT NULL DEFAULT '{}',
+            size_bytes BIGINT NOT NULL DEFAULT 0,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT NOW(),
+            updated_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (kind, content_hash)
+        );
+    """)
+
+    # Index một phần cho garbage collector: chỉ các ảnh không còn được tham chiếu
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS idx_media_assets_unreferenced
+        ON media_assets (updated_at) WHERE ref_count <= 0;
+    """)
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS media_assets;")
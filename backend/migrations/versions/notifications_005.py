@@ -0,0 +1,60 @@
+"""Bộ đếm thông báo chưa đọc và index cho hộp thư thông báo
+
+Revision ID: notifications_005
+Revises: media_assets_004
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = 'notifications_005'
+down_revision = 'media_assets_004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Phân trang keyset hộp thư theo (created_at, id) của từng user
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS idx_notifications_user_created
+        ON notifications (user_id, created_at DESC, id DESC);
+    """)
+
+    # Index một phần cho đánh dấu đã đọc và đối soát bộ đếm: chỉ thông báo chưa đọc
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS idx_notifications_user_unread
+        ON notifications (user_id) WHERE is_read = false;
+    """)
+
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS idx_notification_settings_user
+        ON notification_settings (user_id);
+    """)
+
+    # Số thông báo chưa đọc của từng user (badge không cần COUNT(*))
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS notification_counters (
+            user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+            unread_count INTEGER NOT NULL DEFAULT 0,
+            reconciled_at TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+
+    # Khởi tạo bộ đếm từ các thông báo hiện có
+    op.execute("""
+        INSERT INTO notification_counters (user_id, unread_count, reconciled_at)
+        SELECT user_id, COUNT(*) FILTER (WHERE is_read = false), NOW()
+        FROM notifications
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO NOTHING;
+    """)
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS notification_counters;")
+    op.execute("DROP INDEX IF EXISTS idx_notification_settings_user;")
+    op.execute("DROP INDEX IF EXISTS idx_notifications_user_unread;")
+    op.execute("DROP INDEX IF EXISTS idx_notifications_user_created;")
@@ -0,0 +1,45 @@
+"""Hàng đợi email/SMS gửi đi (outbox)
+
+Revision ID: outbound_messages_006
+Revises: notifications_005
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = 'outbound_messages_006'
+down_revision = 'notifications_005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Mỗi email/SMS một dòng, được worker gửi sau khi transaction của request commit
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS outbound_messages (
+            id UUID PRIMARY KEY,
+            channel VARCHAR(20) NOT NULL,
+            recipient VARCHAR(255) NOT NULL,
+            subject VARCHAR(255),
+            body TEXT NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT NOW(),
+            sent_at TIMESTAMP
+        );
+    """)
+
+    # Index một phần cho worker lấy tin đến hạn: chỉ các tin chưa gửi xong
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS idx_outbound_messages_due
+        ON outbound_messages (channel, next_attempt_at)
+        WHERE status IN ('pending', 'sending');
+    """)
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS outbound_messages;")
@@ -0,0 +1,28 @@
+"""Cờ promotions.auto_apply: khuyến mãi được tự áp dụng khi đặt lịch không gửi mã
+
+Trước đây booking không gửi mã được áp khuyến mãi tốt nhất trong mọi mã đang
+hoạt động, kể cả mã riêng tạo hàng loạt (dùng một lần). Nay chỉ khuyến mãi có
+``auto_apply`` mới được tự áp dụng/gợi ý; mọi khuyến mãi hiện có mặc định là
+false, admin bật lại cho từng khuyến mãi công khai qua ``PUT /api/promotions/<id>``.
+
+Revision ID: promotion_auto_apply_015
+Revises: review_booking_unique_014
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = 'promotion_auto_apply_015'
+down_revision = 'review_booking_unique_014'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("ALTER TABLE promotions ADD COLUMN IF NOT EXISTS auto_apply BOOLEAN NOT NULL DEFAULT FALSE;")
+
+
+def downgrade():
+    op.execute("ALTER TABLE promotions DROP COLUMN IF EXISTS auto_apply;")
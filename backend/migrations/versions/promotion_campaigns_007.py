@@ -0,0 +1,50 @@
+"""Chiến dịch gửi thông báo khuyến mãi cho khách hàng
+
+Revision ID: promotion_campaigns_007
+Revises: outbound_messages_006
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = 'promotion_campaigns_007'
+down_revision = 'outbound_messages_006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Mỗi lần gửi một khuyến mãi một dòng; last_user_id để chạy tiếp khi bị gián đoạn
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS promotion_campaigns (
+            id UUID PRIMARY KEY,
+            promotion_id UUID NOT NULL REFERENCES promotions(id) ON DELETE CASCADE,
+            created_by UUID REFERENCES users(id),
+            title VARCHAR(255) NOT NULL,
+            message TEXT NOT NULL,
+            channels VARCHAR(20)[] NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            total_recipients INTEGER,
+            processed INTEGER NOT NULL DEFAULT 0,
+            emails_queued INTEGER NOT NULL DEFAULT 0,
+            sms_queued INTEGER NOT NULL DEFAULT 0,
+            notifications_created INTEGER NOT NULL DEFAULT 0,
+            last_user_id UUID,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT NOW(),
+            started_at TIMESTAMP,
+            heartbeat_at TIMESTAMP,
+            finished_at TIMESTAMP
+        );
+    """)
+
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS ix_promotion_campaigns_promotion_id
+        ON promotion_campaigns (promotion_id);
+    """)
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS promotion_campaigns;")
@@ -0,0 +1,33 @@
+"""Bảng shard đếm lượt sử dụng khuyến mãi
+
+Revision ID: promotion_usage_003
+Revises: vnpay_history_002
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers
+revision = 'promotion_usage_003'
+down_revision = 'vnpay_history_002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Mỗi mã khuyến mãi có nhiều dòng đếm để tránh tranh chấp khóa trên một dòng
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS promotion_usage_shards (
+            promotion_id UUID NOT NULL REFERENCES promotions(id) ON DELETE CASCADE,
+            shard_no INTEGER NOT NULL,
+            used_count INTEGER NOT NULL DEFAULT 0,
+            capacity INTEGER,
+            PRIMARY KEY (promotion_id, shard_no)
+        );
+    """)
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS promotion_usage_shards;")
@@ -0,0 +1,99 @@
+"""Bảng tổng hợp điểm đánh giá theo dịch vụ, nhân viên và ngày
+
+Revision ID: rating_summaries_009
+Revises: settings_version_008
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = 'rating_summaries_009'
+down_revision = 'settings_version_008'
+branch_labels = None
+depends_on = None
+
+COUNTERS = """
+            review_count INTEGER NOT NULL DEFAULT 0,
+            rating_sum BIGINT NOT NULL DEFAULT 0,
+            rating_1 INTEGER NOT NULL DEFAULT 0,
+            rating_2 INTEGER NOT NULL DEFAULT 0,
+            rating_3 INTEGER NOT NULL DEFAULT 0,
+            rating_4 INTEGER NOT NULL DEFAULT 0,
+            rating_5 INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT NOW()
+"""
+
+HISTOGRAM = """
+            COUNT(*), SUM(r.rating),
+            COUNT(*) FILTER (WHERE r.rating = 1), COUNT(*) FILTER (WHERE r.rating = 2),
+            COUNT(*) FILTER (WHERE r.rating = 3), COUNT(*) FILTER (WHERE r.rating = 4),
+            COUNT(*) FILTER (WHERE r.rating = 5), NOW()
+"""
+
+
+def upgrade():
+    # Một dòng cho mỗi dịch vụ / nhân viên (target_type = 'service' hoặc 'staff')
+    op.execute(f"""
+        CREATE TABLE IF NOT EXISTS rating_summaries (
+            target_type VARCHAR(20) NOT NULL,
+            target_id UUID NOT NULL,
+            {COUNTERS},
+            PRIMARY KEY (target_type, target_id)
+        );
+    """)
+
+    # Một dòng cho mỗi ngày tạo booking (báo cáo ngày/tháng/năm)
+    op.execute(f"""
+        CREATE TABLE IF NOT EXISTS rating_daily_summaries (
+            day DATE PRIMARY KEY,
+            {COUNTERS}
+        );
+    """)
+
+    # Danh sách đánh giá theo dịch vụ / nhân viên, mới nhất trước
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reviews_service_created
+        ON reviews (service_id, created_at, id);
+    """)
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reviews_staff_created
+        ON reviews (staff_id, created_at, id);
+    """)
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reviews_booking
+        ON reviews (booking_id);
+    """)
+
+    # Tổng hợp các đánh giá đã duyệt hiện có
+    op.execute(f"""
+        INSERT INTO rating_summaries
+        SELECT 'service', r.service_id, {HISTOGRAM}
+        FROM reviews r WHERE r.status = 'approved'
+        GROUP BY r.service_id
+        ON CONFLICT DO NOTHING;
+    """)
+    op.execute(f"""
+        INSERT INTO rating_summaries
+        SELECT 'staff', r.staff_id, {HISTOGRAM}
+        FROM reviews r WHERE r.status = 'approved' AND r.staff_id IS NOT NULL
+        GROUP BY r.staff_id
+        ON CONFLICT DO NOTHING;
+    """)
+    op.execute(f"""
+        INSERT INTO rating_daily_summaries
+        SELECT DATE(b.created_at), {HISTOGRAM}
+        FROM reviews r JOIN bookings b ON b.id = r.booking_id
+        WHERE r.status = 'approved'
+        GROUP BY DATE(b.created_at)
+        ON CONFLICT DO NOTHING;
+    """)
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS idx_reviews_booking;")
+    op.execute("DROP INDEX IF EXISTS idx_reviews_staff_created;")
+    op.execute("DROP INDEX IF EXISTS idx_reviews_service_created;")
+    op.execute("DROP TABLE IF EXISTS rating_daily_summaries;")
+    op.execute("DROP TABLE IF EXISTS rating_summaries;")
@@ -0,0 +1,36 @@
+"""Mỗi booking tối đa một đánh giá: idx_reviews_booking thành UNIQUE
+
+Hai request đánh giá cùng lúc đều qua được bước kiểm tra trong create_review;
+index unique để database từ chối bản thứ hai. Các đánh giá trùng đã có (giữ
+bản cũ nhất) bị xoá trước khi tạo index, sau đó chạy
+``flask reviews rebuild-summaries`` để tính lại bảng tổng hợp.
+
+Revision ID: review_booking_unique_014
+Revises: booking_series_013
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = 'review_booking_unique_014'
+down_revision = 'booking_series_013'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+        DELETE FROM reviews r
+        USING reviews older
+        WHERE r.booking_id = older.booking_id
+          AND (older.created_at, older.id) < (r.created_at, r.id);
+    """)
+    op.execute("DROP INDEX IF EXISTS idx_reviews_booking;")
+    op.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_reviews_booking ON reviews (booking_id);")
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS idx_reviews_booking;")
+    op.execute("CREATE INDEX IF NOT EXISTS idx_reviews_booking ON reviews (booking_id);")
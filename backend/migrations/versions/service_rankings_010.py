@@ -0,0 +1,38 @@
+"""Bảng xếp hạng dịch vụ phổ biến (dịch vụ nổi bật)
+
+Revision ID: service_rankings_010
+Revises: rating_summaries_009
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = 'service_rankings_010'
+down_revision = 'rating_summaries_009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Tính lại định kỳ bằng `flask services rank-popularity`
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS service_rankings (
+            service_id UUID PRIMARY KEY REFERENCES services(id) ON DELETE CASCADE,
+            rank INTEGER NOT NULL,
+            score DOUBLE PRECISION NOT NULL,
+            bookings INTEGER NOT NULL DEFAULT 0,
+            recent_volume DOUBLE PRECISION NOT NULL DEFAULT 0,
+            rating DOUBLE PRECISION,
+            computed_at TIMESTAMP NOT NULL
+        );
+    """)
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS ix_service_rankings_rank
+        ON service_rankings (rank);
+    """)
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS service_rankings;")
@@ -0,0 +1,35 @@
+"""Phiên bản cài đặt để các worker tải lại cài đặt khi admin sửa
+
+Revision ID: settings_version_008
+Revises: promotion_campaigns_007
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = 'settings_version_008'
+down_revision = 'promotion_campaigns_007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Một dòng duy nhất; tăng mỗi lần sửa bảng settings (kèm NOTIFY settings_changed)
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS settings_version (
+            id INTEGER PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT NOW()
+        );
+    """)
+
+    op.execute("""
+        INSERT INTO settings_version (id, version) VALUES (1, 0)
+        ON CONFLICT (id) DO NOTHING;
+    """)
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS settings_version;")
@@ -0,0 +1,54 @@
+"""Lịch làm việc của nhân viên (ca, nghỉ, giờ đã nhận booking)
+
+Revision ID: staff_schedules_012
+Revises: area_delivery_fee_011
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = 'staff_schedules_012'
+down_revision = 'area_delivery_fee_011'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Bảng đã có trong database.sql; tạo lại khi cơ sở dữ liệu dựng từ các model
+    op.execute("""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_type WHERE typname = 'schedule_status') THEN
+                CREATE TYPE schedule_status AS ENUM ('available', 'booked', 'off');
+            END IF;
+        END
+        $$;
+    """)
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS staff_schedules (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            staff_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            date DATE NOT NULL,
+            start_time TIME NOT NULL,
+            end_time TIME NOT NULL,
+            booking_id UUID REFERENCES bookings(id) ON DELETE SET NULL,
+            status schedule_status DEFAULT 'available',
+            notes TEXT,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS idx_staff_schedules_staff ON staff_schedules (staff_id);")
+    op.execute("CREATE INDEX IF NOT EXISTS idx_staff_schedules_date ON staff_schedules (date);")
+
+    # Lịch theo khoảng ngày của một nhóm nhân viên (trang lịch, lưới ngày của admin)
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS idx_staff_schedules_staff_date
+        ON staff_schedules (staff_id, date);
+    """)
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS idx_staff_schedules_staff_date;")
@@ -0,0 +1,57 @@
+"""Index keyset cho lịch sử giao dịch VNPay và bảng tổng hợp theo user
+
+Revision ID: vnpay_history_002
+Revises: vnpay_integration_001
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers
+revision = 'vnpay_history_002'
+down_revision = 'vnpay_integration_001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Index phục vụ phân trang keyset theo (created_at, id) của từng user
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS idx_vnpay_transactions_user_created
+        ON vnpay_transactions(user_id, created_at DESC, id DESC);
+    """)
+
+    # Bảng tổng hợp giao dịch theo user (cập nhật khi nhận IPN/return)
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS vnpay_user_summaries (
+            user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+            total_paid DECIMAL(15, 2) NOT NULL DEFAULT 0,
+            success_count INTEGER NOT NULL DEFAULT 0,
+            failed_count INTEGER NOT NULL DEFAULT 0,
+            pending_count INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+
+    # Khởi tạo dữ liệu tổng hợp từ các giao dịch hiện có
+    op.execute("""
+        INSERT INTO vnpay_user_summaries (user_id, total_paid, success_count, failed_count, pending_count)
+        SELECT
+            user_id,
+            COALESCE(SUM(vnp_amount) FILTER (WHERE vnp_responsecode = '00' AND vnp_transactionstatus = '00'), 0),
+            COUNT(*) FILTER (WHERE vnp_responsecode = '00' AND vnp_transactionstatus = '00'),
+            COUNT(*) FILTER (WHERE vnp_responsecode IS NOT NULL
+                             AND NOT (vnp_responsecode = '00' AND vnp_transactionstatus IS NOT DISTINCT FROM '00')),
+            COUNT(*) FILTER (WHERE vnp_responsecode IS NULL)
+        FROM vnpay_transactions
+        WHERE user_id IS NOT NULL
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO NOTHING;
+    """)
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS vnpay_user_summaries;")
+    op.execute("DROP INDEX IF EXISTS idx_vnpay_transactions_user_created;")
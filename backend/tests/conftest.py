@@ -0,0 +1,147 @@
+"""
+Test fixtures
+
+The tests run against PostgreSQL (row locks, ``ON CONFLICT``, ``RETURNING``):
+set ``TEST_DATABASE_URL`` to a database used only for tests, its tables are
+recreated and emptied. Without it every test needing the database is skipped.
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost/cleanhome_test python -m pytest tests
+"""
+
+import os
+import time
+import uuid
+
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy import text
+
+from app import create_app
+from app.extensions import db
+
+
+@pytest.fixture(scope='session')
+def _app():
+    if not os.environ.get('TEST_DATABASE_URL'):
+        pytest.skip('TEST_DATABASE_URL is not set')
+    app = create_app('testing')
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    return app
+
+
+def _reset_caches():
+    from app.utils.config import REGISTRY
+    from app.utils.coverage import coverage_index
+    from app.utils.notifications import SETTINGS_CACHE
+    from app.utils.promotion_engine import promotion_engine
+    from app.utils.staff_calendar import CALENDAR_CACHE
+    from app.utils.staff_locator import staff_locator
+
+    REGISTRY.invalidate()
+    coverage_index.invalidate()
+    SETTINGS_CACHE.clear()
+    promotion_engine.invalidate()
+    CALENDAR_CACHE.clear()
+    staff_locator.invalidate()
+
+
+@pytest.fixture
+def app(_app):
+    """The app inside an app context; every table is emptied after the test"""
+    with _app.app_context():
+        yield _app
+        db.session.remove()
+        tables = ', '.join(table.name for table in db.metadata.sorted_tables)
+        with db.engine.begin() as connection:
+            connection.execute(text(f'TRUNCATE {tables} CASCADE'))
+    _reset_caches()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(app):
+    from app.models.user import User
+
+    def make(role='customer', **fields):
+        user = User(name=fields.pop('name', role.title()), email=f'{uuid.uuid4().hex[:12]}@example.com',
+                    role=role, **fields)
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+        return user
+
+    return make
+
+
+@pytest.fixture
+def make_service(app):
+    from app.models.service import Service, ServiceCategory
+
+    def make(price=200000, duration=120, category=None, **fields):
+        if category is None:
+            category = ServiceCategory(name=f'Category {uuid.uuid4().hex[:6]}')
+            db.session.add(category)
+            db.session.flush()
+        name = fields.pop('name', f'Service {uuid.uuid4().hex[:6]}')
+        service = Service(name=name, slug=name.lower().replace(' ', '-'), price=price, duration=duration,
+                          category_id=category.id, **fields)
+        db.session.add(service)
+        db.session.commit()
+        return service
+
+    return make
+
+
+@pytest.fixture
+def make_booking(app):
+    from app.models.booking import Booking, BookingItem
+
+    def make(user, service, booking_date, booking_time, **fields):
+        booking = Booking(
+            booking_code=f'BK{uuid.uuid4().hex[:10].upper()}', user_id=user.id,
+            booking_date=booking_date, booking_time=booking_time,
+            customer_address=fields.pop('customer_address', '1 Lê Lợi, Quận 1'),
+            subtotal=service.price, total_price=service.price, **fields
+        )
+        booking.booking_items.append(BookingItem(service_id=service.id, quantity=1, unit_price=service.price,
+                                                 subtotal=service.price))
+        db.session.add(booking)
+        db.session.commit()
+        return booking
+
+    return make
+
+
+@pytest.fixture
+def auth_headers(app):
+    def headers(user):
+        return {'Authorization': f'Bearer {create_access_token(identity=str(user.id))}'}
+
+    return headers
+
+
+@pytest.fixture
+def wait_for_lock_waiters(app):
+    """Block until count connections wait on a row lock (run the racing requests in threads first)"""
+    def wait(count, timeout=10):
+        deadline = time.monotonic() + timeout
+        with db.engine.connect() as connection:
+            while time.monotonic() < deadline:
+                waiting = connection.execute(text(
+                    "SELECT count(*) FROM pg_stat_activity "
+                    "WHERE datname = current_database() AND wait_event_type = 'Lock'"
+                )).scalar()
+                # pg_stat_activity is a snapshot taken once per transaction
+                connection.rollback()
+                if waiting >= count:
+                    return
+                time.sleep(0.05)
+        raise AssertionError(f'{count} requests never waited on a lock')
+
+    return wait
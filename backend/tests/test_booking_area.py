@@ -0,0 +1,122 @@
+"""Service areas and delivery fees when booking"""
+
+from datetime import date, timedelta
+
+import pytest
+
+from app.extensions import db
+from app.models.booking import Booking
+from app.models.service import Area, ServiceArea
+from app.models.user import UserAddress
+
+
+@pytest.fixture
+def areas(app, make_service):
+    """A service sold in Quận 1 (HCM, fee 20.000) and in all of Hà Nội (fee 10.000)"""
+    service = make_service()
+    district = Area(name='Quận 1', city='Hồ Chí Minh', district='Quận 1', delivery_fee=20000)
+    city = Area(name='Hà Nội', city='Hà Nội', delivery_fee=10000)
+    db.session.add_all([district, city])
+    db.session.flush()
+    db.session.add_all([ServiceArea(service_id=service.id, area_id=area.id) for area in (district, city)])
+    db.session.commit()
+    return service
+
+
+def _book(client, headers, service, path='/api/bookings/', **fields):
+    body = {
+        'service_id': str(service.id), 'booking_date': (date.today() + timedelta(days=2)).isoformat(),
+        'booking_time': '09:00', 'customer_address': '12 Lê Lợi', **fields
+    }
+    return client.post(path, json=body, headers=headers)
+
+
+@pytest.mark.parametrize('fields, fee', [
+    ({'city': 'TP. Hồ Chí Minh', 'district': 'Q1'}, 20000),
+    ({'city': 'Hà Nội'}, 10000),
+    ({'customer_address': '12 Lê Lợi, Phường Bến Nghé, Quận 1, TP.HCM'}, 20000),
+    ({'customer_address': '5 Tràng Tiền, Hoàn Kiếm, Hà Nội'}, 10000),
+])
+def test_area_is_taken_from_the_request(client, make_user, auth_headers, areas, fields, fee):
+    response = _book(client, auth_headers(make_user()), areas, **fields)
+    assert response.status_code == 201, response.get_json()
+    assert response.get_json()['booking']['deliveryFee'] == fee
+
+
+def test_area_is_taken_from_the_saved_address(client, make_user, auth_headers, areas):
+    user = make_user()
+    address = UserAddress(user_id=user.id, address_name='Nhà', recipient_name='A', phone='0900000001',
+                          address='12 Lê Lợi', district='Quận 1', city='Hồ Chí Minh')
+    db.session.add(address)
+    db.session.commit()
+
+    response = _book(client, auth_headers(user), areas, address_id=str(address.id))
+    assert response.status_code == 201
+    booking = db.session.get(Booking, response.get_json()['booking']['id'])
+    assert (booking.address_id, float(booking.delivery_fee)) == (address.id, 20000)
+
+    response = _book(client, auth_headers(user), areas, path='/api/bookings/series', address_id=str(address.id),
+                     booking_time='13:00', recurrence={'frequency': 'weekly', 'count': 3})
+    assert response.status_code == 201, response.get_json()
+    series_id = response.get_json()['series']['id']
+    assert {(row.address_id, float(row.delivery_fee)) for row in Booking.query.filter_by(series_id=series_id)} \
+        == {(address.id, 20000)}
+
+    other = auth_headers(make_user())
+    assert _book(client, other, areas, address_id=str(address.id)).status_code == 404
+
+
+@pytest.mark.parametrize('path', ['/api/bookings/', '/api/bookings/series'])
+@pytest.mark.parametrize('fields, message', [
+    ({}, 'Không xác định được khu vực'),
+    ({'customer_address': '1 Nguyễn Văn Linh, Hải Châu, Đà Nẵng'}, 'Không xác định được khu vực'),
+    ({'city': 'Hồ Chí Minh', 'district': 'Quận 3'}, 'chưa phục vụ khu vực Quận 3, Hồ Chí Minh'),
+    ({'city': 'Hồ Chí Minh'}, 'chưa phục vụ khu vực Hồ Chí Minh'),
+])
+def test_booking_outside_the_areas_is_rejected(client, make_user, auth_headers, areas, path, fields, message):
+    response = _book(client, auth_headers(make_user()), areas, path=path,
+                     recurrence={'frequency': 'weekly', 'count': 2}, **fields)
+    assert response.status_code == 400
+    assert message in response.get_json()['message']
+    assert Booking.query.count() == 0
+
+
+def test_without_areas_any_address_is_accepted(client, make_user, make_service, auth_headers):
+    response = _book(client, auth_headers(make_user()), make_service())
+    assert response.status_code == 201
+    assert response.get_json()['booking']['deliveryFee'] == 0
+
+
+@pytest.mark.parametrize('path', ['/api/bookings/', '/api/bookings/series'])
+def test_unrestricted_service_accepts_an_unknown_city(client, make_user, make_service, auth_headers, areas, path):
+    service = make_service(name='Giặt rèm')
+    response = _book(client, auth_headers(make_user()), service, path=path,
+                     customer_address='1 Nguyễn Văn Linh, Hải Châu, Đà Nẵng', recurrence={'frequency': 'weekly', 'count': 2})
+    assert response.status_code == 201, response.get_json()
+    assert {float(row.delivery_fee) for row in Booking.query} == {0}
+
+
+def test_series_address_change_moves_the_delivery_fee(client, make_user, auth_headers, areas):
+    headers = auth_headers(make_user())
+    response = _book(client, headers, areas, path='/api/bookings/series', city='Hồ Chí Minh', district='Quận 1',
+                     recurrence={'frequency': 'weekly', 'count': 3})
+    assert response.status_code == 201
+    series_id = response.get_json()['series']['id']
+
+    def occurrences():
+        db.session.expire_all()
+        return {(row.customer_address, float(row.delivery_fee), float(row.total_price))
+                for row in Booking.query.filter_by(series_id=series_id)}
+
+    assert occurrences() == {('12 Lê Lợi', 20000, 220000)}
+
+    response = client.put(f'/api/bookings/series/{series_id}', headers=headers,
+                          json={'customer_address': '1 Nguyễn Văn Linh, Hải Châu, Đà Nẵng'})
+    assert response.status_code == 400
+    assert 'Không xác định được khu vực' in response.get_json()['message']
+    assert occurrences() == {('12 Lê Lợi', 20000, 220000)}
+
+    response = client.put(f'/api/bookings/series/{series_id}', headers=headers,
+                          json={'customer_address': '5 Tràng Tiền, Hoàn Kiếm, Hà Nội'})
+    assert response.status_code == 200, response.get_json()
+    assert occurrences() == {('5 Tràng Tiền, Hoàn Kiếm, Hà Nội', 10000, 210000)}
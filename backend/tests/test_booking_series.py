@@ -0,0 +1,54 @@
+"""Recurring booking series"""
+
+from datetime import date, timedelta
+
+import pytest
+
+from app.models.booking import Booking
+from app.utils.staff_calendar import CALENDAR_CACHE, staff_calendar
+
+FIRST = date.today() + timedelta(days=2)
+
+
+def _series(client, headers, service, **fields):
+    return client.post('/api/bookings/series', headers=headers, json={
+        'service_id': str(service.id), 'booking_date': FIRST.isoformat(), 'booking_time': '09:00',
+        'customer_address': '12 Lê Lợi', 'recurrence': {'frequency': 'weekly', 'count': 3}, **fields
+    })
+
+
+@pytest.fixture
+def tax_rate(app):
+    app.config['BOOKING_TAX_RATE'] = 0.1
+    yield
+    app.config['BOOKING_TAX_RATE'] = 0
+
+
+def test_created_series_drops_the_cached_calendar_days(client, make_user, make_service, auth_headers):
+    staff = make_user('staff')
+    dates = [FIRST + timedelta(weeks=week) for week in range(3)]
+    staff_calendar([staff.id], FIRST, dates[-1])
+    assert len(CALENDAR_CACHE.get_many([(staff.id, day) for day in dates])) == 3
+
+    response = _series(client, auth_headers(make_user()), make_service())
+    assert response.status_code == 201
+    assert CALENDAR_CACHE.get_many([(staff.id, day) for day in dates]) == {}
+
+
+def test_tax_is_computed_by_the_server(client, make_user, make_service, auth_headers, tax_rate):
+    headers = auth_headers(make_user())
+    service = make_service(price=200000)
+
+    response = _series(client, headers, service, tax=-150000)
+    assert response.status_code == 201
+    series_id = response.get_json()['series']['id']
+    assert {(float(row.tax), float(row.total_price)) for row in Booking.query.filter_by(series_id=series_id)} \
+        == {(20000, 220000)}
+
+    response = client.post('/api/bookings/', headers=headers, json={
+        'service_id': str(service.id), 'booking_date': (FIRST + timedelta(days=1)).isoformat(),
+        'booking_time': '09:00', 'customer_address': '12 Lê Lợi', 'tax': -150000
+    })
+    assert response.status_code == 201
+    booking = response.get_json()['booking']
+    assert (booking['tax'], booking['totalAmount']) == (20000, 220000)
@@ -0,0 +1,45 @@
+"""Promotion campaigns"""
+
+from datetime import date, timedelta
+
+import pytest
+
+from app.extensions import db
+from app.models.promotion import Promotion, PromotionCampaign, PromotionUsageShard
+
+
+def _promotion(**fields):
+    today = date.today()
+    promotion = Promotion(**{
+        'code': 'SUMMER', 'name': 'Summer', 'discount_type': 'percentage', 'discount_value': 10,
+        'start_date': today - timedelta(days=10), 'end_date': today + timedelta(days=10), **fields
+    })
+    db.session.add(promotion)
+    db.session.commit()
+    return promotion
+
+
+@pytest.mark.parametrize('fields, message', [
+    ({'status': 'inactive'}, 'not active'),
+    ({'status': 'draft'}, 'not active'),
+    ({'end_date': date.today() - timedelta(days=1)}, 'expired'),
+    ({'usage_limit': 5, 'used_count': 5}, 'usage limit'),
+])
+def test_campaign_for_an_unusable_promotion_is_rejected(app, client, make_user, auth_headers, fields, message):
+    promotion = _promotion(**fields)
+    response = client.post(f'/api/promotions/{promotion.id}/campaigns', json={},
+                           headers=auth_headers(make_user('admin')))
+    assert response.status_code == 400
+    assert message in response.get_json()['message']
+    assert PromotionCampaign.query.count() == 0
+
+
+def test_campaign_counts_redemptions_not_yet_merged(app, client, make_user, auth_headers):
+    promotion = _promotion(usage_limit=5, used_count=3)
+    db.session.add_all([PromotionUsageShard(promotion_id=promotion.id, shard_no=i, used_count=1, capacity=1)
+                        for i in range(2)])
+    db.session.commit()
+    response = client.post(f'/api/promotions/{promotion.id}/campaigns', json={},
+                           headers=auth_headers(make_user('admin')))
+    assert response.status_code == 400
+    assert 'usage limit' in response.get_json()['message']
@@ -0,0 +1,22 @@
+"""Streaming CSV / XLSX exports"""
+
+import csv
+import io
+from decimal import Decimal
+
+from app.utils.export import csv_stream
+
+
+def _read_csv(chunks):
+    return list(csv.reader(io.StringIO(b''.join(chunks).decode('utf-8-sig'))))
+
+
+def test_csv_cells_are_not_read_as_formulas():
+    rows = [
+        ['=HYPERLINK("http://evil.example","x")', '+84900000001', '-2+3', '@SUM(A1)', '\tcmd', '\rcmd'],
+        ['Nguyễn Văn A', Decimal('-150000.00'), -3, None, 'a=b', ''],
+    ]
+    header, dangerous, plain = _read_csv(csv_stream(['a', 'b', 'c', 'd', 'e', 'f'], rows))
+    assert header == ['a', 'b', 'c', 'd', 'e', 'f']
+    assert dangerous == ["'" + value for value in rows[0]]
+    assert plain == ['Nguyễn Văn A', '-150000.0', '-3', '', 'a=b', '']
@@ -0,0 +1,27 @@
+"""Gunicorn hooks"""
+
+import logging
+import os
+import runpy
+import threading
+import types
+
+CONFIG = runpy.run_path(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'gunicorn.conf.py'))
+
+
+def test_timeout_kill_logs_every_thread_stack(caplog):
+    stop = threading.Event()
+    stuck = threading.Thread(target=stop.wait, name='stuck-request')
+    stuck.start()
+    worker = types.SimpleNamespace(pid=os.getpid(), log=logging.getLogger('gunicorn.error'))
+    try:
+        with caplog.at_level(logging.WARNING, logger='gunicorn.error'):
+            CONFIG['worker_abort'](worker)
+    finally:
+        stop.set()
+        stuck.join()
+
+    stuck_logs = [record.getMessage() for record in caplog.records if 'thread stuck-request' in record.getMessage()]
+    assert stuck_logs and 'in wait' in stuck_logs[0]
+    # SIGINT/SIGQUIT (worker_int) is a normal shutdown, not a timeout
+    assert 'worker_int' not in CONFIG
@@ -0,0 +1,90 @@
+"""Uploaded image checks"""
+
+import io
+import struct
+import threading
+import zlib
+
+import pytest
+from PIL import Image
+
+from app.extensions import db
+from app.models.user import User
+from app.utils import images
+from app.utils.images import ImageProcessingError, inspect_image
+
+
+def _png_claiming(width, height):
+    """A small PNG whose header announces width x height pixels"""
+    buffer = io.BytesIO()
+    Image.new('RGB', (1, 1)).save(buffer, 'PNG')
+    data = bytearray(buffer.getvalue())
+    # IHDR chunk: length (4), type (4), width (4), height (4), ..., CRC after 13 data bytes
+    data[16:24] = struct.pack('>II', width, height)
+    data[29:33] = struct.pack('>I', zlib.crc32(bytes(data[12:29])))
+    return bytes(data)
+
+
+def test_decompression_bomb_is_rejected_as_too_large():
+    with pytest.raises(ImageProcessingError, match='too large'):
+        inspect_image(_png_claiming(20000, 20000))
+
+
+def test_decompression_bomb_upload_returns_400(client, make_user, auth_headers):
+    user = make_user()
+    response = client.post(
+        f'/api/users/{user.id}/avatar', headers=auth_headers(user),
+        data={'avatar': (io.BytesIO(_png_claiming(20000, 20000)), 'bomb.png', 'image/png')},
+        content_type='multipart/form-data'
+    )
+    assert response.status_code == 400
+    assert 'too large' in response.get_json()['error']
+
+
+@pytest.fixture
+def upload_folder(app, tmp_path):
+    folder, store = app.config['UPLOAD_FOLDER'], app.extensions.pop('media_store', None)
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    yield tmp_path
+    app.config['UPLOAD_FOLDER'] = folder
+    app.extensions.pop('media_store', None)
+    if store is not None:
+        app.extensions['media_store'] = store
+
+
+def test_avatar_is_kept_until_the_variants_are_written(app, client, make_user, auth_headers,
+                                                      upload_folder, monkeypatch):
+    release, done = threading.Event(), threading.Event()
+    process = images._process
+
+    def slow_process(*args):
+        release.wait(5)
+        try:
+            return process(*args)
+        finally:
+            done.set()
+
+    monkeypatch.setattr(images, '_process', slow_process)
+    monkeypatch.setitem(app.config, 'IMAGE_PROCESS_TIMEOUT', 0.05)
+    user = make_user()
+    buffer = io.BytesIO()
+    Image.new('RGB', (400, 300), 'red').save(buffer, 'PNG')
+
+    def upload():
+        return client.post(f'/api/users/{user.id}/avatar', headers=auth_headers(user),
+                           data={'avatar': (io.BytesIO(buffer.getvalue()), 'me.png', 'image/png')},
+                           content_type='multipart/form-data')
+
+    response = upload()
+    assert response.status_code == 503 and response.headers['Retry-After']
+    db.session.expire_all()
+    assert db.session.get(User, user.id).avatar is None
+
+    release.set()
+    assert done.wait(5)
+    response = upload()
+    assert response.status_code == 200
+    avatar = response.get_json()['data']['avatar_url']
+    db.session.expire_all()
+    assert db.session.get(User, user.id).avatar == avatar
+    assert (upload_folder / 'avatars' / avatar.rsplit('/', 1)[1]).exists()
@@ -0,0 +1,46 @@
+"""Media references and file cleanup"""
+
+import pytest
+
+from app.extensions import db
+from app.utils.media import release_reference
+
+
+@pytest.fixture
+def legacy_upload(app, tmp_path):
+    """A legacy (not content addressed) avatar file in a temporary upload folder"""
+    folder, store = app.config['UPLOAD_FOLDER'], app.extensions.pop('media_store', None)
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    path = tmp_path / 'avatars' / 'old.png'
+    path.parent.mkdir()
+    path.write_bytes(b'png')
+    yield '/static/uploads/avatars/old.png', path
+    app.config['UPLOAD_FOLDER'] = folder
+    app.extensions.pop('media_store', None)
+    if store is not None:
+        app.extensions['media_store'] = store
+
+
+def test_released_legacy_file_survives_a_rollback(legacy_upload, make_user):
+    url, path = legacy_upload
+    user = make_user(avatar=url)
+    release_reference(user.avatar)
+    user.avatar = None
+    db.session.flush()
+    db.session.rollback()
+    assert user.avatar == url and path.exists()
+
+    # The rolled back release is forgotten: the next commit deletes nothing
+    user.name = 'Renamed'
+    db.session.commit()
+    assert path.exists()
+
+
+def test_released_legacy_file_is_deleted_on_commit(legacy_upload, make_user):
+    url, path = legacy_upload
+    user = make_user(avatar=url)
+    release_reference(user.avatar)
+    user.avatar = None
+    assert path.exists()
+    db.session.commit()
+    assert not path.exists()
@@ -0,0 +1,94 @@
+"""Outbound message workers against a fake SMS gateway"""
+
+import json
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from app.extensions import db
+from app.models.message import OutboundMessage
+from app.utils.messaging import MessageWorker, send_sms
+
+
+@contextmanager
+def fake_gateway(status=200):
+    """HTTP server recording the JSON bodies it receives"""
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received.append((self.headers.get('Authorization'),
+                             json.loads(self.rfile.read(int(self.headers['Content-Length'])))))
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_port}/send', received
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def sms_config(app):
+    keys = ('MESSAGE_SMS_PROVIDER', 'SMS_HTTP_URL', 'SMS_HTTP_TOKEN', 'MESSAGE_MAX_ATTEMPTS')
+    saved = {key: app.config.get(key) for key in keys}
+    yield app.config
+    for key, value in saved.items():
+        if value is None:
+            app.config.pop(key, None)
+        else:
+            app.config[key] = value
+
+
+def _queue(recipient='0900000001', body='Mã xác thực: 123456'):
+    message = send_sms(recipient, body)
+    db.session.commit()
+    return message.id
+
+
+def _message(message_id):
+    db.session.expire_all()
+    return db.session.get(OutboundMessage, message_id)
+
+
+@pytest.mark.parametrize('status, expected', [(200, 'sent'), (400, 'failed'), (503, 'pending')])
+def test_sms_goes_through_the_http_gateway(app, sms_config, status, expected):
+    message_id = _queue()
+    with fake_gateway(status) as (url, received):
+        sms_config.update(MESSAGE_SMS_PROVIDER='http', SMS_HTTP_URL=url, SMS_HTTP_TOKEN='secret')
+        assert MessageWorker(app, channels=('sms',)).drain() == 1
+
+    assert received == [('Bearer secret', {'to': '0900000001', 'message': 'Mã xác thực: 123456', 'sender': 'CleanHome'})]
+    message = _message(message_id)
+    assert (message.status, message.attempts) == (expected, 1)
+
+
+def test_unavailable_provider_retries_the_batch_then_fails_it(app, sms_config):
+    message_id = _queue()
+    sms_config.update(MESSAGE_SMS_PROVIDER='pigeon', MESSAGE_MAX_ATTEMPTS=3)
+    worker = MessageWorker(app, channels=('sms',))
+
+    for attempt in range(1, 4):
+        assert worker.drain() == 1
+        message = _message(message_id)
+        assert message.attempts == attempt
+        assert 'Unknown sms provider' in message.last_error
+        if attempt < 3:
+            assert message.status == 'pending' and message.next_attempt_at > datetime.utcnow()
+            # Make the retry due now
+            message.next_attempt_at = datetime.utcnow()
+            db.session.commit()
+
+    assert message.status == 'failed'
+    assert worker.drain() == 0
@@ -0,0 +1,71 @@
+"""Unread notification counters"""
+
+from datetime import date
+
+from sqlalchemy import event
+
+from app.extensions import db
+from app.models.message import OutboundMessage
+from app.models.notification import Notification, NotificationCounter
+from app.utils import notifications
+from app.utils.db_routing import RoutingSession
+from app.utils.messaging import WAKE, send_sms
+from app.utils.notifications import notify, write_notifications
+from app.utils.staff_calendar import CALENDAR_CACHE, CalendarDay, invalidate_calendar
+
+
+def _unread(user, count):
+    db.session.add_all([
+        Notification(user_id=user.id, title='Lịch hẹn', message=f'Thông báo {i}', type='booking')
+        for i in range(count)
+    ])
+    db.session.commit()
+
+
+def test_unread_count_does_not_write(client, make_user, auth_headers):
+    user = make_user()
+    _unread(user, 3)
+    commits = []
+    listener = lambda session: commits.append(session)  # noqa: E731
+    event.listen(RoutingSession, 'after_commit', listener)
+    try:
+        response = client.get('/api/notifications/unread-count', headers=auth_headers(user))
+    finally:
+        event.remove(RoutingSession, 'after_commit', listener)
+
+    assert response.get_json()['data']['unread'] == 3
+    assert commits == []
+    assert db.session.get(NotificationCounter, user.id) is None
+
+
+def test_unread_count_reads_the_counter(client, make_user, auth_headers):
+    user = make_user()
+    write_notifications([
+        {'user_id': user.id, 'title': 'Khuyến mãi', 'message': 'Giảm 10%', 'type': 'promotion'} for _ in range(2)
+    ])
+    db.session.commit()
+    headers = auth_headers(user)
+    assert client.get('/api/notifications/unread-count', headers=headers).get_json()['data']['unread'] == 2
+
+    response = client.put('/api/notifications/read', json={'all': True}, headers=headers)
+    assert response.get_json()['data'] == {'updated': 2, 'unread': 0}
+
+
+def test_failed_fan_out_keeps_the_after_commit_work_of_the_transaction(app, make_user, monkeypatch):
+    def fail(events, session=None):
+        raise RuntimeError('fan-out failed')
+
+    user = make_user()
+    key = (user.id, date.today())
+    CALENDAR_CACHE.put_many({key: CalendarDay(*key).finish()}, 60)
+    monkeypatch.setattr(notifications, 'deliver', fail)
+
+    notify([user.id], 'system', 'Lịch hẹn', 'Đã cập nhật')
+    send_sms('0900000001', 'Lịch hẹn đã cập nhật')
+    invalidate_calendar(dates=[key[1]])
+    WAKE.clear()
+    db.session.commit()
+
+    assert OutboundMessage.query.count() == 1 and Notification.query.count() == 0
+    assert WAKE.is_set()
+    assert CALENDAR_CACHE.get_many([key]) == {}
@@ -0,0 +1,55 @@
+"""Featured services ranking"""
+
+from datetime import date, time as clock, timedelta
+
+from app.extensions import db
+from app.models.service import ServiceRanking
+from app.utils.popularity import rank_services
+
+
+def _catalog(make_user, make_service, make_booking):
+    user = make_user()
+    quiet = make_service(name='Quiet', is_featured=True)
+    busy = make_service(name='Busy', is_featured=True)
+    plain = make_service(name='Plain', is_featured=False)
+    day = date.today() + timedelta(days=3)
+    for service, count in ((busy, 3), (plain, 10)):
+        for hour in range(count):
+            make_booking(user, service, day, clock(8 + hour))
+    return quiet, busy, plain
+
+
+def test_only_featured_services_are_ranked(app, client, make_user, make_service, make_booking):
+    quiet, busy, plain = _catalog(make_user, make_service, make_booking)
+
+    assert rank_services() == 2
+    assert [service['name'] for service in client.get('/api/services/featured').get_json()] == ['Busy', 'Quiet']
+
+    # Unmarked services leave the list before the next ranking run
+    busy.is_featured = False
+    db.session.commit()
+    assert [service['name'] for service in client.get('/api/services/featured').get_json()] == ['Quiet']
+
+
+def test_whole_catalog_ranking_is_an_option(app, make_user, make_service, make_booking):
+    quiet, busy, plain = _catalog(make_user, make_service, make_booking)
+    app.config['POPULARITY_FEATURED_ONLY'] = False
+    try:
+        assert rank_services() == 3
+    finally:
+        app.config['POPULARITY_FEATURED_ONLY'] = True
+    ranking = [row.service_id for row in ServiceRanking.query.order_by(ServiceRanking.rank)]
+    assert ranking == [plain.id, busy.id, quiet.id]
+
+
+def test_services_featured_after_the_ranking_run_follow_the_ranked_ones(app, client, make_user, make_service,
+                                                                        make_booking):
+    quiet, busy, plain = _catalog(make_user, make_service, make_booking)
+    assert [service['name'] for service in client.get('/api/services/featured').get_json()] == ['Busy', 'Quiet']
+
+    rank_services()
+    make_service(name='Airy', is_featured=True)
+    plain.is_featured = True
+    db.session.commit()
+    assert [service['name'] for service in client.get('/api/services/featured').get_json()] \
+        == ['Busy', 'Quiet', 'Airy', 'Plain']
@@ -0,0 +1,95 @@
+"""Bulk promotion code generation limits"""
+
+from datetime import date, timedelta
+
+import pytest
+
+from app.models.promotion import Promotion
+from app.utils.promotion_bulk import generate_codes
+
+TEMPLATE = {
+    'name': 'Tết', 'discountType': 'percentage', 'discountValue': 10,
+    'startDate': '2026-01-01', 'endDate': '2026-12-31'
+}
+
+
+@pytest.fixture
+def admin_headers(make_user, auth_headers):
+    return auth_headers(make_user('admin'))
+
+
+def test_generate_codes_rejects_a_count_beyond_the_code_space():
+    with pytest.raises(ValueError):
+        generate_codes(40, length=1)
+    with pytest.raises(ValueError):
+        generate_codes(1, length=0)
+
+
+@pytest.mark.parametrize('options, message', [
+    ({'count': 40, 'length': 1}, 'at least'),
+    ({'count': 5, 'length': 0}, 'at least'),
+    ({'count': 5, 'length': -3}, 'at least'),
+    ({'count': 10000, 'length': 4}, 'longer code length'),
+    ({'count': 0, 'length': 8}, 'positive'),
+    ({'count': 'many', 'length': 8}, 'invalid literal'),
+])
+def test_bulk_generate_rejects_impossible_requests(client, admin_headers, options, message):
+    response = client.post('/api/promotions/bulk', json={'generate': options, 'template': TEMPLATE},
+                           headers=admin_headers)
+    assert response.status_code == 400
+    assert message in response.get_json()['message']
+
+
+def test_bulk_generate_count_is_capped(app, client, admin_headers):
+    app.config['PROMOTION_GENERATE_MAX_COUNT'] = 20
+    try:
+        response = client.post('/api/promotions/bulk', json={'generate': {'count': 21}, 'template': TEMPLATE},
+                               headers=admin_headers)
+    finally:
+        app.config['PROMOTION_GENERATE_MAX_COUNT'] = 100000
+    assert response.status_code == 400
+    assert 'must not exceed 20' in response.get_json()['message']
+
+
+def test_bulk_generate_creates_unique_codes(client, admin_headers):
+    response = client.post('/api/promotions/bulk',
+                           json={'generate': {'count': 25, 'prefix': 'TET', 'length': 4}, 'template': TEMPLATE},
+                           headers=admin_headers)
+    assert response.status_code == 201
+    assert response.get_json()['result']['created'] == 25
+    codes = [code for code, in Promotion.query.with_entities(Promotion.code)]
+    assert len(set(codes)) == 25 and all(code.startswith('TET') and len(code) == 7 for code in codes)
+
+
+def _book(client, headers, service, **fields):
+    body = {'service_id': str(service.id), 'booking_date': (date.today() + timedelta(days=2)).isoformat(),
+            'booking_time': '09:00', 'customer_address': '12 Lê Lợi', **fields}
+    return client.post('/api/bookings/', json=body, headers=headers)
+
+
+def test_generated_codes_are_only_applied_when_named(client, admin_headers, make_user, make_service, auth_headers):
+    response = client.post('/api/promotions/bulk', json={'generate': {'count': 3}, 'template': TEMPLATE},
+                           headers=admin_headers)
+    assert response.status_code == 201
+    code = Promotion.query.with_entities(Promotion.code).first().code
+    service = make_service()
+    headers = auth_headers(make_user())
+
+    response = _book(client, headers, service)
+    assert response.status_code == 201
+    assert response.get_json()['promotion'] is None
+    best = client.post(f'/api/promotions/apply/{make_user().id}', json={'orderValue': 200000}, headers=headers)
+    assert best.get_json()['promotion'] is None
+
+    response = _book(client, headers, service, booking_time='14:00', promotion_code=code)
+    assert response.status_code == 201
+    assert response.get_json()['promotion']['code'] == code
+
+
+def test_auto_apply_promotions_are_applied_without_a_code(client, admin_headers, make_user, make_service, auth_headers):
+    response = client.post('/api/promotions/', json={**TEMPLATE, 'code': 'WELCOME', 'autoApply': True},
+                           headers=admin_headers)
+    assert response.status_code == 201
+    response = _book(client, auth_headers(make_user()), make_service())
+    assert response.status_code == 201
+    assert response.get_json()['promotion']['code'] == 'WELCOME'
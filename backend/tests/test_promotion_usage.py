@@ -0,0 +1,23 @@
+"""Promotion usage reservations"""
+
+from datetime import date, timedelta
+
+from app.extensions import db
+from app.models.promotion import Promotion, PromotionUsageShard
+from app.utils.promotion_usage import reserve_usage
+
+
+def test_usage_is_counted_on_the_promotion_by_default(app):
+    today = date.today()
+    promotion = Promotion(code='ONCE', name='Once', discount_type='fixed', discount_value=10000,
+                          start_date=today, end_date=today + timedelta(days=1), usage_limit=1)
+    db.session.add(promotion)
+    db.session.commit()
+
+    reservation = reserve_usage(promotion.id)
+    assert reservation is not None and reservation.shard_no is None
+    assert reserve_usage(promotion.id) is None
+
+    db.session.expire_all()
+    assert db.session.get(Promotion, promotion.id).used_count == 1
+    assert PromotionUsageShard.query.count() == 0
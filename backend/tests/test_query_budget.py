@@ -0,0 +1,77 @@
+"""Query budgets of the catalog endpoints, enforced by app.utils.pytest_query_budget"""
+
+import os
+
+import pytest
+
+from app.extensions import db
+from app.models.service import Area, ServiceArea, ServiceCategory
+
+pytest_plugins = ['pytester']
+
+
+@pytest.fixture
+def catalog(make_service):
+    categories = [ServiceCategory(name=name) for name in ('Nhà ở', 'Văn phòng', 'Sofa')]
+    db.session.add_all(categories)
+    db.session.flush()
+    return [make_service(name=f'Dịch vụ {i:02d}', category=categories[i % 3]) for i in range(25)]
+
+
+def test_service_list_loads_categories_once(client, catalog):
+    response = client.get('/api/services/?limit=20')
+    assert response.status_code == 200
+    services = response.get_json()
+    assert len(services) == 20
+    assert {service['category'] for service in services} == {'Nhà ở', 'Văn phòng', 'Sofa'}
+    assert int(response.headers['X-Query-Count']) <= 4
+
+
+def test_service_list_with_every_filter_stays_in_budget(client, catalog):
+    district_1 = Area(name='Quận 1', city='Hồ Chí Minh', district='Quận 1')
+    hanoi = Area(name='Hà Nội', city='Hà Nội')
+    db.session.add_all([district_1, hanoi])
+    db.session.flush()
+    db.session.add_all([
+        ServiceArea(service_id=catalog[0].id, area_id=district_1.id),
+        ServiceArea(service_id=catalog[3].id, area_id=hanoi.id),
+    ])
+    db.session.commit()
+
+    # Cold coverage index: reloaded inside this request
+    response = client.get('/api/services/', query_string={
+        'category': 'Nhà ở', 'city': 'Hồ Chí Minh', 'district': 'Quận 1', 'search': 'Dịch vụ'
+    })
+    assert response.status_code == 200
+    expected = {str(service.id) for i, service in enumerate(catalog) if i % 3 == 0 and i != 3}
+    assert {service['id'] for service in response.get_json()} == expected
+
+
+def test_plugin_fails_a_test_whose_request_runs_n_plus_one(pytester, monkeypatch):
+    # In a subprocess, so the violation does not reach this session's plugin
+    monkeypatch.setenv('PYTHONPATH', os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    pytester.makepyfile(test_n_plus_one='''
+        from flask import Flask
+        from sqlalchemy import text
+
+        from app.extensions import db
+        from app.utils.query_budget import init_query_budget, query_budget
+
+        def test_loop():
+            app = Flask(__name__)
+            app.config.update(SQLALCHEMY_DATABASE_URI='sqlite://', QUERY_BUDGET_MODE='log', QUERY_REPEAT_THRESHOLD=5)
+            db.init_app(app)
+            init_query_budget(app)
+
+            @app.route('/loop')
+            @query_budget(10)
+            def loop():
+                for i in range(6):
+                    db.session.execute(text('SELECT :i'), {'i': i})
+                return 'ok'
+
+            assert app.test_client().get('/loop').status_code == 200
+    ''')
+    result = pytester.runpytest_subprocess('-p', 'app.utils.pytest_query_budget')
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines(['*Query budget exceeded / N+1 detected*', '*query budget*'])
@@ -0,0 +1,53 @@
+"""Reviews: one per booking"""
+
+import threading
+from datetime import date, time as clock, timedelta
+
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.models.review import Review, ReviewStatus, RatingSummary
+
+
+def _completed_booking(make_user, make_service, make_booking):
+    user = make_user()
+    service = make_service()
+    booking = make_booking(user, service, date.today() - timedelta(days=1), clock(9), status='completed')
+    return user, service, booking
+
+
+def test_second_review_of_a_booking_is_rejected(app, client, make_user, make_service, make_booking, auth_headers):
+    user, _, booking = _completed_booking(make_user, make_service, make_booking)
+    body = {'bookingId': str(booking.id), 'rating': 5}
+    assert client.post('/api/reviews', json=body, headers=auth_headers(user)).status_code == 201
+    assert client.post('/api/reviews', json=body, headers=auth_headers(user)).status_code == 409
+    assert Review.query.count() == 1
+
+
+def test_concurrent_review_of_a_booking_gets_409(app, make_user, make_service, make_booking, auth_headers,
+                                                  wait_for_lock_waiters):
+    user, service, booking = _completed_booking(make_user, make_service, make_booking)
+
+    # An uncommitted review of the same booking: the request's check cannot see it,
+    # its INSERT waits on the unique index
+    other = Session(bind=db.engine)
+    other.add(Review(booking_id=booking.id, user_id=user.id, service_id=service.id, rating=4,
+                     status=ReviewStatus.APPROVED))
+    other.flush()
+    headers = auth_headers(user)
+    responses = []
+    thread = threading.Thread(target=lambda: responses.append(app.test_client().post(
+        '/api/reviews', json={'bookingId': str(booking.id), 'rating': 1}, headers=headers
+    )))
+    thread.start()
+    try:
+        wait_for_lock_waiters(1)
+        other.commit()
+    finally:
+        other.close()
+    thread.join(10)
+
+    assert responses[0].status_code == 409
+    assert [review.rating for review in Review.query] == [4]
+    # The rejected review added nothing to the summary (the other one was inserted without it)
+    assert RatingSummary.query.filter_by(target_type='service', target_id=service.id).count() == 0
@@ -0,0 +1,28 @@
+"""Benchmark dataset generator"""
+
+import os
+import sys
+
+from app.extensions import db
+from app.models.vnpay import VnpayTransaction, VnpayUserSummary
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from seed_data import seed  # noqa: E402
+
+
+def test_seed_builds_payment_summaries(app):
+    counts = seed(app, 400, reset=True, chunk_size=150)
+    assert counts['vnpay_transactions'] > 0
+
+    summaries = {summary.user_id: summary.to_dict() for summary in VnpayUserSummary.query}
+    payers = {user_id for user_id, in db.session.query(VnpayTransaction.user_id).distinct()}
+    assert set(summaries) == payers
+    assert sum(summary['count_by_status']['success'] for summary in summaries.values()) > 0
+
+    # Same totals as the per-user rebuild used by the API
+    for user_id in list(payers)[:20]:
+        expected = VnpayUserSummary.rebuild(user_id).to_dict()
+        assert summaries[user_id]['count_by_status'] == expected['count_by_status']
+        assert summaries[user_id]['total_paid'] == expected['total_paid']
+    db.session.rollback()
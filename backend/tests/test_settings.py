@@ -0,0 +1,40 @@
+"""Runtime settings edited through PUT /api/admin/settings"""
+
+import pytest
+
+from app.models.setting import Setting
+from app.utils.config import REGISTRY
+
+
+@pytest.fixture
+def admin_headers(make_user, auth_headers):
+    return auth_headers(make_user('admin'))
+
+
+@pytest.mark.parametrize('stored, change, message', [
+    ({}, {'booking.work_start_hour': 17}, 'must be before'),
+    ({}, {'booking.work_start_hour': 12, 'booking.work_end_hour': 9}, 'must be before'),
+    ({'booking.work_end_hour': 10}, {'booking.work_start_hour': 11}, 'must be before'),
+    ({}, {'booking.work_start_hour': 9, 'booking.work_end_hour': 11, 'booking.min_advance_hours': 3},
+     'working day (2 hours)'),
+    ({'booking.min_advance_hours': 4}, {'booking.work_end_hour': 11}, 'working day (3 hours)'),
+])
+def test_settings_are_checked_together(client, admin_headers, stored, change, message):
+    if stored:
+        assert client.put('/api/admin/settings', json=stored, headers=admin_headers).status_code == 200
+    version = REGISTRY.load().version
+
+    response = client.put('/api/admin/settings', json=change, headers=admin_headers)
+    assert response.status_code == 400
+    assert message in response.get_json()['message']
+    assert REGISTRY.load().version == version
+    assert {setting.key for setting in Setting.query} == set(stored)
+
+
+def test_consistent_change_is_stored(client, admin_headers):
+    response = client.put('/api/admin/settings', headers=admin_headers, json={
+        'booking.work_start_hour': 18, 'booking.work_end_hour': 22, 'booking.min_advance_hours': 4
+    })
+    assert response.status_code == 200
+    snapshot = REGISTRY.load()
+    assert (snapshot['booking.work_start_hour'], snapshot['booking.work_end_hour']) == (18, 22)
@@ -0,0 +1,86 @@
+"""Nearest-staff suggestions and automatic assignment"""
+
+from datetime import date, time as clock, timedelta
+
+import pytest
+
+from app.extensions import db
+from app.models.booking import Booking
+from app.models.schedule import StaffSchedule
+from app.models.user import UserAddress
+
+DAY = date.today() + timedelta(days=2)
+
+
+def _address(user, latitude, longitude):
+    address = UserAddress(user_id=user.id, address_name='Nhà', recipient_name=user.name, phone='0900000001',
+                          address='1 Lê Lợi', district='Quận 1', city='Hồ Chí Minh', is_default=True,
+                          latitude=latitude, longitude=longitude)
+    db.session.add(address)
+    db.session.commit()
+    return address
+
+
+@pytest.fixture
+def admin_headers(make_user, auth_headers):
+    return auth_headers(make_user('admin'))
+
+
+@pytest.fixture
+def booking(make_user, make_service, make_booking):
+    customer = make_user()
+    return make_booking(customer, make_service(), DAY, clock(9),
+                        address_id=_address(customer, 10.7769, 106.7009).id)
+
+
+@pytest.fixture
+def staff(make_user):
+    """Near: about 1 km from the booking; far: about 10 km"""
+    near, far = make_user('staff', name='Near'), make_user('staff', name='Far')
+    _address(near, 10.7859, 106.7009)
+    _address(far, 10.8669, 106.7009)
+    return near, far
+
+
+@pytest.mark.parametrize('max_km', ['far', -1, 0, True, 'nan', [5]])
+def test_invalid_max_km_is_rejected(client, admin_headers, max_km):
+    response = client.post('/api/admin/bookings/auto-assign', json={'date': DAY.isoformat(), 'maxKm': max_km},
+                           headers=admin_headers)
+    assert response.status_code == 400
+    assert 'maxKm' in response.get_json()['message']
+
+
+def test_invalid_max_km_of_suggestions_is_rejected(client, admin_headers, booking):
+    response = client.get(f'/api/admin/bookings/{booking.id}/staff-suggestions?maxKm=-3', headers=admin_headers)
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('off, expected', [
+    ((clock(8), clock(12)), 'Far'),
+    ((clock(14), clock(17)), 'Near'),
+])
+def test_staff_on_time_off_are_not_assigned(client, admin_headers, booking, staff, off, expected):
+    near, _ = staff
+    db.session.add(StaffSchedule(staff_id=near.id, date=DAY, start_time=off[0], end_time=off[1], status='off'))
+    db.session.commit()
+
+    suggestions = client.get(f'/api/admin/bookings/{booking.id}/staff-suggestions', headers=admin_headers)
+    assert [staff['name'] for staff in suggestions.get_json()['data']['staff']][0] == expected
+
+    response = client.post('/api/admin/bookings/auto-assign', json={'date': DAY.isoformat(), 'maxKm': '25'},
+                           headers=admin_headers)
+    assert response.status_code == 200
+    assert [row['name'] for row in response.get_json()['data']['assigned']] == [expected]
+    db.session.expire_all()
+    assert db.session.get(Booking, booking.id).staff_id == {user.name: user.id for user in staff}[expected]
+
+
+def test_max_km_limits_the_assignment(client, admin_headers, booking, staff):
+    near, _ = staff
+    db.session.add(StaffSchedule(staff_id=near.id, date=DAY, start_time=clock(0), end_time=clock(23, 59),
+                                 status='off'))
+    db.session.commit()
+
+    response = client.post('/api/admin/bookings/auto-assign', json={'date': DAY.isoformat(), 'maxKm': 5},
+                           headers=admin_headers)
+    assert response.get_json()['data']['unassigned'][0]['reason'] == 'no_staff'
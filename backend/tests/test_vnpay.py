@@ -0,0 +1,65 @@
+"""VNPay result handlers and the per-user transaction summary"""
+
+import hashlib
+import hmac
+import threading
+import urllib.parse
+from datetime import date, time as clock, timedelta
+
+from sqlalchemy import text
+
+from app.extensions import db
+from app.models.vnpay import VnpayTransaction, VnpayUserSummary
+
+
+def _signed(app, params):
+    query_string = urllib.parse.urlencode(sorted(params.items()), quote_via=urllib.parse.quote)
+    secure_hash = hmac.new(app.config['VNPAY_HASH_SECRET_KEY'].encode(), query_string.encode(),
+                           hashlib.sha512).hexdigest()
+    return {**params, 'vnp_SecureHash': secure_hash}
+
+
+def test_ipn_and_return_racing_count_the_payment_once(app, make_user, make_service, make_booking,
+                                                      wait_for_lock_waiters):
+    user = make_user()
+    booking = make_booking(user, make_service(), date.today() + timedelta(days=2), clock(9), payment_method='vnpay')
+    transaction = VnpayTransaction(booking_id=booking.id, user_id=user.id, vnp_txnref='TXN0001',
+                                   vnp_amount=booking.total_price)
+    db.session.add(transaction)
+    VnpayUserSummary.apply_change(user.id, None, 'pending', booking.total_price)
+    db.session.commit()
+
+    params = _signed(app, {
+        'vnp_TxnRef': 'TXN0001', 'vnp_ResponseCode': '00', 'vnp_TransactionStatus': '00',
+        'vnp_Amount': str(int(booking.total_price * 100)), 'vnp_TransactionNo': '14000001', 'vnp_BankCode': 'NCB'
+    })
+
+    # Hold the transaction row so that both handlers are in flight at the same time
+    blocker = db.engine.connect()
+    blocker.execute(text("SELECT id FROM vnpay_transactions WHERE vnp_txnref = 'TXN0001' FOR UPDATE"))
+    responses = {}
+
+    def call(name, path):
+        responses[name] = app.test_client().get(path, query_string=params)
+
+    threads = [
+        threading.Thread(target=call, args=('ipn', '/api/vnpay/vnpay_ipn')),
+        threading.Thread(target=call, args=('return', '/api/vnpay/vnpay_return')),
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        wait_for_lock_waiters(2)
+    finally:
+        blocker.rollback()
+        blocker.close()
+    for thread in threads:
+        thread.join(10)
+
+    assert responses['ipn'].get_json()['RspCode'] == '00'
+    assert '/payment/success' in responses['return'].headers['Location']
+
+    db.session.expire_all()
+    summary = db.session.get(VnpayUserSummary, user.id)
+    assert (summary.success_count, summary.pending_count, summary.failed_count) == (1, 0, 0)
+    assert summary.total_paid == booking.total_price
@@ -0,0 +1,48 @@
+"""Per-worker indexes are rebuilt only after the writes they depend on commit"""
+
+from datetime import date, timedelta
+
+import pytest
+
+from app.extensions import db
+from app.models.promotion import Promotion
+from app.models.service import Area
+from app.models.user import UserAddress
+from app.utils.coverage import coverage_index
+from app.utils.promotion_engine import promotion_engine
+from app.utils.staff_locator import staff_locator
+
+
+def _promotion(staff):
+    db.session.add(Promotion(code='OPEN', name='Open', discount_type='fixed', discount_value=10000,
+                             start_date=date.today(), end_date=date.today() + timedelta(days=1), auto_apply=True))
+
+
+def _area(staff):
+    db.session.add(Area(name='Đà Nẵng', city='Đà Nẵng'))
+
+
+def _home(staff):
+    db.session.add(UserAddress(user_id=staff.id, address_name='Nhà', recipient_name='A', phone='0900000001',
+                               address='12 Lê Lợi', district='Quận 1', city='Hồ Chí Minh',
+                               latitude=10.7769, longitude=106.7009))
+
+
+@pytest.mark.parametrize('write, visible', [
+    (_promotion, lambda staff: 'OPEN' in promotion_engine.get_index().by_code),
+    (_area, lambda staff: coverage_index.locate('1 Bạch Đằng, Hải Châu, Đà Nẵng')[0] is not None),
+    (_home, lambda staff: staff_locator.get_index().staff[staff.id].latitude is not None),
+])
+def test_index_follows_committed_writes_only(app, make_user, write, visible):
+    staff = make_user('staff')
+    assert not visible(staff)
+
+    write(staff)
+    db.session.flush()
+    assert not visible(staff)
+    db.session.rollback()
+    assert not visible(staff)
+
+    write(staff)
+    db.session.commit()
+    assert visible(staff)
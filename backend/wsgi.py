@@ -0,0 +1,12 @@
+"""
+CleanHome Backend - WSGI entry point for production servers
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+import os
+
+from app import create_app
+
+# Production config unless FLASK_ENV says otherwise
+app = create_app(os.getenv('FLASK_ENV', 'production'))